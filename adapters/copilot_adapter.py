@@ -18,9 +18,17 @@ This implementation provides a flexible adapter that can be configured via
 environment variables to work with different GitHub Copilot deployments.
 """
 
+import functools
 import httpx
+import json
+import logging
 import os
-from typing import Dict, List, Optional, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Any
+
+from sse import iter_sse_events
+
+logger = logging.getLogger(__name__)
 
 
 class CopilotAdapter:
@@ -29,7 +37,7 @@ class CopilotAdapter:
     
     Supports:
     - Code completions
-    - Chat conversations
+    - Chat conversations (buffered or streamed)
     - Agentic workflows
     - Multi-turn sessions
     """
@@ -37,7 +45,11 @@ class CopilotAdapter:
     def __init__(
         self,
         api_key: Optional[str] = None,
-        base_url: Optional[str] = None
+        base_url: Optional[str] = None,
+        client: Optional[httpx.AsyncClient] = None,
+        retry: Optional[Any] = None,
+        timeout: float = 60.0,
+        stream_timeout: float = 120.0
     ):
         """
         Initialize the Copilot adapter.
@@ -45,9 +57,19 @@ class CopilotAdapter:
         Args:
             api_key: GitHub API token with Copilot access. Falls back to GITHUB_COPILOT_API_KEY env var.
             base_url: Base URL for Copilot API. Falls back to GITHUB_COPILOT_BASE_URL env var.
+            client: Optional shared httpx.AsyncClient to reuse pooled connections.
+                    The adapter never closes a client it was given.
+            retry: Optional retry policy (``retry.RetryPolicy``) used to send requests,
+                   retrying transient upstream failures.
+            timeout: Seconds allowed for a buffered chat completion
+            stream_timeout: Seconds allowed between chunks of a streamed one
         """
         self.api_key = api_key or os.getenv("GITHUB_COPILOT_API_KEY", "")
         self.base_url = base_url or os.getenv("GITHUB_COPILOT_BASE_URL", "https://api.github.com/copilot")
+        self.client = client
+        self.retry = retry
+        self.timeout = timeout
+        self.stream_timeout = stream_timeout
         
         if not self.api_key:
             raise ValueError("GitHub Copilot API key is required")
@@ -77,33 +99,135 @@ class CopilotAdapter:
         Returns:
             Response from Copilot API in OpenAI-compatible format
         """
-        headers = {
+        payload = self._payload(messages, stream, max_tokens, temperature)
+        
+        # Try standard completions endpoint
+        # Note: Actual endpoint may vary based on GitHub Copilot access level
+        if self.client is not None:
+            return await self._post(self.client, payload, self._headers())
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            return await self._post(client, payload, self._headers())
+    
+    async def stream_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "copilot-gpt-4",
+        max_tokens: int = 1024,
+        temperature: float = 0.0,
+        on_response: Optional[Callable[[httpx.Response], None]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a chat completion from GitHub Copilot.
+        
+        Yields each server-sent chunk as a decoded OpenAI-style
+        ``chat.completion.chunk`` dict (``choices[0].delta`` holds the new
+        content) as soon as it arrives; the ``[DONE]`` sentinel ends the
+        iteration. Closing the generator closes the upstream response.
+        
+        Args:
+            messages: List of message objects with 'role' and 'content'
+            model: Model identifier
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            on_response: Called with the response as soon as its headers
+                arrive, before any chunk is read (e.g. to time the upstream)
+            
+        Raises:
+            httpx.HTTPStatusError: The upstream answered with an error status;
+                the error body has been read and is available as ``response.text``
+        """
+        payload = self._payload(messages, True, max_tokens, temperature)
+        headers = self._headers(accept="text/event-stream")
+        if self.client is not None:
+            async for chunk in self._stream(self.client, payload, headers, on_response):
+                yield chunk
+            return
+        async with httpx.AsyncClient(timeout=self.stream_timeout) as client:
+            async for chunk in self._stream(client, payload, headers, on_response):
+                yield chunk
+    
+    def _headers(self, accept: str = "application/json") -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
-            "Accept": "application/json",
+            "Accept": accept,
             "Editor-Version": "vscode/1.80.0",  # Required by some Copilot endpoints
             "Editor-Plugin-Version": "copilot/1.0.0"
         }
-        
+    
+    @staticmethod
+    def _payload(
+        messages: List[Dict[str, str]],
+        stream: bool,
+        max_tokens: int,
+        temperature: float
+    ) -> Dict[str, Any]:
         # GitHub Copilot may use OpenAI-compatible format
-        payload = {
+        return {
             "messages": messages,
             "stream": stream,
             "max_tokens": max_tokens,
             "temperature": temperature,
             "n": 1
         }
-        
-        # Try standard completions endpoint
-        # Note: Actual endpoint may vary based on GitHub Copilot access level
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                json=payload,
-                headers=headers
-            )
-            response.raise_for_status()
-            return response.json()
+    
+    @asynccontextmanager
+    async def _open_stream(
+        self,
+        client: httpx.AsyncClient,
+        payload: Dict[str, Any],
+        headers: Dict[str, str]
+    ) -> AsyncIterator[httpx.Response]:
+        url = f"{self.base_url}/chat/completions"
+        if self.retry is not None:
+            async with self.retry.stream(
+                client, "github-copilot", "POST", url, json=payload, headers=headers, timeout=self.stream_timeout
+            ) as response:
+                yield response
+        else:
+            async with client.stream("POST", url, json=payload, headers=headers, timeout=self.stream_timeout) as response:
+                yield response
+    
+    async def _stream(
+        self,
+        client: httpx.AsyncClient,
+        payload: Dict[str, Any],
+        headers: Dict[str, str],
+        on_response: Optional[Callable[[httpx.Response], None]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """POST a streaming chat completion and yield its decoded chunks."""
+        async with self._open_stream(client, payload, headers) as response:
+            if on_response is not None:
+                on_response(response)
+            if response.status_code >= 400:
+                await response.aread()
+                response.raise_for_status()
+            async for event in iter_sse_events(response.aiter_bytes()):
+                if event.is_done:
+                    return
+                try:
+                    chunk = json.loads(event.data)
+                except ValueError:
+                    logger.warning(f"Skipping malformed Copilot stream event: {event.data[:200]}")
+                    continue
+                if isinstance(chunk, dict):
+                    yield chunk
+    
+    async def _post(
+        self,
+        client: httpx.AsyncClient,
+        payload: Dict[str, Any],
+        headers: Dict[str, str]
+    ) -> Dict[str, Any]:
+        """POST a chat completion payload and return the decoded JSON body."""
+        url = f"{self.base_url}/chat/completions"
+        send = functools.partial(client.post, url, json=payload, headers=headers, timeout=self.timeout)
+        if self.retry is not None:
+            response = await self.retry.call("github-copilot", send)
+        else:
+            response = await send()
+        response.raise_for_status()
+        return response.json()
     
     async def code_completion(
         self,
@@ -1,23 +1,101 @@
+"""
+Python client for the Perplexity Bridge API.
 
+``RooAdapter`` is the synchronous client: ``query()`` sends one prompt to
+``/v1/chat/completions`` and returns the answer. It keeps a
+``requests.Session`` so consecutive calls reuse the same TCP (and TLS)
+connection instead of opening a new one per prompt.
+
+``AsyncRooAdapter`` is the asyncio client for tools that send many prompts:
+
+* one pooled ``httpx.AsyncClient`` (keep-alive, optional HTTP/2) shared by
+  every call made through the adapter
+* ``stream()`` yields content deltas as they arrive, over SSE from
+  ``/v1/chat/completions`` or over the ``/ws/chat`` WebSocket
+* ``query_many()`` runs a batch of prompts with bounded concurrency and
+  returns the answers in order
+
+Both read ``ROO_BRIDGE_URL`` and ``ROO_BRIDGE_KEY`` from the environment.
+``RooAdapter.query_many()`` runs the async batch from synchronous code.
+"""
+
+import asyncio
+import builtins
+import json
 import os
 import requests
 import logging
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Union
 from requests.exceptions import RequestException, Timeout, ConnectionError
 
+import httpx
+
+from sse import iter_sse_events
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL = "mistral-7b-instruct"
+
+
+def _request_body(prompt: str, model: str, stream: bool = False) -> Dict[str, Any]:
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt cannot be empty")
+    body: Dict[str, Any] = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt.strip()}]
+    }
+    if stream:
+        body["stream"] = True
+    return body
+
+
+def _error_detail(data: Any) -> Optional[str]:
+    """The message of a bridge or upstream error object, if ``data`` is one."""
+    if not isinstance(data, dict):
+        return None
+    for field in ("error", "detail"):
+        error = data.get(field)
+        if error:
+            return error.get("message", "Unknown API error") if isinstance(error, dict) else str(error)
+    return None
+
+
+def _message_content(data: Any) -> str:
+    """Validate a chat completion and return its first message's content."""
+    if isinstance(data, dict) and "error" in data:
+        error_msg = _error_detail(data)
+        logger.error(f"RooAdapter: API error: {error_msg}")
+        raise RuntimeError(f"API error: {error_msg}")
+    if not isinstance(data, dict) or "choices" not in data or not isinstance(data["choices"], list) or len(data["choices"]) == 0:
+        logger.error("RooAdapter: Invalid response format - no choices")
+        raise RuntimeError("Invalid response format: no choices returned")
+    choice = data["choices"][0]
+    if "message" not in choice or "content" not in choice["message"]:
+        logger.error("RooAdapter: Invalid response format - missing message content")
+        raise RuntimeError("Invalid response format: missing message content")
+    return choice["message"]["content"]
+
+
+def _delta_content(data: str) -> Optional[str]:
+    """Content delta of one streamed chunk; raises on an error frame."""
+    chunk = json.loads(data)
+    error_msg = _error_detail(chunk)
+    if error_msg:
+        raise RuntimeError(f"API error: {error_msg}")
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content")
+
 
 class RooAdapter:
     """
     Adapter for connecting to the Perplexity Bridge API.
     Supports configurable URL and API key via environment variables.
     """
-    
+
     def __init__(self, url: Optional[str] = None, api_key: Optional[str] = None, timeout: int = 60):
         """
         Initialize the Roo Adapter.
-        
+
         Args:
             url: Bridge API URL (defaults to ROO_BRIDGE_URL env var or localhost:7860)
             api_key: API key for authentication (defaults to ROO_BRIDGE_KEY env var or dev-secret)
@@ -26,107 +104,326 @@ class RooAdapter:
         self.url = url or os.getenv("ROO_BRIDGE_URL", "http://localhost:7860")
         self.api_key = api_key or os.getenv("ROO_BRIDGE_KEY", "dev-secret")
         self.timeout = timeout
-        self.default_model = "mistral-7b-instruct"
-        
+        self.default_model = DEFAULT_MODEL
+
         # Ensure URL doesn't end with trailing slash
         self.url = self.url.rstrip('/')
-    
+
+        # Reuse one connection for every query
+        self.session = requests.Session()
+        self.session.headers.update({
+            "X-API-KEY": self.api_key,
+            "Content-Type": "application/json"
+        })
+
+    def close(self) -> None:
+        """Close the pooled connection."""
+        self.session.close()
+
+    def __enter__(self) -> "RooAdapter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
     def query(self, prompt: str, model: Optional[str] = None) -> str:
         """
         Query the bridge API with a prompt.
-        
+
         Args:
             prompt: The user prompt/question
             model: Model to use (defaults to configured default model)
-            
+
         Returns:
             Response content from the API
-            
+
         Raises:
             ValueError: If prompt is empty or invalid
             ConnectionError: If unable to connect to the API
             Timeout: If request times out
             RuntimeError: If API returns an error response
         """
-        if not prompt or not prompt.strip():
-            raise ValueError("Prompt cannot be empty")
-        
         model = model or self.default_model
+        body = _request_body(prompt, model)
         endpoint = f"{self.url}/v1/chat/completions"
-        
-        body = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt.strip()}]
-        }
-        
-        headers = {
-            "X-API-KEY": self.api_key,
-            "Content-Type": "application/json"
-        }
-        
+
         logger.info(f"RooAdapter: Sending request to {endpoint} with model {model}")
-        
+
         try:
-            response = requests.post(
+            response = self.session.post(
                 endpoint,
-                headers=headers,
                 json=body,
                 timeout=self.timeout
             )
-            
+
             # Check HTTP status
             response.raise_for_status()
-            
+
             # Parse JSON response
             try:
                 data = response.json()
             except ValueError as e:
                 logger.error(f"RooAdapter: Invalid JSON response: {e}")
                 raise RuntimeError(f"Invalid JSON response from API: {e}")
-            
-            # Check for API errors in response
-            if "error" in data:
-                error_msg = data["error"].get("message", "Unknown API error") if isinstance(data["error"], dict) else str(data["error"])
-                logger.error(f"RooAdapter: API error: {error_msg}")
-                raise RuntimeError(f"API error: {error_msg}")
-            
-            # Validate response structure
-            if "choices" not in data or not isinstance(data["choices"], list) or len(data["choices"]) == 0:
-                logger.error("RooAdapter: Invalid response format - no choices")
-                raise RuntimeError("Invalid response format: no choices returned")
-            
-            choice = data["choices"][0]
-            if "message" not in choice or "content" not in choice["message"]:
-                logger.error("RooAdapter: Invalid response format - missing message content")
-                raise RuntimeError("Invalid response format: missing message content")
-            
-            content = choice["message"]["content"]
+
+            content = _message_content(data)
             logger.info("RooAdapter: Successfully received response")
             return content
-            
+
         except Timeout:
             logger.error(f"RooAdapter: Request timed out after {self.timeout} seconds")
             raise Timeout(f"Request to {endpoint} timed out after {self.timeout} seconds")
-            
+
         except ConnectionError as e:
             logger.error(f"RooAdapter: Connection error: {e}")
             raise ConnectionError(f"Unable to connect to {endpoint}. Is the server running?") from e
-            
+
         except requests.exceptions.HTTPError as e:
             logger.error(f"RooAdapter: HTTP error {e.response.status_code}: {e.response.text}")
             error_msg = f"HTTP {e.response.status_code}"
             try:
-                error_data = e.response.json()
-                if "error" in error_data:
-                    error_msg = error_data["error"].get("message", error_msg)
-            except:
+                error_msg = _error_detail(e.response.json()) or error_msg
+            except ValueError:
                 pass
             raise RuntimeError(f"API request failed: {error_msg}") from e
-            
+
         except RequestException as e:
             logger.error(f"RooAdapter: Request error: {e}")
             raise RuntimeError(f"Request failed: {str(e)}") from e
-            
+
+        except RuntimeError:
+            raise
+
         except Exception as e:
             logger.error(f"RooAdapter: Unexpected error: {e}", exc_info=True)
             raise RuntimeError(f"Unexpected error: {str(e)}") from e
+
+    def query_many(
+        self,
+        prompts: Iterable[str],
+        model: Optional[str] = None,
+        concurrency: int = 8,
+        return_exceptions: bool = False
+    ) -> List[Union[str, BaseException]]:
+        """
+        Send several prompts concurrently (at most ``concurrency`` at a time) and return the answers in order.
+
+        Runs ``AsyncRooAdapter.query_many`` on a new event loop, so it cannot be
+        called from inside a running loop; async code should use
+        ``AsyncRooAdapter`` directly.
+        """
+        async def run() -> List[Union[str, BaseException]]:
+            async with AsyncRooAdapter(self.url, self.api_key, self.timeout, max_connections=concurrency) as adapter:
+                adapter.default_model = self.default_model
+                return await adapter.query_many(prompts, model, concurrency, return_exceptions)
+
+        return asyncio.run(run())
+
+
+class AsyncRooAdapter:
+    """
+    Asynchronous bridge client backed by one pooled ``httpx.AsyncClient``.
+
+    Use it as an async context manager (or call ``aclose()``) so the pooled
+    connections are closed. Errors are raised as ``ValueError`` (empty
+    prompt), ``TimeoutError``, ``ConnectionError`` or ``RuntimeError`` (the
+    bridge or upstream API returned an error).
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        timeout: float = 60,
+        max_connections: int = 20,
+        http2: bool = False,
+        client: Optional[httpx.AsyncClient] = None
+    ):
+        """
+        Initialize the async adapter.
+
+        Args:
+            url: Bridge API URL (defaults to ROO_BRIDGE_URL env var or localhost:7860)
+            api_key: API key for authentication (defaults to ROO_BRIDGE_KEY env var or dev-secret)
+            timeout: Request timeout in seconds (default: 60)
+            max_connections: Size of the connection pool
+            http2: Use HTTP/2 (needs ``httpx[http2]``; the bridge must be served over TLS)
+            client: Optional shared httpx.AsyncClient; the adapter never closes a client it was given
+        """
+        self.url = (url or os.getenv("ROO_BRIDGE_URL", "http://localhost:7860")).rstrip('/')
+        self.api_key = api_key or os.getenv("ROO_BRIDGE_KEY", "dev-secret")
+        self.timeout = timeout
+        self.default_model = DEFAULT_MODEL
+        self._owns_client = client is None
+        self.client = client or httpx.AsyncClient(
+            timeout=timeout,
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+    async def aclose(self) -> None:
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def __aenter__(self) -> "AsyncRooAdapter":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        return {"X-API-KEY": self.api_key, "Content-Type": "application/json"}
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response) -> None:
+        if response.status_code < 400:
+            return
+        error_msg = f"HTTP {response.status_code}"
+        try:
+            error_msg = _error_detail(response.json()) or error_msg
+        except ValueError:
+            pass
+        logger.error(f"RooAdapter: HTTP error {response.status_code}: {response.text}")
+        raise RuntimeError(f"API request failed: {error_msg}")
+
+    async def query(self, prompt: str, model: Optional[str] = None) -> str:
+        """
+        Query the bridge API with a prompt and return the full answer.
+
+        Raises:
+            ValueError: If prompt is empty
+            TimeoutError: If the request times out
+            ConnectionError: If unable to connect to the API
+            RuntimeError: If the API returns an error response
+        """
+        body = _request_body(prompt, model or self.default_model)
+        endpoint = f"{self.url}/v1/chat/completions"
+        try:
+            response = await self.client.post(endpoint, json=body, headers=self._headers)
+        except httpx.TimeoutException as e:
+            raise TimeoutError(f"Request to {endpoint} timed out after {self.timeout} seconds") from e
+        except httpx.ConnectError as e:
+            raise builtins.ConnectionError(f"Unable to connect to {endpoint}. Is the server running?") from e
+        except httpx.RequestError as e:
+            raise RuntimeError(f"Request failed: {str(e)}") from e
+        self._raise_for_status(response)
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise RuntimeError(f"Invalid JSON response from API: {e}") from e
+        return _message_content(data)
+
+    async def model_stats(self) -> Dict[str, Any]:
+        """
+        The bridge's rolling per-model estimates (``GET /models/stats``), by model.
+
+        Raises:
+            TimeoutError, ConnectionError or RuntimeError as ``query()`` does
+        """
+        endpoint = f"{self.url}/models/stats"
+        try:
+            response = await self.client.get(endpoint, headers=self._headers)
+        except httpx.TimeoutException as e:
+            raise TimeoutError(f"Request to {endpoint} timed out after {self.timeout} seconds") from e
+        except httpx.ConnectError as e:
+            raise builtins.ConnectionError(f"Unable to connect to {endpoint}. Is the server running?") from e
+        except httpx.RequestError as e:
+            raise RuntimeError(f"Request failed: {str(e)}") from e
+        self._raise_for_status(response)
+        try:
+            models = response.json().get("models")
+        except (ValueError, AttributeError) as e:
+            raise RuntimeError(f"Invalid JSON response from API: {e}") from e
+        if not isinstance(models, dict):
+            raise RuntimeError("Invalid response format: missing 'models' field")
+        return models
+
+    async def stream(self, prompt: str, model: Optional[str] = None, transport: str = "sse") -> AsyncIterator[str]:
+        """
+        Yield the answer's content deltas as they arrive.
+
+        Args:
+            prompt: The user prompt/question
+            model: Model to use (defaults to configured default model)
+            transport: ``"sse"`` (POST /v1/chat/completions) or ``"ws"`` (/ws/chat)
+        """
+        body = _request_body(prompt, model or self.default_model, stream=True)
+        if transport == "ws":
+            frames = self._ws_frames(body)
+        elif transport == "sse":
+            frames = self._sse_frames(body)
+        else:
+            raise ValueError(f"Unknown stream transport: {transport!r} (expected 'sse' or 'ws')")
+        async for data in frames:
+            if data == "[DONE]":
+                return
+            content = _delta_content(data)
+            if content:
+                yield content
+
+    async def _sse_frames(self, body: Dict[str, Any]) -> AsyncIterator[str]:
+        endpoint = f"{self.url}/v1/chat/completions"
+        try:
+            async with self.client.stream("POST", endpoint, json=body, headers=self._headers) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    self._raise_for_status(response)
+                async for event in iter_sse_events(response.aiter_bytes()):
+                    yield event.data
+        except httpx.TimeoutException as e:
+            raise TimeoutError(f"Stream from {endpoint} timed out after {self.timeout} seconds") from e
+        except httpx.ConnectError as e:
+            raise builtins.ConnectionError(f"Unable to connect to {endpoint}. Is the server running?") from e
+
+    async def _ws_frames(self, body: Dict[str, Any]) -> AsyncIterator[str]:
+        import websockets
+
+        endpoint = self.url.replace("http", "ws", 1) + "/ws/chat"
+        query = str(httpx.QueryParams({"api_key": self.api_key}))
+        try:
+            async with websockets.connect(f"{endpoint}?{query}", open_timeout=self.timeout) as websocket:
+                await websocket.send(json.dumps(body))
+                while True:
+                    message = await asyncio.wait_for(websocket.recv(), self.timeout)
+                    if message.startswith("{"):
+                        # JSON frames carry errors; chunks arrive SSE-formatted
+                        raise RuntimeError(f"API error: {_error_detail(json.loads(message))}")
+                    for line in message.splitlines():
+                        if line.startswith("data:"):
+                            yield line[5:].strip()
+        except asyncio.TimeoutError as e:
+            raise TimeoutError(f"Stream from {endpoint} timed out after {self.timeout} seconds") from e
+        except websockets.exceptions.InvalidStatus as e:
+            raise RuntimeError(f"WebSocket handshake rejected: HTTP {e.response.status_code}") from e
+        except websockets.exceptions.WebSocketException as e:
+            raise RuntimeError(f"WebSocket stream failed: {e}") from e
+        except OSError as e:
+            raise builtins.ConnectionError(f"Unable to connect to {endpoint}. Is the server running?") from e
+
+    async def query_many(
+        self,
+        prompts: Iterable[str],
+        model: Optional[str] = None,
+        concurrency: int = 8,
+        return_exceptions: bool = False
+    ) -> List[Union[str, BaseException]]:
+        """
+        Query several prompts with at most ``concurrency`` requests in flight.
+
+        Answers are returned in the order of ``prompts``. With
+        ``return_exceptions`` a failed prompt yields its exception instead of
+        failing the batch; otherwise the first failure cancels the rest.
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(prompt: str) -> str:
+            async with semaphore:
+                return await self.query(prompt, model)
+
+        tasks = [asyncio.ensure_future(run(prompt)) for prompt in prompts]
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+        finally:
+            for task in tasks:
+                task.cancel()
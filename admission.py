@@ -0,0 +1,404 @@
+"""
+Token-aware admission scheduling for upstream calls.
+
+Every upstream chat call first takes a ``Ticket`` from the
+``AdmissionScheduler``. A ticket is granted when all of these hold:
+
+* the provider is below its concurrency cap (``ADMISSION_PROVIDER_CONCURRENCY``)
+* the model is below its concurrency cap (``ADMISSION_MODEL_CONCURRENCY``)
+* the provider's tokens-per-minute budget (``ADMISSION_TPM``) can cover the
+  request's estimated size: its ``max_tokens`` plus ~4 characters per
+  prompt token
+
+Requests that cannot start yet wait in one queue ordered by weighted-fair
+virtual finish time. Each flow (an API key, or a client address for
+requests without one) is charged the request's estimated tokens divided by
+its weight, so a key sending a burst of large prompts cannot starve the
+others. The queue is work-conserving: a waiter whose model is at its cap
+does not hold up requests for other models, but the first waiter blocked on
+a provider's token budget reserves it so large requests are not starved by
+small ones.
+
+A request still queued after ``ADMISSION_QUEUE_TIMEOUT`` seconds (or
+arriving when ``ADMISSION_MAX_QUEUE`` requests are already waiting) is
+rejected with 503 and a Retry-After header, keeping the bridge at the
+provider's ceiling instead of cycling through upstream 429s.
+
+The scheduler lives in each worker process, so with several workers
+(``BRIDGE_WORKER_COUNT``) every cap and token budget is divided between
+them; together they stay within the configured totals.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import math
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from config import (
+    ADMISSION_ENABLED, ADMISSION_PROVIDER_CONCURRENCY, ADMISSION_MODEL_CONCURRENCY, ADMISSION_TPM,
+    ADMISSION_QUEUE_TIMEOUT, ADMISSION_MAX_QUEUE, BRIDGE_WORKER_COUNT
+)
+from codec import total_tokens
+from metrics import admission_queue_wait, admission_rejections_total
+
+logger = logging.getLogger(__name__)
+
+# Rough prompt size estimate: ~4 characters per token plus per-message framing
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """Parse ``"name=number,name=number"`` into a dict, skipping malformed entries."""
+    limits: Dict[str, int] = {}
+    for item in (spec or "").split(","):
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            limits[name.strip()] = int(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid admission limit entry: {item!r}")
+    return limits
+
+
+def per_worker(limits: Dict[str, int], workers: int) -> Dict[str, int]:
+    """Each worker's share of ``limits`` (rounded up, at least 1)."""
+    if workers <= 1:
+        return limits
+    return {name: max(1, math.ceil(limit / workers)) if limit > 0 else limit for name, limit in limits.items()}
+
+
+def estimate_tokens(messages: Any, max_tokens: Any) -> int:
+    """Estimate the tokens a chat request consumes: prompt size plus the completion budget."""
+    if not isinstance(messages, list):
+        messages = []
+    if not isinstance(max_tokens, int):
+        max_tokens = 0
+    chars = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        if isinstance(content, str):
+            chars += len(content)
+    return len(messages) * TOKENS_PER_MESSAGE + chars // CHARS_PER_TOKEN + max(max_tokens, 0)
+
+
+def used_tokens(response: Any) -> Optional[int]:
+    """``usage.total_tokens`` of a completion response (dict or raw JSON bytes), if it reports one."""
+    if isinstance(response, bytes):
+        return total_tokens(response)
+    if isinstance(response, dict):
+        usage = response.get("usage")
+        if isinstance(usage, dict) and isinstance(usage.get("total_tokens"), int):
+            return usage["total_tokens"]
+    return None
+
+
+def request_flow(api_key: Optional[str], client: str) -> str:
+    """Fair-queuing flow of a request: its API key, or its client address without one."""
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return "ip:" + client
+
+
+class AdmissionRejected(HTTPException):
+    """503 raised when a request cannot be admitted in time."""
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=503,
+            detail=f"Upstream capacity exhausted ({reason}); retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+class _TokenBudget:
+    """Tokens-per-minute bucket that refills continuously."""
+
+    __slots__ = ("capacity", "rate", "level", "updated")
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        """Seconds until ``tokens`` are available (0 if they are now)."""
+        self._refill(now)
+        # A request larger than the whole budget only waits for a full bucket
+        deficit = min(float(tokens), self.capacity) - self.level
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def take(self, tokens: int) -> None:
+        self.level -= min(float(tokens), self.capacity)
+
+    def refund(self, tokens: int) -> None:
+        self.level = min(self.capacity, self.level + tokens)
+
+
+class Ticket:
+    """Permission for one upstream call; release it when the call (or stream) ends."""
+
+    __slots__ = ("scheduler", "model", "provider", "tokens", "waited", "released")
+
+    def __init__(self, scheduler: Optional["AdmissionScheduler"], model: str, provider: str, tokens: int, waited: float):
+        self.scheduler = scheduler
+        self.model = model
+        self.provider = provider
+        self.tokens = tokens
+        self.waited = waited
+        self.released = False
+
+    def release(self, used_tokens: Optional[int] = None) -> None:
+        """
+        Free the concurrency slots. Idempotent.
+
+        ``used_tokens`` (e.g. the response's ``usage.total_tokens``) refunds
+        the part of the estimate that was not consumed.
+        """
+        if self.released:
+            return
+        self.released = True
+        if self.scheduler is not None:
+            self.scheduler._release(self, used_tokens)
+
+    async def __aenter__(self) -> "Ticket":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+async def release_after(source: AsyncIterator[Any], ticket: Ticket) -> AsyncIterator[Any]:
+    """Yield from ``source``, releasing ``ticket`` when the stream ends or is torn down."""
+    try:
+        async for chunk in source:
+            yield chunk
+    finally:
+        ticket.release()
+
+
+class _Waiter:
+    __slots__ = ("flow", "model", "provider", "tokens", "future", "enqueued", "timer")
+
+    def __init__(self, flow: str, model: str, provider: str, tokens: int, future: "asyncio.Future[Ticket]"):
+        self.flow = flow
+        self.model = model
+        self.provider = provider
+        self.tokens = tokens
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class AdmissionScheduler:
+    """Weighted-fair admission queue in front of the upstream providers."""
+
+    def __init__(
+        self,
+        provider_limits: Optional[Dict[str, int]] = None,
+        model_limits: Optional[Dict[str, int]] = None,
+        tpm: Optional[Dict[str, int]] = None,
+        queue_timeout: float = 10.0,
+        max_queue: int = 256,
+        enabled: bool = True
+    ):
+        self.provider_limits = provider_limits or {}
+        self.model_limits = model_limits or {}
+        self.budgets = {provider: _TokenBudget(limit) for provider, limit in (tpm or {}).items() if limit > 0}
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self._provider_active: Dict[str, int] = {}
+        self._model_active: Dict[str, int] = {}
+        # Waiters sorted by (virtual finish tag, arrival sequence)
+        self._queue: List[Tuple[float, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._virtual = 0.0
+        self._flow_finish: Dict[str, float] = {}
+        self._flow_queued: Dict[str, int] = {}
+        self._refill_timer: Optional[asyncio.TimerHandle] = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected: Dict[str, int] = {}
+
+    def _model_limit(self, model: str) -> Optional[int]:
+        return self.model_limits.get(model, self.model_limits.get("*"))
+
+    def _has_slot(self, model: str, provider: str) -> bool:
+        limit = self.provider_limits.get(provider)
+        if limit is not None and self._provider_active.get(provider, 0) >= limit:
+            return False
+        limit = self._model_limit(model)
+        return limit is None or self._model_active.get(model, 0) < limit
+
+    def _grant(self, model: str, provider: str, tokens: int, waited: float) -> Ticket:
+        self._provider_active[provider] = self._provider_active.get(provider, 0) + 1
+        self._model_active[model] = self._model_active.get(model, 0) + 1
+        budget = self.budgets.get(provider)
+        if budget is not None:
+            budget.take(tokens)
+        self.admitted += 1
+        admission_queue_wait.labels(provider).observe(waited)
+        return Ticket(self, model, provider, tokens, waited)
+
+    def _reject(self, provider: str, reason: str, retry_after: float) -> AdmissionRejected:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        admission_rejections_total.labels(provider, reason).inc()
+        logger.warning(f"Rejecting {provider} request: {reason}")
+        return AdmissionRejected(reason, retry_after)
+
+    def _retry_after(self, provider: str, tokens: int) -> float:
+        budget = self.budgets.get(provider)
+        if budget is not None:
+            return max(1.0, budget.wait_time(tokens, time.monotonic()))
+        return 1.0
+
+    async def admit(self, model: str, provider: str, tokens: int, flow: str = "default", weight: float = 1.0) -> Ticket:
+        """
+        Wait for capacity for one upstream call of about ``tokens`` tokens.
+
+        Raises:
+            AdmissionRejected: the queue is full or the wait exceeded the queue timeout
+        """
+        if not self.enabled:
+            return Ticket(None, model, provider, tokens, 0.0)
+        now = time.monotonic()
+        if not self._queue and self._has_slot(model, provider):
+            budget = self.budgets.get(provider)
+            if budget is None or budget.wait_time(tokens, now) == 0:
+                return self._grant(model, provider, tokens, 0.0)
+        if len(self._queue) >= self.max_queue:
+            raise self._reject(provider, "queue_full", self._retry_after(provider, tokens))
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(flow, model, provider, tokens, loop.create_future())
+        # Weighted-fair queuing: a flow's requests finish one after another in virtual time
+        tag = max(self._virtual, self._flow_finish.get(flow, 0.0)) + tokens / max(weight, 1e-6)
+        self._flow_finish[flow] = tag
+        self._flow_queued[flow] = self._flow_queued.get(flow, 0) + 1
+        bisect.insort(self._queue, (tag, next(self._sequence), waiter))
+        waiter.timer = loop.call_later(self.queue_timeout, self._expire, waiter)
+        self.queued += 1
+        self._dispatch()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # Admitted just as the caller went away
+                waiter.future.result().release()
+            else:
+                self._remove(waiter)
+                self._dispatch()
+            raise
+
+    def _remove(self, waiter: _Waiter) -> None:
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+        for index, entry in enumerate(self._queue):
+            if entry[2] is waiter:
+                del self._queue[index]
+                break
+        else:
+            return
+        remaining = self._flow_queued[waiter.flow] - 1
+        if remaining:
+            self._flow_queued[waiter.flow] = remaining
+        else:
+            del self._flow_queued[waiter.flow]
+            self._flow_finish.pop(waiter.flow, None)
+
+    def _expire(self, waiter: _Waiter) -> None:
+        if waiter.future.done():
+            return
+        self._remove(waiter)
+        waiter.future.set_exception(
+            self._reject(waiter.provider, "queue_timeout", self._retry_after(waiter.provider, waiter.tokens))
+        )
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit queued requests in fair order while capacity allows."""
+        if not self._queue:
+            return
+        now = time.monotonic()
+        reserved: Set[str] = set()
+        refill_in: Optional[float] = None
+        for entry in list(self._queue):
+            tag, _, waiter = entry
+            if waiter.future.done():
+                # Cancelled; the waiting task removes it when it resumes
+                continue
+            if waiter.provider in reserved or not self._has_slot(waiter.model, waiter.provider):
+                continue
+            budget = self.budgets.get(waiter.provider)
+            if budget is not None:
+                wait = budget.wait_time(waiter.tokens, now)
+                if wait > 0:
+                    # Hold the budget for this waiter instead of letting smaller requests overtake it
+                    reserved.add(waiter.provider)
+                    refill_in = wait if refill_in is None else min(refill_in, wait)
+                    continue
+            self._remove(waiter)
+            self._virtual = max(self._virtual, tag)
+            waiter.future.set_result(self._grant(waiter.model, waiter.provider, waiter.tokens, now - waiter.enqueued))
+        if refill_in is not None and self._refill_timer is None:
+            self._refill_timer = asyncio.get_running_loop().call_later(refill_in, self._on_refill)
+
+    def _on_refill(self) -> None:
+        self._refill_timer = None
+        self._dispatch()
+
+    def _release(self, ticket: Ticket, used_tokens: Optional[int]) -> None:
+        self._provider_active[ticket.provider] -= 1
+        self._model_active[ticket.model] -= 1
+        budget = self.budgets.get(ticket.provider)
+        if budget is not None and used_tokens is not None and used_tokens < ticket.tokens:
+            budget.refund(ticket.tokens - used_tokens)
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        budgets = {}
+        for provider, budget in self.budgets.items():
+            budget.wait_time(0, now)
+            budgets[provider] = {"tokens_per_minute": int(budget.capacity), "available": int(budget.level)}
+        return {
+            "enabled": self.enabled,
+            "queue_timeout": self.queue_timeout,
+            "max_queue": self.max_queue,
+            "provider_limits": dict(self.provider_limits),
+            "model_limits": dict(self.model_limits),
+            "tpm": budgets,
+            "in_flight": {p: n for p, n in self._provider_active.items() if n},
+            "in_flight_models": {m: n for m, n in self._model_active.items() if n},
+            "waiting": len(self._queue),
+            "waiting_flows": len(self._flow_queued),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": dict(self.rejected)
+        }
+
+
+# Module-level scheduler shared by the application
+admission = AdmissionScheduler(
+    provider_limits=per_worker(parse_limits(ADMISSION_PROVIDER_CONCURRENCY), BRIDGE_WORKER_COUNT),
+    model_limits=per_worker(parse_limits(ADMISSION_MODEL_CONCURRENCY), BRIDGE_WORKER_COUNT),
+    tpm=per_worker(parse_limits(ADMISSION_TPM), BRIDGE_WORKER_COUNT),
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    enabled=ADMISSION_ENABLED
+)
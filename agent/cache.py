@@ -0,0 +1,190 @@
+"""
+Content-addressed cache for planner answers and step results.
+
+Re-running a goal re-asks the planner for the same decomposition and
+re-executes steps whose inputs have not changed. ``AgentCache`` stores those
+answers in a local SQLite file so iterating on a long workflow replays the
+unchanged steps instantly and only pays for what changed.
+
+Entries are addressed by a SHA-256 over (kind, model, prompt, context):
+
+* ``kind`` separates planner answers (``"plan"``) from step results (``"step"``)
+* ``prompt`` is what varies per entry: the goal of a plan, the task text
+  of a step
+* ``context`` is the hash of the upstream results a step was given
+  (``context_hash()``), so when a dependency's output changes, every step
+  below it misses while its siblings still hit; for a plan it is the fixed
+  planner instructions wrapped around the goal
+
+The file is bounded by ``max_bytes``: after each write the least recently
+used entries are evicted until the stored values fit. ``invalidate()``
+drops entries by key, kind, model, prompt (under any context) or age, and
+``clear()`` empties the cache. The database runs in WAL mode, so several processes can share one file.
+
+Configuration (environment):
+
+* ``AGENT_CACHE_PATH`` - database file (default ``.agent_cache.sqlite3``)
+* ``AGENT_CACHE_MAX_BYTES`` - size budget for cached values (default 64 MiB)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+AGENT_CACHE_PATH = os.getenv("AGENT_CACHE_PATH", ".agent_cache.sqlite3")
+AGENT_CACHE_MAX_BYTES = int(os.getenv("AGENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE INDEX IF NOT EXISTS entries_prompt ON entries (prompt_hash);
+"""
+
+
+def context_hash(outputs: Iterable[Any]) -> str:
+    """Hash the upstream results a step depends on (order matters)."""
+    digest = hashlib.sha256()
+    for output in outputs:
+        encoded = json.dumps(output, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def _prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def cache_key(kind: str, model: str, prompt: str, context: str = "") -> str:
+    """Content address of an answer."""
+    encoded = json.dumps([kind, model, prompt, context], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class AgentCache:
+    """SQLite-backed, size-bounded LRU cache of agent answers."""
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = AGENT_CACHE_MAX_BYTES):
+        self.path = path or AGENT_CACHE_PATH
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        if self.path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for ``key``, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, kind: str, model: str, prompt: str, value: str) -> bool:
+        """Store ``value`` under ``key``; returns False if it is larger than the whole budget."""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return False
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, kind, model, prompt_hash, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, model, _prompt_hash(prompt), value, size, now, now)
+            )
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        excess = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed, created"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self.evictions += len(victims)
+        logger.debug(f"Agent cache evicted {len(victims)} entries to stay under {self.max_bytes} bytes")
+
+    def invalidate(
+        self,
+        key: Optional[str] = None,
+        kind: Optional[str] = None,
+        model: Optional[str] = None,
+        prompt: Optional[str] = None,
+        older_than: Optional[float] = None
+    ) -> int:
+        """
+        Drop every entry matching all the given filters and return how many went.
+
+        ``prompt`` is what the entry was stored under: the goal for
+        ``"plan"`` entries (not the full planner prompt) and the task text
+        sent for ``"step"`` entries, matched under any context;
+        ``older_than`` is an age in seconds. With no filters nothing is
+        dropped; use ``clear()`` to empty the cache.
+        """
+        clauses, params = [], []
+        prompt_hash = None if prompt is None else _prompt_hash(prompt)
+        for column, value in (("key", key), ("kind", kind), ("model", model), ("prompt_hash", prompt_hash)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if older_than is not None:
+            clauses.append("created < ?")
+            params.append(time.time() - older_than)
+        if not clauses:
+            return 0
+        with self._lock:
+            return self._db.execute(f"DELETE FROM entries WHERE {' AND '.join(clauses)}", params).rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -1,12 +1,85 @@
+"""
+Plan execution engine.
+
+``Executor.run()`` sends a single task to the bridge. ``Executor.stream()``
+runs a whole ``Plan`` (see ``agent/plan.py``) as a dependency graph:
+
+* every step whose dependencies have finished is dispatched at once, so
+  independent research and coding steps overlap instead of running end to
+  end one after another
+* each step's model comes from ``Router.pick`` (unless the plan names one)
+* a step's prompt includes the outputs of the steps it depends on
+* results are yielded as soon as each step finishes
+* at most ``concurrency`` requests are in flight across every plan the
+  executor runs, over one pooled ``AsyncRooAdapter``
+* with an ``AgentCache`` (see ``agent/cache.py``), a step whose model, task
+  and upstream results are unchanged is replayed from disk instead of
+  being sent again
+* when the router has ``ModelStats``, each step's latency and outcome are
+  fed back into it, and ``refresh_model_stats()`` loads the bridge's
+  estimates, so later steps go to whichever candidate model is meeting
+  its class's SLO
+
+A failed step does not stop the plan: its dependents are reported as
+``skipped`` and the independent branches keep going.
+"""
+
+import asyncio
+import time
+from typing import AsyncIterator, Dict, NamedTuple, Optional, Union
 
 import requests
 
+from adapters.roo_adapter import AsyncRooAdapter
+from agent.cache import AgentCache, cache_key, context_hash
+from agent.plan import Plan, Step, parse_plan
+from agent.router import Router
+from model_stats import ModelStats
+
+
+class StepResult(NamedTuple):
+    """Outcome of one plan step."""
+
+    step: Step
+    model: str
+    status: str  # "ok", "error" or "skipped"
+    output: Optional[str] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    cached: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+
 class Executor:
-    def __init__(self,bridge,secret):
+    def __init__(
+        self,
+        bridge,
+        secret,
+        router: Optional[Router] = None,
+        concurrency: int = 4,
+        timeout: float = 120,
+        adapter: Optional[AsyncRooAdapter] = None,
+        cache: Optional[AgentCache] = None
+    ):
         self.bridge=bridge
         self.secret=secret
+        self.router = router or Router()
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self._adapter = adapter
+        self._owns_adapter = adapter is None
+        self.cache = cache
+        # Global cap shared by every plan this executor runs
+        self._slots = asyncio.Semaphore(self.concurrency)
 
     def run(self,task,model):
+        key = cache_key("step", model, task)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            return cached
         body={
          "model":model,
          "messages":[{"role":"user","content":task}]
@@ -14,4 +87,127 @@ class Executor:
         r=requests.post(self.bridge+"/v1/chat/completions",
          headers={"X-API-KEY":self.secret},
          json=body)
-        return r.json()["choices"][0]["message"]["content"]
+        content = r.json()["choices"][0]["message"]["content"]
+        if self.cache is not None:
+            self.cache.set(key, "step", model, task, content)
+        return content
+
+    @property
+    def adapter(self) -> AsyncRooAdapter:
+        if self._adapter is None:
+            self._adapter = AsyncRooAdapter(
+                url=self.bridge, api_key=self.secret, timeout=self.timeout, max_connections=self.concurrency
+            )
+        return self._adapter
+
+    async def aclose(self) -> None:
+        if self._owns_adapter and self._adapter is not None:
+            await self._adapter.aclose()
+            self._adapter = None
+
+    async def __aenter__(self) -> "Executor":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def refresh_model_stats(self) -> int:
+        """Load the bridge's per-model estimates into the router; returns the number of models."""
+        if self.router.stats is None:
+            self.router.stats = ModelStats()
+        return self.router.stats.load(await self.adapter.model_stats())
+
+    def model_for(self, step: Step) -> str:
+        return step.model or self.router.pick(step.task)
+
+    @staticmethod
+    def prompt_for(step: Step, plan: Plan, results: Dict[str, StepResult]) -> str:
+        """The step's task followed by the outputs of the steps it depends on."""
+        if not step.depends_on:
+            return step.task
+        context = "\n\n".join(
+            f"[{dep}] {plan.steps[dep].task}\n{results[dep].output}" for dep in step.depends_on
+        )
+        return f"{step.task}\n\nResults of the steps this one builds on:\n\n{context}"
+
+    async def run_step(self, step: Step, plan: Plan, results: Dict[str, StepResult]) -> StepResult:
+        model = self.model_for(step)
+        if self.cache is not None:
+            context = context_hash(results[dep].output for dep in step.depends_on)
+            key = cache_key("step", model, step.task, context)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return StepResult(step, model, "ok", output=cached, cached=True)
+        prompt = self.prompt_for(step, plan, results)
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                output = await self.adapter.query(prompt, model)
+            except Exception as e:
+                elapsed = time.perf_counter() - started
+                self.router.observe(model, elapsed, error=True)
+                return StepResult(step, model, "error", error=str(e) or type(e).__name__, elapsed=elapsed)
+        self.router.observe(model, time.perf_counter() - started)
+        if self.cache is not None:
+            self.cache.set(key, "step", model, step.task, output)
+        return StepResult(step, model, "ok", output=output, elapsed=time.perf_counter() - started)
+
+    async def stream(self, plan: Union[Plan, str]) -> AsyncIterator[StepResult]:
+        """
+        Run a plan, yielding each step's result as soon as it is known.
+
+        ``plan`` may be a ``Plan`` or the planner's raw JSON answer. Closing
+        the iterator early cancels the steps still running.
+        """
+        if not isinstance(plan, Plan):
+            plan = parse_plan(plan)
+        waiting = {step.id: len(step.depends_on) for step in plan}
+        results: Dict[str, StepResult] = {}
+        running: Dict[asyncio.Future, Step] = {}
+
+        def start(step: Step) -> None:
+            running[asyncio.ensure_future(self.run_step(step, plan, results))] = step
+
+        for step in plan.roots():
+            start(step)
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    result = future.result()
+                    results[step.id] = result
+                    yield result
+                    if not result.ok:
+                        for skipped in self._skip_dependents(step, plan, results):
+                            yield skipped
+                        continue
+                    for dependent in plan.dependents[step.id]:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0 and dependent not in results:
+                            start(plan.steps[dependent])
+        finally:
+            for future in running:
+                future.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    def _skip_dependents(self, failed: Step, plan: Plan, results: Dict[str, StepResult]):
+        """Mark every step downstream of ``failed`` as skipped."""
+        pending = list(plan.dependents[failed.id])
+        while pending:
+            step_id = pending.pop(0)
+            if step_id in results:
+                continue
+            step = plan.steps[step_id]
+            results[step_id] = StepResult(step, self.model_for(step), "skipped",
+                                          error=f"Dependency {failed.id!r} did not complete")
+            yield results[step_id]
+            pending.extend(plan.dependents[step_id])
+
+    async def execute(self, plan: Union[Plan, str]) -> Dict[str, StepResult]:
+        """Run a plan to completion and return the results by step id, in plan order."""
+        if not isinstance(plan, Plan):
+            plan = parse_plan(plan)
+        results = {result.step.id: result async for result in self.stream(plan)}
+        return {step_id: results[step_id] for step_id in plan.steps}
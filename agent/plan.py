@@ -0,0 +1,142 @@
+"""
+Agent plans as dependency graphs.
+
+The planner asks the model to break a goal into JSON steps. ``parse_plan()``
+turns that answer into a ``Plan``: a validated DAG of ``Step``s, each naming
+the steps whose results it needs. The executor uses it to run every step
+whose dependencies are done at the same time, instead of walking the list
+one step after another.
+
+Accepted shapes (optionally inside a fenced code block or surrounded by prose):
+
+* ``{"steps": [...]}`` or a bare ``[...]`` list
+* each step an object with ``id`` (defaults to its 1-based position),
+  ``task`` (also ``description``/``title``/``step``), optional
+  ``depends_on`` (also ``dependencies``/``deps``/``after``) and optional
+  ``model`` to bypass the router
+* or a plain string, which becomes a step with no dependencies
+
+Steps without dependencies are independent and may run concurrently.
+Unknown dependencies, duplicate ids and cycles raise ``ValueError``.
+"""
+
+import json
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+TASK_FIELDS = ("task", "description", "title", "step", "content")
+DEPENDENCY_FIELDS = ("depends_on", "dependencies", "deps", "after")
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+
+class Step(NamedTuple):
+    """One unit of work in a plan."""
+
+    id: str
+    task: str
+    depends_on: Tuple[str, ...] = ()
+    model: Optional[str] = None
+
+
+class Plan:
+    """A validated dependency graph of steps."""
+
+    def __init__(self, steps: Iterable[Step]):
+        self.steps: Dict[str, Step] = {}
+        for step in steps:
+            if step.id in self.steps:
+                raise ValueError(f"Duplicate step id: {step.id!r}")
+            self.steps[step.id] = step
+        self.dependents: Dict[str, List[str]] = {step_id: [] for step_id in self.steps}
+        for step in self.steps.values():
+            for dependency in step.depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(f"Step {step.id!r} depends on unknown step {dependency!r}")
+                if dependency == step.id:
+                    raise ValueError(f"Step {step.id!r} depends on itself")
+                self.dependents[dependency].append(step.id)
+        self.order = self._topological_order()
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps.values())
+
+    def roots(self) -> List[Step]:
+        """Steps that can start immediately."""
+        return [step for step in self.steps.values() if not step.depends_on]
+
+    def _topological_order(self) -> List[str]:
+        waiting = {step_id: len(step.depends_on) for step_id, step in self.steps.items()}
+        ready = [step_id for step_id, count in waiting.items() if count == 0]
+        order: List[str] = []
+        while ready:
+            step_id = ready.pop(0)
+            order.append(step_id)
+            for dependent in self.dependents[step_id]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) != len(self.steps):
+            cycle = sorted(step_id for step_id, count in waiting.items() if count)
+            raise ValueError(f"Plan has a dependency cycle between steps: {', '.join(cycle)}")
+        return order
+
+
+def _load_json(text: str) -> Any:
+    """Decode the JSON in a model answer, tolerating code fences and surrounding prose."""
+    candidates = [text.strip()] + [match.strip() for match in _FENCE.findall(text)]
+    for opener, closer in (("{", "}"), ("[", "]")):
+        start, end = text.find(opener), text.rfind(closer)
+        if 0 <= start < end:
+            candidates.append(text[start:end + 1])
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    raise ValueError("Plan does not contain valid JSON")
+
+
+def _step_id(value: Any) -> str:
+    return str(value).strip()
+
+
+def _parse_step(raw: Any, position: int) -> Step:
+    if isinstance(raw, str):
+        return Step(id=str(position), task=raw)
+    if not isinstance(raw, dict):
+        raise ValueError(f"Step {position} must be an object or a string")
+    task = next((raw[field] for field in TASK_FIELDS if raw.get(field)), None)
+    if not isinstance(task, str) or not task.strip():
+        raise ValueError(f"Step {position} has no task")
+    dependencies = next((raw[field] for field in DEPENDENCY_FIELDS if field in raw), None) or []
+    if isinstance(dependencies, (str, int)):
+        dependencies = [dependencies]
+    if not isinstance(dependencies, list):
+        raise ValueError(f"Step {position} has invalid dependencies")
+    step_id = raw.get("id")
+    model = raw.get("model")
+    return Step(
+        id=_step_id(position if step_id is None else step_id),
+        task=task.strip(),
+        depends_on=tuple(dict.fromkeys(_step_id(dep) for dep in dependencies)),
+        model=model if isinstance(model, str) and model else None
+    )
+
+
+def parse_plan(text: Any) -> Plan:
+    """
+    Parse a planner answer (or already-decoded JSON) into a ``Plan``.
+
+    Raises:
+        ValueError: If the answer has no usable steps or the graph is invalid
+    """
+    data = _load_json(text) if isinstance(text, str) else text
+    if isinstance(data, dict):
+        data = data.get("steps", data.get("plan"))
+    if not isinstance(data, list) or not data:
+        raise ValueError("Plan must contain a non-empty list of steps")
+    return Plan(_parse_step(raw, position) for position, raw in enumerate(data, 1))
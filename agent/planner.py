@@ -1,14 +1,46 @@
 
 import requests
 
+from agent.cache import cache_key
+from agent.plan import Plan, parse_plan
+
+PLAN_PREAMBLE = "You are a senior architect. Break into JSON steps: "
+PLAN_FORMAT = (
+    'Answer with JSON only: {"steps": [{"id": "1", "task": "...", "depends_on": []}, ...]}. '
+    "List in depends_on only the ids of steps whose results a step needs, so independent steps can run in parallel."
+)
+
+
+def plan_key(model, goal) -> str:
+    """Cache key of a goal's plan: the goal is its prompt, the instructions around it its context."""
+    return cache_key("plan", model, goal, PLAN_PREAMBLE + PLAN_FORMAT)
+
+
+def _parses(content) -> bool:
+    try:
+        parse_plan(content)
+    except ValueError:
+        return False
+    return True
+
+
 class Planner:
-    def __init__(self,bridge,secret,model):
+    def __init__(self,bridge,secret,model,cache=None):
         self.bridge=bridge
         self.secret=secret
         self.model=model
+        # Optional AgentCache: the same goal is only planned once
+        self.cache=cache
 
     def plan(self,goal):
-        prompt=f"You are a senior architect. Break into JSON steps: {goal}"
+        prompt=f"{PLAN_PREAMBLE}{goal}\n\n{PLAN_FORMAT}"
+        key=plan_key(self.model,goal)
+        cached=self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            if _parses(cached):
+                return cached
+            # Never replay an unusable plan; ask the planner again
+            self.cache.invalidate(key=key)
         body={
           "model":self.model,
           "messages":[{"role":"user","content":prompt}]
@@ -16,4 +48,12 @@ class Planner:
         r=requests.post(self.bridge+"/v1/chat/completions",
          headers={"X-API-KEY":self.secret},
          json=body)
-        return r.json()["choices"][0]["message"]["content"]
+        content=r.json()["choices"][0]["message"]["content"]
+        # An unusable plan is not kept, so the next run asks again
+        if self.cache is not None and _parses(content):
+            self.cache.set(key,"plan",self.model,goal,content)
+        return content
+
+    def steps(self, goal) -> Plan:
+        """Plan ``goal`` and parse the answer into a dependency graph (raises ValueError if unusable)."""
+        return parse_plan(self.plan(goal))
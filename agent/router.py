@@ -1,85 +1,486 @@
+"""
+Model router for agent steps.
+
+Routing is driven by a rules table rather than code. Each rule names a
+model, the keywords that trigger it, optional ``requires`` keywords of which
+at least one must also appear, and a weight::
+
+    {"name": "code-review", "model": "claude-4.5-sonnet",
+     "keywords": ["code", "bug", "refactor"], "requires": ["review", "explain"], "weight": 10}
+
+``Router`` compiles every keyword of every rule into one regular expression
+with a zero-width lookahead at each word start, so all rules are matched in
+a single pass. Matching is case-insensitive and anchored at word starts:
+``debug`` matches "debugging" and ``test`` matches "testing", but ``arch``
+no longer fires inside "research" nor ``test`` inside "latest".
+
+Keywords without spaces cannot cross whitespace, so a task is split into
+whitespace-separated tokens and each distinct token is run through the
+pattern once and memoized; routing a task is then a dictionary lookup per
+token. Phrases ("unit test") have their own pattern, which only runs when a
+token holds a phrase's first word. The winning model is memoized per set of
+keywords found.
+
+Matches are scored instead of the first hit winning: every rule that fires
+adds ``weight`` times the number of its keywords found to its model's
+score. The highest score wins, ties go to the model whose first rule is
+listed earliest, and a task that fires no rule gets the default model.
+
+``pick_batch()`` routes many tasks at once; duplicates are routed once.
+
+The rule that decides a task (the winning model's highest-scoring rule) is
+its task class. A rule may list ``candidates``, other models that can serve
+the class, and an ``slo``::
+
+    {"name": "research", "model": "sonar-pro", "candidates": ["sonar-70b", "gpt-5.2"],
+     "keywords": [...], "slo": {"max_ttft": 2.0, "max_error_rate": 0.1, "objective": "cost"}}
+
+Given a ``ModelStats`` (see ``model_stats.py``: decayed per-model TTFT,
+latency, tokens per second, error rate and cost, loaded from the bridge's
+``/models/stats`` and/or fed with what the agent observes), the router
+picks among the rule's model and its candidates. Models meeting the SLO
+(the rule's, with the router's targets for the figures it leaves open) are
+ranked by its objective: expected latency, TTFT or cost, divided by the
+success rate since a failed call has to be made again. If none meets it,
+the best of all is taken. Models with fewer than ``min_samples`` recent
+calls have no say, and the rule's own model is kept while it has none, so
+the router only moves away from the static choice on evidence. Without
+stats, or for rules without candidates, routing is static.
+
+The rules come from ``ROUTER_RULES_FILE`` (JSON: a list of rules or
+``{"default": "...", "rules": [...]}``) when set, else ``DEFAULT_RULES``.
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from model_stats import ModelStats
+
+ROUTER_RULES_FILE = os.getenv("ROUTER_RULES_FILE")
+
+DEFAULT_MODEL = "gpt-5.2"
+
+CODE_KEYWORDS = ["code", "function", "class", "bug", "debug", "implement", "refactor"]
+REASONING_KEYWORDS = ["reason", "analyze", "logic", "think", "complex", "solve"]
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    # Coding and development tasks -> GitHub Copilot, or Claude for reviews
+    {"name": "code-review", "model": "claude-4.5-sonnet", "candidates": ["gpt-5.2"], "keywords": CODE_KEYWORDS,
+     "requires": ["review", "explain"], "weight": 10},
+    {"name": "coding", "model": "copilot-gpt-4", "candidates": ["claude-4.5-sonnet", "gpt-5.2"],
+     "keywords": CODE_KEYWORDS, "weight": 9},
+    # Complex reasoning and logic -> GPT-5.2, or Claude when precision matters
+    {"name": "precise-reasoning", "model": "claude-4.5-sonnet", "candidates": ["claude-4.5-opus"],
+     "keywords": REASONING_KEYWORDS, "requires": ["technical", "precise"], "weight": 8.5},
+    {"name": "reasoning", "model": "gpt-5.2", "candidates": ["claude-4.5-sonnet", "gemini-3-pro"],
+     "keywords": REASONING_KEYWORDS, "weight": 8},
+    # Research and factual queries -> Sonar
+    {"name": "research", "model": "sonar-pro", "candidates": ["llama-3.1-sonar-large-128k-online"],
+     "keywords": ["research", "find", "search", "what is", "who is", "fact", "source"], "weight": 7},
+    # Large data processing and multimodal -> Gemini
+    {"name": "data", "model": "gemini-3-pro", "candidates": ["gemini-3-flash"],
+     "keywords": ["data", "dataset", "analyze data", "large", "multimodal", "image", "video"], "weight": 6},
+    # Architecture and design tasks -> Claude
+    {"name": "design", "model": "claude-4.5-sonnet", "candidates": ["gpt-5.2"],
+     "keywords": ["design", "arch", "architecture", "plan", "structure"], "weight": 5},
+    # Testing -> Copilot
+    {"name": "testing", "model": "copilot-gpt-4", "candidates": ["claude-4.5-sonnet"],
+     "keywords": ["test", "testing", "unit test", "qa"], "weight": 4},
+    # Creative and generative tasks -> GPT-5.2
+    {"name": "creative", "model": "gpt-5.2", "candidates": ["claude-4.5-sonnet"],
+     "keywords": ["create", "generate", "write", "creative", "story", "content"], "weight": 3},
+    # DevOps and automation -> Copilot Agent
+    {"name": "devops", "model": "copilot-agent",
+     "keywords": ["deploy", "ci/cd", "pipeline", "automate", "devops"], "weight": 2},
+]
+
+MODEL_REASONS = {
+    "gpt-5.2": "Best for complex reasoning, creativity, and general problem-solving",
+    "gemini-3-pro": "Optimal for large data sets and multimodal analysis",
+    "gemini-3-flash": "Fast, low-cost option for data and multimodal tasks",
+    "claude-4.5-sonnet": "Strongest for technical reasoning, coding, and structured workflows",
+    "claude-4.5-opus": "Premium tier for most demanding logic tasks",
+    "sonar-pro": "Best for factual research with source citations",
+    "copilot-gpt-4": "Specialized for code generation and development tasks",
+    "copilot-agent": "Multi-step agentic workflows for DevOps automation",
+    "llama-3.1-sonar-large-128k-online": "Large context window for comprehensive tasks"
+}
+
+# Entries kept in each of the router's memo tables (tokens, keyword sets)
+MEMO_SIZE = 65536
+
+OBJECTIVES = ("latency", "ttft", "cost")
+
+
+class SLO(NamedTuple):
+    """Targets a task class's model should meet; None leaves a figure unconstrained."""
+
+    max_ttft: Optional[float] = None
+    max_latency: Optional[float] = None
+    min_tokens_per_second: Optional[float] = None
+    max_error_rate: Optional[float] = None
+    max_cost: Optional[float] = None
+    objective: str = "latency"
+
+    def violations(self, estimate: Dict[str, Any]) -> List[str]:
+        """The targets ``estimate`` misses; figures it has no value for are not held against it."""
+        missed = []
+        for figure, limit, above in (
+            ("ttft", self.max_ttft, True), ("latency", self.max_latency, True),
+            ("tokens_per_second", self.min_tokens_per_second, False),
+            ("error_rate", self.max_error_rate, True), ("cost", self.max_cost, True),
+        ):
+            value = estimate.get(figure)
+            if limit is not None and value is not None and (value > limit if above else value < limit):
+                missed.append(figure)
+        return missed
+
+
+DEFAULT_SLO = SLO(max_error_rate=0.2)
+
+
+class Rule(NamedTuple):
+    """One compiled routing rule."""
+
+    name: str
+    model: str
+    keywords: FrozenSet[str]
+    requires: FrozenSet[str] = frozenset()
+    weight: float = 1.0
+    candidates: Tuple[str, ...] = ()
+    slo: Optional[SLO] = None
+
+
+def _keywords(raw: Any, field: str, name: str) -> FrozenSet[str]:
+    if raw is None:
+        return frozenset()
+    if isinstance(raw, str):
+        raw = [raw]
+    if not isinstance(raw, list) or not all(isinstance(keyword, str) for keyword in raw):
+        raise ValueError(f"Routing rule {name!r}: {field} must be a list of strings")
+    keywords = frozenset(" ".join(keyword.lower().split()) for keyword in raw)
+    if "" in keywords:
+        raise ValueError(f"Routing rule {name!r}: {field} contains an empty keyword")
+    return keywords
+
+
+def _lookahead_pattern(terms: Iterable[str]) -> Optional["re.Pattern[str]"]:
+    """One regex reporting, at every word start, the longest term found there."""
+    ordered = sorted(terms, key=lambda term: (-len(term), term))
+    if not ordered:
+        return None
+    alternatives = "|".join(re.escape(term).replace(r"\ ", r"\s+") for term in ordered)
+    return re.compile(r"(?<!\w)(?=(" + alternatives + "))")
+
+
+def parse_slo(raw: Any, name: str = "router") -> SLO:
+    """Validate an SLO object (raises ValueError)."""
+    if isinstance(raw, SLO):
+        return raw
+    if not isinstance(raw, dict) or set(raw) - set(SLO._fields):
+        raise ValueError(f"Routing rule {name!r}: slo must be an object with fields {', '.join(SLO._fields)}")
+    limits: Dict[str, Any] = {}
+    for field in SLO._fields[:-1]:
+        value = raw.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"Routing rule {name!r}: slo {field} must be a non-negative number")
+        limits[field] = float(value)
+    objective = raw.get("objective", "latency")
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Routing rule {name!r}: slo objective must be one of {', '.join(OBJECTIVES)}")
+    return SLO(objective=objective, **limits)
+
+
+def parse_rule(raw: Any) -> Rule:
+    """Validate one rule from the table (raises ValueError)."""
+    if not isinstance(raw, dict) or not isinstance(raw.get("model"), str) or not raw["model"]:
+        raise ValueError(f"Routing rule must be an object with a model: {raw!r}")
+    name = str(raw.get("name") or raw["model"])
+    keywords = _keywords(raw.get("keywords"), "keywords", name)
+    if not keywords:
+        raise ValueError(f"Routing rule {name!r} has no keywords")
+    try:
+        weight = float(raw.get("weight", 1.0))
+    except (TypeError, ValueError):
+        raise ValueError(f"Routing rule {name!r}: weight must be a number")
+    if weight <= 0:
+        raise ValueError(f"Routing rule {name!r}: weight must be positive")
+    candidates = raw.get("candidates") or []
+    if isinstance(candidates, str):
+        candidates = [candidates]
+    if not isinstance(candidates, list) or not all(isinstance(model, str) and model for model in candidates):
+        raise ValueError(f"Routing rule {name!r}: candidates must be a list of model names")
+    slo = None if raw.get("slo") is None else parse_slo(raw["slo"], name)
+    return Rule(
+        name, raw["model"], keywords, _keywords(raw.get("requires"), "requires", name), weight,
+        tuple(model for model in dict.fromkeys(candidates) if model != raw["model"]), slo
+    )
+
+
+def load_rules(path: str) -> Tuple[List[Rule], Optional[str]]:
+    """Read a rules file; returns the rules and the default model it names, if any."""
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"Routing rules file {path} is not valid JSON: {e}")
+    default = None
+    if isinstance(data, dict):
+        default = data.get("default")
+        data = data.get("rules")
+    if not isinstance(data, list):
+        raise ValueError(f"Routing rules file {path} must contain a list of rules")
+    return [parse_rule(raw) for raw in data], default
+
+
+def _describe(estimate: Dict[str, Any]) -> str:
+    """The observed figures of an estimate, leaving out those never measured."""
+    observed = []
+    for figure, template in (
+        ("latency", "{:.2f}s latency"), ("ttft", "{:.2f}s to first token"),
+        ("tokens_per_second", "{:.0f} tokens/s"), ("error_rate", "{:.0%} errors"), ("cost", "${:.4f} per call"),
+    ):
+        if estimate.get(figure) is not None:
+            observed.append(template.format(estimate[figure]))
+    return ", ".join(observed)
+
 
 class Router:
     """
     Intelligent model router that selects the best model for a given task.
-    
+
     Routes between Perplexity models (GPT-5.2, Gemini 3 Pro, Claude 4.5, Sonar)
-    and GitHub Copilot models based on task characteristics.
+    and GitHub Copilot models based on task characteristics and, given
+    ``stats``, on how the candidate models are performing.
     """
-    
+
+    def __init__(
+        self,
+        rules: Optional[Iterable[Any]] = None,
+        default: Optional[str] = None,
+        path: Optional[str] = None,
+        stats: Optional[ModelStats] = None,
+        slo: Any = DEFAULT_SLO,
+        min_samples: float = 3.0
+    ):
+        """
+        Compile a rules table.
+
+        Args:
+            rules: Rules as dicts or ``Rule``s (defaults to the rules file, then DEFAULT_RULES)
+            default: Model for tasks no rule matches
+            path: JSON rules file (defaults to ROUTER_RULES_FILE)
+            stats: Per-model estimates to route by (static routing without)
+            slo: ``SLO`` (or dict) for rules that have none
+            min_samples: Recent calls a model needs before its estimates count
+        """
+        file_default = None
+        path = path or (ROUTER_RULES_FILE if rules is None else None)
+        if rules is None and path:
+            rules, file_default = load_rules(path)
+        if rules is None:
+            rules = DEFAULT_RULES
+        self.rules: List[Rule] = [rule if isinstance(rule, Rule) else parse_rule(rule) for rule in rules]
+        self.default = default or file_default or DEFAULT_MODEL
+        self.stats = stats
+        self.slo = parse_slo(slo)
+        self.min_samples = min_samples
+        # A rule's SLO takes the router's targets for the figures it leaves open
+        self._slos = [
+            self.slo if rule.slo is None else rule.slo._replace(**{
+                field: getattr(self.slo, field) for field in SLO._fields[:-1] if getattr(rule.slo, field) is None
+            })
+            for rule in self.rules
+        ]
+        self._compile()
+
+    def _compile(self) -> None:
+        keywords: Set[str] = set()
+        for rule in self.rules:
+            keywords |= rule.keywords | rule.requires
+        phrases = {keyword for keyword in keywords if " " in keyword}
+        heads = {phrase.split(" ", 1)[0] for phrase in phrases}
+        # Keywords without spaces never cross whitespace, so each token is
+        # scanned on its own (and only once, see _scan_token); phrases get a
+        # second pattern that only runs when a token holds a phrase's first word
+        self._token_pattern = _lookahead_pattern((keywords - phrases) | heads)
+        self._phrase_pattern = _lookahead_pattern(phrases)
+        # Terms that may open a phrase (a longer term can hide a head at the same position)
+        self._phrase_starts = frozenset(
+            term for term in (keywords - phrases) | heads if any(term.startswith(head) for head in heads)
+        )
+        # A keyword found at a word start also proves every shorter keyword it begins with
+        self._implied: Dict[str, FrozenSet[str]] = {
+            term: frozenset(keyword for keyword in keywords if term.startswith(keyword))
+            for term in keywords | heads
+        }
+        self._triggers: Dict[str, Tuple[int, ...]] = {
+            keyword: tuple(index for index, rule in enumerate(self.rules) if keyword in rule.keywords)
+            for keyword in keywords
+        }
+        self._priority: Dict[str, int] = {}
+        for index, rule in enumerate(self.rules):
+            self._priority.setdefault(rule.model, index)
+        # Static model by deciding rule index; -1 (no rule) is the default
+        self._models = [rule.model for rule in self.rules] + [self.default]
+        self._tokens: Dict[str, FrozenSet[str]] = {}
+        self._phrase_tokens: Set[str] = set()
+        self._routes: Dict[FrozenSet[str], int] = {}
+
+    def _scan_token(self, token: str) -> FrozenSet[str]:
+        """Memoize the keywords found in one whitespace-free token."""
+        terms = set(self._token_pattern.findall(token)) if self._token_pattern else set()
+        found = frozenset().union(*(self._implied[term] for term in terms))
+        if len(self._tokens) >= MEMO_SIZE:
+            self._tokens.clear()
+            self._phrase_tokens.clear()
+        self._tokens[token] = found
+        if not self._phrase_starts.isdisjoint(terms):
+            self._phrase_tokens.add(token)
+        return found
+
+    def _found(self, text: str) -> FrozenSet[str]:
+        """Every keyword that occurs at a word start in ``text`` (already lowercased)."""
+        words = text.split()
+        try:
+            found = frozenset().union(*map(self._tokens.__getitem__, words))
+        except KeyError:
+            tokens = self._tokens
+            found = frozenset().union(*[tokens[word] if word in tokens else self._scan_token(word) for word in words])
+        if self._phrase_pattern is not None and not self._phrase_tokens.isdisjoint(words):
+            phrases = set(self._phrase_pattern.findall(text))
+            found = found.union(*(self._implied[" ".join(match.split())] for match in phrases))
+        return found
+
+    def _rule_scores(self, found: FrozenSet[str]) -> Dict[int, float]:
+        """Score of every rule (by index) that fires on ``found``."""
+        hits: Dict[int, int] = {}
+        triggers = self._triggers
+        for keyword in found:
+            for index in triggers[keyword]:
+                hits[index] = hits.get(index, 0) + 1
+        scores: Dict[int, float] = {}
+        for index, count in hits.items():
+            rule = self.rules[index]
+            if rule.requires and rule.requires.isdisjoint(found):
+                continue
+            scores[index] = rule.weight * count
+        return scores
+
+    def _model_scores(self, rule_scores: Dict[int, float]) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for index, score in rule_scores.items():
+            model = self.rules[index].model
+            scores[model] = scores.get(model, 0.0) + score
+        return scores
+
+    def _route(self, found: FrozenSet[str]) -> int:
+        """Index of the rule that decides ``found`` (the task class), or -1 for the default model."""
+        index = self._routes.get(found)
+        if index is None:
+            rule_scores = self._rule_scores(found)
+            index = -1
+            if rule_scores:
+                scores = self._model_scores(rule_scores)
+                priority = self._priority
+                model = max(scores, key=lambda name: (scores[name], -priority[name]))
+                index = max(
+                    (i for i in rule_scores if self.rules[i].model == model), key=lambda i: (rule_scores[i], -i)
+                )
+            if len(self._routes) >= MEMO_SIZE:
+                self._routes.clear()
+            self._routes[found] = index
+        return index
+
+    def _expected(self, estimate: Dict[str, Any], objective: str) -> Tuple[float, float]:
+        """Rank key of a model's estimate: the objective, then latency, per successful call."""
+        retries = 1.0 / max(0.01, 1.0 - (estimate.get("error_rate") or 0.0))
+        key = []
+        for figure in (objective, "latency"):
+            value = estimate.get(figure)
+            key.append(float("inf") if value is None else value * retries)
+        return key[0], key[1]
+
+    def _choose(self, index: int, explain: bool = False) -> Tuple[str, str]:
+        """Model for a task class given the current stats and, with ``explain``, why it was chosen."""
+        if index < 0 or self.stats is None or not self.rules[index].candidates:
+            return self._models[index], ""
+        rule = self.rules[index]
+        slo = self._slos[index]
+        estimates = {}
+        for model in (rule.model,) + rule.candidates:
+            estimate = self.stats.estimate(model)
+            if estimate is not None and estimate["samples"] >= self.min_samples:
+                estimates[model] = estimate
+        if rule.model not in estimates:
+            return rule.model, ""
+        meeting = [model for model in estimates if not slo.violations(estimates[model])]
+        pool = meeting or list(estimates)
+        model = min(pool, key=lambda name: self._expected(estimates[name], slo.objective))
+        if not explain:
+            return model, ""
+        verdict = (f"best {slo.objective} of {len(meeting)} meeting the SLO" if meeting
+                   else f"no candidate meets the SLO, best {slo.objective} of {len(estimates)}")
+        return model, f"{rule.name}: {_describe(estimates[model])} ({verdict})"
+
+    def scores(self, task: str) -> Dict[str, float]:
+        """Score of every model whose rules match ``task``."""
+        return self._model_scores(self._rule_scores(self._found(task.lower())))
+
+    def task_class(self, task: str) -> Optional[str]:
+        """Name of the rule that decides ``task``, or None if it gets the default model."""
+        index = self._route(self._found(task.lower()))
+        return self.rules[index].name if index >= 0 else None
+
     def pick(self, task):
         """
-        Select the best model for a task based on keywords and patterns.
-        
+        Select the best model for a task.
+
         Args:
             task: Task description string
-            
+
         Returns:
             Model ID to use
         """
-        t = task.lower()
-        
-        # Coding and development tasks -> GitHub Copilot or Claude
-        if any(keyword in t for keyword in ["code", "function", "class", "bug", "debug", "implement", "refactor"]):
-            if "review" in t or "explain" in t:
-                return "claude-4.5-sonnet"
-            return "copilot-gpt-4"
-        
-        # Complex reasoning and logic -> GPT-5.2 or Claude
-        if any(keyword in t for keyword in ["reason", "analyze", "logic", "think", "complex", "solve"]):
-            if "technical" in t or "precise" in t:
-                return "claude-4.5-sonnet"
-            return "gpt-5.2"
-        
-        # Research and factual queries -> Sonar
-        if any(keyword in t for keyword in ["research", "find", "search", "what is", "who is", "fact", "source"]):
-            return "sonar-pro"
-        
-        # Large data processing and multimodal -> Gemini
-        if any(keyword in t for keyword in ["data", "dataset", "analyze data", "large", "multimodal", "image", "video"]):
-            return "gemini-3-pro"
-        
-        # Architecture and design tasks -> Sonar Large or Claude
-        if any(keyword in t for keyword in ["design", "arch", "architecture", "plan", "structure"]):
-            return "claude-4.5-sonnet"
-        
-        # Testing and debugging -> Claude or Copilot
-        if any(keyword in t for keyword in ["test", "testing", "unit test", "qa"]):
-            return "copilot-gpt-4"
-        
-        # Creative and generative tasks -> GPT-5.2
-        if any(keyword in t for keyword in ["create", "generate", "write", "creative", "story", "content"]):
-            return "gpt-5.2"
-        
-        # DevOps and automation -> Copilot Agent
-        if any(keyword in t for keyword in ["deploy", "ci/cd", "pipeline", "automate", "devops"]):
-            return "copilot-agent"
-        
-        # Default: Use GPT-5.2 for general tasks
-        return "gpt-5.2"
-    
+        index = self._route(self._found(task.lower()))
+        if self.stats is None:
+            return self._models[index]
+        return self._choose(index)[0]
+
+    def pick_batch(self, tasks: Sequence[str]) -> List[str]:
+        """
+        Select models for many tasks at once, in order.
+
+        Equivalent to ``[self.pick(task) for task in tasks]``, but identical
+        tasks are routed only once.
+        """
+        found, route = self._found, self._route
+        classes = {task: route(found(task.lower())) for task in dict.fromkeys(tasks)}
+        if self.stats is None:
+            models = self._models
+        else:
+            models = {index: self._choose(index)[0] for index in set(classes.values())}
+        return [models[classes[task]] for task in tasks]
+
+    def observe(self, model: str, latency: float, error: bool = False) -> None:
+        """Feed one call the agent made into ``stats`` (no-op without stats)."""
+        if self.stats is not None:
+            self.stats.record(model, latency, error=error)
+
     def pick_with_reasoning(self, task):
         """
         Select model and provide reasoning for the choice.
-        
+
         Args:
             task: Task description string
-            
+
         Returns:
             Tuple of (model_id, reasoning)
         """
-        model = self.pick(task)
-        
-        reasons = {
-            "gpt-5.2": "Best for complex reasoning, creativity, and general problem-solving",
-            "gemini-3-pro": "Optimal for large data sets and multimodal analysis",
-            "claude-4.5-sonnet": "Strongest for technical reasoning, coding, and structured workflows",
-            "claude-4.5-opus": "Premium tier for most demanding logic tasks",
-            "sonar-pro": "Best for factual research with source citations",
-            "copilot-gpt-4": "Specialized for code generation and development tasks",
-            "copilot-agent": "Multi-step agentic workflows for DevOps automation",
-            "llama-3.1-sonar-large-128k-online": "Large context window for comprehensive tasks"
-        }
-        
-        return model, reasons.get(model, "General purpose model")
-
+        model, observed = self._choose(self._route(self._found(task.lower())), explain=True)
+        reason = MODEL_REASONS.get(model, "General purpose model")
+        return model, f"{reason}; observed for {observed}" if observed else reason
@@ -3,25 +3,42 @@ from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPExcept
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.websockets import WebSocketState
 from pydantic import BaseModel, Field, validator
 from typing import List, Dict, Optional, Union, Any
 import asyncio
+import functools
 import httpx
 import json
 import logging
 import os
+import re
 import time
 import shlex
+from contextlib import asynccontextmanager
 from pathlib import Path
-from slowapi import _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from config import (
-    PERPLEXITY_KEY, BASE_URL, BRIDGE_SECRET, RATE_LIMIT,
-    GITHUB_COPILOT_KEY, GITHUB_COPILOT_BASE_URL, has_github_copilot
+from config import WS_SEND_TIMEOUT, WS_MAX_CONCURRENT_STREAMS, METRICS_PUBLIC
+from auth import APIKeyMiddleware
+from keystore import APIKey, api_keys
+from rate_limit import limiter, RateLimitExceeded, rate_limit_exceeded_handler, client_address
+from admission import (
+    admission, AdmissionRejected, estimate_tokens, request_flow, release_after, used_tokens
+)
+import codec
+from providers import Provider, providers
+from catalog import model_catalog, etag_matches
+from upstream import upstream_pool
+from retry import upstream_retry
+from breaker import circuit_breakers, CircuitOpenError, OPEN
+from cache import response_cache, canonical_request_key, wants_no_cache
+from coalesce import single_flight, stream_fanout
+from sse import SSEBufferOverflow, format_sse
+from backpressure import SendQueue, SlowConsumerError, backpressure_stats
+from cancellation import StreamTracker, cancel_on_disconnect, cancellation_stats
+from metrics import (
+    registry as metrics_registry, shared_metrics, observe_request, instrument_stream, snapshot_samples, model_stats,
+    requests_total, websocket_connections, terminal_commands_total, terminal_duration
 )
-from rate_limit import limiter
-from adapters.copilot_adapter import CopilotAdapter
 
 # Configure logging
 logging.basicConfig(
@@ -30,6 +47,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared upstream clients on startup and close them on shutdown."""
+    await upstream_pool.start(providers.available())
+    model_catalog.refresh()
+    # With several workers, each publishes its metrics for /metrics to aggregate
+    flusher = asyncio.ensure_future(shared_metrics.run()) if shared_metrics.enabled else None
+    try:
+        yield
+    finally:
+        if flusher is not None:
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+            shared_metrics.flush()
+        await upstream_pool.close()
+        await limiter.close()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Perplexity Bridge API",
@@ -57,12 +93,12 @@ app = FastAPI(
     """,
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
-# Configure rate limiter with app state
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+# Rate-limit rejections are returned as {"error": ...} with a Retry-After header
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 
 # Add CORS middleware
 app.add_middleware(
@@ -77,6 +113,49 @@ app.add_middleware(
     allow_headers=["Content-Type", "X-API-KEY", "Authorization"],
 )
 
+# API-key check for HTTP requests; added last so it runs outermost, as before
+app.add_middleware(
+    APIKeyMiddleware,
+    keys=api_keys,
+    public_paths=["/", "/health", "/models", "/docs", "/openapi.json", "/redoc"] + (["/metrics"] if METRICS_PUBLIC else []),
+    public_prefixes=["/ui", "/assets"],
+    admin_prefixes=["/admin", "/metrics", "/terminal", "/project"]
+)
+
+# Request ids used to multiplex several streams over one /ws/chat connection
+WS_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+# Component statistics exported on /metrics alongside the request metrics
+metrics_registry.register_collector(
+    lambda: snapshot_samples("bridge_upstream_pool", upstream_pool.stats(), {"providers": "provider"})
+)
+metrics_registry.register_collector(
+    lambda: snapshot_samples("bridge_response_cache", response_cache.stats(), {"model_ttls": "model"})
+)
+metrics_registry.register_collector(
+    lambda: snapshot_samples("bridge_coalesce", {"requests": single_flight.stats(), "streams": stream_fanout.stats()})
+)
+metrics_registry.register_collector(lambda: snapshot_samples("bridge_websocket", backpressure_stats.snapshot()))
+metrics_registry.register_collector(
+    lambda: snapshot_samples("bridge_cancellations", cancellation_stats.snapshot(), {"by_reason": "reason"})
+)
+metrics_registry.register_collector(
+    lambda: snapshot_samples("bridge_circuit", circuit_breakers.stats(), {"upstreams": "upstream"})
+)
+metrics_registry.register_collector(
+    lambda: snapshot_samples("bridge_retry", upstream_retry.stats(), {"retries": "reason", "p95_seconds": "provider"})
+)
+metrics_registry.register_collector(
+    lambda: snapshot_samples("bridge_api_keys", api_keys.stats(), {"keys": "key", "rejected": "reason"})
+)
+metrics_registry.register_collector(
+    lambda: snapshot_samples("bridge_admission", admission.stats(), {
+        "provider_limits": "provider", "model_limits": "model", "tpm": "provider",
+        "in_flight": "provider", "in_flight_models": "model", "rejected": "reason"
+    })
+)
+metrics_registry.register_collector(lambda: snapshot_samples("bridge_model_stats", model_stats.stats(), {"models": "model"}))
+
 # Paths
 PROJECT_ROOT = Path(__file__).parent.resolve()
 UI_FILE = PROJECT_ROOT / "ui" / "perplex_index2.html"
@@ -164,339 +243,257 @@ class TerminalReq(BaseModel):
     command: str = Field(..., description="Shell command to execute")
 
 
-def get_perplexity_key() -> str:
-    if not PERPLEXITY_KEY or not PERPLEXITY_KEY.strip():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="PERPLEXITY_API_KEY is not configured on the server"
-        )
-    return PERPLEXITY_KEY.strip()
-
-
 def get_model_provider(model_id: str) -> str:
     """
     Determine which API provider to use based on model ID.
     
     Returns:
-        'perplexity' or 'github-copilot'
+        The registered provider name, e.g. 'perplexity' or 'github-copilot'
     """
-    if model_id.startswith("copilot-"):
-        return "github-copilot"
-    return "perplexity"
-
-
-async def _perplexity_chat(req: ChatReq, request_data: dict) -> Any:
-    """Handle chat request via Perplexity API."""
-    key = get_perplexity_key()
-    headers = {
-        "Authorization": f"Bearer {key}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    
-    if req.stream:
-        async def stream_response():
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                async with client.stream(
-                    "POST",
-                    BASE_URL,
-                    json=request_data,
-                    headers=headers
-                ) as response:
-                    if response.status_code >= 400:
-                        error_text = await response.aread()
-                        error_payload = json.dumps({
-                            "error": f"Perplexity API error: {error_text.decode(errors='replace')}",
-                            "type": "error"
-                        })
-                        yield f"data: {error_payload}\n\n"
-                        return
-                    async for chunk in response.aiter_text():
-                        if chunk:
-                            yield chunk
-
-        return StreamingResponse(stream_response(), media_type="text/event-stream")
-    
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(
-            BASE_URL,
-            json=request_data,
-            headers=headers
-        )
-        response.raise_for_status()
-        response_data = response.json()
-        
-        if not isinstance(response_data, dict):
-            raise ValueError("Response is not a valid JSON object")
-        
-        if "error" in response_data:
-            error_msg = response_data.get("error", {}).get("message", "Unknown API error")
-            logger.error(f"Perplexity API returned error: {error_msg}")
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail=f"Perplexity API error: {error_msg}"
-            )
-        
-        if "choices" not in response_data:
-            logger.error("Response missing 'choices' field")
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail="Invalid response format: missing 'choices' field"
-            )
-        
-        if not isinstance(response_data["choices"], list) or len(response_data["choices"]) == 0:
-            logger.error("Response has no choices")
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail="Invalid response format: no choices returned"
-            )
-        
-        choice = response_data["choices"][0]
-        if "message" not in choice:
-            logger.error("Choice missing 'message' field")
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail="Invalid response format: choice missing 'message' field"
-            )
-        
-        logger.info("Successfully validated and returning response")
-        return response_data
+    return providers.provider_name(model_id)
 
 
-async def _copilot_chat(req: ChatReq, request_data: dict) -> Any:
-    """Handle chat request via GitHub Copilot API."""
-    if not has_github_copilot():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="GitHub Copilot API is not configured. Please set GITHUB_COPILOT_API_KEY."
-        )
-    
+async def _sse_stream(provider: Provider, payload: dict):
+    """Forward a provider stream as SSE, turning upstream failures into an error event."""
     try:
-        adapter = CopilotAdapter(api_key=GITHUB_COPILOT_KEY, base_url=GITHUB_COPILOT_BASE_URL)
-        
-        if req.stream:
-            # For streaming, we'd need to implement streaming in the adapter
-            # For now, return a note that streaming is not yet supported for Copilot
-            raise HTTPException(
-                status_code=status.HTTP_501_NOT_IMPLEMENTED,
-                detail="Streaming is not yet implemented for GitHub Copilot. Please disable streaming."
-            )
-        
-        response_data = await adapter.chat_completion(
-            messages=[m.dict() for m in req.messages],
-            model=req.model,
-            stream=False,
-            max_tokens=req.max_tokens,
-            temperature=req.temperature
-        )
-        
-        logger.info("Successfully received response from GitHub Copilot")
-        return response_data
-        
-    except Exception as e:
-        logger.error(f"GitHub Copilot API error: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"GitHub Copilot API error: {str(e)}"
-        )
+        async for frame in provider.stream(payload):
+            yield frame
+    except httpx.HTTPStatusError as e:
+        yield format_sse(json.dumps({"error": f"{provider.label} API error: {e.response.text}", "type": "error"}))
+    except SSEBufferOverflow as e:
+        logger.error(f"{provider.label} stream framing error: {str(e)}")
+        yield format_sse(json.dumps({"error": f"Stream error: {str(e)}", "type": "error"}))
 
 
-@app.middleware("http")
-async def auth(req: Request, call_next):
-    """Authentication middleware for HTTP requests."""
-    # Skip auth for public endpoints and UI
-    public_paths = [
-        "/", "/health", "/models", "/docs", "/openapi.json", "/redoc"
-    ]
-    if (
-        req.url.path in public_paths
-        or req.url.path.startswith("/ui/")
-        or req.url.path == "/ui"
-        or req.url.path.startswith("/assets/")
-        or req.url.path == "/assets"
-    ):
-        return await call_next(req)
-    
-    api_key = req.headers.get("X-API-KEY")
-    if api_key != BRIDGE_SECRET:
-        logger.warning(f"Unauthorized request attempt from {get_remote_address(req)}")
-        return Response(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            content=json.dumps({"error": "Unauthorized. Invalid X-API-KEY header."}),
-            media_type="application/json"
-        )
-    return await call_next(req)
+async def _record_stream_usage(source, api_key, tracker: StreamTracker):
+    """Yield from ``source``, then add the streamed token count to ``api_key``'s usage."""
+    try:
+        async for chunk in source:
+            yield chunk
+    finally:
+        api_keys.record_usage(api_key, tracker.tokens)
 
 
 @app.get("/health")
 async def health():
-    """Health check endpoint."""
+    """Health check endpoint. Reports "degraded" while any upstream circuit is open."""
+    circuits = circuit_breakers.states()
     return {
-        "status": "healthy",
+        "status": "degraded" if OPEN in circuits.values() else "healthy",
         "service": "perplexity-bridge",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "circuits": circuits
     }
 
 
+@app.get("/admin/pool")
+async def pool_stats():
+    """
+    Upstream connection pool statistics.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return upstream_pool.stats()
+
+
+@app.get("/admin/cache")
+async def cache_stats():
+    """
+    Response cache statistics.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return response_cache.stats()
+
+
+@app.post("/admin/cache/clear")
+async def cache_clear():
+    """
+    Drop every cached response.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    response_cache.clear()
+    return {"status": "cleared"}
+
+
+@app.get("/admin/coalesce")
+async def coalesce_stats():
+    """
+    Request coalescing statistics.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return {"requests": single_flight.stats(), "streams": stream_fanout.stats()}
+
+
+@app.get("/admin/websocket")
+async def websocket_stats():
+    """
+    WebSocket send queue statistics (queue depth, time blocked on slow clients).
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return backpressure_stats.snapshot()
+
+
+@app.get("/admin/cancellations")
+async def cancellation_stats_endpoint():
+    """
+    Streams cancelled by their clients and the upstream tokens and bytes that were not pulled.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return {**cancellation_stats.snapshot(), "upstream_streams_cancelled": stream_fanout.cancelled}
+
+
+@app.get("/admin/rate-limit")
+async def rate_limit_stats():
+    """
+    Rate limiter configuration and decision counts.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return limiter.stats()
+
+
+@app.get("/admin/providers")
+async def provider_stats():
+    """
+    Registered providers with their URL, timeouts, pool limits and models.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return providers.stats()
+
+
+@app.get("/admin/circuits")
+async def circuit_stats():
+    """
+    Circuit breaker state, rolling failure rate and trips per upstream, plus the failover table.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return circuit_breakers.stats()
+
+
+@app.get("/admin/retry")
+async def retry_stats():
+    """
+    Upstream retry and hedging counters, retry budget and per-provider p95 latency.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return upstream_retry.stats()
+
+
+@app.get("/admin/admission")
+async def admission_stats():
+    """
+    Upstream admission scheduler limits, in-flight calls, queue depth and rejections.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return admission.stats()
+
+
+@app.get("/admin/keys")
+async def key_stats():
+    """
+    API keys with their model allowlists, quotas and usage counters (never the keys themselves).
+    
+    **Authentication Required**: Include an admin `X-API-KEY` header
+    """
+    return api_keys.stats()
+
+
+@app.post("/admin/keys/reload")
+async def key_reload():
+    """
+    Re-read `API_KEYS_FILE` now instead of waiting for the next change check.
+    
+    **Authentication Required**: Include an admin `X-API-KEY` header
+    """
+    try:
+        count = api_keys.reload()
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"status": "reloaded", "keys": count}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus text-format metrics.
+    
+    Per-model and per-provider request counts, latency, time-to-first-token and
+    stream duration histograms, upstream status codes, bytes proxied, plus the
+    pool, cache, coalescing, WebSocket and cancellation statistics.
+    
+    With several worker processes the metrics of all workers are combined
+    (component statistics are labelled by `worker`).
+    
+    **Authentication Required**: Include `X-API-KEY` header (unless `METRICS_PUBLIC` is enabled)
+    """
+    body = shared_metrics.render() if shared_metrics.enabled else metrics_registry.render()
+    return Response(content=body, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/models")
-async def get_models():
+async def get_models(request: Request, provider: Optional[str] = None, category: Optional[str] = None):
     """
-    Get list of available models from both Perplexity and GitHub Copilot.
+    Get list of available models from every configured provider (Perplexity,
+    GitHub Copilot and any local OpenAI-compatible backends).
     This endpoint returns all supported models including GPT, Gemini, Claude, and reasoning models.
     Model availability depends on your Perplexity API subscription tier.
+    
+    **Filtering**: `?provider=github-copilot` and/or `?category=coding`
+    
+    **Caching**: The response carries a strong `ETag` and `Cache-Control: max-age`;
+    send `If-None-Match` to get `304 Not Modified` when the list is unchanged
     """
-    models = [
-        # OpenAI GPT Models
-        {
-            "id": "gpt-5.2",
-            "name": "GPT-5.2 (ChatGPT)",
-            "description": "Advanced reasoning, coding, creativity. Best for generative tasks and complex problem-solving",
-            "provider": "perplexity",
-            "category": "reasoning"
-        },
-        # Google Gemini Models
-        {
-            "id": "gemini-3-pro",
-            "name": "Gemini 3 Pro",
-            "description": "Multimodal AI with 1M token context. Ideal for large data sets and enterprise tasks",
-            "provider": "perplexity",
-            "category": "reasoning"
-        },
-        {
-            "id": "gemini-3-flash",
-            "name": "Gemini 3 Flash",
-            "description": "Fast variant of Gemini 3 optimized for speed while maintaining strong performance",
-            "provider": "perplexity",
-            "category": "reasoning"
-        },
-        # Anthropic Claude Models
-        {
-            "id": "claude-4.5-sonnet",
-            "name": "Claude 4.5 Sonnet",
-            "description": "Technical reasoning, coding, agentic workflows. Strong for structured problem solving",
-            "provider": "perplexity",
-            "category": "reasoning"
-        },
-        {
-            "id": "claude-4.5-opus",
-            "name": "Claude 4.5 Opus",
-            "description": "Most advanced Claude model with superior reasoning for Pro/Max/Enterprise users",
-            "provider": "perplexity",
-            "category": "reasoning"
-        },
-        # xAI Grok
-        {
-            "id": "grok-4.1",
-            "name": "Grok 4.1",
-            "description": "Conversational intelligence, code, image/text understanding with reasoning toggle",
-            "provider": "perplexity",
-            "category": "reasoning"
-        },
-        # Moonshot Kimi
-        {
-            "id": "kimi-k2-thinking",
-            "name": "Kimi K2 Thinking",
-            "description": "Privacy-first model with step-by-step reasoning always enabled, ideal for technical analysis",
-            "provider": "perplexity",
-            "category": "reasoning"
-        },
-        # Perplexity Sonar Models
-        {
-            "id": "sonar-pro",
-            "name": "Sonar Pro (Llama 3.1 70B)",
-            "description": "Real-time search, rapid summarization, transparent source citation. Best for factual research",
-            "provider": "perplexity",
-            "category": "search"
-        },
-        {
-            "id": "sonar-70b",
-            "name": "Sonar 70B",
-            "description": "Perplexity's flagship model optimized for real-time search, retrieval, and web summarization",
-            "provider": "perplexity",
-            "category": "search"
-        },
-        {
-            "id": "llama-3.1-sonar-small-128k-online",
-            "name": "Llama 3.1 Sonar Small (128k)",
-            "description": "Small Sonar model with 128k context window and online capabilities, fast and efficient",
-            "provider": "perplexity",
-            "category": "search"
-        },
-        {
-            "id": "llama-3.1-sonar-large-128k-online",
-            "name": "Llama 3.1 Sonar Large (128k)",
-            "description": "Large Sonar model with 128k context window and online capabilities, balanced performance",
-            "provider": "perplexity",
-            "category": "search"
-        },
-        {
-            "id": "llama-3.1-sonar-huge-128k-online",
-            "name": "Llama 3.1 Sonar Huge (128k)",
-            "description": "Huge Sonar model with 128k context window and online capabilities, maximum accuracy",
-            "provider": "perplexity",
-            "category": "search"
-        },
-        # Additional Llama Models
-        {
-            "id": "llama-3.1-70b-instruct",
-            "name": "Llama 3.1 70B Instruct",
-            "description": "Meta's Llama 3.1 70B instruction-tuned model for general-purpose tasks",
-            "provider": "perplexity",
-            "category": "general"
-        },
-        {
-            "id": "mistral-7b-instruct",
-            "name": "Mistral 7B Instruct",
-            "description": "Efficient 7B parameter instruction-tuned model for quick responses",
-            "provider": "perplexity",
-            "category": "general"
-        },
-    ]
-    
-    # Add GitHub Copilot models if configured
-    if has_github_copilot():
-        models.extend([
-            {
-                "id": "copilot-gpt-4",
-                "name": "Copilot GPT-4",
-                "description": "GitHub Copilot powered by GPT-4, optimized for code generation and completion",
-                "provider": "github-copilot",
-                "category": "coding"
-            },
-            {
-                "id": "copilot-agent",
-                "name": "Copilot Agent",
-                "description": "GitHub Copilot agent mode for autonomous coding tasks",
-                "provider": "github-copilot",
-                "category": "coding"
-            },
-        ])
-    
-    data = [
-        {
-            "id": m["id"],
-            "name": m["name"],
-            "description": m["description"],
-            "provider": m["provider"],
-            "category": m["category"],
-            "object": "model"
-        }
-        for m in models
-    ]
-    return {"models": models, "data": data}
+    view = model_catalog.view(provider, category)
+    headers = {"ETag": view.etag, "Cache-Control": model_catalog.cache_control}
+    if etag_matches(request.headers.get("If-None-Match"), view.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=view.body, media_type="application/json", headers=headers)
+
+
+@app.get("/models/stats")
+async def models_stats():
+    """
+    Rolling per-model performance estimates, for latency- and cost-aware routing.
+    
+    Time to first token, latency, tokens per second, error rate and cost per
+    call of each model, as decayed averages (see `MODEL_STATS_HALF_LIFE` and
+    `MODEL_PRICES`). With several workers each reports its own traffic.
+    
+    **Authentication Required**: Include `X-API-KEY` header
+    """
+    return model_stats.stats()
 
 
 @app.post("/v1/chat/completions")
-@limiter.limit(RATE_LIMIT)
 async def chat(req: ChatReq, request: Request):
     """
     Chat completions endpoint.
     
-    Proxies requests to Perplexity AI API or GitHub Copilot API based on model selection.
+    Proxies requests to Perplexity AI API, GitHub Copilot API or a configured
+    local OpenAI-compatible backend based on model selection.
     
     **Authentication Required**: Include `X-API-KEY` header
     
-    **Rate Limited**: 10 requests per minute per IP (default)
+    **Rate Limited**: 10 requests per minute per IP (default; see `RATE_LIMIT*` settings)
+    
+    **Failover**: While a provider's circuit breaker is open, requests go to the
+    configured fallback model (`CIRCUIT_FALLBACKS`) or fail fast with HTTP 503
+    
+    **Admission**: Upstream calls are capped per provider and model (`ADMISSION_*`
+    settings); excess requests queue fairly across API keys and get HTTP 503
+    with `Retry-After` if no capacity frees up in time
+    
+    **API Keys**: A key may be restricted to some models (HTTP 403 otherwise) and
+    to requests and tokens per minute (HTTP 429 with `Retry-After`); see `API_KEYS`
     
     **Request Validation**:
     - Model name must not be empty
@@ -508,6 +505,7 @@ async def chat(req: ChatReq, request: Request):
     **Supported Providers**:
     - Perplexity: GPT-5.2, Gemini 3 Pro, Claude 4.5, Sonar models, etc.
     - GitHub Copilot: copilot-gpt-4, copilot-agent
+    - Local OpenAI-compatible backends: models listed in `PROVIDER_<NAME>_MODELS`
     
     **Response**:
     - Validates response structure before returning
@@ -526,40 +524,257 @@ async def chat(req: ChatReq, request: Request):
     }
     ```
     """
-    try:
-        request_data = req.dict()
-        provider = get_model_provider(req.model)
-        logger.info(f"Processing chat request with model: {req.model} (provider: {provider})")
+    started = time.perf_counter()
+    provider = get_model_provider(req.model)
+    with observe_request("chat", req.model, provider):
+        await limiter.check(request, "/v1/chat/completions", model=req.model)
+        # Set by APIKeyMiddleware
+        api_key = getattr(request.state, "api_key", None)
+        if api_key is not None:
+            api_keys.authorize(api_key, req.model)
+        try:
+            request_data = req.dict()
+            logger.info(f"Processing chat request with model: {req.model} (provider: {provider})")
+        
+            cache_key = None
+            cache_status = "MISS"
+            skip_store = False
+            if not req.stream and response_cache.should_cache(req.model):
+                cache_key = canonical_request_key(request_data)
+                skip_lookup, skip_store = wants_no_cache(request.headers.get("Cache-Control"))
+                if skip_lookup:
+                    cache_status = "BYPASS"
+                else:
+                    cached = response_cache.get(cache_key)
+                    if cached is not None:
+                        logger.info(f"Serving cached response for model: {req.model}")
+                        return Response(content=cached, media_type="application/json", headers={"X-Cache": "HIT"})
         
-        if provider == "github-copilot":
-            return await _copilot_chat(req, request_data)
-        else:
-            return await _perplexity_chat(req, request_data)
+            # Cache hits are free; anything that goes upstream counts against the key's quotas
+            estimated = estimate_tokens(request_data["messages"], req.max_tokens)
+            if api_key is not None:
+                await api_keys.check_quota(api_key, estimated)
+        
+            # Fail over (or fail fast) while the provider's circuit is open
+            model, target = circuit_breakers.route(
+                req.model, provider, get_model_provider, providers.available()
+            )
+            if model != req.model:
+                req = req.copy(update={"model": model})
+                request_data = req.dict()
+                provider = target
+                # Never cache a fallback model's answer under the original request
+                skip_store = True
+        
+            backend = providers.get(provider)
+            if not backend.configured:
+                raise backend.not_configured()
+        
+            async def call_upstream():
+                if req.stream:
+                    stream = stream_fanout.subscribe(
+                        "sse:" + canonical_request_key(request_data),
+                        functools.partial(_sse_stream, backend, request_data)
+                    )
+                    return StreamingResponse(stream, media_type="text/event-stream")
+                return await backend.complete(request_data)
+        
+            flow = request_flow(request.headers.get("X-API-KEY"), client_address(request))
+        
+            async def admitted_call():
+                ticket = await admission.admit(req.model, provider, estimated, flow)
+                async with ticket:
+                    result = await call_upstream()
+                    ticket.release(used_tokens(result))
+                    return result
+        
+            if req.stream:
+                # The admission slot is held until the stream finishes
+                ticket = await admission.admit(req.model, provider, estimated, flow)
+                try:
+                    response = await call_upstream()
+                except BaseException:
+                    ticket.release()
+                    raise
+                if not isinstance(response, StreamingResponse):
+                    ticket.release()
+                    return response
+                # Tear the upstream stream down as soon as the client goes away
+                tracker = StreamTracker(max_tokens=req.max_tokens)
+                stream = instrument_stream(tracker.wrap(response.body_iterator), "chat", req.model, provider, started)
+                if api_key is not None:
+                    stream = _record_stream_usage(stream, api_key, tracker)
+                response.body_iterator = cancel_on_disconnect(request, release_after(stream, ticket))
+                return response
+            # Only the leader of coalesced duplicates takes an admission slot
+            result, shared = await single_flight.do(cache_key or canonical_request_key(request_data), admitted_call)
+            if shared:
+                logger.info(f"Coalesced duplicate in-flight request for model: {req.model}")
+            if api_key is not None:
+                api_keys.record_usage(api_key, used_tokens(result))
+        
+            # Raw upstream bytes (JSON_PASSTHROUGH) are forwarded without re-encoding
+            if isinstance(result, bytes):
+                body = result
+            elif isinstance(result, dict):
+                body = codec.dumps(result)
+            else:
+                return result
+            if cache_key is None:
+                return Response(content=body, media_type="application/json")
+            if not skip_store:
+                response_cache.set(cache_key, req.model, body)
+            return Response(content=body, media_type="application/json", headers={"X-Cache": cache_status})
             
+        except HTTPException:
+            raise
+        except httpx.HTTPStatusError as e:
+            logger.error(f"API error: {e.response.status_code} - {e.response.text}")
+            retry_after = e.response.headers.get("Retry-After")
+            raise HTTPException(
+                status_code=e.response.status_code,
+                detail=f"API error: {e.response.text}",
+                headers={"Retry-After": retry_after} if retry_after else None
+            )
+        except httpx.TimeoutException:
+            logger.error("Request to API timed out")
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Request to API timed out"
+            )
+        except httpx.RequestError as e:
+            logger.error(f"Request error: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"Failed to connect to API: {str(e)}"
+            )
+        except Exception as e:
+            logger.error(f"Unexpected error in chat endpoint: {str(e)}", exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Internal server error: {str(e)}"
+            )
+
+
+def _ws_error(message: str, request_id: Optional[str] = None, retry_after: Optional[int] = None) -> str:
+    """Build a JSON error frame, tagged with the request id when multiplexing."""
+    frame: Dict[str, Any] = {"error": message, "type": "error"}
+    if request_id is not None:
+        frame["id"] = request_id
+    if retry_after is not None:
+        frame["retry_after"] = retry_after
+    return json.dumps(frame)
+
+
+async def _ws_stream_request(
+    websocket: WebSocket,
+    outbox: SendQueue,
+    payload: dict,
+    request_id: Optional[str],
+    previous: Optional[asyncio.Task] = None,
+    flow: str = "default",
+    api_key: Optional[APIKey] = None
+) -> None:
+    """Stream one chat request into the connection's send queue."""
+    if previous is not None:
+        # Untagged requests keep the original one-at-a-time ordering
+        await asyncio.gather(previous, return_exceptions=True)
+    
+    if request_id is None:
+        logger.info("Processing WebSocket chat request")
+    else:
+        logger.info(f"Processing WebSocket chat request {request_id}")
+    
+    cancel_reason = "client_cancel"
+    
+    def reason() -> str:
+        if websocket.client_state == WebSocketState.DISCONNECTED:
+            return "client_disconnect"
+        return cancel_reason
+    
+    model = str(payload.get("model"))
+    provider = get_model_provider(model)
+    estimated = estimate_tokens(payload.get("messages"), payload.get("max_tokens"))
+    if api_key is not None:
+        try:
+            api_keys.authorize(api_key, model)
+            await api_keys.check_quota(api_key, estimated)
+        except HTTPException as e:
+            requests_total.labels("ws_chat", model, provider, str(e.status_code)).inc()
+            retry_after = e.headers.get("Retry-After") if e.headers else None
+            await outbox.put(_ws_error(e.detail, request_id, int(retry_after) if retry_after else None), request_id)
+            return
+    try:
+        routed, provider = circuit_breakers.route(model, provider, get_model_provider, providers.available())
+    except CircuitOpenError as e:
+        requests_total.labels("ws_chat", model, provider, "503").inc()
+        await outbox.put(_ws_error(e.detail, request_id, int(e.headers["Retry-After"])), request_id)
+        return
+    if routed != model:
+        payload = dict(payload, model=routed)
+        model = routed
+    backend = providers.get(provider)
+    if not backend.configured:
+        requests_total.labels("ws_chat", model, provider, "400").inc()
+        await outbox.put(_ws_error(backend.unconfigured_detail, request_id), request_id)
+        return
+    try:
+        ticket = await admission.admit(model, provider, estimated, flow)
+    except AdmissionRejected as e:
+        requests_total.labels("ws_chat", model, provider, "503").inc()
+        await outbox.put(_ws_error(e.detail, request_id, int(e.headers["Retry-After"])), request_id)
+        return
+    
+    # Stream the response from the provider, sharing identical in-flight streams
+    tracker = StreamTracker(max_tokens=payload.get("max_tokens"), reason=reason)
+    stream = tracker.wrap(stream_fanout.subscribe(
+        "ws:" + canonical_request_key(payload),
+        functools.partial(backend.stream, payload)
+    ))
+    stream = instrument_stream(stream, "ws_chat", model, provider)
+    outcome = "500"
+    try:
+        async for chunk in stream:
+            await outbox.put(chunk, request_id)
+        await outbox.end_stream(request_id)
+        outcome = "200"
+        
+    except asyncio.CancelledError:
+        outcome = "499"
+        raise
     except httpx.HTTPStatusError as e:
-        logger.error(f"API error: {e.response.status_code} - {e.response.text}")
-        raise HTTPException(
-            status_code=e.response.status_code,
-            detail=f"API error: {e.response.text}"
-        )
-    except httpx.TimeoutException:
-        logger.error("Request to API timed out")
-        raise HTTPException(
-            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-            detail="Request to API timed out"
-        )
+        outcome = str(e.response.status_code)
+        logger.error(f"{backend.label} API error in WebSocket: {e.response.status_code}")
+        await outbox.put(_ws_error(f"{backend.label} API error: {e.response.status_code}", request_id), request_id)
     except httpx.RequestError as e:
-        logger.error(f"Request error: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"Failed to connect to API: {str(e)}"
-        )
+        outcome = "502"
+        logger.error(f"Request error in WebSocket: {str(e)}")
+        await outbox.put(_ws_error(f"Connection error: {str(e)}", request_id), request_id)
+    except SSEBufferOverflow as e:
+        outcome = "502"
+        logger.error(f"Stream framing error in WebSocket: {str(e)}")
+        await outbox.put(_ws_error(f"Stream error: {str(e)}", request_id), request_id)
+    except SlowConsumerError as e:
+        logger.warning(f"Aborting WebSocket stream for slow client {websocket.client}: {str(e)}")
+        cancel_reason = "slow_consumer"
+        outcome = "499"
+        await stream.aclose()
+        outbox.discard(request_id)
+        await outbox.put(_ws_error("Stream aborted: client is not reading fast enough", request_id), request_id)
     except Exception as e:
-        logger.error(f"Unexpected error in chat endpoint: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Internal server error: {str(e)}"
-        )
+        logger.error(f"Error processing WebSocket message: {str(e)}", exc_info=True)
+        try:
+            await outbox.put(_ws_error(f"Internal error: {str(e)}", request_id), request_id)
+        except Exception:
+            # Connection may be closed
+            pass
+    finally:
+        # Close the upstream stream now rather than whenever the generator is collected
+        await stream.aclose()
+        ticket.release()
+        if api_key is not None:
+            api_keys.record_usage(api_key, tracker.tokens)
+        requests_total.labels("ws_chat", model, provider, outcome).inc()
 
 
 @app.websocket("/ws/chat")
@@ -586,12 +801,29 @@ async def ws_chat(websocket: WebSocket):
     }
     ```
     
+    **Multiplexing**:
+    - Add an `"id"` (1-64 chars of `A-Z a-z 0-9 . _ : -`) to run several requests
+      concurrently on one socket; each runs as its own task
+    - SSE frames of that request start with an `id: <id>` line and JSON frames carry `"id"`
+    - `{"type": "cancel", "id": "<id>"}` cancels one in-flight request and is
+      acknowledged with `{"type": "cancelled", "id": "<id>"}`
+    - Requests without an `id` are processed one at a time, as before
+    
+    **Cancellation**:
+    - `{"type": "cancel"}` (with the request's `id` when multiplexing) stops a
+      stream; the upstream request is closed immediately, not drained
+    - Closing the socket cancels every in-flight request the same way
+    
+    **Providers**: Perplexity and GitHub Copilot (`copilot-*`) models both stream
+    
     **Response Format**:
-    - SSE format chunks: `data: {...}\n\n`
-    - Final chunk: `data: [DONE]\n\n`
+    - Exactly one SSE event per frame: `data: {...}\n\n`
+    - Final frame: `data: [DONE]\n\n`
     
     **Error Handling**:
     - Sends JSON error messages: `{"error": "message", "type": "error"}`
+    - When upstream capacity is exhausted the error frame also carries
+      `"retry_after"` (seconds)
     - Closes connection on critical errors
     
     **Example Usage**:
@@ -608,14 +840,23 @@ async def ws_chat(websocket: WebSocket):
     """
     # Get API key from query parameter or header
     api_key = websocket.query_params.get("api_key") or websocket.headers.get("X-API-KEY")
+    key = api_keys.lookup(api_key)
     
-    if api_key != BRIDGE_SECRET:
+    if key is None:
         logger.warning(f"Unauthorized WebSocket connection attempt from {websocket.client}")
         await websocket.close(code=1008, reason="Unauthorized")  # 1008 = Policy Violation
         return
     
     await websocket.accept()
     logger.info(f"WebSocket connection accepted from {websocket.client}")
+    websocket_connections.labels().inc()
+    
+    # Frames go through a bounded queue so a slow client never stalls the upstream read
+    outbox = SendQueue(websocket.send_text)
+    # All requests on the connection share one fair-queuing flow
+    flow = request_flow(api_key, websocket.client.host if websocket.client else "127.0.0.1")
+    # In-flight requests by id; untagged requests are chained under None
+    tasks: Dict[Optional[str], asyncio.Task] = {}
     
     try:
         while True:
@@ -628,58 +869,54 @@ async def ws_chat(websocket: WebSocket):
                     payload = json.loads(data)
                 except json.JSONDecodeError as e:
                     logger.error(f"Invalid JSON in WebSocket message: {str(e)}")
-                    await websocket.send_text(json.dumps({
-                        "error": "Invalid JSON format",
-                        "type": "error"
-                    }))
+                    await outbox.put(_ws_error("Invalid JSON format"))
+                    continue
+                if not isinstance(payload, dict):
+                    await outbox.put(_ws_error("Request must be a JSON object"))
                     continue
                 
+                request_id = payload.pop("id", None)
+                if request_id is not None:
+                    request_id = str(request_id)
+                    if not WS_REQUEST_ID_PATTERN.fullmatch(request_id):
+                        await outbox.put(_ws_error("Invalid request id"))
+                        continue
+                
+                if payload.get("type") == "cancel":
+                    task = tasks.get(request_id)
+                    if task is None or task.done():
+                        await outbox.put(_ws_error("No in-flight request to cancel", request_id), request_id)
+                        continue
+                    # Cancelling the task unwinds the upstream stream immediately
+                    task.cancel()
+                    outbox.discard(request_id)
+                    ack = {"type": "cancelled"}
+                    if request_id is not None:
+                        ack["id"] = request_id
+                    await outbox.put(json.dumps(ack), request_id)
+                    continue
+                
+                if request_id is not None:
+                    if request_id in tasks:
+                        await outbox.put(_ws_error("Request id is already in flight", request_id), request_id)
+                        continue
+                    if sum(1 for rid in tasks if rid is not None) >= WS_MAX_CONCURRENT_STREAMS:
+                        await outbox.put(_ws_error("Too many concurrent requests on this connection", request_id), request_id)
+                        continue
+                
                 # Ensure stream is True
                 payload["stream"] = True
                 
-                try:
-                    key = get_perplexity_key()
-                except HTTPException as e:
-                    await websocket.send_text(json.dumps({
-                        "error": e.detail,
-                        "type": "error"
-                    }))
-                    await websocket.close(code=1011, reason="Server configuration error")
-                    return
-                headers = {
-                    "Authorization": f"Bearer {key}",
-                    "Content-Type": "application/json"
-                }
-                
-                logger.info(f"Processing WebSocket chat request")
+                previous = tasks.get(None) if request_id is None else None
+                task = asyncio.ensure_future(
+                    _ws_stream_request(websocket, outbox, payload, request_id, previous, flow, key)
+                )
+                tasks[request_id] = task
                 
-                # Stream response from Perplexity API
-                async with httpx.AsyncClient(timeout=120.0) as client:
-                    try:
-                        async with client.stream(
-                            "POST",
-                            BASE_URL,
-                            json=payload,
-                            headers=headers
-                        ) as response:
-                            response.raise_for_status()
-                            
-                            async for chunk in response.aiter_text():
-                                if chunk:
-                                    await websocket.send_text(chunk)
-                                    
-                    except httpx.HTTPStatusError as e:
-                        logger.error(f"Perplexity API error in WebSocket: {e.response.status_code}")
-                        await websocket.send_text(json.dumps({
-                            "error": f"Perplexity API error: {e.response.status_code}",
-                            "type": "error"
-                        }))
-                    except httpx.RequestError as e:
-                        logger.error(f"Request error in WebSocket: {str(e)}")
-                        await websocket.send_text(json.dumps({
-                            "error": f"Connection error: {str(e)}",
-                            "type": "error"
-                        }))
+                def forget(done: asyncio.Task, rid: Optional[str] = request_id) -> None:
+                    if tasks.get(rid) is done:
+                        del tasks[rid]
+                task.add_done_callback(forget)
                         
             except WebSocketDisconnect:
                 logger.info(f"WebSocket client disconnected: {websocket.client}")
@@ -687,10 +924,7 @@ async def ws_chat(websocket: WebSocket):
             except Exception as e:
                 logger.error(f"Error processing WebSocket message: {str(e)}", exc_info=True)
                 try:
-                    await websocket.send_text(json.dumps({
-                        "error": f"Internal error: {str(e)}",
-                        "type": "error"
-                    }))
+                    await outbox.put(_ws_error(f"Internal error: {str(e)}"))
                 except:
                     # Connection may be closed, just break
                     break
@@ -700,6 +934,12 @@ async def ws_chat(websocket: WebSocket):
     except Exception as e:
         logger.error(f"WebSocket connection error: {str(e)}", exc_info=True)
     finally:
+        for task in list(tasks.values()):
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        await outbox.close(timeout=WS_SEND_TIMEOUT)
+        websocket_connections.labels().dec()
         try:
             await websocket.close()
         except:
@@ -739,10 +979,11 @@ def _validate_terminal_command(command: str) -> List[str]:
 
 
 @app.post("/terminal")
-@limiter.limit(RATE_LIMIT)
 async def terminal(req: TerminalReq, request: Request):
     """Execute a command with streaming output and guardrails."""
-    args = _validate_terminal_command(req.command)
+    with observe_request("terminal", "none", "local"):
+        await limiter.check(request, "/terminal")
+        args = _validate_terminal_command(req.command)
     max_output_bytes = 64 * 1024
     timeout_seconds = 8
     start_time = time.monotonic()
@@ -801,19 +1042,23 @@ async def terminal(req: TerminalReq, request: Request):
         except asyncio.TimeoutError:
             proc.kill()
 
+        exit_code = proc.returncode if proc.returncode is not None else -1
+        terminal_commands_total.labels(args[0], str(exit_code)).inc()
+        terminal_duration.labels(args[0]).observe(time.monotonic() - start_time)
         exit_payload = json.dumps({
             "type": "exit",
-            "code": proc.returncode if proc.returncode is not None else -1
+            "code": exit_code
         })
         yield f"data: {exit_payload}\n\n"
 
-    return StreamingResponse(stream_output(), media_type="text/event-stream")
+    stream = instrument_stream(stream_output(), "terminal", "none", "local")
+    return StreamingResponse(stream, media_type="text/event-stream")
 
 
 @app.get("/project/file")
-@limiter.limit(RATE_LIMIT)
 async def project_file(path: str, request: Request):
     """Read a project file safely with size limits."""
+    await limiter.check(request, "/project/file")
     if not path or path.strip() == "":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Path is required")
     if path.startswith("/") or ".." in path:
@@ -0,0 +1,105 @@
+"""
+API-key authentication as a pure ASGI middleware.
+
+``@app.middleware("http")`` functions run on Starlette's
+``BaseHTTPMiddleware``, which re-wraps every response - including SSE
+streams and static files - in an extra task and memory stream, adding
+overhead to each chunk. ``APIKeyMiddleware`` instead inspects the ASGI
+scope once and then hands ``receive``/``send`` to the application
+untouched, so authenticated responses pass through with zero per-chunk
+cost.
+
+Public paths are matched with one precompiled regular expression (exact
+paths plus whole-segment prefixes such as ``/ui``). Keys are resolved by a
+``KeyStore`` (see ``keystore.py``), which looks up the SHA-256 digest of the
+raw header bytes, so the lookup time does not reveal how much of a guessed
+key was right. The matching ``APIKey`` is stored in the scope's state
+(``request.state.api_key``) for per-key allowlists and quotas, and keys
+without admin rights get 403 on the admin path prefixes.
+
+Only HTTP requests are checked here; ``/ws/chat`` authenticates its own
+handshake (it also accepts the key as a query parameter).
+"""
+
+import json
+import logging
+import re
+from typing import Callable, Iterable
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from keystore import KeyStore
+
+logger = logging.getLogger(__name__)
+
+API_KEY_HEADER = b"x-api-key"
+
+UNAUTHORIZED_BODY = json.dumps({"error": "Unauthorized. Invalid X-API-KEY header."}).encode("utf-8")
+FORBIDDEN_BODY = json.dumps({"error": "Forbidden. This API key cannot access this endpoint."}).encode("utf-8")
+
+
+def compile_path_matcher(paths: Iterable[str], prefixes: Iterable[str] = ()) -> Callable[[str], bool]:
+    """
+    Build a matcher for a set of paths.
+
+    ``paths`` match exactly; ``prefixes`` match themselves and anything below
+    them (``/ui`` matches ``/ui`` and ``/ui/app.js`` but not ``/uix``).
+    """
+    alternatives = [re.escape(path) for path in paths]
+    alternatives += [re.escape(prefix.rstrip("/")) + r"(?:/.*)?" for prefix in prefixes]
+    if not alternatives:
+        return lambda path: False
+    pattern = re.compile("(?:" + "|".join(alternatives) + ")", re.DOTALL)
+    match = pattern.fullmatch
+    return lambda path: match(path) is not None
+
+
+class APIKeyMiddleware:
+    """Reject HTTP requests without a valid ``X-API-KEY`` header, except on public paths."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        keys: KeyStore,
+        public_paths: Iterable[str] = (),
+        public_prefixes: Iterable[str] = (),
+        admin_prefixes: Iterable[str] = ()
+    ):
+        self.app = app
+        self.keys = keys
+        self.is_public = compile_path_matcher(public_paths, public_prefixes)
+        self.is_admin = compile_path_matcher((), admin_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.is_public(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        api_key = None
+        for name, value in scope["headers"]:
+            if name == API_KEY_HEADER:
+                api_key = value
+                break
+        key = self.keys.lookup(api_key)
+        if key is None:
+            client = scope.get("client")
+            logger.warning(f"Unauthorized request attempt from {client[0] if client else '127.0.0.1'}")
+            await _reject(send, 401, UNAUTHORIZED_BODY)
+            return
+        if not key.admin and self.is_admin(scope["path"]):
+            logger.warning(f"API key {key.name!r} denied access to {scope['path']}")
+            await _reject(send, 403, FORBIDDEN_BODY)
+            return
+        scope.setdefault("state", {})["api_key"] = key
+        await self.app(scope, receive, send)
+
+
+async def _reject(send: Send, status: int, body: bytes) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii"))
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,261 @@
+"""
+Backpressure-aware WebSocket sending.
+
+Each ``/ws/chat`` connection gets a ``SendQueue``: a bounded buffer between
+the task reading the upstream stream and a writer task that owns
+``websocket.send_text``. A slow client therefore no longer stalls the
+upstream read. When the queue is full the configured policy decides what
+happens to new frames:
+
+* ``coalesce`` - merge content deltas into the last queued delta frame
+  (other frames wait for space).
+* ``summary``  - stop forwarding deltas and send their accumulated content
+  as one frame when the next non-delta frame (usually ``[DONE]``) arrives.
+* ``abort``    - wait up to ``WS_SEND_TIMEOUT`` seconds for space, then
+  give up on the stream with ``SlowConsumerError``.
+
+Frames can be tagged with the id of the multiplexed request they belong
+to; merging and summaries never mix frames of different requests.
+
+Queue depth, time spent blocked on slow consumers and policy actions are
+recorded in ``backpressure_stats``.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import weakref
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from config import WS_SEND_QUEUE_SIZE, WS_BACKPRESSURE_POLICY, WS_SEND_TIMEOUT
+from sse import format_sse
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("coalesce", "summary", "abort")
+
+
+class SlowConsumerError(Exception):
+    """Raised when a client cannot keep up with its stream under the ``abort`` policy."""
+
+
+class BackpressureStats:
+    """Process-wide counters for WebSocket send queues."""
+
+    def __init__(self) -> None:
+        self.queues: "weakref.WeakSet[SendQueue]" = weakref.WeakSet()
+        self.max_depth = 0
+        self.frames_sent = 0
+        self.blocked_seconds = 0.0
+        self.blocked_events = 0
+        self.coalesced = 0
+        self.summarized = 0
+        self.aborted = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        depths = [q.depth for q in list(self.queues)]
+        return {
+            "active_queues": len(depths),
+            "queue_depth": sum(depths),
+            "max_queue_depth": self.max_depth,
+            "frames_sent": self.frames_sent,
+            "blocked_seconds": round(self.blocked_seconds, 6),
+            "blocked_events": self.blocked_events,
+            "coalesced_frames": self.coalesced,
+            "summarized_frames": self.summarized,
+            "aborted_streams": self.aborted
+        }
+
+
+backpressure_stats = BackpressureStats()
+
+
+def _parse_delta(frame: str) -> Optional[Dict[str, Any]]:
+    """Return the decoded chunk if ``frame`` is a plain single-choice content delta."""
+    if not frame.startswith("data: ") or frame.startswith("data: [DONE]"):
+        return None
+    try:
+        chunk = json.loads(frame[6:])
+    except ValueError:
+        return None
+    choices = chunk.get("choices") if isinstance(chunk, dict) else None
+    if not isinstance(choices, list) or len(choices) != 1 or not isinstance(choices[0], dict):
+        return None
+    delta = choices[0].get("delta")
+    if choices[0].get("finish_reason") or not isinstance(delta, dict):
+        return None
+    if set(delta) - {"content", "role"} or not isinstance(delta.get("content"), str):
+        return None
+    return chunk
+
+
+class SendQueue:
+    """Bounded, policy-driven frame queue in front of a WebSocket writer."""
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        maxsize: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_BACKPRESSURE_POLICY,
+        block_timeout: float = WS_SEND_TIMEOUT,
+        stats: BackpressureStats = backpressure_stats
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Backpressure policy must be one of {POLICIES}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.stats = stats
+        # Each entry is [frame, stream, parsed delta or None]; the parse is cached for coalescing
+        self._frames: Deque[List[Any]] = deque()
+        # stream -> [held back content parts, first held back chunk] under the summary policy
+        self._summaries: Dict[Optional[str], List[Any]] = {}
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._closed = False
+        self._send = send
+        self._writer = asyncio.ensure_future(self._run())
+        stats.queues.add(self)
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    async def put(self, frame: str, stream: Optional[str] = None) -> None:
+        """
+        Queue a frame, applying the backpressure policy when the queue is full.
+
+        ``stream`` identifies the multiplexed request a frame belongs to; deltas
+        are only ever merged within one stream, and SSE frames of a named
+        stream are sent with an ``id:`` line.
+        """
+        self._raise_if_writer_failed()
+        if stream in self._summaries:
+            if self._absorb(frame, stream):
+                return
+            await self._put_blocking(self._summary_frame(stream), stream)
+        elif len(self._frames) >= self.maxsize:
+            if self.policy == "coalesce" and self._coalesce(frame, stream):
+                return
+            if self.policy == "summary" and self._absorb(frame, stream):
+                return
+        await self._put_blocking(frame, stream)
+
+    async def end_stream(self, stream: Optional[str] = None) -> None:
+        """Flush any delta content of ``stream`` still held back for a summary frame."""
+        if stream in self._summaries:
+            await self._put_blocking(self._summary_frame(stream), stream)
+
+    def discard(self, stream: Optional[str] = None) -> int:
+        """Drop every unsent frame of ``stream`` and return how many were dropped."""
+        kept = deque(entry for entry in self._frames if entry[1] != stream)
+        dropped = len(self._frames) - len(kept)
+        self._frames = kept
+        self._summaries.pop(stream, None)
+        if len(self._frames) < self.maxsize:
+            self._writable.set()
+        return dropped
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """Flush pending frames and stop the writer."""
+        self._closed = True
+        self._readable.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._writer), timeout)
+        except asyncio.TimeoutError:
+            self._writer.cancel()
+        except Exception:
+            pass
+
+    async def _put_blocking(self, frame: str, stream: Optional[str]) -> None:
+        if len(self._frames) >= self.maxsize:
+            timeout = self.block_timeout if self.policy == "abort" else None
+            if not await self._wait_writable(timeout):
+                self.stats.aborted += 1
+                raise SlowConsumerError(
+                    f"Client did not read {len(self._frames)} queued frames within {self.block_timeout}s"
+                )
+        self._frames.append([frame, stream, None])
+        depth = len(self._frames)
+        if depth > self.stats.max_depth:
+            self.stats.max_depth = depth
+        if depth >= self.maxsize:
+            self._writable.clear()
+        self._readable.set()
+
+    async def _wait_writable(self, timeout: Optional[float]) -> bool:
+        started = time.monotonic()
+        self.stats.blocked_events += 1
+        try:
+            while len(self._frames) >= self.maxsize:
+                self._raise_if_writer_failed()
+                remaining = None if timeout is None else timeout - (time.monotonic() - started)
+                if remaining is not None and remaining <= 0:
+                    return False
+                waiter = asyncio.ensure_future(self._writable.wait())
+                await asyncio.wait({waiter, self._writer}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+            return True
+        finally:
+            self.stats.blocked_seconds += time.monotonic() - started
+
+    def _coalesce(self, frame: str, stream: Optional[str]) -> bool:
+        """Merge a delta frame into the last queued frame of the same stream, if that is a delta too."""
+        chunk = _parse_delta(frame)
+        if chunk is None:
+            return False
+        for entry in reversed(self._frames):
+            if entry[1] == stream:
+                break
+        else:
+            return False
+        if entry[2] is None:
+            entry[2] = _parse_delta(entry[0]) or False
+        if not entry[2]:
+            return False
+        entry[2]["choices"][0]["delta"]["content"] += chunk["choices"][0]["delta"]["content"]
+        entry[0] = format_sse(json.dumps(entry[2]))
+        self.stats.coalesced += 1
+        return True
+
+    def _absorb(self, frame: str, stream: Optional[str]) -> bool:
+        """Hold back a delta frame's content for the stream's summary frame."""
+        chunk = _parse_delta(frame)
+        if chunk is None:
+            return False
+        summary = self._summaries.get(stream)
+        if summary is None:
+            summary = self._summaries[stream] = [[], chunk]
+        summary[0].append(chunk["choices"][0]["delta"]["content"])
+        self.stats.summarized += 1
+        return True
+
+    def _summary_frame(self, stream: Optional[str]) -> str:
+        parts, chunk = self._summaries.pop(stream)
+        chunk["choices"][0]["delta"]["content"] = "".join(parts)
+        return format_sse(json.dumps(chunk))
+
+    def _raise_if_writer_failed(self) -> None:
+        if not self._writer.done():
+            return
+        if not self._writer.cancelled() and self._writer.exception() is not None:
+            raise self._writer.exception()
+        raise RuntimeError("WebSocket send queue is closed")
+
+    async def _run(self) -> None:
+        while True:
+            while not self._frames:
+                if self._closed:
+                    return
+                self._readable.clear()
+                await self._readable.wait()
+            frame, stream, _ = self._frames.popleft()
+            if len(self._frames) < self.maxsize:
+                self._writable.set()
+            if stream is not None and frame.startswith("data:"):
+                frame = f"id: {stream}\n{frame}"
+            await self._send(frame)
+            self.stats.frames_sent += 1
@@ -0,0 +1 @@
+"""Load-test and benchmark harness (see ``benchmarks.run``)."""
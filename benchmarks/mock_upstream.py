@@ -0,0 +1,110 @@
+"""
+Mock Perplexity / GitHub Copilot upstream for benchmarks.
+
+Serves OpenAI-compatible chat completions without a network or API key:
+
+* ``POST /chat/completions``         - Perplexity-style endpoint
+* ``POST /copilot/chat/completions`` - Copilot-style endpoint (``GITHUB_COPILOT_BASE_URL=.../copilot``)
+
+Both honour ``"stream": true`` with SSE deltas. Behaviour is configured with
+environment variables so the server can be started by ``uvicorn``:
+
+* ``MOCK_LATENCY``     - seconds before the first byte (default 0.05)
+* ``MOCK_TOKEN_RATE``  - tokens generated per second, 0 for unlimited (default 200)
+* ``MOCK_TOKENS``      - tokens per response, capped by the request's ``max_tokens`` (default 64)
+* ``MOCK_CHUNK_TOKENS`` - tokens per SSE chunk (default 1)
+"""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+TOKEN = "tok "
+
+
+@dataclass
+class MockSettings:
+    latency: float = 0.05
+    token_rate: float = 200.0
+    tokens: int = 64
+    chunk_tokens: int = 1
+
+    @classmethod
+    def from_env(cls) -> "MockSettings":
+        return cls(
+            latency=float(os.getenv("MOCK_LATENCY", "0.05")),
+            token_rate=float(os.getenv("MOCK_TOKEN_RATE", "200")),
+            tokens=int(os.getenv("MOCK_TOKENS", "64")),
+            chunk_tokens=max(1, int(os.getenv("MOCK_CHUNK_TOKENS", "1")))
+        )
+
+
+def _completion_id() -> str:
+    return f"mock-{time.monotonic_ns()}"
+
+
+async def _stream(settings: MockSettings, model: str, tokens: int) -> AsyncIterator[bytes]:
+    completion_id = _completion_id()
+    interval = settings.chunk_tokens / settings.token_rate if settings.token_rate > 0 else 0.0
+    sent = 0
+    while sent < tokens:
+        count = min(settings.chunk_tokens, tokens - sent)
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": TOKEN * count}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk)}\n\n".encode()
+        sent += count
+        if interval:
+            await asyncio.sleep(interval)
+    done = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+    }
+    yield f"data: {json.dumps(done)}\n\n".encode()
+    yield b"data: [DONE]\n\n"
+
+
+def create_app(settings: MockSettings) -> Starlette:
+    """Build the mock upstream with fixed latency, token rate and chunk size."""
+
+    async def chat_completions(request: Request) -> Response:
+        body = await request.json()
+        model = str(body.get("model", "mock"))
+        tokens = min(settings.tokens, int(body.get("max_tokens") or settings.tokens))
+        await asyncio.sleep(settings.latency)
+        if body.get("stream"):
+            return StreamingResponse(_stream(settings, model, tokens), media_type="text/event-stream")
+        if settings.token_rate > 0:
+            await asyncio.sleep(tokens / settings.token_rate)
+        return JSONResponse({
+            "id": _completion_id(),
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": TOKEN * tokens},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 8, "completion_tokens": tokens, "total_tokens": tokens + 8}
+        })
+
+    return Starlette(routes=[
+        Route("/chat/completions", chat_completions, methods=["POST"]),
+        Route("/copilot/chat/completions", chat_completions, methods=["POST"])
+    ])
+
+
+app = create_app(MockSettings.from_env())
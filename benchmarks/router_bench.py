@@ -0,0 +1,159 @@
+"""
+Microbenchmark for ``agent.router.Router``.
+
+Routes a synthetic workload of agent step descriptions three ways and
+reports nanoseconds per task as machine-readable JSON:
+
+* ``legacy`` - the original sequential ``any(keyword in t ...)`` scans,
+  first hit wins
+* ``pick`` - the compiled single-pass matcher, one task at a time
+* ``pick_batch`` - the whole workload in one call
+
+``--extra-rules`` appends synthetic rules to show how each approach scales
+with the size of the table, and ``--distinct`` controls how often tasks
+repeat. It also reports how often the scored router agrees with the
+first-hit rules (they differ by design on tasks that match several
+categories, and on substrings such as "arch" inside "research"). Typical use::
+
+    python -m benchmarks.router_bench --tasks 10000 --repeat 5
+    python -m benchmarks.router_bench --tasks 10000 --extra-rules 200
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from agent.router import DEFAULT_RULES, Router
+
+TEMPLATES = [
+    "Implement the {thing} function and fix the off-by-one bug",
+    "Review and explain the {thing} class before the refactor",
+    "Research the latest sources on {thing} and summarize the facts",
+    "Analyze the {thing} dataset and chart the large outliers",
+    "Design the architecture and module structure for {thing}",
+    "Write unit tests for {thing} and raise coverage for QA",
+    "Generate release notes and a short story about {thing}",
+    "Deploy {thing} through the CI/CD pipeline and automate rollbacks",
+    "Think through the complex, technical trade-offs of {thing}",
+    "Summarize the meeting notes about {thing}",
+]
+THINGS = ["OAuth login", "rate limiter", "billing export", "search index", "image resizer", "payments API"]
+
+
+def legacy_pick(task: str, extra_rules: Sequence[Tuple[str, Sequence[str]]] = ()) -> str:
+    """
+    The router's original hardcoded first-hit scans, kept as the baseline.
+
+    ``extra_rules`` are (model, keywords) pairs checked the same way after
+    the original eight categories, as a longer hardcoded chain would be.
+    """
+    t = task.lower()
+    if any(keyword in t for keyword in ["code", "function", "class", "bug", "debug", "implement", "refactor"]):
+        if "review" in t or "explain" in t:
+            return "claude-4.5-sonnet"
+        return "copilot-gpt-4"
+    if any(keyword in t for keyword in ["reason", "analyze", "logic", "think", "complex", "solve"]):
+        if "technical" in t or "precise" in t:
+            return "claude-4.5-sonnet"
+        return "gpt-5.2"
+    if any(keyword in t for keyword in ["research", "find", "search", "what is", "who is", "fact", "source"]):
+        return "sonar-pro"
+    if any(keyword in t for keyword in ["data", "dataset", "analyze data", "large", "multimodal", "image", "video"]):
+        return "gemini-3-pro"
+    if any(keyword in t for keyword in ["design", "arch", "architecture", "plan", "structure"]):
+        return "claude-4.5-sonnet"
+    if any(keyword in t for keyword in ["test", "testing", "unit test", "qa"]):
+        return "copilot-gpt-4"
+    if any(keyword in t for keyword in ["create", "generate", "write", "creative", "story", "content"]):
+        return "gpt-5.2"
+    if any(keyword in t for keyword in ["deploy", "ci/cd", "pipeline", "automate", "devops"]):
+        return "copilot-agent"
+    for model, keywords in extra_rules:
+        if any(keyword in t for keyword in keywords):
+            return model
+    return "gpt-5.2"
+
+
+def synthetic_rules(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """``count`` extra rules of made-up keywords, as a larger deployment's table would have."""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return [
+        {"name": f"extra-{i}", "model": f"model-{i % 7}", "weight": 1,
+         "keywords": ["".join(rng.choice(letters) for _ in range(rng.randint(5, 9))) for _ in range(6)]}
+        for i in range(count)
+    ]
+
+
+def workload(count: int, distinct: int, seed: int = 0) -> List[str]:
+    """``count`` tasks drawn from ``distinct`` unique descriptions."""
+    rng = random.Random(seed)
+    pool = [
+        rng.choice(TEMPLATES).format(thing=rng.choice(THINGS)) + f" (ticket {i})"
+        for i in range(max(1, distinct))
+    ]
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def _best_of(repeat: int, run: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    extra = synthetic_rules(args.extra_rules, args.seed)
+    extra_pairs = [(rule["model"], rule["keywords"]) for rule in extra]
+    router = Router(rules=DEFAULT_RULES + extra)
+    tasks = workload(args.tasks, args.distinct or args.tasks, args.seed)
+    timings = {
+        "legacy": _best_of(args.repeat, lambda: [legacy_pick(task, extra_pairs) for task in tasks]),
+        "pick": _best_of(args.repeat, lambda: [router.pick(task) for task in tasks]),
+        "pick_batch": _best_of(args.repeat, lambda: router.pick_batch(tasks)),
+    }
+    legacy = [legacy_pick(task, extra_pairs) for task in tasks]
+    agreement = sum(a == b for a, b in zip(legacy, router.pick_batch(tasks))) / len(tasks) if tasks else 1.0
+    per_task = {name: round(seconds / max(1, len(tasks)) * 1e9, 1) for name, seconds in timings.items()}
+    return {
+        "tasks": len(tasks),
+        "distinct": len(set(tasks)),
+        "rules": len(router.rules),
+        "ns_per_task": per_task,
+        "speedup_vs_legacy": {
+            name: round(timings["legacy"] / seconds, 2) if seconds else None
+            for name, seconds in timings.items() if name != "legacy"
+        },
+        "agreement_with_legacy": round(agreement, 4),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Microbenchmark the agent model router.")
+    parser.add_argument("--tasks", type=int, default=10000, help="Tasks routed per run")
+    parser.add_argument("--distinct", type=int, default=0, help="Unique task descriptions (default: all unique)")
+    parser.add_argument("--extra-rules", type=int, default=0, help="Synthetic rules added to the default table")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per variant; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0, help="Workload random seed")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    text = json.dumps(run_benchmark(args), indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,447 @@
+"""
+Load test and benchmark for the bridge against a local mock upstream.
+
+Starts ``benchmarks.mock_upstream:app`` and ``app:app`` with uvicorn,
+points the bridge at the mock, drives REST, SSE and ``/ws/chat`` traffic at
+a target concurrency and writes machine-readable JSON:
+
+* p50/p95/p99 time to first token and total latency per scenario
+* throughput (requests/s and tokens/s)
+* bridge CPU time per request and RSS growth (Linux ``/proc``; null elsewhere)
+* proxy overhead: bridge minus direct-to-mock latency at the same load
+
+No network or API key is needed. Typical use::
+
+    python -m benchmarks.run --requests 200 --concurrency 20 --output before.json
+    python -m benchmarks.run --requests 200 --concurrency 20 --compare before.json
+
+``--compare`` exits with status 1 when a tracked metric regresses by more
+than ``--max-regression`` (default 20%).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+BRIDGE_SECRET = "benchmark-secret"
+SCENARIOS = ("direct-rest", "direct-sse", "rest", "sse", "ws", "copilot")
+
+# (metric, percentile or None, True if higher is better) checked by --compare
+TRACKED_METRICS = (
+    ("ttft_ms", "p50", False),
+    ("ttft_ms", "p95", False),
+    ("latency_ms", "p99", False),
+    ("throughput_rps", None, True),
+    ("cpu_ms_per_request", None, False),
+)
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Nearest-rank p50/p95/p99 plus mean and max, rounded to microseconds."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        index = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))
+        return round(ordered[index], 3)
+
+    return {
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "max": round(ordered[-1], 3)
+    }
+
+
+class ProcessSampler:
+    """Read CPU time and RSS of a process from ``/proc``; every value is None where that is unavailable."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        try:
+            self.ticks = os.sysconf("SC_CLK_TCK")
+        except (AttributeError, ValueError, OSError):
+            self.ticks = 0
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        if not self.ticks:
+            return None
+        # utime and stime are fields 14 and 15; fields[0] here is field 3 (state)
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_bytes(self) -> Optional[int]:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+
+
+@dataclass
+class Result:
+    ttft: float
+    latency: float
+    ok: bool
+
+
+@dataclass
+class ScenarioReport:
+    name: str
+    results: List[Result] = field(default_factory=list)
+    duration: float = 0.0
+    cpu_seconds: Optional[float] = None
+    rss_start: Optional[int] = None
+    rss_end: Optional[int] = None
+
+    def to_dict(self, concurrency: int, tokens_per_response: int) -> Dict[str, Any]:
+        ok = [r for r in self.results if r.ok]
+        throughput = len(ok) / self.duration if self.duration else 0.0
+        return {
+            "requests": len(self.results),
+            "errors": len(self.results) - len(ok),
+            "concurrency": concurrency,
+            "duration_s": round(self.duration, 3),
+            "throughput_rps": round(throughput, 2),
+            "tokens_per_s": round(throughput * tokens_per_response, 1),
+            "ttft_ms": percentiles([r.ttft * 1000 for r in ok]),
+            "latency_ms": percentiles([r.latency * 1000 for r in ok]),
+            "cpu_ms_per_request": (
+                round(self.cpu_seconds * 1000 / len(self.results), 3)
+                if self.cpu_seconds is not None and self.results else None
+            ),
+            "rss_start_bytes": self.rss_start,
+            "rss_end_bytes": self.rss_end,
+            "rss_growth_bytes": (
+                self.rss_end - self.rss_start if self.rss_start is not None and self.rss_end is not None else None
+            )
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(target: str, port: int, env: Dict[str, str], show_logs: bool) -> subprocess.Popen:
+    output = None if show_logs else subprocess.DEVNULL
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=str(PROJECT_ROOT),
+        env={**os.environ, **env},
+        stdout=output,
+        stderr=output
+    )
+
+
+async def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Server for {url} exited with status {proc.returncode}")
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"Server for {url} did not start within {timeout}s")
+
+
+def _payload(model: str, index: int, stream: bool, max_tokens: int) -> Dict[str, Any]:
+    # A unique prompt per request keeps the response cache and coalescing out of the measurement
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": f"benchmark request {index}"}],
+        "max_tokens": max_tokens,
+        "stream": stream
+    }
+
+
+async def _http_request(client: httpx.AsyncClient, url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> Result:
+    """POST a chat request; TTFT is the first content chunk for streams and the full body otherwise."""
+    started = time.perf_counter()
+    ttft = None
+    try:
+        async with client.stream("POST", url, json=payload, headers=headers) as response:
+            async for chunk in response.aiter_bytes():
+                if ttft is None and chunk:
+                    ttft = time.perf_counter() - started
+            ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    latency = time.perf_counter() - started
+    if not payload.get("stream"):
+        ttft = latency
+    return Result(ttft if ttft is not None else latency, latency, ok)
+
+
+async def _run_workers(
+    total: int,
+    concurrency: int,
+    make_worker: Callable[[Callable[[], Optional[int]]], Awaitable[List[Result]]]
+) -> Tuple[List[Result], float]:
+    counter = iter(range(total))
+
+    def next_index() -> Optional[int]:
+        return next(counter, None)
+
+    started = time.perf_counter()
+    batches = await asyncio.gather(*(make_worker(next_index) for _ in range(concurrency)))
+    return [r for batch in batches for r in batch], time.perf_counter() - started
+
+
+async def run_http_scenario(
+    url: str,
+    model: str,
+    stream: bool,
+    total: int,
+    concurrency: int,
+    max_tokens: int,
+    headers: Dict[str, str]
+) -> Tuple[List[Result], float]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120.0) as client:
+
+        async def worker(next_index: Callable[[], Optional[int]]) -> List[Result]:
+            results = []
+            index = next_index()
+            while index is not None:
+                results.append(await _http_request(client, url, _payload(model, index, stream, max_tokens), headers))
+                index = next_index()
+            return results
+
+        return await _run_workers(total, concurrency, worker)
+
+
+async def run_ws_scenario(
+    url: str,
+    model: str,
+    total: int,
+    concurrency: int,
+    max_tokens: int
+) -> Tuple[List[Result], float]:
+    """One WebSocket connection per worker, requests sent one after another on it."""
+    from websockets.asyncio.client import connect
+
+    async def worker(next_index: Callable[[], Optional[int]]) -> List[Result]:
+        results = []
+        async with connect(url, max_size=None) as ws:
+            index = next_index()
+            while index is not None:
+                payload = _payload(model, index, True, max_tokens)
+                started = time.perf_counter()
+                ttft = None
+                ok = True
+                await ws.send(json.dumps(payload))
+                while True:
+                    frame = await ws.recv()
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    if frame.startswith("{"):
+                        ok = False
+                        break
+                    if frame.startswith("data: [DONE]"):
+                        break
+                latency = time.perf_counter() - started
+                results.append(Result(ttft or latency, latency, ok))
+                index = next_index()
+        return results
+
+    return await _run_workers(total, concurrency, worker)
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    mock_port, bridge_port = _free_port(), _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    bridge_url = f"http://127.0.0.1:{bridge_port}"
+    mock_env = {
+        "MOCK_LATENCY": str(args.latency),
+        "MOCK_TOKEN_RATE": str(args.token_rate),
+        "MOCK_TOKENS": str(args.tokens),
+        "MOCK_CHUNK_TOKENS": str(args.chunk_tokens)
+    }
+    bridge_env = {
+        "BRIDGE_SECRET": BRIDGE_SECRET,
+        "PERPLEXITY_API_KEY": "benchmark",
+        "PERPLEXITY_BASE_URL": f"{mock_url}/chat/completions",
+        "GITHUB_COPILOT_API_KEY": "benchmark",
+        "GITHUB_COPILOT_BASE_URL": f"{mock_url}/copilot",
+        # The default 10/minute would throttle the run
+        "RATE_LIMIT_ENABLED": "false",
+        "RESPONSE_CACHE_ENABLED": "false"
+    }
+    mock = _start_server("benchmarks.mock_upstream:app", mock_port, mock_env, args.server_logs)
+    bridge = _start_server("app:app", bridge_port, bridge_env, args.server_logs)
+    try:
+        await _wait_ready(f"{mock_url}/", mock)
+        await _wait_ready(f"{bridge_url}/health", bridge)
+        sampler = ProcessSampler(bridge.pid)
+        auth = {"X-API-KEY": BRIDGE_SECRET}
+        ws_url = f"ws://127.0.0.1:{bridge_port}/ws/chat?api_key={BRIDGE_SECRET}"
+
+        def scenario_runner(name: str, total: int) -> Awaitable[Tuple[List[Result], float]]:
+            common = (total, args.concurrency, args.tokens)
+            if name == "direct-rest":
+                return run_http_scenario(f"{mock_url}/chat/completions", args.model, False, *common, {})
+            if name == "direct-sse":
+                return run_http_scenario(f"{mock_url}/chat/completions", args.model, True, *common, {})
+            if name == "rest":
+                return run_http_scenario(f"{bridge_url}/v1/chat/completions", args.model, False, *common, auth)
+            if name == "sse":
+                return run_http_scenario(f"{bridge_url}/v1/chat/completions", args.model, True, *common, auth)
+            if name == "ws":
+                return run_ws_scenario(ws_url, args.model, *common)
+            if name == "copilot":
+                return run_http_scenario(f"{bridge_url}/v1/chat/completions", "copilot-gpt-4", False, *common, auth)
+            raise ValueError(f"Unknown scenario: {name}")
+
+        reports: Dict[str, Any] = {}
+        for name in args.scenarios:
+            if args.warmup:
+                await scenario_runner(name, args.warmup)
+            report = ScenarioReport(name)
+            cpu_before = sampler.cpu_seconds()
+            report.rss_start = sampler.rss_bytes()
+            report.results, report.duration = await scenario_runner(name, args.requests)
+            cpu_after = sampler.cpu_seconds()
+            report.rss_end = sampler.rss_bytes()
+            if not name.startswith("direct-") and cpu_before is not None and cpu_after is not None:
+                report.cpu_seconds = cpu_after - cpu_before
+            reports[name] = report.to_dict(args.concurrency, args.tokens)
+            print(
+                f"{name:12s} {reports[name]['throughput_rps']:8.1f} req/s  "
+                f"ttft p50 {reports[name]['ttft_ms']['p50']} ms  p99 {reports[name]['ttft_ms']['p99']} ms  "
+                f"errors {reports[name]['errors']}",
+                file=sys.stderr
+            )
+    finally:
+        for proc in (bridge, mock):
+            proc.terminate()
+        for proc in (bridge, mock):
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    overhead = {}
+    for direct, proxied in (("direct-rest", "rest"), ("direct-sse", "sse")):
+        if direct in reports and proxied in reports:
+            overhead[proxied] = {
+                metric: {
+                    p: (
+                        round(reports[proxied][metric][p] - reports[direct][metric][p], 3)
+                        if reports[proxied][metric][p] is not None and reports[direct][metric][p] is not None
+                        else None
+                    )
+                    for p in ("p50", "p95", "p99")
+                }
+                for metric in ("ttft_ms", "latency_ms")
+            }
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "model": args.model,
+            "mock": {
+                "latency_s": args.latency,
+                "token_rate": args.token_rate,
+                "tokens": args.tokens,
+                "chunk_tokens": args.chunk_tokens
+            }
+        },
+        "scenarios": reports,
+        "overhead_ms": overhead
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Return a description of every tracked metric that got worse by more than ``max_regression``."""
+    regressions = []
+    for name, report in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        for metric, key, higher_is_better in TRACKED_METRICS:
+            new_value = report.get(metric) if key is None else (report.get(metric) or {}).get(key)
+            old_value = old.get(metric) if key is None else (old.get(metric) or {}).get(key)
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if higher_is_better:
+                change = -change
+            if change > max_regression:
+                label = metric if key is None else f"{metric}.{key}"
+                regressions.append(f"{name} {label}: {old_value} -> {new_value} ({change:+.0%})")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the bridge against a local mock upstream.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before each scenario")
+    parser.add_argument("--model", default="sonar", help="Model sent to the bridge")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock upstream time to first byte (s)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Mock tokens per second (0 = unlimited)")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per response")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="Tokens per SSE chunk")
+    parser.add_argument("--server-logs", action="store_true", help="Show bridge and mock server output")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative regression for --compare (default 0.2)")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(run_benchmark(args))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+Per-upstream circuit breakers with failover.
+
+Every upstream attempt made through ``retry.RetryPolicy`` reports its
+outcome here. Failures are 5xx/429 answers, transport errors and calls that
+took longer than ``CIRCUIT_SLOW_CALL`` seconds to produce headers. Each
+upstream (provider) has a ``CircuitBreaker``:
+
+* **closed** - requests flow; outcomes are counted in a rolling window of
+  ``CIRCUIT_WINDOW`` seconds. Once it holds ``CIRCUIT_MIN_REQUESTS`` calls
+  and the failure rate reaches ``CIRCUIT_FAILURE_RATE`` the breaker opens.
+* **open** - requests are not sent for ``CIRCUIT_OPEN_SECONDS``; they fail
+  over to a fallback model or fail fast with 503 instead of waiting out
+  the upstream timeout.
+* **half-open** - ``CIRCUIT_HALF_OPEN_PROBES`` requests are let through as
+  probes. A successful probe closes the breaker; a failed one re-opens it.
+
+Fallbacks (``CIRCUIT_FALLBACKS``) map a model or a provider to the model to
+use instead, e.g. ``perplexity=copilot-gpt-4``. Without configuration,
+Perplexity fails over to ``copilot-gpt-4`` when GitHub Copilot is set up.
+"""
+
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from config import (
+    CIRCUIT_BREAKER_ENABLED, CIRCUIT_WINDOW, CIRCUIT_MIN_REQUESTS, CIRCUIT_FAILURE_RATE, CIRCUIT_SLOW_CALL,
+    CIRCUIT_OPEN_SECONDS, CIRCUIT_HALF_OPEN_PROBES, CIRCUIT_FALLBACKS, has_github_copilot
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def parse_fallbacks(spec: str) -> Dict[str, str]:
+    """Parse ``"model-or-provider=fallback-model,..."`` into a dict, skipping malformed entries."""
+    fallbacks: Dict[str, str] = {}
+    for item in (spec or "").split(","):
+        name, sep, fallback = item.partition("=")
+        if sep and name.strip() and fallback.strip():
+            fallbacks[name.strip()] = fallback.strip()
+    return fallbacks
+
+
+class CircuitOpenError(HTTPException):
+    """503 raised when an upstream's breaker is open and no fallback is available."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        self.upstream = upstream
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=503,
+            detail=f"Upstream {upstream} is unavailable (circuit open); retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a rolling window of call outcomes."""
+
+    def __init__(
+        self,
+        name: str,
+        window: float = 30.0,
+        min_requests: int = 10,
+        failure_rate: float = 0.5,
+        slow_call: float = 20.0,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+        buckets: int = 10,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_started = 0.0
+        self.trips = 0
+        self.rejected = 0
+        # Ring of time buckets: bucket id, calls, failures
+        self._width = window / buckets
+        self._ids: List[int] = [-1] * buckets
+        self._calls: List[int] = [0] * buckets
+        self._failures: List[int] = [0] * buckets
+
+    def _counts(self, now: float) -> Tuple[int, int]:
+        oldest = int(now / self._width) - len(self._ids) + 1
+        calls = failures = 0
+        for index, bucket in enumerate(self._ids):
+            if bucket >= oldest:
+                calls += self._calls[index]
+                failures += self._failures[index]
+        return calls, failures
+
+    def current_state(self) -> str:
+        """The breaker state, moving open to half-open once the open period is over."""
+        if self.state == OPEN and self.clock() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.probes = 0
+            logger.info(f"Circuit for {self.name} is half-open; probing")
+        return self.state
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now; in half-open state this takes a probe slot."""
+        state = self.current_state()
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN:
+            now = self.clock()
+            # A probe that never reported back (e.g. coalesced away) frees its slot eventually
+            if self.probes and now - self.probe_started >= self.open_seconds:
+                self.probes = 0
+            if self.probes < self.half_open_probes:
+                self.probes += 1
+                self.probe_started = now
+                return True
+        self.rejected += 1
+        return False
+
+    def record(self, success: bool, latency: float) -> None:
+        """Report the outcome of one upstream call."""
+        failed = not success or latency >= self.slow_call
+        now = self.clock()
+        state = self.current_state()
+        if state == HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+            if failed:
+                self._open(now)
+            else:
+                self._close()
+            return
+        if state == OPEN:
+            # A late answer to a call sent before the breaker opened
+            return
+        bucket = int(now / self._width)
+        index = bucket % len(self._ids)
+        if self._ids[index] != bucket:
+            self._ids[index] = bucket
+            self._calls[index] = 0
+            self._failures[index] = 0
+        self._calls[index] += 1
+        if failed:
+            self._failures[index] += 1
+            calls, failures = self._counts(now)
+            if calls >= self.min_requests and failures / calls >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+        logger.warning(f"Circuit for {self.name} opened for {self.open_seconds:.0f}s")
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self._ids = [-1] * len(self._ids)
+        logger.info(f"Circuit for {self.name} closed")
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets probes through again."""
+        if self.current_state() != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_seconds - self.clock())
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.current_state()
+        calls, failures = self._counts(self.clock())
+        return {
+            "state": state,
+            "state_code": STATE_CODES[state],
+            "calls": calls,
+            "failures": failures,
+            "failure_rate": round(failures / calls, 4) if calls else 0.0,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retry_after": round(self.retry_after(), 1)
+        }
+
+
+class CircuitBreakers:
+    """One breaker per upstream, plus the failover table."""
+
+    def __init__(self, fallbacks: Optional[Dict[str, str]] = None, enabled: bool = True, **settings: Any):
+        self.fallbacks = fallbacks or {}
+        self.enabled = enabled
+        self.settings = settings
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.failovers = 0
+
+    def get(self, upstream: str) -> CircuitBreaker:
+        breaker = self._breakers.get(upstream)
+        if breaker is None:
+            breaker = self._breakers[upstream] = CircuitBreaker(upstream, **self.settings)
+        return breaker
+
+    def record(self, upstream: str, success: bool, latency: float) -> None:
+        if self.enabled:
+            self.get(upstream).record(success, latency)
+
+    def is_open(self, upstream: str) -> bool:
+        return self.enabled and self.get(upstream).current_state() == OPEN
+
+    def route(
+        self,
+        model: str,
+        provider: str,
+        resolve: Callable[[str], str],
+        providers: Optional[Iterable[str]] = None
+    ) -> Tuple[str, str]:
+        """
+        Pick the model to call: ``model`` itself, or the first fallback whose breaker allows it.
+
+        Args:
+            resolve: Maps a fallback model to its provider
+            providers: If given, only fallbacks served by these providers are used
+
+        Raises:
+            CircuitOpenError: every candidate's breaker is open
+        """
+        if not self.enabled or self.get(provider).allow():
+            return model, provider
+        allowed = None if providers is None else set(providers)
+        seen = {model}
+        candidate, candidate_provider = model, provider
+        while True:
+            fallback = self.fallbacks.get(candidate) or self.fallbacks.get(candidate_provider)
+            if fallback is None or fallback in seen:
+                raise CircuitOpenError(provider, self.get(provider).retry_after())
+            seen.add(fallback)
+            candidate, candidate_provider = fallback, resolve(fallback)
+            if allowed is not None and candidate_provider not in allowed:
+                continue
+            if self.get(candidate_provider).allow():
+                self.failovers += 1
+                logger.warning(f"Failing over from {model} to {candidate}: circuit for {provider} is open")
+                return candidate, candidate_provider
+
+    def states(self) -> Dict[str, str]:
+        return {name: breaker.current_state() for name, breaker in self._breakers.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "fallbacks": dict(self.fallbacks),
+            "failovers": self.failovers,
+            "upstreams": {name: breaker.stats() for name, breaker in self._breakers.items()}
+        }
+
+
+def _default_fallbacks() -> Dict[str, str]:
+    fallbacks = parse_fallbacks(CIRCUIT_FALLBACKS)
+    if not fallbacks and has_github_copilot():
+        fallbacks["perplexity"] = "copilot-gpt-4"
+    return fallbacks
+
+
+# Module-level breakers shared by the application
+circuit_breakers = CircuitBreakers(
+    fallbacks=_default_fallbacks(),
+    enabled=CIRCUIT_BREAKER_ENABLED,
+    window=CIRCUIT_WINDOW,
+    min_requests=CIRCUIT_MIN_REQUESTS,
+    failure_rate=CIRCUIT_FAILURE_RATE,
+    slow_call=CIRCUIT_SLOW_CALL,
+    open_seconds=CIRCUIT_OPEN_SECONDS,
+    half_open_probes=CIRCUIT_HALF_OPEN_PROBES
+)
@@ -0,0 +1,163 @@
+"""
+Response cache for non-streaming chat completions.
+
+Byte-identical deterministic requests are answered from memory instead of
+being paid for upstream again. Entries are keyed on a canonical hash of the
+model, messages and sampling parameters, expire after a per-model TTL and
+are evicted least-recently-used once the memory budget is exceeded.
+
+The cache is opt-in (``RESPONSE_CACHE_ENABLED``) and never stores answers
+from time-sensitive search models (``RESPONSE_CACHE_EXCLUDE``).
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config import (
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MODEL_TTLS, RESPONSE_CACHE_EXCLUDE
+)
+
+logger = logging.getLogger(__name__)
+
+# Request fields that do not influence the completion content.
+IGNORED_FIELDS = frozenset({"stream"})
+
+
+def canonical_request_key(request_data: Dict[str, Any]) -> str:
+    """
+    Return a stable hash identifying a chat request.
+
+    Two requests share a key only if model, messages and sampling
+    parameters are identical; key order and whitespace do not matter.
+    """
+    canonical = {field: value for field, value in request_data.items() if field not in IGNORED_FIELDS}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def parse_model_ttls(spec: str) -> Dict[str, float]:
+    """Parse ``"model=seconds,model=seconds"`` into a dict, skipping malformed entries."""
+    ttls: Dict[str, float] = {}
+    for item in spec.split(","):
+        model, sep, seconds = item.partition("=")
+        if not sep or not model.strip():
+            continue
+        try:
+            ttls[model.strip()] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ignoring invalid cache TTL entry: {item!r}")
+    return ttls
+
+
+def wants_no_cache(cache_control: Optional[str]) -> Tuple[bool, bool]:
+    """
+    Interpret a request ``Cache-Control`` header.
+
+    Returns:
+        Tuple of (skip_lookup, skip_store)
+    """
+    if not cache_control:
+        return False, False
+    directives = {d.strip().lower() for d in cache_control.split(",")}
+    no_store = "no-store" in directives
+    return no_store or "no-cache" in directives, no_store
+
+
+class ResponseCache:
+    """In-memory LRU cache of serialized responses with a byte budget and per-model TTLs."""
+
+    def __init__(
+        self,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        default_ttl: float = RESPONSE_CACHE_TTL,
+        model_ttls: Optional[Dict[str, float]] = None,
+        exclude: Iterable[str] = ()
+    ):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.model_ttls = dict(model_ttls or {})
+        self.exclude = tuple(pattern.strip() for pattern in exclude if pattern.strip())
+        # key -> (expires_at, body)
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def ttl_for(self, model: str) -> float:
+        """Return the TTL in seconds for a model; 0 means the model is not cached."""
+        if any(pattern in model for pattern in self.exclude):
+            return 0.0
+        return self.model_ttls.get(model, self.default_ttl)
+
+    def should_cache(self, model: str) -> bool:
+        return self.enabled and self.max_bytes > 0 and self.ttl_for(model) > 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached body for ``key``, or None on miss or expiry."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, body = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def set(self, key: str, model: str, body: bytes) -> bool:
+        """Store a serialized response. Returns False if it was not cacheable."""
+        ttl = self.ttl_for(model)
+        if not self.enabled or ttl <= 0 or len(body) > self.max_bytes:
+            return False
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, body)
+        self._bytes += len(body)
+        while self._bytes > self.max_bytes:
+            oldest, _ = next(iter(self._entries.items()))
+            self._remove(oldest)
+            self.evictions += 1
+        return True
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "default_ttl": self.default_ttl,
+            "model_ttls": self.model_ttls,
+            "exclude": list(self.exclude),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+# Module-level cache shared by the application
+response_cache = ResponseCache(
+    model_ttls=parse_model_ttls(RESPONSE_CACHE_MODEL_TTLS),
+    exclude=RESPONSE_CACHE_EXCLUDE.split(",")
+)
@@ -0,0 +1,136 @@
+"""
+Client-driven cancellation of upstream streams.
+
+A streamed chat completion keeps the upstream ``client.stream`` open for as
+long as somebody iterates it. When the browser closes an SSE response or a
+``/ws/chat`` client cancels a request, the iterating task is cancelled and
+the ``async with client.stream(...)`` block unwinds, closing the upstream
+connection instead of pulling the rest of the answer.
+
+* ``StreamTracker`` wraps a stream, counts what was forwarded and records
+  cancellations (and an estimate of the tokens and bytes that were never
+  pulled) in ``cancellation_stats``.
+* ``cancel_on_disconnect`` makes sure the HTTP streaming task is cancelled
+  as soon as the client goes away, on every ASGI server.
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Union
+
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+
+class CancellationStats:
+    """Process-wide counters for streams cancelled by their clients."""
+
+    def __init__(self) -> None:
+        self.cancelled: Dict[str, int] = {}
+        self.bytes_streamed = 0
+        self.tokens_streamed = 0
+        self.estimated_tokens_saved = 0
+        self.estimated_bytes_saved = 0
+
+    def record(self, reason: str, streamed_bytes: int, streamed_tokens: int, max_tokens: Optional[int]) -> None:
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+        self.bytes_streamed += streamed_bytes
+        self.tokens_streamed += streamed_tokens
+        if max_tokens:
+            saved = max(0, max_tokens - streamed_tokens)
+            self.estimated_tokens_saved += saved
+            if streamed_tokens:
+                self.estimated_bytes_saved += saved * streamed_bytes // streamed_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "cancelled_streams": sum(self.cancelled.values()),
+            "by_reason": dict(self.cancelled),
+            "bytes_streamed_before_cancel": self.bytes_streamed,
+            "tokens_streamed_before_cancel": self.tokens_streamed,
+            "estimated_tokens_saved": self.estimated_tokens_saved,
+            "estimated_bytes_saved": self.estimated_bytes_saved
+        }
+
+
+cancellation_stats = CancellationStats()
+
+
+class StreamTracker:
+    """
+    Count the SSE frames forwarded to one client and record it if the client cancels.
+
+    Every content frame is counted as one token, which is how OpenAI-style
+    upstreams stream. ``reason`` may be a callable so the caller can decide
+    why the stream was cancelled at the moment it happens.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        reason: Union[str, Callable[[], str]] = "client_disconnect",
+        stats: CancellationStats = cancellation_stats
+    ):
+        self.max_tokens = max_tokens
+        self.reason = reason
+        self.stats = stats
+        self.bytes = 0
+        self.tokens = 0
+
+    def observe(self, chunk: str) -> None:
+        self.bytes += len(chunk)
+        if chunk.startswith("data:") and not chunk.startswith("data: [DONE]"):
+            self.tokens += 1
+
+    def cancelled(self) -> None:
+        reason = self.reason() if callable(self.reason) else self.reason
+        logger.info(f"Stream cancelled ({reason}) after {self.tokens} chunks")
+        self.stats.record(reason, self.bytes, self.tokens, self.max_tokens)
+
+    async def wrap(self, source: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Yield from ``source``, recording a cancellation if iteration is abandoned."""
+        try:
+            async for chunk in source:
+                self.observe(chunk)
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled()
+            raise
+
+
+def _asgi_spec_version(request: Request) -> tuple:
+    version = request.scope.get("asgi", {}).get("spec_version", "2.0")
+    return tuple(int(part) for part in version.split("."))
+
+
+async def cancel_on_disconnect(request: Request, source: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Yield from ``source`` until the HTTP client disconnects.
+
+    For ASGI spec < 2.4 servers (uvicorn) Starlette's ``StreamingResponse``
+    already listens for ``http.disconnect`` and cancels the body iterator.
+    Newer servers only report a disconnect when a write fails, which would
+    leave the upstream stream running until the next chunk arrives, so a
+    watcher task cancels the streaming task as soon as the disconnect is
+    received.
+    """
+    if _asgi_spec_version(request) < (2, 4):
+        async for chunk in source:
+            yield chunk
+        return
+
+    streaming_task = asyncio.current_task()
+
+    async def watch() -> None:
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        if streaming_task is not None:
+            streaming_task.cancel()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        async for chunk in source:
+            yield chunk
+    finally:
+        watcher.cancel()
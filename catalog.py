@@ -0,0 +1,134 @@
+"""
+Precomputed ``/models`` responses.
+
+The model catalogue only changes when providers are registered or their API
+keys are set, yet the web UI fetches ``/models`` on every load. Instead of
+rebuilding and re-serialising the list per request, ``ModelCatalog``
+serialises every model once (both its ``models`` and its ``data`` entry)
+whenever the registry's fingerprint changes, and stores the finished body
+together with a strong ``ETag``.
+
+Filtered views (``?provider=...&category=...``) are assembled by joining
+the pre-serialised fragments of the matching models; they are cached per
+filter, so a filter value costs one join the first time it is asked for.
+Filters naming an unknown provider or category share one cached empty body
+so arbitrary query strings cannot grow the cache.
+
+Clients revalidate with ``If-None-Match`` and get ``304 Not Modified``;
+``Cache-Control: max-age`` (``MODELS_CACHE_MAX_AGE``) lets them skip the
+request entirely for a while.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import MODELS_CACHE_MAX_AGE
+from providers import ProviderRegistry, providers
+
+# Same compact encoding as FastAPI's JSONResponse
+_SEPARATORS = (",", ":")
+
+
+def _encode(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=_SEPARATORS).encode("utf-8")
+
+
+def strong_etag(body: bytes) -> str:
+    """A strong entity tag derived from the response bytes."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches ``etag`` (weak comparison, as RFC 9110 requires for GET)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class CatalogView:
+    """One serialised ``/models`` body and its ETag."""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = strong_etag(body)
+
+
+class ModelCatalog:
+    """Serialise the registry's model list once and serve it as cached bytes."""
+
+    def __init__(self, registry: ProviderRegistry, max_age: int = 300):
+        self.registry = registry
+        self.max_age = max_age
+        self._fingerprint: Optional[Tuple[Any, ...]] = None
+        # (models fragment, data fragment, provider, category) per model
+        self._fragments: List[Tuple[bytes, bytes, str, str]] = []
+        self._providers: frozenset = frozenset()
+        self._categories: frozenset = frozenset()
+        self._views: Dict[Tuple[Optional[str], Optional[str]], CatalogView] = {}
+        self._empty = CatalogView(self._join([]))
+        self.rebuilds = 0
+
+    @property
+    def cache_control(self) -> str:
+        return f"public, max-age={self.max_age}"
+
+    def refresh(self) -> None:
+        """Re-serialise the catalogue if the providers changed since the last build."""
+        fingerprint = (self.registry,) + self.registry.fingerprint()
+        if fingerprint == self._fingerprint:
+            return
+        fragments = []
+        for model in self.registry.models():
+            entry = {
+                "id": model["id"],
+                "name": model["name"],
+                "description": model["description"],
+                "provider": model["provider"],
+                "category": model["category"]
+            }
+            fragments.append((_encode(entry), _encode(dict(entry, object="model")), entry["provider"], entry["category"]))
+        self._fragments = fragments
+        self._providers = frozenset(fragment[2] for fragment in fragments)
+        self._categories = frozenset(fragment[3] for fragment in fragments)
+        self._views = {(None, None): CatalogView(self._join(fragments))}
+        self._fingerprint = fingerprint
+        self.rebuilds += 1
+
+    @staticmethod
+    def _join(fragments: List[Tuple[bytes, bytes, str, str]]) -> bytes:
+        return (
+            b'{"models":[' + b",".join(fragment[0] for fragment in fragments)
+            + b'],"data":[' + b",".join(fragment[1] for fragment in fragments) + b"]}"
+        )
+
+    def view(self, provider: Optional[str] = None, category: Optional[str] = None) -> CatalogView:
+        """The (cached) response body for an optional provider and category filter."""
+        self.refresh()
+        provider = provider or None
+        category = category or None
+        if (provider is not None and provider not in self._providers) or \
+                (category is not None and category not in self._categories):
+            return self._empty
+        key = (provider, category)
+        view = self._views.get(key)
+        if view is None:
+            view = self._views[key] = CatalogView(self._join([
+                fragment for fragment in self._fragments
+                if (provider is None or fragment[2] == provider) and (category is None or fragment[3] == category)
+            ]))
+        return view
+
+
+# Module-level catalogue shared by the application
+model_catalog = ModelCatalog(providers, max_age=MODELS_CACHE_MAX_AGE)
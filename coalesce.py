@@ -0,0 +1,176 @@
+"""
+Single-flight coalescing of identical in-flight chat requests.
+
+When several clients send the same request at the same moment only one
+upstream call is made:
+
+* ``SingleFlight`` shares one upstream future between concurrent
+  non-streaming duplicates.
+* ``StreamFanout`` shares one upstream SSE stream between concurrent
+  streaming duplicates. Subscribers that join mid-stream first replay the
+  chunks already received, so every client sees the complete response.
+
+Requests are keyed with ``cache.canonical_request_key``. The shared upstream
+work runs in its own task so a leader disconnecting does not fail the
+followers; a shared stream is cancelled once its last subscriber leaves.
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import COALESCE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one awaited task."""
+
+    def __init__(self, enabled: bool = COALESCE_REQUESTS):
+        self.enabled = enabled
+        self._calls: Dict[str, "asyncio.Task[Any]"] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run ``fn`` once for all concurrent callers with the same key.
+
+        Returns:
+            Tuple of (result, shared) where ``shared`` is True if the caller
+            joined a call that was already in flight.
+        """
+        if not self.enabled:
+            return await fn(), False
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+            self.leaders += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key: str, task: "asyncio.Task[Any]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "shared": self.shared
+        }
+
+
+class _Broadcast:
+    """One upstream stream replayed to any number of subscribers."""
+
+    def __init__(self) -> None:
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional["asyncio.Task[None]"] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def follow(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class StreamFanout:
+    """Share one upstream stream between concurrent identical streaming requests."""
+
+    def __init__(self, enabled: bool = COALESCE_REQUESTS):
+        self.enabled = enabled
+        self._streams: Dict[str, _Broadcast] = {}
+        self.leaders = 0
+        self.shared = 0
+        self.cancelled = 0
+
+    async def subscribe(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Yield the chunks of the stream for ``key``.
+
+        ``factory`` is only called when no identical stream is in flight.
+        """
+        if not self.enabled:
+            async for chunk in factory():
+                yield chunk
+            return
+
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(broadcast.pump(factory()))
+            broadcast.task.add_done_callback(lambda _t, k=key, b=broadcast: self._forget(k, b))
+            self.leaders += 1
+        else:
+            self.shared += 1
+
+        broadcast.subscribers += 1
+        try:
+            async for chunk in broadcast.follow():
+                yield chunk
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and broadcast.task is not None and not broadcast.task.done():
+                # Nobody is listening any more; stop pulling from upstream
+                broadcast.task.cancel()
+                self.cancelled += 1
+                self._forget(key, broadcast)
+
+    def _forget(self, key: str, broadcast: _Broadcast) -> None:
+        if self._streams.get(key) is broadcast:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._streams),
+            "subscribers": sum(b.subscribers for b in self._streams.values()),
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "cancelled": self.cancelled
+        }
+
+
+# Module-level coalescers shared by the application
+single_flight = SingleFlight()
+stream_fanout = StreamFanout()
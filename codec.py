@@ -0,0 +1,112 @@
+"""
+JSON encoding and decoding for request and response bodies.
+
+A chat completion used to be encoded and decoded several times per hop:
+the validated request was re-encoded by httpx with the stdlib ``json``
+module, and the upstream answer was parsed, checked field by field and
+serialised again for the client. With long multi-turn conversations those
+passes dominate the bridge's own CPU time.
+
+``dumps``/``loads`` use the fastest available backend (``JSON_CODEC``):
+
+* ``orjson`` (``pip install orjson``)
+* ``msgspec`` (``pip install msgspec``)
+* the stdlib ``json`` module, always available
+
+``auto`` (the default) picks the first one that is installed.
+
+With ``JSON_PASSTHROUGH`` enabled (it is off by default), a non-streaming
+upstream body that passes ``looks_like_completion`` - a cheap structural
+check on the raw bytes - is forwarded to the client (and the response
+cache) as-is instead of being decoded and re-encoded. Anything unusual,
+such as an upstream error object, falls back to the full decode-and-validate
+path. The check does not prove what ``Provider.validate`` does (a non-empty
+``choices`` list whose first entry has a message), which is why passthrough
+is opt-in.
+"""
+
+import json
+import logging
+import re
+from typing import Any, Callable, Optional, Tuple, Union
+
+from config import JSON_CODEC, JSON_PASSTHROUGH
+
+logger = logging.getLogger(__name__)
+
+Encoder = Callable[[Any], bytes]
+Decoder = Callable[[Union[bytes, bytearray, memoryview, str]], Any]
+
+# A top-level (or any unescaped) "error" member means the body needs a full look
+_ERROR_MEMBER = re.compile(rb'"error"\s*:')
+_TOTAL_TOKENS = re.compile(rb'"total_tokens"\s*:\s*(\d+)')
+_WHITESPACE = b" \t\r\n"
+
+
+def _stdlib() -> Tuple[str, Encoder, Decoder]:
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    return "json", dumps, json.loads
+
+
+def _orjson() -> Tuple[str, Encoder, Decoder]:
+    import orjson
+
+    return "orjson", orjson.dumps, orjson.loads
+
+
+def _msgspec() -> Tuple[str, Encoder, Decoder]:
+    import msgspec
+
+    return "msgspec", msgspec.json.encode, msgspec.json.decode
+
+
+_BACKENDS = {"orjson": _orjson, "msgspec": _msgspec, "json": _stdlib}
+
+
+def select_backend(name: str) -> Tuple[str, Encoder, Decoder]:
+    """Return ``(name, dumps, loads)`` for ``name`` (or the fastest installed for ``auto``)."""
+    name = (name or "auto").strip().lower()
+    candidates = ["orjson", "msgspec", "json"] if name == "auto" else [name, "json"]
+    for candidate in candidates:
+        factory = _BACKENDS.get(candidate)
+        if factory is None:
+            logger.warning(f"Unknown JSON_CODEC {candidate!r}; using the stdlib json module")
+            continue
+        try:
+            return factory()
+        except ImportError:
+            if name != "auto":
+                logger.warning(f"JSON_CODEC={candidate} is not installed; using the stdlib json module")
+    return _stdlib()
+
+
+def looks_like_completion(body: Any) -> bool:
+    """
+    Cheap structural check that ``body`` is a chat completion object.
+
+    It must be a JSON object mentioning ``choices`` and ``message`` and must
+    not carry an ``error`` member. This never decodes the body.
+    """
+    if not isinstance(body, (bytes, bytearray)):
+        return False
+    stripped = body.strip(_WHITESPACE)
+    return (
+        stripped[:1] == b"{"
+        and stripped[-1:] == b"}"
+        and b'"choices"' in stripped
+        and b'"message"' in stripped
+        and _ERROR_MEMBER.search(stripped) is None
+    )
+
+
+def total_tokens(body: bytes) -> Optional[int]:
+    """``usage.total_tokens`` of a raw completion body, if it reports one."""
+    match = _TOTAL_TOKENS.search(body)
+    return int(match.group(1)) if match else None
+
+
+# Module-level codec shared by the application
+CODEC, dumps, loads = select_backend(JSON_CODEC)
+passthrough = JSON_PASSTHROUGH
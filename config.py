@@ -5,6 +5,15 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean flag from the environment."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 # Perplexity Configuration
 PERPLEXITY_KEY: Optional[str] = os.getenv("PERPLEXITY_API_KEY")
 BRIDGE_SECRET: Optional[str] = os.getenv("BRIDGE_SECRET")
@@ -14,8 +23,128 @@ BASE_URL: str = os.getenv("PERPLEXITY_BASE_URL", "https://api.perplexity.ai/chat
 GITHUB_COPILOT_KEY: Optional[str] = os.getenv("GITHUB_COPILOT_API_KEY")
 GITHUB_COPILOT_BASE_URL: str = os.getenv("GITHUB_COPILOT_BASE_URL", "https://api.github.com/copilot")
 
-# Rate Limiting
-RATE_LIMIT: str = "10/minute"
+# Extra OpenAI-compatible backends (e.g. a llama.cpp or vLLM server), comma-separated names.
+# Each is configured with PROVIDER_<NAME>_URL, _MODELS and optionally _API_KEY and _PREFIX;
+# any provider (including perplexity and github-copilot) can be tuned with
+# PROVIDER_<NAME>_TIMEOUT, _STREAM_TIMEOUT, _MAX_CONNECTIONS and _MAX_KEEPALIVE
+LOCAL_PROVIDERS: str = os.getenv("LOCAL_PROVIDERS", "")
+
+# JSON backend for request/response bodies: auto (fastest installed), orjson, msgspec or json
+JSON_CODEC: str = os.getenv("JSON_CODEC", "auto")
+# Forward upstream completion bodies as raw bytes instead of re-encoding them. Off by default:
+# the raw-bytes check is shallower than full response validation
+JSON_PASSTHROUGH: bool = _env_bool("JSON_PASSTHROUGH", False)
+
+# Seconds clients may reuse the /models response before revalidating it with its ETag
+MODELS_CACHE_MAX_AGE: int = int(os.getenv("MODELS_CACHE_MAX_AGE", "300"))
+
+# Extra API keys besides BRIDGE_SECRET: "name=key;models=sonar*|gpt-5.2;rpm=60;tpm=100000,..."
+# (keys may be given as sha256:<hex digest>)
+API_KEYS: str = os.getenv("API_KEYS", "")
+# JSON file of API keys, re-read when it changes
+API_KEYS_FILE: Optional[str] = os.getenv("API_KEYS_FILE")
+# Seconds between checks of API_KEYS_FILE for changes
+API_KEYS_RELOAD_INTERVAL: float = float(os.getenv("API_KEYS_RELOAD_INTERVAL", "5"))
+
+# Rate Limiting (token buckets; rates like "10/minute" or "10/minute;burst=20")
+RATE_LIMIT_ENABLED: bool = _env_bool("RATE_LIMIT_ENABLED", True)
+# Default limit per route and client address
+RATE_LIMIT: str = os.getenv("RATE_LIMIT", "10/minute")
+# Per-route overrides: "/terminal=5/minute,/v1/chat/completions=30/minute"
+RATE_LIMIT_ROUTES: str = os.getenv("RATE_LIMIT_ROUTES", "")
+# Limit per X-API-KEY across all routes and clients (empty = none)
+RATE_LIMIT_PER_KEY: str = os.getenv("RATE_LIMIT_PER_KEY", "")
+# Per-model limits per client address; "*" applies to every other model
+RATE_LIMIT_MODELS: str = os.getenv("RATE_LIMIT_MODELS", "")
+# Bucket store: memory, file[:/path] (shared by workers on one host) or redis://host:port/db
+RATE_LIMIT_STORE: str = os.getenv("RATE_LIMIT_STORE", "memory")
+# Allow requests when the store is unreachable instead of failing them with 503
+RATE_LIMIT_FAIL_OPEN: bool = _env_bool("RATE_LIMIT_FAIL_OPEN", True)
+
+# Upstream admission scheduler: caps concurrent upstream calls and queues the rest
+ADMISSION_ENABLED: bool = _env_bool("ADMISSION_ENABLED", True)
+# Concurrent upstream calls per provider, e.g. "perplexity=32,github-copilot=16"
+ADMISSION_PROVIDER_CONCURRENCY: str = os.getenv("ADMISSION_PROVIDER_CONCURRENCY", "perplexity=32,github-copilot=16")
+# Concurrent upstream calls per model; "*" applies to every other model
+ADMISSION_MODEL_CONCURRENCY: str = os.getenv("ADMISSION_MODEL_CONCURRENCY", "")
+# Tokens-per-minute budget per provider (prompt estimate + max_tokens), e.g. "perplexity=200000"
+ADMISSION_TPM: str = os.getenv("ADMISSION_TPM", "")
+# Seconds a request may wait for capacity before failing with 503
+ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# Requests allowed to wait at once; more are rejected immediately
+ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+
+# Upstream Connection Pool
+UPSTREAM_HTTP2: bool = _env_bool("UPSTREAM_HTTP2", True)
+UPSTREAM_MAX_CONNECTIONS: int = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE: int = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY: float = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+
+# Upstream retries (429/502/503/504 and connection failures) with decorrelated jitter
+# Total attempts per upstream call, including the first
+UPSTREAM_RETRY_ATTEMPTS: int = int(os.getenv("UPSTREAM_RETRY_ATTEMPTS", "3"))
+UPSTREAM_RETRY_BASE_DELAY: float = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.1"))
+UPSTREAM_RETRY_MAX_DELAY: float = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "2"))
+# A longer upstream Retry-After is passed to the client instead of being waited out
+UPSTREAM_RETRY_MAX_RETRY_AFTER: float = float(os.getenv("UPSTREAM_RETRY_MAX_RETRY_AFTER", "10"))
+# Retries (and hedges) allowed per request on average, e.g. 0.2 = at most 20% extra load
+UPSTREAM_RETRY_BUDGET: float = float(os.getenv("UPSTREAM_RETRY_BUDGET", "0.2"))
+# Fire a second attempt when the first has no response headers after the provider's p95 latency
+UPSTREAM_HEDGE: bool = _env_bool("UPSTREAM_HEDGE", False)
+UPSTREAM_HEDGE_MIN_DELAY: float = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.05"))
+
+# Circuit breakers per upstream provider, with failover to a fallback model
+CIRCUIT_BREAKER_ENABLED: bool = _env_bool("CIRCUIT_BREAKER_ENABLED", True)
+# Rolling window (seconds) of call outcomes, and the calls it needs before it can trip
+CIRCUIT_WINDOW: float = float(os.getenv("CIRCUIT_WINDOW", "30"))
+CIRCUIT_MIN_REQUESTS: int = int(os.getenv("CIRCUIT_MIN_REQUESTS", "10"))
+# Failure rate (errors, 5xx/429 and slow calls) that opens the circuit
+CIRCUIT_FAILURE_RATE: float = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+# Calls taking longer than this (seconds to response headers) count as failures
+CIRCUIT_SLOW_CALL: float = float(os.getenv("CIRCUIT_SLOW_CALL", "20"))
+# Seconds an open circuit fails fast before letting probe requests through
+CIRCUIT_OPEN_SECONDS: float = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_PROBES: int = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+# Failover targets by model or provider, e.g. "perplexity=copilot-gpt-4,sonar-pro=sonar"
+# (default: perplexity=copilot-gpt-4 when GitHub Copilot is configured)
+CIRCUIT_FALLBACKS: str = os.getenv("CIRCUIT_FALLBACKS", "")
+
+# Response Cache (opt-in, non-streaming chat completions only)
+RESPONSE_CACHE_ENABLED: bool = _env_bool("RESPONSE_CACHE_ENABLED", False)
+RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+# Per-model TTL overrides, e.g. "gpt-5.2=600,claude-4.5-sonnet=120" (0 disables caching)
+RESPONSE_CACHE_MODEL_TTLS: str = os.getenv("RESPONSE_CACHE_MODEL_TTLS", "")
+# Comma-separated substrings of model IDs that are never cached (time-sensitive search models)
+RESPONSE_CACHE_EXCLUDE: str = os.getenv("RESPONSE_CACHE_EXCLUDE", "sonar")
+
+# Single-flight coalescing of identical in-flight chat requests
+COALESCE_REQUESTS: bool = _env_bool("COALESCE_REQUESTS", True)
+
+# WebSocket backpressure: bounded per-connection send queue
+WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+# What to do when a slow client fills the queue: coalesce, summary or abort
+WS_BACKPRESSURE_POLICY: str = os.getenv("WS_BACKPRESSURE_POLICY", "coalesce").strip().lower()
+# Seconds the abort policy waits for a slow client before giving up on the stream
+WS_SEND_TIMEOUT: float = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# Concurrent requests (tagged with an "id") allowed on one WebSocket connection
+WS_MAX_CONCURRENT_STREAMS: int = int(os.getenv("WS_MAX_CONCURRENT_STREAMS", "8"))
+
+# Serve /metrics without an X-API-KEY so Prometheus can scrape it
+METRICS_PUBLIC: bool = _env_bool("METRICS_PUBLIC", False)
+# Directory where worker processes share metrics snapshots (set by start.py --production)
+METRICS_MULTIPROC_DIR: Optional[str] = os.getenv("METRICS_MULTIPROC_DIR")
+# Seconds between a worker's metrics snapshots
+METRICS_FLUSH_INTERVAL: float = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Seconds after which a call counts half as much in the per-model estimates on /models/stats
+MODEL_STATS_HALF_LIFE: float = float(os.getenv("MODEL_STATS_HALF_LIFE", "300"))
+# Model prices for those estimates, in USD per 1K tokens: "sonar-pro=0.003,gpt-5.2=0.01"
+MODEL_PRICES: str = os.getenv("MODEL_PRICES", "")
+
+# Worker processes serving the bridge (set by start.py --production); per-process
+# upstream budgets (ADMISSION_*) are divided between them
+BRIDGE_WORKER_COUNT: int = max(1, int(os.getenv("BRIDGE_WORKER_COUNT", "1")))
 
 # Validate BRIDGE_SECRET on import
 if not BRIDGE_SECRET or not BRIDGE_SECRET.strip():
@@ -40,6 +169,13 @@ def validate_config() -> None:
         )
 
 
+def provider_env(provider: str, setting: str, default: str = "") -> str:
+    """Read ``PROVIDER_<NAME>_<SETTING>`` (e.g. PROVIDER_GITHUB_COPILOT_TIMEOUT) from the environment."""
+    name = "".join(ch if ch.isalnum() else "_" for ch in provider).upper()
+    value = os.getenv(f"PROVIDER_{name}_{setting}")
+    return default if value is None or not value.strip() else value.strip()
+
+
 def has_github_copilot() -> bool:
     """Check if GitHub Copilot is configured."""
     return bool(GITHUB_COPILOT_KEY and GITHUB_COPILOT_KEY.strip())
@@ -0,0 +1,382 @@
+"""
+API keys for several teams sharing one bridge.
+
+Every key has a name, an optional model allowlist and optional quotas:
+
+* ``rpm`` - requests per minute
+* ``tpm`` - tokens per minute, charged with the same estimate the admission
+  scheduler uses (prompt size plus ``max_tokens``)
+
+Quota buckets live in the rate limiter's store (``RATE_LIMIT_STORE``), so
+with the ``file`` or ``redis`` store they are shared by every worker. Each
+key also keeps usage counters (requests, tokens charged, tokens reported by
+the upstream or counted in a stream, rejections), visible on ``/admin/keys``.
+
+Keys come from three places, later ones winning on a name clash:
+
+* ``BRIDGE_SECRET`` - the ``default`` key, with admin rights and no limits
+* ``API_KEYS`` - ``name=key;models=sonar*|gpt-5.2;rpm=60;tpm=100000,...``
+* ``API_KEYS_FILE`` - a JSON list (or ``{"keys": [...]}``) of objects with
+  ``name``, ``key``, ``models``, ``rpm``, ``tpm`` and ``admin``
+
+A key may be given in clear text or as ``sha256:<hex digest>``; only digests
+are kept in memory. A lookup hashes the presented key once and does a single
+dict lookup, so the cost does not grow with the number of keys, and since
+the attacker does not control the digest, the dict's comparisons reveal
+nothing about stored keys.
+
+The key file is checked for changes at most every
+``API_KEYS_RELOAD_INTERVAL`` seconds (and on ``POST /admin/keys/reload``).
+A reload builds a new table and swaps it in with one assignment, so
+requests never wait on a lock and never see a half-built table; a file that
+fails to parse leaves the previous table in place. Only admin keys can use
+``/admin``, ``/metrics``, ``/terminal`` and ``/project`` endpoints.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+from config import BRIDGE_SECRET, API_KEYS, API_KEYS_FILE, API_KEYS_RELOAD_INTERVAL
+from metrics import rate_limit_store_errors_total
+from rate_limit import Rate, RateLimitExceeded, RateLimitStore, limiter
+
+logger = logging.getLogger(__name__)
+
+HASH_PREFIX = "sha256:"
+DEFAULT_KEY_NAME = "default"
+
+
+def hash_key(key: Union[str, bytes]) -> bytes:
+    """SHA-256 digest of a client-supplied key."""
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    return hashlib.sha256(key).digest()
+
+
+def per_minute(count: int, unit: str) -> Rate:
+    return Rate(count, 60.0, count, f"{count} {unit}/minute")
+
+
+class APIKey:
+    """One key's identity, permissions and quotas (immutable once loaded)."""
+
+    __slots__ = ("name", "digest", "models", "model_prefixes", "rpm", "tpm", "admin")
+
+    def __init__(
+        self,
+        name: str,
+        digest: bytes,
+        models: Optional[Iterable[str]] = None,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        admin: bool = False
+    ):
+        self.name = name
+        self.digest = digest
+        self.models: Optional[FrozenSet[str]] = None
+        self.model_prefixes: Tuple[str, ...] = ()
+        patterns = [model.strip() for model in models or () if model.strip()]
+        if patterns and "*" not in patterns:
+            self.models = frozenset(model for model in patterns if not model.endswith("*"))
+            self.model_prefixes = tuple(model[:-1] for model in patterns if model.endswith("*"))
+        self.rpm = per_minute(rpm, "requests") if rpm else None
+        self.tpm = per_minute(tpm, "tokens") if tpm else None
+        self.admin = admin
+
+    def allows(self, model: str) -> bool:
+        """Whether the allowlist (exact ids and ``prefix*`` patterns) admits ``model``."""
+        if self.models is None:
+            return True
+        return model in self.models or model.startswith(self.model_prefixes)
+
+    def describe(self) -> Dict[str, Any]:
+        models = None
+        if self.models is not None:
+            models = sorted(self.models) + [prefix + "*" for prefix in self.model_prefixes]
+        return {
+            "admin": self.admin,
+            "models": models,
+            "rpm": self.rpm.count if self.rpm else None,
+            "tpm": self.tpm.count if self.tpm else None
+        }
+
+
+class KeyUsage:
+    """Running counters for one key; survives reloads while the key exists."""
+
+    __slots__ = ("requests", "tokens_charged", "tokens_used", "rejected")
+
+    def __init__(self):
+        self.requests = 0
+        self.tokens_charged = 0
+        self.tokens_used = 0
+        self.rejected: Dict[str, int] = {}
+
+    def reject(self, reason: str) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+
+def _quota(entry: Dict[str, Any], field: str) -> Optional[int]:
+    value = entry.get(field)
+    if value in (None, ""):
+        return None
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"{field} must not be negative")
+    return value
+
+
+def parse_key_entry(entry: Dict[str, Any]) -> APIKey:
+    """Build an ``APIKey`` from a file or ``API_KEYS`` entry, raising ``ValueError`` if it is malformed."""
+    name = str(entry.get("name") or "").strip()
+    key = str(entry.get("key") or "").strip()
+    if not name or not key:
+        raise ValueError("an API key needs a name and a key")
+    if key.startswith(HASH_PREFIX):
+        digest = bytes.fromhex(key[len(HASH_PREFIX):])
+        if len(digest) != hashlib.sha256().digest_size:
+            raise ValueError(f"{name}: sha256 digest must be 64 hex characters")
+    else:
+        digest = hash_key(key)
+    models = entry.get("models")
+    if isinstance(models, str):
+        models = models.replace("|", ",").split(",")
+    admin = entry.get("admin", False)
+    if isinstance(admin, str):
+        admin = admin.strip().lower() in ("1", "true", "yes", "on")
+    return APIKey(
+        name,
+        digest,
+        models=models,
+        rpm=_quota(entry, "rpm"),
+        tpm=_quota(entry, "tpm"),
+        admin=bool(admin)
+    )
+
+
+def parse_keys_spec(spec: str) -> List[Dict[str, Any]]:
+    """Parse ``API_KEYS`` (``name=key;models=a|b*;rpm=60;tpm=100000,...``) into entries."""
+    entries = []
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, sep, rest = item.partition("=")
+        key, *options = rest.split(";")
+        entry: Dict[str, Any] = {"name": name.strip(), "key": key.strip() if sep else ""}
+        for option in options:
+            option_name, _, value = option.partition("=")
+            entry[option_name.strip().lower()] = value.strip()
+        entries.append(entry)
+    return entries
+
+
+def load_key_file(path: str) -> List[Dict[str, Any]]:
+    """Read the entries of a JSON key file."""
+    with open(path, "r", encoding="utf-8") as handle:
+        data = json.load(handle)
+    if isinstance(data, dict):
+        data = data.get("keys", [])
+    if not isinstance(data, list):
+        raise ValueError("expected a list of keys or {\"keys\": [...]}")
+    return data
+
+
+class KeyStore:
+    """Hashed API keys with allowlists, quotas and usage counters."""
+
+    def __init__(
+        self,
+        secret: Optional[str] = None,
+        spec: str = "",
+        path: Optional[str] = None,
+        reload_interval: float = 5.0,
+        store: Optional[RateLimitStore] = None
+    ):
+        self.secret = secret
+        self.spec = spec
+        self.path = path or None
+        self.reload_interval = reload_interval
+        self.store = store
+        self._table: Dict[bytes, APIKey] = {}
+        self._usage: Dict[str, KeyUsage] = {}
+        self._file_state: Optional[Tuple[int, int]] = None
+        self._next_check = 0.0
+        self.version = 0
+        self.reload_errors = 0
+        self.store_errors = 0
+        try:
+            self.reload()
+        except ValueError:
+            # Start with the other keys; the file is read again once it changes
+            self._install(self._entries(include_file=False))
+
+    def _entries(self, include_file: bool = True) -> List[Any]:
+        entries: List[Any] = []
+        if self.secret:
+            entries.append({"name": DEFAULT_KEY_NAME, "key": self.secret, "admin": True})
+        entries += parse_keys_spec(self.spec)
+        if self.path and include_file:
+            try:
+                stat = os.stat(self.path)
+                self._file_state = (stat.st_mtime_ns, stat.st_size)
+                entries += load_key_file(self.path)
+            except (OSError, ValueError) as e:
+                raise ValueError(f"Cannot load API key file {self.path}: {str(e)}") from e
+        return entries
+
+    def _install(self, entries: List[Any]) -> int:
+        table: Dict[bytes, APIKey] = {}
+        names: Dict[str, bytes] = {}
+        for entry in entries:
+            try:
+                key = parse_key_entry(entry)
+            except (AttributeError, TypeError, ValueError) as e:
+                name = entry.get("name") if isinstance(entry, dict) else None
+                logger.warning(f"Ignoring invalid API key entry {name!r}: {str(e)}")
+                continue
+            # A later definition of a name replaces the earlier one
+            previous = names.pop(key.name, None)
+            if previous is not None:
+                del table[previous]
+            if key.digest in table:
+                logger.warning(f"API keys {table[key.digest].name!r} and {key.name!r} are identical; using {key.name!r}")
+                del names[table[key.digest].name]
+            table[key.digest] = key
+            names[key.name] = key.digest
+        self._usage = {name: self._usage.get(name) or KeyUsage() for name in names}
+        # One assignment: requests in flight keep whichever table they looked up
+        self._table = table
+        self.version += 1
+        logger.info(f"Loaded {len(table)} API key(s)")
+        return len(table)
+
+    def reload(self) -> int:
+        """
+        Rebuild the key table from the environment and key file; returns the number of keys.
+
+        If the key file cannot be read or parsed the current table is kept and
+        ``ValueError`` is raised.
+        """
+        self._next_check = time.monotonic() + self.reload_interval
+        try:
+            entries = self._entries()
+        except ValueError as e:
+            self.reload_errors += 1
+            logger.error(f"{str(e)}; keeping the previous API keys")
+            raise
+        return self._install(entries)
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if self.path is None or now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+        try:
+            stat = os.stat(self.path)
+            state: Optional[Tuple[int, int]] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            state = None
+        if state != self._file_state:
+            try:
+                self.reload()
+            except ValueError:
+                # Do not re-read the same broken (or missing) file on every check
+                self._file_state = state
+
+    def lookup(self, provided: Optional[Union[str, bytes]]) -> Optional[APIKey]:
+        """The key matching a client-supplied value, or ``None``."""
+        if not provided:
+            return None
+        self._maybe_reload()
+        return self._table.get(hash_key(provided))
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def usage(self, key: APIKey) -> KeyUsage:
+        usage = self._usage.get(key.name)
+        if usage is None:
+            # The key was removed by a reload while its request was in flight
+            usage = KeyUsage()
+        return usage
+
+    def authorize(self, key: APIKey, model: str) -> None:
+        """Raise 403 if ``key`` may not use ``model``."""
+        if not key.allows(model):
+            self.usage(key).reject("model")
+            raise HTTPException(status_code=403, detail=f"API key '{key.name}' is not allowed to use model '{model}'")
+
+    async def _acquire(self, bucket: str, rate: Rate, cost: int) -> Optional[float]:
+        """Take ``cost`` from a quota bucket; returns the retry delay if it is empty."""
+        store = self.store or limiter.store
+        try:
+            decision = await store.acquire(bucket, rate, cost)
+        except Exception as e:
+            self.store_errors += 1
+            rate_limit_store_errors_total.labels(store.name).inc()
+            logger.warning(f"Rate-limit store error, skipping API key quota: {str(e)}")
+            return None
+        return None if decision.allowed else decision.retry_after
+
+    async def check_quota(self, key: APIKey, tokens: int) -> None:
+        """
+        Charge one request of about ``tokens`` tokens to ``key``'s quotas.
+
+        Raises:
+            RateLimitExceeded: the key is over its ``rpm`` or ``tpm`` quota
+        """
+        usage = self.usage(key)
+        if key.rpm is not None:
+            retry_after = await self._acquire(f"apikey:{key.name}:rpm", key.rpm, 1)
+            if retry_after is not None:
+                usage.reject("rpm")
+                raise RateLimitExceeded(f"key:{key.name}:rpm", key.rpm, retry_after)
+        if key.tpm is not None:
+            # A request larger than the whole quota only waits for a full bucket
+            retry_after = await self._acquire(f"apikey:{key.name}:tpm", key.tpm, max(1, min(tokens, key.tpm.burst)))
+            if retry_after is not None:
+                usage.reject("tpm")
+                raise RateLimitExceeded(f"key:{key.name}:tpm", key.tpm, retry_after)
+        usage.requests += 1
+        usage.tokens_charged += tokens
+
+    def record_usage(self, key: APIKey, used_tokens: Optional[int]) -> None:
+        """Add the upstream-reported (or streamed) token count of a finished request."""
+        if used_tokens:
+            self.usage(key).tokens_used += used_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        keys = {}
+        for key in self._table.values():
+            usage = self.usage(key)
+            keys[key.name] = dict(
+                key.describe(),
+                requests=usage.requests,
+                tokens_charged=usage.tokens_charged,
+                tokens_used=usage.tokens_used,
+                rejected=dict(usage.rejected)
+            )
+        return {
+            "count": len(self._table),
+            "file": self.path,
+            "reload_interval": self.reload_interval,
+            "version": self.version,
+            "reload_errors": self.reload_errors,
+            "store_errors": self.store_errors,
+            "keys": keys
+        }
+
+
+# Module-level key store shared by the application
+api_keys = KeyStore(
+    secret=BRIDGE_SECRET,
+    spec=API_KEYS,
+    path=API_KEYS_FILE,
+    reload_interval=API_KEYS_RELOAD_INTERVAL
+)
@@ -0,0 +1,672 @@
+"""
+In-process metrics exposed in the Prometheus text format on ``/metrics``.
+
+Counters, gauges and histograms are plain Python objects keyed by a tuple of
+label values. Callers resolve a labelled child once (``metric.labels(...)``)
+and then record into it; recording is a dict lookup plus an integer add or a
+``bisect`` into a preallocated bucket list, so it stays cheap on the
+streaming hot path. Nothing is aggregated until ``/metrics`` is scraped.
+
+Statistics that other components already keep (upstream pool, response
+cache, coalescing, WebSocket queues, cancellations) are exported through
+collectors that are called at scrape time.
+
+Model names come from clients, so each metric caps its number of label sets
+at ``MAX_SERIES``; further label sets are folded into one ``overflow`` series.
+
+With several worker processes (``start.py --production``) each worker only
+sees its own requests. When ``METRICS_MULTIPROC_DIR`` is set, ``SharedMetrics``
+has every worker write a JSON snapshot of its metrics there every
+``METRICS_FLUSH_INTERVAL`` seconds, and ``/metrics`` - whichever worker
+serves it - sums counters and histograms over all snapshots (including
+workers that exited, e.g. when recycled) and gauges over the live workers.
+Collector statistics stay per worker and carry a ``worker`` label.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.exceptions import HTTPException
+
+from config import METRICS_MULTIPROC_DIR, METRICS_FLUSH_INTERVAL, MODEL_PRICES, MODEL_STATS_HALF_LIFE
+from model_stats import ModelStats, parse_prices, usage_tokens
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAX_SERIES = 1000
+OVERFLOW = "overflow"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: str) -> Any:
+        """Return the child for a label set, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            if len(self._children) >= MAX_SERIES:
+                values = (OVERFLOW,) * len(self.labelnames)
+                child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def clone(self) -> "_Metric":
+        """An empty metric with the same name, labels and buckets."""
+        return type(self)(self.name, self.documentation, self.labelnames)
+
+    def dump(self) -> List[Any]:
+        """The label sets and values as JSON-compatible data."""
+        return [[list(values), self._dump_child(child)] for values, child in list(self._children.items())]
+
+    def merge(self, dumped: List[Any]) -> None:
+        """Add values produced by ``dump`` (of another process) to this metric."""
+        for values, data in dumped:
+            self._merge_child(self.labels(*values), data)
+
+    def _dump_child(self, child: Any) -> Any:
+        raise NotImplementedError
+
+    def _merge_child(self, child: Any, data: Any) -> None:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child: Any) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def _dump_child(self, child: _Value) -> float:
+        return child.value
+
+    def _merge_child(self, child: _Value, data: float) -> None:
+        child.value += data
+
+    def _render_child(self, values: Tuple[str, ...], child: _Value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    """Value per label set that can go up and down."""
+
+    kind = "gauge"
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """Bucketed distribution per label set; buckets are only made cumulative at scrape time."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def clone(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, self.labelnames, self.buckets)
+
+    def _dump_child(self, child: _HistogramChild) -> List[Any]:
+        return [list(child.counts), child.sum]
+
+    def _merge_child(self, child: _HistogramChild, data: List[Any]) -> None:
+        counts, total = data
+        for index, count in enumerate(counts[:len(child.counts)]):
+            child.counts[index] += count
+        child.sum += total
+
+    def _render_child(self, values: Tuple[str, ...], child: _HistogramChild) -> List[str]:
+        lines = []
+        cumulative = 0
+        counts = list(child.counts)
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(float(bound))}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def snapshot_samples(
+    prefix: str,
+    snapshot: Dict[str, Any],
+    labelled: Optional[Dict[str, str]] = None
+) -> List[Sample]:
+    """
+    Flatten a component's stats dict into samples.
+
+    Numeric and boolean leaves become ``<prefix>_<path>`` samples; other
+    values are skipped. Keys listed in ``labelled`` hold a mapping whose keys
+    become the value of the given label instead of part of the name, e.g.
+    ``{"providers": "provider"}``.
+    """
+    labelled = labelled or {}
+    samples: List[Sample] = []
+
+    def walk(name: str, value: Any, labels: Dict[str, str]) -> None:
+        if isinstance(value, (bool, int, float)):
+            samples.append((_INVALID_NAME_CHARS.sub("_", name), labels, float(value)))
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if key in labelled and isinstance(item, dict):
+                    for label_value, nested in item.items():
+                        walk(f"{name}_{key}", nested, {**labels, labelled[key]: str(label_value)})
+                else:
+                    walk(f"{name}_{key}", item, labels)
+
+    walk(prefix, snapshot, {})
+    return samples
+
+
+class MetricsRegistry:
+    """Owns the application's metrics and renders them for ``/metrics``."""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[Sample]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[Sample]]) -> None:
+        """Add a callable returning ``(name, labels, value)`` samples at scrape time."""
+        self._collectors.append(collector)
+
+    def collect(self) -> List[Sample]:
+        """Run every collector."""
+        samples: List[Sample] = []
+        for collector in self._collectors:
+            samples.extend(collector())
+        return samples
+
+    def dump(self) -> Dict[str, List[Any]]:
+        """Every metric's values, as JSON-compatible data keyed by metric name."""
+        return {metric.name: metric.dump() for metric in self._metrics}
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(_render_samples(self.collect()))
+        return "\n".join(lines) + "\n"
+
+    def render_merged(self, snapshots: List[Tuple[Dict[str, Any], bool]]) -> str:
+        """
+        Render the sum of several processes' snapshots (``SharedMetrics`` files).
+
+        Each entry is ``(snapshot, alive)``: gauges and collector samples only
+        count for live processes, counters and histograms for all of them.
+        """
+        lines: List[str] = []
+        for metric in self._metrics:
+            merged = metric.clone()
+            for snapshot, alive in snapshots:
+                if alive or merged.kind != "gauge":
+                    merged.merge(snapshot.get("metrics", {}).get(metric.name, []))
+            lines.extend(merged.render())
+        samples: List[Sample] = []
+        for snapshot, alive in snapshots:
+            if alive:
+                worker = str(snapshot.get("pid"))
+                samples.extend((name, {**labels, "worker": worker}, value) for name, labels, value in snapshot.get("samples", []))
+        lines.extend(_render_samples(samples))
+        return "\n".join(lines) + "\n"
+
+
+def _render_samples(samples: List[Sample]) -> List[str]:
+    # The text format wants every sample of a family together
+    families: Dict[str, List[str]] = {}
+    for name, labels, value in samples:
+        label_text = _format_labels(list(labels), list(labels.values()))
+        families.setdefault(name, []).append(f"{name}{label_text} {_format_value(value)}")
+    lines: List[str] = []
+    for name, family in families.items():
+        lines.append(f"# TYPE {name} untyped")
+        lines.extend(family)
+    return lines
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedMetrics:
+    """Combine the metrics of every worker process through a directory of JSON snapshots."""
+
+    ARCHIVE = "exited.json"
+    LOCK = ".lock"
+
+    def __init__(self, registry: MetricsRegistry, directory: Optional[str], interval: float = 5.0):
+        self.registry = registry
+        self.directory = directory or None
+        self.interval = interval
+        self.flushes = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _write(self, name: str, data: Dict[str, Any]) -> None:
+        # Write then rename so readers never see a partial file
+        path = self._path(name)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(data, handle)
+        os.replace(temporary, path)
+
+    def flush(self) -> None:
+        """Write this process's snapshot."""
+        os.makedirs(self.directory, exist_ok=True)
+        pid = os.getpid()
+        self._write(f"{pid}.json", {"pid": pid, "metrics": self.registry.dump(), "samples": self.registry.collect()})
+        self.flushes += 1
+
+    def _load(self) -> List[Tuple[str, Dict[str, Any]]]:
+        snapshots = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(self._path(name), "r", encoding="utf-8") as handle:
+                    snapshots.append((name, json.load(handle)))
+            except (OSError, ValueError):
+                # Removed or being replaced while listing; the next scrape sees it
+                continue
+        return snapshots
+
+    def _compact(self, exited: List[Tuple[str, Dict[str, Any]]], archive: Optional[Dict[str, Any]]) -> None:
+        """Fold the snapshots of exited workers into one file so recycling does not grow the directory."""
+        merged = {}
+        for metric in self.registry._metrics:
+            if metric.kind == "gauge":
+                continue
+            combined = metric.clone()
+            for _, snapshot in exited + ([("", archive)] if archive else []):
+                combined.merge(snapshot.get("metrics", {}).get(metric.name, []))
+            merged[metric.name] = combined.dump()
+        self._write(self.ARCHIVE, {"pid": None, "metrics": merged, "samples": []})
+        for name, _ in exited:
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def render(self) -> str:
+        """The ``/metrics`` text for all workers."""
+        self.flush()
+        lock = None
+        if fcntl is not None:
+            lock = open(self._path(self.LOCK), "a")
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            snapshots = []
+            exited = []
+            archive = None
+            for name, snapshot in self._load():
+                if name == self.ARCHIVE:
+                    archive = snapshot
+                    snapshots.append((snapshot, False))
+                    continue
+                alive = isinstance(snapshot.get("pid"), int) and _process_alive(snapshot["pid"])
+                snapshots.append((snapshot, alive))
+                if not alive:
+                    exited.append((name, snapshot))
+            # Only one process may rewrite the archive at a time
+            if exited and lock is not None:
+                self._compact(exited, archive)
+            return self.registry.render_merged(snapshots)
+        finally:
+            if lock is not None:
+                lock.close()
+
+    async def run(self) -> None:
+        """Flush periodically until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except OSError as e:
+                self.errors += 1
+                logger.warning(f"Could not write metrics snapshot: {str(e)}")
+
+
+# Module-level registry and metrics shared by the application
+registry = MetricsRegistry()
+shared_metrics = SharedMetrics(registry, METRICS_MULTIPROC_DIR, METRICS_FLUSH_INTERVAL)
+model_stats = ModelStats(MODEL_STATS_HALF_LIFE, parse_prices(MODEL_PRICES))
+
+requests_total = registry.counter(
+    "bridge_requests_total",
+    "Client requests by endpoint, model, provider and status code.",
+    ("endpoint", "model", "provider", "status")
+)
+request_duration = registry.histogram(
+    "bridge_request_duration_seconds",
+    "Time until the response (or, for streams, its headers) was ready.",
+    ("endpoint", "model", "provider")
+)
+time_to_first_token = registry.histogram(
+    "bridge_time_to_first_token_seconds",
+    "Time from request start until the first streamed chunk was forwarded.",
+    ("endpoint", "model", "provider")
+)
+stream_duration = registry.histogram(
+    "bridge_stream_duration_seconds",
+    "Total duration of streamed responses.",
+    ("endpoint", "model", "provider")
+)
+bytes_proxied = registry.counter(
+    "bridge_bytes_proxied_total",
+    "Response bytes forwarded to clients.",
+    ("endpoint", "model", "provider")
+)
+streams_in_flight = registry.gauge(
+    "bridge_streams_in_flight",
+    "Streams currently being forwarded.",
+    ("endpoint",)
+)
+upstream_requests_total = registry.counter(
+    "bridge_upstream_requests_total",
+    "Upstream API calls by provider, model and upstream status code (\"error\" if no response).",
+    ("provider", "model", "status")
+)
+upstream_latency = registry.histogram(
+    "bridge_upstream_latency_seconds",
+    "Upstream response time (time to response headers for streams).",
+    ("provider", "model")
+)
+websocket_connections = registry.gauge(
+    "bridge_websocket_connections",
+    "Open /ws/chat connections."
+)
+terminal_commands_total = registry.counter(
+    "bridge_terminal_commands_total",
+    "Commands run through /terminal by command and exit code.",
+    ("command", "exit_code")
+)
+terminal_duration = registry.histogram(
+    "bridge_terminal_duration_seconds",
+    "Run time of /terminal commands.",
+    ("command",)
+)
+
+rate_limit_decision = registry.histogram(
+    "bridge_rate_limit_decision_seconds",
+    "Time the rate limiter took to decide on one limit, by store.",
+    ("store",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.25)
+)
+rate_limit_decisions_total = registry.counter(
+    "bridge_rate_limit_decisions_total",
+    "Rate-limit decisions by scope (route, key, model) and outcome.",
+    ("scope", "outcome")
+)
+rate_limit_store_errors_total = registry.counter(
+    "bridge_rate_limit_store_errors_total",
+    "Rate-limit store failures, by store.",
+    ("store",)
+)
+
+admission_queue_wait = registry.histogram(
+    "bridge_admission_queue_wait_seconds",
+    "Time requests waited for upstream capacity, by provider.",
+    ("provider",)
+)
+admission_rejections_total = registry.counter(
+    "bridge_admission_rejections_total",
+    "Requests rejected by the admission scheduler, by provider and reason.",
+    ("provider", "reason")
+)
+
+upstream_retries_total = registry.counter(
+    "bridge_upstream_retries_total",
+    "Upstream retries by provider and reason (status code, error type or \"budget_exhausted\").",
+    ("provider", "reason")
+)
+upstream_hedges_total = registry.counter(
+    "bridge_upstream_hedges_total",
+    "Hedged upstream attempts fired, and how many answered first.",
+    ("provider", "outcome")
+)
+
+
+@contextmanager
+def observe_request(endpoint: str, model: str, provider: str) -> Iterator[None]:
+    """Count a request and time it, taking the status from any ``HTTPException`` raised."""
+    started = time.perf_counter()
+    status = "200"
+    try:
+        yield
+    except HTTPException as e:
+        status = str(e.status_code)
+        raise
+    except asyncio.CancelledError:
+        # Client went away before the response was ready (nginx's "client closed request")
+        status = "499"
+        raise
+    except BaseException:
+        status = "500"
+        raise
+    finally:
+        requests_total.labels(endpoint, model, provider, status).inc()
+        request_duration.labels(endpoint, model, provider).observe(time.perf_counter() - started)
+
+
+class UpstreamTimer:
+    """
+    Time one upstream call.
+
+    Call ``done(status_code)`` as soon as the upstream answers (for streams,
+    when the headers arrive); a call left without a status, e.g. because the
+    connection failed, is counted with status ``"error"``.
+
+    When the call ends, it is also recorded in ``model_stats``: streams call
+    ``token()`` for each content frame, non-streamed calls pass the response
+    to ``usage()``.
+    """
+
+    __slots__ = ("provider", "model", "started", "recorded", "status", "first_token", "tokens", "total_tokens")
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.started = 0.0
+        self.recorded = False
+        self.status: Any = None
+        self.first_token: Optional[float] = None
+        self.tokens: Optional[int] = None
+        self.total_tokens: Optional[int] = None
+
+    def __enter__(self) -> "UpstreamTimer":
+        self.started = time.perf_counter()
+        return self
+
+    def done(self, status: Any) -> None:
+        if self.recorded:
+            return
+        self.recorded = True
+        self.status = status
+        upstream_latency.labels(self.provider, self.model).observe(time.perf_counter() - self.started)
+        upstream_requests_total.labels(self.provider, self.model, str(status)).inc()
+
+    def token(self) -> None:
+        """Count one streamed content frame."""
+        if self.tokens is None:
+            self.first_token = time.perf_counter()
+            self.tokens = 0
+        self.tokens += 1
+
+    def usage(self, response: Any) -> None:
+        """Take the token counts from a completion response (dict or raw JSON bytes)."""
+        self.tokens, self.total_tokens = usage_tokens(response)
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        self.done("error")
+        if exc_type is not None and issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            # The client went away; that says nothing about the model
+            return
+        code = int(self.status) if str(self.status).isdigit() else None
+        if code is not None and 400 <= code < 500 and code != 429:
+            return
+        latency = time.perf_counter() - self.started
+        if exc_type is not None or code is None or code >= 400:
+            model_stats.record(self.model, latency, error=True)
+            return
+        ttft = None if self.first_token is None else self.first_token - self.started
+        model_stats.record(self.model, latency, ttft, self.tokens, self.total_tokens)
+
+
+async def instrument_stream(
+    source: AsyncIterator[str],
+    endpoint: str,
+    model: str,
+    provider: str,
+    started: Optional[float] = None
+) -> AsyncIterator[str]:
+    """Yield from ``source`` recording time to first chunk, stream duration and bytes."""
+    if started is None:
+        started = time.perf_counter()
+    ttft = time_to_first_token.labels(endpoint, model, provider)
+    sent = bytes_proxied.labels(endpoint, model, provider)
+    in_flight = streams_in_flight.labels(endpoint)
+    first = True
+    in_flight.inc()
+    try:
+        async for chunk in source:
+            if first:
+                ttft.observe(time.perf_counter() - started)
+                first = False
+            # ASCII strings (almost every SSE frame) have len() == encoded size
+            sent.inc(len(chunk) if chunk.isascii() else len(chunk.encode("utf-8")))
+            yield chunk
+    finally:
+        in_flight.dec()
+        stream_duration.labels(endpoint, model, provider).observe(time.perf_counter() - started)
@@ -0,0 +1,251 @@
+"""
+Rolling per-model performance estimates.
+
+The bridge records every upstream chat call here (see ``UpstreamTimer`` in
+``metrics.py``): time to first token, total latency, tokens per second,
+whether it failed and what it cost. Each figure is an exponentially decayed
+average whose sample weights halve every ``half_life`` seconds, so the
+estimates follow a model that slows down or recovers within minutes.
+Recording one call is a handful of float operations per figure.
+
+* a call that gets no response, HTTP 429 or a 5xx counts as an error;
+  other 4xx answers (bad requests, unknown models) are the client's doing
+  and are not recorded, nor are calls the client abandoned
+* a non-streamed completion's time to first token is its full latency
+* tokens per second is completion tokens over the time spent generating
+  them (after the first token, for streams, where every content frame is
+  counted as one token)
+* cost is ``usage.total_tokens`` (or the streamed token count) times the
+  model's price in USD per 1K tokens from ``MODEL_PRICES``; models without a
+  price report no cost
+
+``snapshot()`` also decays each model's sample count to the present, so an
+estimate nobody has refreshed for a while loses its standing. The bridge
+serves it on ``GET /models/stats``; ``agent.router.Router`` loads it (and
+adds what the agent observes itself) to route by latency and cost. The
+module has no server dependencies so the agent can import it.
+
+Estimates are kept per worker process.
+"""
+
+import logging
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Models tracked at most; model names come from clients
+MAX_MODELS = 1000
+
+FIGURES = ("ttft", "latency", "tokens_per_second", "error_rate", "cost")
+
+_USAGE_TOKENS = re.compile(rb'"(completion|total)_tokens"\s*:\s*(\d+)')
+
+
+def parse_prices(spec: str) -> Dict[str, float]:
+    """Parse ``"model=usd_per_1k_tokens,..."`` into a dict, skipping malformed entries."""
+    prices: Dict[str, float] = {}
+    for item in (spec or "").split(","):
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            prices[name.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid model price entry: {item!r}")
+    return prices
+
+
+def usage_tokens(response: Any) -> Tuple[Optional[int], Optional[int]]:
+    """``(completion_tokens, total_tokens)`` of a completion response (dict or raw JSON bytes)."""
+    if isinstance(response, bytes):
+        found = {name: int(count) for name, count in _USAGE_TOKENS.findall(response)}
+        return found.get(b"completion"), found.get(b"total")
+    usage = response.get("usage") if isinstance(response, dict) else None
+    if not isinstance(usage, dict):
+        return None, None
+    completion, total = usage.get("completion_tokens"), usage.get("total_tokens")
+    return (completion if isinstance(completion, int) else None, total if isinstance(total, int) else None)
+
+
+class DecayingAverage:
+    """Average whose sample weights halve every ``half_life`` seconds."""
+
+    __slots__ = ("half_life", "value", "weight", "updated")
+
+    def __init__(self, half_life: float):
+        self.half_life = half_life
+        self.value = 0.0
+        self.weight = 0.0
+        self.updated = 0.0
+
+    def decayed_weight(self, now: float) -> float:
+        if not self.weight:
+            return 0.0
+        return self.weight * 0.5 ** (max(0.0, now - self.updated) / self.half_life)
+
+    def add(self, sample: float, now: float) -> None:
+        self.weight = self.decayed_weight(now) + 1.0
+        self.value += (sample - self.value) / self.weight
+        self.updated = now
+
+    def get(self) -> Optional[float]:
+        return self.value if self.weight else None
+
+
+class ModelEstimate:
+    """The decayed figures of one model."""
+
+    __slots__ = FIGURES + ("calls", "errors")
+
+    def __init__(self, half_life: float):
+        for figure in FIGURES:
+            setattr(self, figure, DecayingAverage(half_life))
+        self.calls = 0
+        self.errors = 0
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        samples = self.error_rate.decayed_weight(now)
+        data: Dict[str, Any] = {
+            "samples": round(samples, 3),
+            "age": round(max(0.0, now - self.error_rate.updated), 3),
+            "calls": self.calls,
+            "errors": self.errors,
+        }
+        for figure in FIGURES:
+            value = getattr(self, figure).get()
+            data[figure] = None if value is None else round(value, 6)
+        return data
+
+
+class ModelStats:
+    """
+    Online estimates of each model's latency, throughput, error rate and cost.
+
+    Time is ``time.monotonic()`` unless a caller passes ``now``.
+    """
+
+    def __init__(self, half_life: float = 300.0, prices: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            half_life: Seconds after which a sample counts half as much
+            prices: USD per 1K tokens by model
+        """
+        self.half_life = max(1e-3, float(half_life))
+        self.prices = dict(prices or {})
+        self._models: Dict[str, ModelEstimate] = {}
+        self.dropped = 0
+
+    def _estimate(self, model: str) -> Optional[ModelEstimate]:
+        estimate = self._models.get(model)
+        if estimate is None:
+            if len(self._models) >= MAX_MODELS:
+                self.dropped += 1
+                return None
+            estimate = self._models[model] = ModelEstimate(self.half_life)
+        return estimate
+
+    def record(
+        self,
+        model: str,
+        latency: float,
+        ttft: Optional[float] = None,
+        completion_tokens: Optional[int] = None,
+        total_tokens: Optional[int] = None,
+        error: bool = False,
+        now: Optional[float] = None
+    ) -> None:
+        """
+        Record one call.
+
+        Args:
+            model: Model the call went to
+            latency: Seconds until the response was complete
+            ttft: Seconds until the first streamed token (None for non-streamed calls)
+            completion_tokens: Tokens generated, if known
+            total_tokens: Tokens billed (prompt and completion), if known
+            error: The call failed; only the error rate is updated
+            now: Current ``time.monotonic()`` (for tests)
+        """
+        estimate = self._estimate(model)
+        if estimate is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        estimate.calls += 1
+        if error:
+            estimate.errors += 1
+            estimate.error_rate.add(1.0, now)
+            return
+        estimate.error_rate.add(0.0, now)
+        estimate.latency.add(latency, now)
+        estimate.ttft.add(latency if ttft is None else ttft, now)
+        if completion_tokens:
+            generating = latency - ttft if ttft is not None and latency > ttft else latency
+            if generating > 0:
+                estimate.tokens_per_second.add(completion_tokens / generating, now)
+        price = self.prices.get(model)
+        tokens = total_tokens or completion_tokens
+        if price is not None and tokens:
+            estimate.cost.add(tokens / 1000 * price, now)
+
+    def estimate(self, model: str, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """A model's current figures (None for figures never observed), or None if it was never seen."""
+        estimate = self._models.get(model)
+        if estimate is None:
+            return None
+        return estimate.snapshot(time.monotonic() if now is None else now)
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """Every model's figures."""
+        if now is None:
+            now = time.monotonic()
+        return {model: estimate.snapshot(now) for model, estimate in self._models.items()}
+
+    def load(self, snapshot: Dict[str, Any], now: Optional[float] = None) -> int:
+        """
+        Replace estimates with those of another ``snapshot()`` (e.g. the bridge's).
+
+        Each figure takes the snapshot's sample count (already decayed to
+        when it was taken) as its weight as of ``now``, so later local
+        samples blend in as they would have there. Returns the number
+        of models loaded; malformed entries are skipped.
+        """
+        if now is None:
+            now = time.monotonic()
+        loaded = 0
+        for model, data in (snapshot or {}).items():
+            if not isinstance(data, dict):
+                continue
+            try:
+                samples = float(data.get("samples") or 0)
+                values = {figure: data.get(figure) for figure in FIGURES}
+                values = {figure: None if value is None else float(value) for figure, value in values.items()}
+                calls, errors = int(data.get("calls") or 0), int(data.get("errors") or 0)
+            except (TypeError, ValueError):
+                continue
+            if samples <= 0:
+                continue
+            self._models.pop(model, None)
+            estimate = self._estimate(model)
+            if estimate is None:
+                continue
+            for figure, value in values.items():
+                if value is not None:
+                    average = getattr(estimate, figure)
+                    average.value, average.weight, average.updated = value, samples, now
+            estimate.calls, estimate.errors = calls, errors
+            loaded += 1
+        return loaded
+
+    def clear(self) -> None:
+        self._models.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "half_life": self.half_life,
+            "priced_models": len(self.prices),
+            "dropped": self.dropped,
+            "models": self.snapshot(),
+        }
@@ -0,0 +1,558 @@
+"""
+Provider registry: pluggable async backends for chat completions.
+
+Every upstream is a ``Provider`` with the same two coroutines:
+
+* ``complete(payload)`` - one buffered chat completion, returned as a dict
+  (or as the raw upstream bytes in passthrough mode, see ``codec.py``)
+* ``stream(payload)`` - an async iterator of SSE frames (``data: ...\\n\\n``)
+
+Each provider owns its settings - URL, API key, timeouts, connection-pool
+limits and model catalogue - so backends can be tuned independently.
+Requests go through the provider's pooled client (``upstream.py``) and the
+shared retry policy (``retry.py``).
+
+``ProviderRegistry.resolve`` maps a model id to its provider with a
+precomputed index: exact model ids first, then model-id prefixes (such as
+``copilot-``), then the default provider (Perplexity). Results are memoised,
+so a lookup is a single dict access on the hot path.
+
+Built-in providers are Perplexity and GitHub Copilot. Any OpenAI-compatible
+server (llama.cpp, vLLM, Ollama, ...) is added through configuration::
+
+    LOCAL_PROVIDERS=llamacpp
+    PROVIDER_LLAMACPP_URL=http://localhost:8080/v1/chat/completions
+    PROVIDER_LLAMACPP_MODELS=qwen2.5-coder-7b,llama-3.1-8b-instruct
+
+Per-provider tuning uses ``PROVIDER_<NAME>_TIMEOUT``, ``_STREAM_TIMEOUT``,
+``_MAX_CONNECTIONS`` and ``_MAX_KEEPALIVE``.
+"""
+
+import functools
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import httpx
+from fastapi import HTTPException, status
+
+from config import (
+    PERPLEXITY_KEY, BASE_URL, GITHUB_COPILOT_KEY, GITHUB_COPILOT_BASE_URL, LOCAL_PROVIDERS, provider_env
+)
+import codec
+from adapters.copilot_adapter import CopilotAdapter
+from metrics import UpstreamTimer
+from retry import upstream_retry
+from sse import DONE_DATA, format_sse, iter_sse_events
+from upstream import upstream_pool
+
+logger = logging.getLogger(__name__)
+
+# Memoised model lookups kept at most; the table is reset when it fills up
+MAX_RESOLVED = 4096
+
+PERPLEXITY_MODELS: List[Dict[str, str]] = [
+    # OpenAI GPT Models
+    {
+        "id": "gpt-5.2",
+        "name": "GPT-5.2 (ChatGPT)",
+        "description": "Advanced reasoning, coding, creativity. Best for generative tasks and complex problem-solving",
+        "category": "reasoning"
+    },
+    # Google Gemini Models
+    {
+        "id": "gemini-3-pro",
+        "name": "Gemini 3 Pro",
+        "description": "Multimodal AI with 1M token context. Ideal for large data sets and enterprise tasks",
+        "category": "reasoning"
+    },
+    {
+        "id": "gemini-3-flash",
+        "name": "Gemini 3 Flash",
+        "description": "Fast variant of Gemini 3 optimized for speed while maintaining strong performance",
+        "category": "reasoning"
+    },
+    # Anthropic Claude Models
+    {
+        "id": "claude-4.5-sonnet",
+        "name": "Claude 4.5 Sonnet",
+        "description": "Technical reasoning, coding, agentic workflows. Strong for structured problem solving",
+        "category": "reasoning"
+    },
+    {
+        "id": "claude-4.5-opus",
+        "name": "Claude 4.5 Opus",
+        "description": "Most advanced Claude model with superior reasoning for Pro/Max/Enterprise users",
+        "category": "reasoning"
+    },
+    # xAI Grok
+    {
+        "id": "grok-4.1",
+        "name": "Grok 4.1",
+        "description": "Conversational intelligence, code, image/text understanding with reasoning toggle",
+        "category": "reasoning"
+    },
+    # Moonshot Kimi
+    {
+        "id": "kimi-k2-thinking",
+        "name": "Kimi K2 Thinking",
+        "description": "Privacy-first model with step-by-step reasoning always enabled, ideal for technical analysis",
+        "category": "reasoning"
+    },
+    # Perplexity Sonar Models
+    {
+        "id": "sonar-pro",
+        "name": "Sonar Pro (Llama 3.1 70B)",
+        "description": "Real-time search, rapid summarization, transparent source citation. Best for factual research",
+        "category": "search"
+    },
+    {
+        "id": "sonar-70b",
+        "name": "Sonar 70B",
+        "description": "Perplexity's flagship model optimized for real-time search, retrieval, and web summarization",
+        "category": "search"
+    },
+    {
+        "id": "llama-3.1-sonar-small-128k-online",
+        "name": "Llama 3.1 Sonar Small (128k)",
+        "description": "Small Sonar model with 128k context window and online capabilities, fast and efficient",
+        "category": "search"
+    },
+    {
+        "id": "llama-3.1-sonar-large-128k-online",
+        "name": "Llama 3.1 Sonar Large (128k)",
+        "description": "Large Sonar model with 128k context window and online capabilities, balanced performance",
+        "category": "search"
+    },
+    {
+        "id": "llama-3.1-sonar-huge-128k-online",
+        "name": "Llama 3.1 Sonar Huge (128k)",
+        "description": "Huge Sonar model with 128k context window and online capabilities, maximum accuracy",
+        "category": "search"
+    },
+    # Additional Llama Models
+    {
+        "id": "llama-3.1-70b-instruct",
+        "name": "Llama 3.1 70B Instruct",
+        "description": "Meta's Llama 3.1 70B instruction-tuned model for general-purpose tasks",
+        "category": "general"
+    },
+    {
+        "id": "mistral-7b-instruct",
+        "name": "Mistral 7B Instruct",
+        "description": "Efficient 7B parameter instruction-tuned model for quick responses",
+        "category": "general"
+    },
+]
+
+COPILOT_MODELS: List[Dict[str, str]] = [
+    {
+        "id": "copilot-gpt-4",
+        "name": "Copilot GPT-4",
+        "description": "GitHub Copilot powered by GPT-4, optimized for code generation and completion",
+        "category": "coding"
+    },
+    {
+        "id": "copilot-agent",
+        "name": "Copilot Agent",
+        "description": "GitHub Copilot agent mode for autonomous coding tasks",
+        "category": "coding"
+    },
+]
+
+
+def parse_models(spec: str, provider: str) -> List[Dict[str, str]]:
+    """Turn ``"model-a,model-b"`` into catalogue entries for a configured backend."""
+    return [
+        {
+            "id": model,
+            "name": model,
+            "description": f"Served by the {provider} backend (OpenAI-compatible)",
+            "category": "local"
+        }
+        for model in (item.strip() for item in (spec or "").split(","))
+        if model
+    ]
+
+
+def _float_setting(provider: str, setting: str, default: float) -> float:
+    value = provider_env(provider, setting)
+    try:
+        return float(value) if value else default
+    except ValueError:
+        logger.warning(f"Ignoring invalid PROVIDER setting {setting} for {provider}: {value!r}")
+        return default
+
+
+def _int_setting(provider: str, setting: str) -> Optional[int]:
+    value = provider_env(provider, setting)
+    try:
+        return int(value) if value else None
+    except ValueError:
+        logger.warning(f"Ignoring invalid PROVIDER setting {setting} for {provider}: {value!r}")
+        return None
+
+
+class Provider:
+    """
+    An OpenAI-compatible chat-completions backend.
+
+    ``url`` is the full chat-completions endpoint. Subclasses override
+    ``complete`` and ``stream`` for upstreams that speak something else.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        label: Optional[str] = None,
+        api_key: Optional[str] = None,
+        key_required: bool = False,
+        unconfigured_detail: Optional[str] = None,
+        models: Sequence[Dict[str, str]] = (),
+        prefixes: Sequence[str] = (),
+        timeout: float = 60.0,
+        stream_timeout: float = 120.0,
+        max_connections: Optional[int] = None,
+        max_keepalive: Optional[int] = None
+    ):
+        self.name = name
+        self.url = url
+        self.label = label or name
+        self.api_key = api_key
+        self.key_required = key_required
+        self.unconfigured_detail = unconfigured_detail or f"{self.label} API is not configured on the server"
+        self.models = [
+            {
+                "id": model["id"],
+                "name": model.get("name", model["id"]),
+                "description": model.get("description", ""),
+                "provider": name,
+                "category": model.get("category", "general")
+            }
+            for model in models
+        ]
+        self.prefixes = tuple(prefixes)
+        self.timeout = timeout
+        self.stream_timeout = stream_timeout
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+
+    @classmethod
+    def from_env(cls, name: str, **kwargs: Any) -> "Provider":
+        """Build a provider, letting ``PROVIDER_<NAME>_*`` settings override the defaults."""
+        kwargs["timeout"] = _float_setting(name, "TIMEOUT", kwargs.get("timeout", 60.0))
+        kwargs["stream_timeout"] = _float_setting(name, "STREAM_TIMEOUT", kwargs.get("stream_timeout", 120.0))
+        kwargs.setdefault("max_connections", _int_setting(name, "MAX_CONNECTIONS"))
+        kwargs.setdefault("max_keepalive", _int_setting(name, "MAX_KEEPALIVE"))
+        return cls(name, **kwargs)
+
+    @property
+    def configured(self) -> bool:
+        """Whether requests can be sent (the API key is set, if one is required)."""
+        return not self.key_required or bool(self.api_key and self.api_key.strip())
+
+    def not_configured(self) -> HTTPException:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=self.unconfigured_detail)
+
+    def headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        if self.api_key and self.api_key.strip():
+            headers["Authorization"] = f"Bearer {self.api_key.strip()}"
+        return headers
+
+    async def complete(self, payload: Dict[str, Any]) -> Union[Dict[str, Any], bytes]:
+        """
+        Send one chat completion and return the validated JSON body.
+
+        With ``JSON_PASSTHROUGH`` a well-formed body is returned as raw bytes.
+        """
+        async with upstream_pool.client(self.name) as client:
+            with UpstreamTimer(self.name, str(payload.get("model"))) as call:
+                response = await upstream_retry.call(self.name, functools.partial(
+                    client.post,
+                    self.url,
+                    content=codec.dumps(payload),
+                    headers=self.headers(),
+                    timeout=self.timeout
+                ))
+                call.done(response.status_code)
+                call.usage(response.content)
+            response.raise_for_status()
+            body = response.content
+            if codec.passthrough and codec.looks_like_completion(body):
+                return body
+            return self.validate(codec.loads(body))
+
+    async def stream(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Yield one re-framed SSE event at a time from a streamed completion.
+
+        Raises:
+            httpx.HTTPStatusError: The upstream answered with an error status;
+                the error body has been read and is available as ``response.text``
+        """
+        async with upstream_pool.client(self.name) as client:
+            with UpstreamTimer(self.name, str(payload.get("model"))) as call:
+                async with upstream_retry.stream(
+                    client,
+                    self.name,
+                    "POST",
+                    self.url,
+                    content=codec.dumps(payload),
+                    headers=self.headers(),
+                    timeout=self.stream_timeout
+                ) as response:
+                    call.done(response.status_code)
+                    if response.status_code >= 400:
+                        await response.aread()
+                        response.raise_for_status()
+                    async for event in iter_sse_events(response.aiter_bytes()):
+                        if not event.is_done:
+                            call.token()
+                        yield format_sse(event.data)
+
+    def validate(self, response_data: Any) -> Dict[str, Any]:
+        """Check that a completion has the OpenAI shape, raising HTTP 502 if not."""
+        if not isinstance(response_data, dict):
+            raise ValueError("Response is not a valid JSON object")
+
+        if "error" in response_data:
+            error = response_data.get("error")
+            error_msg = error.get("message", "Unknown API error") if isinstance(error, dict) else str(error)
+            logger.error(f"{self.label} API returned error: {error_msg}")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"{self.label} API error: {error_msg}"
+            )
+
+        if "choices" not in response_data:
+            logger.error("Response missing 'choices' field")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail="Invalid response format: missing 'choices' field"
+            )
+
+        if not isinstance(response_data["choices"], list) or len(response_data["choices"]) == 0:
+            logger.error("Response has no choices")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail="Invalid response format: no choices returned"
+            )
+
+        choice = response_data["choices"][0]
+        if "message" not in choice:
+            logger.error("Choice missing 'message' field")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail="Invalid response format: choice missing 'message' field"
+            )
+
+        logger.info("Successfully validated and returning response")
+        return response_data
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "url": self.url,
+            "configured": self.configured,
+            "models": [model["id"] for model in self.models],
+            "prefixes": list(self.prefixes),
+            "timeout": self.timeout,
+            "stream_timeout": self.stream_timeout,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive
+        }
+
+
+class CopilotProvider(Provider):
+    """GitHub Copilot, spoken to through ``CopilotAdapter``; ``url`` is the API base URL."""
+
+    def _adapter(self, client: httpx.AsyncClient) -> CopilotAdapter:
+        return CopilotAdapter(
+            api_key=self.api_key, base_url=self.url, client=client, retry=upstream_retry,
+            timeout=self.timeout, stream_timeout=self.stream_timeout
+        )
+
+    async def complete(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        model = str(payload.get("model"))
+        try:
+            async with upstream_pool.client(self.name) as client:
+                with UpstreamTimer(self.name, model) as call:
+                    try:
+                        response_data = await self._adapter(client).chat_completion(
+                            messages=payload.get("messages") or [],
+                            model=model,
+                            stream=False,
+                            max_tokens=payload.get("max_tokens") or 1024,
+                            temperature=payload.get("temperature") or 0.0
+                        )
+                    except httpx.HTTPStatusError as e:
+                        call.done(e.response.status_code)
+                        raise
+                    call.done(200)
+                    call.usage(response_data)
+
+            logger.info("Successfully received response from GitHub Copilot")
+            return response_data
+
+        except Exception as e:
+            logger.error(f"GitHub Copilot API error: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"GitHub Copilot API error: {str(e)}"
+            )
+
+    async def stream(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        model = str(payload.get("model"))
+        async with upstream_pool.client(self.name) as client:
+            with UpstreamTimer(self.name, model) as call:
+                deltas = self._adapter(client).stream_chat_completion(
+                    messages=payload.get("messages") or [],
+                    model=model,
+                    max_tokens=payload.get("max_tokens") or 1024,
+                    temperature=payload.get("temperature") or 0.0,
+                    # Time the upstream when its headers arrive, as Provider.stream does
+                    on_response=lambda response: call.done(response.status_code)
+                )
+                try:
+                    async for chunk in deltas:
+                        call.token()
+                        yield format_sse(json.dumps(chunk))
+                    yield format_sse(DONE_DATA)
+                finally:
+                    await deltas.aclose()
+
+
+class ProviderRegistry:
+    """Providers by name, with a precomputed model -> provider index."""
+
+    def __init__(self, default: str = "perplexity"):
+        self.default = default
+        self._providers: Dict[str, Provider] = {}
+        self._index: Dict[str, Provider] = {}
+        self._prefixes: List[Tuple[str, Provider]] = []
+        self._resolved: Dict[str, Provider] = {}
+        # Bumped whenever the set of providers changes
+        self.version = 0
+
+    def register(self, provider: Provider) -> None:
+        """Add (or replace) a provider and rebuild the lookup index."""
+        self._providers[provider.name] = provider
+        self.version += 1
+        self._reindex()
+
+    def _reindex(self) -> None:
+        index: Dict[str, Provider] = {}
+        prefixes: List[Tuple[str, Provider]] = []
+        for provider in self._providers.values():
+            for model in provider.models:
+                index.setdefault(model["id"], provider)
+            prefixes.extend((prefix, provider) for prefix in provider.prefixes)
+        # Longest prefix wins
+        prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+        self._index = index
+        self._prefixes = prefixes
+        self._resolved = dict(index)
+
+    def get(self, name: str) -> Provider:
+        """The provider called ``name``; raises KeyError if there is none."""
+        return self._providers[name]
+
+    def __iter__(self) -> Iterator[Provider]:
+        return iter(list(self._providers.values()))
+
+    def resolve(self, model_id: str) -> Provider:
+        """The provider serving ``model_id``: exact id, then prefix, then the default provider."""
+        provider = self._resolved.get(model_id)
+        if provider is not None:
+            return provider
+        provider = next((p for prefix, p in self._prefixes if model_id.startswith(prefix)), None)
+        if provider is None:
+            provider = self._providers[self.default]
+        if len(self._resolved) >= MAX_RESOLVED + len(self._index):
+            self._resolved = dict(self._index)
+        self._resolved[model_id] = provider
+        return provider
+
+    def provider_name(self, model_id: str) -> str:
+        return self.resolve(model_id).name
+
+    def configured(self) -> List[Provider]:
+        """Providers that can take requests, in registration order."""
+        return [provider for provider in self._providers.values() if provider.configured]
+
+    def available(self) -> List[str]:
+        """Names of the providers that can take requests (failover targets)."""
+        return [provider.name for provider in self.configured()]
+
+    def fingerprint(self) -> Tuple[Any, ...]:
+        """Changes whenever the model catalogue could: providers registered, keys set or cleared."""
+        return (self.version,) + tuple(provider.configured for provider in self._providers.values())
+
+    def models(self) -> List[Dict[str, str]]:
+        """The model catalogue of every configured provider."""
+        return [model for provider in self.configured() for model in provider.models]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "default": self.default,
+            "indexed_models": len(self._index),
+            "providers": {name: provider.stats() for name, provider in self._providers.items()}
+        }
+
+
+def local_providers(names: Iterable[str]) -> List[Provider]:
+    """Build the OpenAI-compatible backends listed in ``LOCAL_PROVIDERS`` from their settings."""
+    built: List[Provider] = []
+    for name in names:
+        url = provider_env(name, "URL")
+        if not url:
+            logger.warning(f"Ignoring local provider {name!r}: PROVIDER_{name.upper()}_URL is not set")
+            continue
+        prefix = provider_env(name, "PREFIX")
+        built.append(Provider.from_env(
+            name,
+            url=url,
+            api_key=provider_env(name, "API_KEY") or None,
+            models=parse_models(provider_env(name, "MODELS"), name),
+            prefixes=(prefix,) if prefix else ()
+        ))
+    return built
+
+
+def _build_registry() -> ProviderRegistry:
+    registry = ProviderRegistry(default="perplexity")
+    registry.register(Provider.from_env(
+        "perplexity",
+        url=BASE_URL,
+        label="Perplexity",
+        api_key=PERPLEXITY_KEY,
+        key_required=True,
+        unconfigured_detail="PERPLEXITY_API_KEY is not configured on the server",
+        models=PERPLEXITY_MODELS
+    ))
+    registry.register(CopilotProvider.from_env(
+        "github-copilot",
+        url=GITHUB_COPILOT_BASE_URL,
+        label="GitHub Copilot",
+        api_key=GITHUB_COPILOT_KEY,
+        key_required=True,
+        unconfigured_detail="GitHub Copilot API is not configured. Please set GITHUB_COPILOT_API_KEY.",
+        models=COPILOT_MODELS,
+        prefixes=("copilot-",)
+    ))
+    names = [name.strip() for name in LOCAL_PROVIDERS.split(",") if name.strip()]
+    for provider in local_providers(names):
+        if provider.name in ("perplexity", "github-copilot"):
+            logger.warning(f"Ignoring local provider {provider.name!r}: the name is taken by a built-in provider")
+            continue
+        registry.register(provider)
+    for provider in registry:
+        if provider.max_connections is not None or provider.max_keepalive is not None:
+            upstream_pool.configure(provider.name, provider.max_connections, provider.max_keepalive)
+    return registry
+
+
+# Module-level registry shared by the application
+providers = _build_registry()
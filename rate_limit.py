@@ -1,6 +1,532 @@
+"""
+Token-bucket rate limiting with pluggable shared stores.
 
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+Limits are enforced with GCRA (the generic cell rate algorithm), which is
+exactly a token bucket whose state is one number per key: the theoretical
+arrival time (TAT) of the next request. A bucket that has fully refilled is
+indistinguishable from one that was never used, so stores can drop expired
+keys freely.
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
+Stores (``RATE_LIMIT_STORE``):
+
+* ``memory``            - per-process dict; every worker enforces its own limit.
+* ``file[:/path]``      - fixed-size hash table in a memory-mapped file guarded
+  by ``flock``; shared by all workers on one host (POSIX only).
+* ``redis://host:port/db`` - any server speaking the Redis protocol (Redis,
+  Valkey, KeyDB or a local stand-in). The bucket update runs as one Lua
+  script using the server clock, so limits hold across hosts.
+
+Rules (all that apply must pass, checked in this order):
+
+* per route and client address: ``RATE_LIMIT`` / ``RATE_LIMIT_ROUTES``
+* per API key: ``RATE_LIMIT_PER_KEY``
+* per model and client address: ``RATE_LIMIT_MODELS``
+
+Rates are written ``"10/minute"``; add ``";burst=20"`` to allow a larger
+burst than the per-period count. Decision latency is recorded in metrics.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+
+from config import (
+    RATE_LIMIT, RATE_LIMIT_ENABLED, RATE_LIMIT_ROUTES, RATE_LIMIT_PER_KEY, RATE_LIMIT_MODELS,
+    RATE_LIMIT_STORE, RATE_LIMIT_FAIL_OPEN
+)
+from metrics import rate_limit_decision, rate_limit_decisions_total, rate_limit_store_errors_total
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_RATE_PATTERN = re.compile(
+    r"^\s*(\d+)\s*(?:/|per)\s*(second|minute|hour|day|sec|min|s|m|h|d)s?\s*(?:;\s*burst\s*=\s*(\d+))?\s*$",
+    re.IGNORECASE
+)
+_PERIOD_ALIASES = {"sec": "second", "s": "second", "min": "minute", "m": "minute", "h": "hour", "d": "day"}
+
+
+class Rate(NamedTuple):
+    """``count`` requests per ``period`` seconds, with bursts of up to ``burst``."""
+
+    count: int
+    period: float
+    burst: int
+    spec: str
+
+    @property
+    def interval(self) -> float:
+        """Seconds for one token to refill."""
+        return self.period / self.count
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float
+
+
+def parse_rate(spec: str) -> Rate:
+    """Parse ``"10/minute"``, ``"5 per second"`` or ``"10/minute;burst=20"``."""
+    match = _RATE_PATTERN.match(spec or "")
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid rate limit: {spec!r} (expected e.g. '10/minute')")
+    count = int(match.group(1))
+    period = match.group(2).lower()
+    period = _PERIOD_ALIASES.get(period, period)
+    burst = int(match.group(3)) if match.group(3) else count
+    return Rate(count, float(PERIODS[period]), max(1, burst), spec.strip())
+
+
+def parse_rate_map(spec: str) -> Dict[str, Rate]:
+    """Parse ``"name=10/minute,other=5/second"`` into a mapping of rates."""
+    rates: Dict[str, Rate] = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, sep, rate = item.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"Invalid rate limit entry: {item!r} (expected name=10/minute)")
+        rates[name.strip()] = parse_rate(rate)
+    return rates
+
+
+def gcra(tat: Optional[float], now: float, rate: Rate, cost: int = 1) -> Tuple[Optional[float], Decision]:
+    """
+    Apply one token-bucket decision.
+
+    Returns the new TAT to store (``None`` when the request is rejected and
+    the state must not change) and the decision.
+    """
+    interval = rate.interval
+    new_tat = max(tat or now, now) + interval * cost
+    allow_at = new_tat - interval * rate.burst
+    if now < allow_at:
+        return None, Decision(False, 0, allow_at - now)
+    remaining = int((interval * rate.burst - (new_tat - now)) / interval + 1e-9)
+    return new_tat, Decision(True, remaining, 0.0)
+
+
+class RateLimitStore:
+    """Interface of a bucket store."""
+
+    name = "base"
+
+    async def acquire(self, key: str, rate: Rate, cost: int = 1) -> Decision:
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStore(RateLimitStore):
+    """Buckets in a per-process dict."""
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._tats: Dict[str, float] = {}
+
+    async def acquire(self, key: str, rate: Rate, cost: int = 1) -> Decision:
+        now = time.monotonic()
+        new_tat, decision = gcra(self._tats.get(key), now, rate, cost)
+        if new_tat is not None:
+            if key not in self._tats and len(self._tats) >= self.max_keys:
+                self._prune(now)
+            self._tats[key] = new_tat
+        return decision
+
+    def _prune(self, now: float) -> None:
+        # Buckets whose TAT has passed are full again and carry no state
+        self._tats = {k: tat for k, tat in self._tats.items() if tat > now}
+        while len(self._tats) >= self.max_keys:
+            self._tats.pop(next(iter(self._tats)))
+
+    async def clear(self) -> None:
+        self._tats.clear()
+
+
+class FileStore(RateLimitStore):
+    """
+    Buckets in a memory-mapped file shared by every worker on the host.
+
+    The file is an open-addressing hash table of ``slots`` 16-byte entries
+    (64-bit key hash, TAT as wall-clock seconds). Each decision holds an
+    exclusive ``flock`` for a handful of memory reads and writes. When all
+    probed slots are live the one with the earliest TAT is reused, which can
+    only ever make that key's limit more lenient.
+    """
+
+    name = "file"
+    ENTRY = struct.Struct("<Qd")
+    PROBES = 16
+
+    def __init__(self, path: Optional[str] = None, slots: int = 65536):
+        if fcntl is None:
+            raise RuntimeError("The file rate-limit store needs fcntl (POSIX); use memory or redis instead")
+        self.path = path or os.path.join(tempfile.gettempdir(), "perplexity-bridge-ratelimit.bin")
+        self.slots = slots
+        size = slots * self.ENTRY.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _hash(self, key: str) -> int:
+        # 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+    async def acquire(self, key: str, rate: Rate, cost: int = 1) -> Decision:
+        key_hash = self._hash(key)
+        entry = self.ENTRY
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            now = time.time()
+            slot = None
+            free = None
+            oldest = None
+            oldest_tat = math.inf
+            start = key_hash % self.slots
+            for probe in range(self.PROBES):
+                offset = ((start + probe) % self.slots) * entry.size
+                stored_hash, tat = entry.unpack_from(self._map, offset)
+                if stored_hash == key_hash:
+                    slot = offset
+                    break
+                if free is None and (stored_hash == 0 or tat <= now):
+                    free = offset
+                if tat < oldest_tat:
+                    oldest, oldest_tat = offset, tat
+            current = None
+            if slot is not None:
+                current = entry.unpack_from(self._map, slot)[1]
+            else:
+                slot = free if free is not None else oldest
+            new_tat, decision = gcra(current, now, rate, cost)
+            if new_tat is not None:
+                entry.pack_into(self._map, slot, key_hash, new_tat)
+            return decision
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    async def clear(self) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            self._map[:] = bytes(len(self._map))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    async def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+
+class RedisError(Exception):
+    """Error reply or protocol failure from a Redis-protocol server."""
+
+
+class _RedisConnection:
+    """Minimal RESP2 client connection."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def call(self, *args: Any) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.writer.write(b"".join(parts))
+        await self.writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by Redis server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode(errors="replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from Redis server: {line!r}")
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RedisStore(RateLimitStore):
+    """Buckets in a Redis-protocol server, updated atomically by a Lua script."""
+
+    name = "redis"
+    # KEYS[1] = bucket; ARGV = interval (us), burst (us), cost. Returns {allowed, remaining, retry_after_us}
+    SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + interval * tonumber(ARGV[3])
+local allow_at = new_tat - burst
+if now < allow_at then
+  return {0, 0, allow_at - now}
+end
+redis.call('SET', KEYS[1], string.format('%d', new_tat), 'PX', math.ceil((new_tat - now) / 1000))
+return {1, math.floor((burst - (new_tat - now)) / interval), 0}
+"""
+
+    def __init__(self, url: str, prefix: str = "bridge:ratelimit:", max_connections: int = 8, timeout: float = 1.0):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported rate-limit store URL: {url!r} (expected redis://host:port/db)")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self.sha = hashlib.sha1(self.SCRIPT.encode()).hexdigest()
+        self._idle: List[_RedisConnection] = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def _connect(self) -> _RedisConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = _RedisConnection(reader, writer)
+        try:
+            if self.password is not None:
+                if self.username:
+                    await connection.call("AUTH", self.username, self.password)
+                else:
+                    await connection.call("AUTH", self.password)
+            if self.db:
+                await connection.call("SELECT", self.db)
+        except BaseException:
+            # Rejected (or timed out) before it was usable
+            connection.close()
+            raise
+        return connection
+
+    async def _execute(self, *args: Any) -> Any:
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else None
+            try:
+                if connection is None:
+                    connection = await asyncio.wait_for(self._connect(), self.timeout)
+                reply = await asyncio.wait_for(connection.call(*args), self.timeout)
+            except RedisError:
+                # An error reply leaves the connection in sync; one that failed to connect was closed
+                if connection is not None:
+                    self._idle.append(connection)
+                raise
+            except BaseException:
+                # The connection may hold a half-read reply; never reuse it
+                if connection is not None:
+                    connection.close()
+                raise
+            self._idle.append(connection)
+            return reply
+
+    async def acquire(self, key: str, rate: Rate, cost: int = 1) -> Decision:
+        interval = int(rate.interval * 1_000_000)
+        args = (1, self.prefix + key, interval, interval * rate.burst, cost)
+        try:
+            reply = await self._execute("EVALSHA", self.sha, *args)
+        except RedisError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            reply = await self._execute("EVAL", self.SCRIPT, *args)
+        allowed, remaining, retry_after_us = (int(v) for v in reply)
+        return Decision(bool(allowed), remaining, retry_after_us / 1_000_000)
+
+    async def clear(self) -> None:
+        cursor = b"0"
+        while True:
+            cursor, keys = await self._execute("SCAN", cursor, "MATCH", self.prefix + "*", "COUNT", 1000)
+            if keys:
+                await self._execute("DEL", *keys)
+            if cursor in (b"0", "0"):
+                return
+
+    async def close(self) -> None:
+        while self._idle:
+            self._idle.pop().close()
+
+
+def create_store(spec: str) -> RateLimitStore:
+    """Build a store from ``RATE_LIMIT_STORE`` (``memory``, ``file[:/path]`` or ``redis://...``)."""
+    spec = (spec or "memory").strip()
+    if spec == "memory":
+        return MemoryStore()
+    if spec == "file" or spec.startswith("file:"):
+        return FileStore(spec[5:] or None)
+    if spec.startswith("redis://"):
+        return RedisStore(spec)
+    raise ValueError(f"Unknown rate-limit store: {spec!r} (expected memory, file[:/path] or redis://...)")
+
+
+class RateLimitExceeded(HTTPException):
+    """429 raised when a request exceeds one of its limits."""
+
+    def __init__(self, scope: str, rate: Rate, retry_after: float):
+        self.scope = scope
+        self.rate = rate
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=429,
+            detail=f"Rate limit exceeded: {rate.spec} ({scope})",
+            headers={
+                "Retry-After": str(max(1, math.ceil(retry_after))),
+                "X-RateLimit-Limit": rate.spec,
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Scope": scope
+            }
+        )
+
+
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> JSONResponse:
+    """Render a rate-limit rejection as ``{"error": ...}`` with Retry-After."""
+    return JSONResponse({"error": exc.detail}, status_code=429, headers=exc.headers)
+
+
+def client_address(request: Request) -> str:
+    return request.client.host if request.client else "127.0.0.1"
+
+
+class RateLimiter:
+    """Checks a request against its route, API-key and model limits."""
+
+    def __init__(
+        self,
+        store: RateLimitStore,
+        default: Optional[Rate],
+        routes: Optional[Dict[str, Rate]] = None,
+        per_key: Optional[Rate] = None,
+        models: Optional[Dict[str, Rate]] = None,
+        enabled: bool = True,
+        fail_open: bool = True
+    ):
+        self.store = store
+        self.default = default
+        self.routes = routes or {}
+        self.per_key = per_key
+        self.models = models or {}
+        self.enabled = enabled
+        self.fail_open = fail_open
+        self.allowed = 0
+        self.rejected = 0
+        self.store_errors = 0
+
+    def _limits(self, request: Request, route: str, model: Optional[str]) -> List[Tuple[str, str, Rate]]:
+        client = client_address(request)
+        limits = []
+        rate = self.routes.get(route, self.default)
+        if rate is not None:
+            limits.append(("route", f"route:{route}:{client}", rate))
+        api_key = request.headers.get("X-API-KEY")
+        if self.per_key is not None and api_key:
+            digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+            limits.append(("key", f"key:{digest}", self.per_key))
+        if model is not None:
+            rate = self.models.get(model, self.models.get("*"))
+            if rate is not None:
+                limits.append(("model", f"model:{model}:{client}", rate))
+        return limits
+
+    async def check(self, request: Request, route: Optional[str] = None, model: Optional[str] = None) -> None:
+        """
+        Consume one token from every limit that applies, raising ``RateLimitExceeded`` on the first that is empty.
+
+        Limits checked before the one that rejects keep their consumed token.
+        """
+        if not self.enabled:
+            return
+        route = route or request.url.path
+        for scope, key, rate in self._limits(request, route, model):
+            started = time.perf_counter()
+            try:
+                decision = await self.store.acquire(key, rate)
+            except Exception as e:
+                self.store_errors += 1
+                rate_limit_store_errors_total.labels(self.store.name).inc()
+                if self.fail_open:
+                    logger.warning(f"Rate-limit store error, allowing request: {str(e)}")
+                    continue
+                logger.error(f"Rate-limit store error, rejecting request: {str(e)}")
+                raise HTTPException(status_code=503, detail="Rate limiter unavailable")
+            finally:
+                rate_limit_decision.labels(self.store.name).observe(time.perf_counter() - started)
+            rate_limit_decisions_total.labels(scope, "allowed" if decision.allowed else "rejected").inc()
+            if not decision.allowed:
+                self.rejected += 1
+                raise RateLimitExceeded(scope, rate, decision.retry_after)
+        self.allowed += 1
+
+    async def close(self) -> None:
+        await self.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "store": self.store.name,
+            "fail_open": self.fail_open,
+            "default": self.default.spec if self.default else None,
+            "routes": {route: rate.spec for route, rate in self.routes.items()},
+            "per_key": self.per_key.spec if self.per_key else None,
+            "models": {model: rate.spec for model, rate in self.models.items()},
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "store_errors": self.store_errors
+        }
+
+
+# Module-level limiter shared by the application
+limiter = RateLimiter(
+    store=create_store(RATE_LIMIT_STORE),
+    default=parse_rate(RATE_LIMIT) if RATE_LIMIT.strip() else None,
+    routes=parse_rate_map(RATE_LIMIT_ROUTES),
+    per_key=parse_rate(RATE_LIMIT_PER_KEY) if RATE_LIMIT_PER_KEY.strip() else None,
+    models=parse_rate_map(RATE_LIMIT_MODELS),
+    enabled=RATE_LIMIT_ENABLED,
+    fail_open=RATE_LIMIT_FAIL_OPEN
+)
@@ -0,0 +1,316 @@
+"""
+Retries and hedging for upstream HTTP calls.
+
+``RetryPolicy`` sits between the chat handlers and the pooled
+``httpx.AsyncClient``:
+
+* **Retries** - a 429/502/503/504 answer or a connection-level failure is
+  retried up to ``UPSTREAM_RETRY_ATTEMPTS`` attempts in total, sleeping
+  with decorrelated jitter (``min(cap, uniform(base, 3 * previous))``) or
+  for the upstream's ``Retry-After`` when it sends one. A ``Retry-After``
+  longer than ``UPSTREAM_RETRY_MAX_RETRY_AFTER`` is not waited out; the
+  answer goes straight back to the client.
+* **Retry budget** - each request deposits ``UPSTREAM_RETRY_BUDGET`` (e.g.
+  0.2) of a token and each retry or hedge spends a whole one, so during an
+  outage extra load is capped at that fraction of normal traffic instead
+  of multiplying it.
+* **Hedging** (``UPSTREAM_HEDGE``) - if an attempt has not produced
+  response headers within the provider's recent p95 latency, a second
+  attempt is started and whichever answers first wins; the other is
+  cancelled. For streams this only covers the phase before the first byte:
+  once a response is handed to the caller it is never retried.
+
+Every attempt's outcome is reported to the provider's circuit breaker
+(``breaker.py``), and no retries are made once it has opened.
+
+Chat completions are safe to repeat: a retried or hedged call can at worst
+produce a second completion that nobody reads.
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Set
+
+import httpx
+
+from config import (
+    UPSTREAM_RETRY_ATTEMPTS, UPSTREAM_RETRY_BASE_DELAY, UPSTREAM_RETRY_MAX_DELAY,
+    UPSTREAM_RETRY_MAX_RETRY_AFTER, UPSTREAM_RETRY_BUDGET, UPSTREAM_HEDGE, UPSTREAM_HEDGE_MIN_DELAY
+)
+from breaker import CircuitBreakers, circuit_breakers
+from metrics import upstream_retries_total, upstream_hedges_total
+
+logger = logging.getLogger(__name__)
+
+# One upstream request; called again for each retry or hedge
+Attempt = Callable[[], Awaitable[httpx.Response]]
+
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# Failures where the upstream never started processing the request
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Seconds to wait from a ``Retry-After`` header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of requests.
+
+    Every request deposits ``ratio`` tokens, and ``min_per_second`` tokens
+    trickle in regardless so a quiet bridge can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, capacity: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.balance = capacity
+        self.updated = time.monotonic()
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        now = time.monotonic()
+        self.balance = min(self.capacity, self.balance + (now - self.updated) * self.min_per_second)
+        self.updated = now
+        if self.balance < 1.0:
+            self.exhausted += 1
+            return False
+        self.balance -= 1.0
+        return True
+
+
+class LatencyWindow:
+    """Recent time-to-headers samples of one provider, with a cached p95."""
+
+    __slots__ = ("samples", "min_samples", "_p95", "_stale")
+
+    def __init__(self, size: int = 256, min_samples: int = 20):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+        self._p95: Optional[float] = None
+        self._stale = 0
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self._stale += 1
+
+    def p95(self) -> Optional[float]:
+        """The 95th percentile, or None until ``min_samples`` samples were seen."""
+        if len(self.samples) < self.min_samples:
+            return None
+        # Sorting 256 floats is cheap, but only redo it every few samples
+        if self._p95 is None or self._stale >= 16:
+            ordered = sorted(self.samples)
+            self._p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            self._stale = 0
+        return self._p95
+
+
+class RetryPolicy:
+    """Send upstream requests with retries, a retry budget and optional hedging."""
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base_delay: float = 0.1,
+        max_delay: float = 2.0,
+        max_retry_after: float = 10.0,
+        budget: Optional[RetryBudget] = None,
+        hedge: bool = False,
+        hedge_min_delay: float = 0.05,
+        breakers: Optional[CircuitBreakers] = None
+    ):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget or RetryBudget()
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breakers = circuit_breakers if breakers is None else breakers
+        self._latency: Dict[str, LatencyWindow] = {}
+        self.retries: Dict[str, int] = {}
+        self.hedges = {"fired": 0, "won": 0}
+
+    def _window(self, provider: str) -> LatencyWindow:
+        window = self._latency.get(provider)
+        if window is None:
+            window = self._latency[provider] = LatencyWindow()
+        return window
+
+    def backoff(self, previous: float) -> float:
+        """Decorrelated jitter: the next sleep after sleeping ``previous`` seconds."""
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous * 3)))
+
+    def hedge_delay(self, provider: str) -> Optional[float]:
+        """Seconds after which a hedge fires, or None when hedging is off or latency is unknown."""
+        if not self.hedge:
+            return None
+        p95 = self._window(provider).p95()
+        return None if p95 is None else max(self.hedge_min_delay, p95)
+
+    async def _attempt(self, provider: str, send: Attempt) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await send()
+        except Exception:
+            self.breakers.record(provider, False, time.perf_counter() - started)
+            raise
+        elapsed = time.perf_counter() - started
+        self._window(provider).add(elapsed)
+        self.breakers.record(provider, response.status_code < 500 and response.status_code != 429, elapsed)
+        return response
+
+    async def _hedged(self, provider: str, send: Attempt) -> httpx.Response:
+        """One logical attempt, backed by a second one if the first is slower than p95."""
+        delay = self.hedge_delay(provider)
+        if delay is None:
+            return await self._attempt(provider, send)
+        primary = asyncio.ensure_future(self._attempt(provider, send))
+        pending: Set["asyncio.Future[httpx.Response]"] = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done and self.budget.withdraw():
+                self.hedges["fired"] += 1
+                upstream_hedges_total.labels(provider, "fired").inc()
+                pending.add(asyncio.ensure_future(self._attempt(provider, send)))
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if _succeeded(task)), None)
+                if winner is None and pending:
+                    # Let the other attempt answer instead
+                    for task in done:
+                        _close_response(task)
+                    continue
+                if winner is None:
+                    winner = primary if primary in done else next(iter(done))
+                for task in done:
+                    if task is not winner:
+                        _close_response(task)
+                if winner is not primary and _succeeded(winner):
+                    self.hedges["won"] += 1
+                    upstream_hedges_total.labels(provider, "won").inc()
+                return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_close_response)
+
+    async def call(self, provider: str, send: Attempt) -> httpx.Response:
+        """
+        Run ``send`` (one upstream request, e.g. ``partial(client.post, url, ...)``),
+        calling it again for transient failures.
+
+        Returns the last response, which may still be an error status for the
+        caller to handle.
+        """
+        self.budget.deposit()
+        attempt = 1
+        sleep = self.base_delay
+        while True:
+            last = attempt >= self.attempts
+            wait: Optional[float] = None
+            try:
+                response = await self._hedged(provider, send)
+            except RETRY_EXCEPTIONS as e:
+                if last or not self._may_retry(provider, type(e).__name__):
+                    raise
+                logger.warning(f"Retrying {provider} request after {type(e).__name__}: {str(e)}")
+            else:
+                if response.status_code not in RETRY_STATUSES or last:
+                    return response
+                wait = parse_retry_after(response.headers.get("Retry-After"))
+                if wait is not None and wait > self.max_retry_after:
+                    return response
+                if not self._may_retry(provider, str(response.status_code)):
+                    return response
+                logger.warning(f"Retrying {provider} request after HTTP {response.status_code}")
+                await response.aclose()
+            sleep = wait if wait is not None else self.backoff(sleep)
+            await asyncio.sleep(sleep)
+            attempt += 1
+
+    def _may_retry(self, provider: str, reason: str) -> bool:
+        if self.breakers.is_open(provider):
+            # The failures just tripped the breaker; fail fast instead
+            return False
+        if not self.budget.withdraw():
+            upstream_retries_total.labels(provider, "budget_exhausted").inc()
+            return False
+        self.retries[reason] = self.retries.get(reason, 0) + 1
+        upstream_retries_total.labels(provider, reason).inc()
+        return True
+
+    @asynccontextmanager
+    async def stream(self, client: httpx.AsyncClient, provider: str, method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+        """Like ``client.stream``: retries happen only until response headers arrive."""
+
+        def send() -> Awaitable[httpx.Response]:
+            return client.send(client.build_request(method, url, **kwargs), stream=True)
+
+        response = await self.call(provider, send)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "hedge": self.hedge,
+            "retries": dict(self.retries),
+            "hedges": dict(self.hedges),
+            "budget": {
+                "balance": round(self.budget.balance, 2),
+                "ratio": self.budget.ratio,
+                "exhausted": self.budget.exhausted
+            },
+            "p95_seconds": {provider: window.p95() for provider, window in self._latency.items()}
+        }
+
+
+def _succeeded(task: "asyncio.Future[httpx.Response]") -> bool:
+    return task.exception() is None and task.result().status_code not in RETRY_STATUSES
+
+
+def _close_response(task: "asyncio.Future[httpx.Response]") -> None:
+    """Close the response of an attempt that lost the hedge race."""
+    if task.cancelled() or task.exception() is not None:
+        return
+    asyncio.ensure_future(task.result().aclose())
+
+
+# Module-level policy shared by the application
+upstream_retry = RetryPolicy(
+    attempts=UPSTREAM_RETRY_ATTEMPTS,
+    base_delay=UPSTREAM_RETRY_BASE_DELAY,
+    max_delay=UPSTREAM_RETRY_MAX_DELAY,
+    max_retry_after=UPSTREAM_RETRY_MAX_RETRY_AFTER,
+    budget=RetryBudget(ratio=UPSTREAM_RETRY_BUDGET),
+    hedge=UPSTREAM_HEDGE,
+    hedge_min_delay=UPSTREAM_HEDGE_MIN_DELAY
+)
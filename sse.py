@@ -0,0 +1,132 @@
+"""
+Incremental Server-Sent Events parsing and re-framing.
+
+Upstream providers stream ``text/event-stream`` bodies whose network chunk
+boundaries do not line up with SSE events. ``SSEParser`` consumes raw bytes
+and emits whole events, so the bridge can forward exactly one event per
+WebSocket frame or HTTP chunk and clients never have to re-buffer.
+
+The parser keeps a single bounded ``bytearray`` buffer and only trims it
+once per ``feed`` call, so it does no quadratic string concatenation. It
+also remembers how much of the unterminated tail it has already searched
+for a newline, so a long line arriving in small pieces is scanned once.
+``iter_sse_events`` is also the natural hook for per-event metrics.
+"""
+
+from typing import AsyncIterator, List, NamedTuple, Optional
+
+# Upper bound on a single event (and on an unterminated line) in bytes
+DEFAULT_MAX_EVENT_BYTES = 1024 * 1024
+
+DONE_DATA = "[DONE]"
+
+
+class SSEBufferOverflow(ValueError):
+    """Raised when an upstream event exceeds the configured size limit."""
+
+
+class SSEEvent(NamedTuple):
+    """A single dispatched SSE event."""
+    data: str
+    event: Optional[str] = None
+    id: Optional[str] = None
+
+    @property
+    def is_done(self) -> bool:
+        return self.data == DONE_DATA
+
+
+class SSEParser:
+    """Turn arbitrarily split byte chunks into complete ``SSEEvent`` objects."""
+
+    def __init__(self, max_event_bytes: int = DEFAULT_MAX_EVENT_BYTES):
+        self.max_event_bytes = max_event_bytes
+        self._buffer = bytearray()
+        # Bytes at the start of the buffer already known to hold no newline
+        self._scanned = 0
+        self._data: List[bytes] = []
+        self._data_bytes = 0
+        self._event: Optional[str] = None
+        self._id: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """Consume a chunk and return every event it completed."""
+        self._buffer += chunk
+        events: List[SSEEvent] = []
+        buffer = self._buffer
+        start = 0
+        search = self._scanned
+        while True:
+            newline = buffer.find(b"\n", search)
+            if newline < 0:
+                break
+            end = newline - 1 if newline > start and buffer[newline - 1] == 0x0D else newline
+            line = bytes(buffer[start:end])
+            start = search = newline + 1
+            if line:
+                self._process_line(line)
+            elif self._data:
+                events.append(self._dispatch())
+        if start:
+            del buffer[:start]
+        self._scanned = len(buffer)
+        if len(buffer) > self.max_event_bytes:
+            raise SSEBufferOverflow(f"SSE line exceeds {self.max_event_bytes} bytes")
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """Return any event left pending when the stream ended without a blank line."""
+        if self._buffer:
+            line = bytes(self._buffer).rstrip(b"\r")
+            self._buffer.clear()
+            self._scanned = 0
+            if line:
+                self._process_line(line)
+        return [self._dispatch()] if self._data else []
+
+    def _process_line(self, line: bytes) -> None:
+        if line.startswith(b":"):
+            return  # comment / keep-alive
+        field, _, value = line.partition(b":")
+        if value.startswith(b" "):
+            value = value[1:]
+        if field == b"data":
+            self._data_bytes += len(value)
+            if self._data_bytes > self.max_event_bytes:
+                raise SSEBufferOverflow(f"SSE event exceeds {self.max_event_bytes} bytes")
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif field == b"id":
+            self._id = value.decode("utf-8", errors="replace")
+
+    def _dispatch(self) -> SSEEvent:
+        event = SSEEvent(
+            data=b"\n".join(self._data).decode("utf-8", errors="replace"),
+            event=self._event,
+            id=self._id
+        )
+        self._data = []
+        self._data_bytes = 0
+        self._event = None
+        return event
+
+
+async def iter_sse_events(
+    chunks: AsyncIterator[bytes],
+    max_event_bytes: int = DEFAULT_MAX_EVENT_BYTES
+) -> AsyncIterator[SSEEvent]:
+    """Yield whole SSE events from an async iterator of raw byte chunks."""
+    parser = SSEParser(max_event_bytes=max_event_bytes)
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.flush():
+        yield event
+
+
+def format_sse(data: str, event: Optional[str] = None) -> str:
+    """Serialize a single SSE event, terminated by a blank line."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
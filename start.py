@@ -2,18 +2,51 @@
 """
 Startup script for Perplexity Bridge.
 Handles graceful startup, browser opening, and error handling.
+
+``python start.py --production`` (or ``BRIDGE_PRODUCTION=true``) serves the
+bridge from several worker processes instead of one:
+
+* ``--workers`` / ``BRIDGE_WORKERS``: a number, or ``auto`` (the default) for
+  one per CPU
+* every worker binds its own ``SO_REUSEPORT`` socket so the kernel spreads
+  connections evenly (``BRIDGE_REUSE_PORT=false``, or a platform without it,
+  shares one listening socket instead)
+* uvloop and httptools are used when installed (``pip install uvloop httptools``)
+* on SIGTERM/SIGINT workers stop accepting connections and let in-flight
+  requests and streams finish for up to ``BRIDGE_GRACEFUL_TIMEOUT`` seconds
+* ``BRIDGE_MAX_REQUESTS`` recycles a worker after that many requests (plus a
+  random ``BRIDGE_MAX_REQUESTS_JITTER`` so they do not restart together);
+  the supervisor starts a replacement
+
+State that lives in each process is made safe to share: rate-limit and
+API-key quota buckets default to the host-wide ``file`` store (``memory``,
+i.e. per worker, where fcntl is missing, as on Windows), admission
+caps are divided between the workers, and ``/metrics`` aggregates every
+worker's metrics through ``METRICS_MULTIPROC_DIR``. The response cache,
+coalescing and circuit breakers stay per worker.
 """
 
+import argparse
 import sys
 import os
 import time
+import functools
+import glob
 import logging
+import random
+import tempfile
 import webbrowser
 import threading
 import subprocess
 import socket
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Add current directory to path
 sys.path.insert(0, str(Path(__file__).parent))
@@ -36,7 +69,6 @@ def check_dependencies() -> bool:
         import uvicorn
         import httpx
         import pydantic
-        import slowapi
         logger.info("✓ All dependencies found")
         return True
     except ImportError as e:
@@ -135,12 +167,158 @@ def start_server() -> None:
         sys.exit(1)
 
 
+def parse_workers(value: Optional[str]) -> int:
+    """Worker count from ``--workers``/``BRIDGE_WORKERS``: a number, or ``auto`` for one per CPU."""
+    value = (value or "auto").strip().lower()
+    if value == "auto":
+        return os.cpu_count() or 1
+    workers = int(value)
+    if workers < 1:
+        raise ValueError(f"Invalid worker count: {value!r}")
+    return workers
+
+
+def event_loop_and_parser() -> Tuple[str, str]:
+    """uvloop and httptools when they are installed, else asyncio and h11."""
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+    return loop, http
+
+
+def bind_reuse_port(host: str, port: int) -> socket.socket:
+    """A listening socket with ``SO_REUSEPORT``, so several processes can bind the same port."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def prepare_worker_environment(workers: int) -> None:
+    """Point process-local state at shared storage; the workers inherit the environment."""
+    os.environ["BRIDGE_WORKER_COUNT"] = str(workers)
+
+    store = os.getenv("RATE_LIMIT_STORE", "").strip()
+    if not store and fcntl is None:
+        # The file store locks with fcntl, which Windows does not have
+        os.environ["RATE_LIMIT_STORE"] = "memory"
+        logger.warning("No fcntl: every worker enforces its own rate limits and quotas (set RATE_LIMIT_STORE=redis://... to share them)")
+    elif not store:
+        os.environ["RATE_LIMIT_STORE"] = "file"
+        logger.info("Rate limits and API key quotas: shared file store (set RATE_LIMIT_STORE to change)")
+    elif store == "memory":
+        logger.warning("RATE_LIMIT_STORE=memory: every worker enforces its own rate limits and quotas")
+
+    directory = os.getenv("METRICS_MULTIPROC_DIR", "").strip()
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        # Snapshots of a previous run would be counted as exited workers
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            os.remove(path)
+    else:
+        os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="perplexity-bridge-metrics-")
+
+
+def _run_worker(config, reuse_port: bool, max_requests_jitter: int, sockets: Optional[List[socket.socket]] = None) -> None:
+    """Entry point of one worker process (started by uvicorn's supervisor)."""
+    import uvicorn
+
+    if config.limit_max_requests and max_requests_jitter:
+        # Spread recycling so the workers do not all restart at once
+        config.limit_max_requests += random.randint(0, max_requests_jitter)
+    if reuse_port:
+        sockets = [bind_reuse_port(config.host, config.port)]
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+def start_production_server(workers: int) -> None:
+    """Serve the bridge from ``workers`` processes under uvicorn's supervisor."""
+    try:
+        import uvicorn
+        from uvicorn.supervisors import Multiprocess
+
+        host = os.getenv("BRIDGE_HOST", "127.0.0.1")
+        port = int(os.getenv("BRIDGE_PORT", "7860"))
+        max_requests = int(os.getenv("BRIDGE_MAX_REQUESTS", "0"))
+        jitter = int(os.getenv("BRIDGE_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+        graceful_timeout = int(os.getenv("BRIDGE_GRACEFUL_TIMEOUT", "30"))
+        reuse_port = (
+            hasattr(socket, "SO_REUSEPORT") and os.name != "nt"
+            and os.getenv("BRIDGE_REUSE_PORT", "true").strip().lower() in ("1", "true", "yes", "on")
+        )
+
+        if not check_port_available(host, port):
+            logger.error(f"✗ Port {port} is already in use on {host}")
+            logger.error("Please stop the other process or set BRIDGE_PORT to a free port.")
+            sys.exit(1)
+
+        prepare_worker_environment(workers)
+        loop, http = event_loop_and_parser()
+        config = uvicorn.Config(
+            "app:app",
+            host=host,
+            port=port,
+            workers=workers,
+            loop=loop,
+            http=http,
+            limit_max_requests=max_requests or None,
+            timeout_graceful_shutdown=graceful_timeout,
+            log_level="info",
+            access_log=os.getenv("BRIDGE_ACCESS_LOG", "false").strip().lower() in ("1", "true", "yes", "on")
+        )
+
+        logger.info("=" * 60)
+        logger.info("Perplexity Bridge - Production Server")
+        logger.info("=" * 60)
+        logger.info(f"Server URL: http://{host}:{port}")
+        logger.info(f"Workers: {workers} ({'SO_REUSEPORT' if reuse_port else 'shared socket'}, loop={loop}, http={http})")
+        if max_requests:
+            logger.info(f"Recycling workers after {max_requests}-{max_requests + jitter} requests")
+        logger.info(f"Graceful shutdown timeout: {graceful_timeout}s")
+        logger.info("=" * 60)
+
+        # With SO_REUSEPORT each worker binds its own socket; otherwise they share this one
+        sockets = [] if reuse_port else [config.bind_socket()]
+        target = functools.partial(_run_worker, config, reuse_port, jitter)
+        Multiprocess(config, target=target, sockets=sockets).run()
+
+    except Exception as e:
+        logger.error(f"\n✗ Failed to start server: {e}")
+        sys.exit(1)
+
+
 def main() -> None:
     """Main entry point."""
+    parser = argparse.ArgumentParser(description="Start the Perplexity Bridge server.")
+    parser.add_argument(
+        "--production", action="store_true",
+        help="serve from several worker processes without opening a browser"
+    )
+    parser.add_argument(
+        "--workers",
+        help="worker processes in production mode: a number or 'auto' (one per CPU, the default)"
+    )
+    args = parser.parse_args()
+
     logger.info("Perplexity Bridge - Startup Check")
     logger.info("-" * 60)
 
     load_dotenv()
+    production = args.production or args.workers is not None or \
+        os.getenv("BRIDGE_PRODUCTION", "false").strip().lower() in ("1", "true", "yes", "on")
     
     # Check dependencies
     if not check_dependencies():
@@ -154,7 +332,15 @@ def main() -> None:
         time.sleep(3)
     
     # Start server
-    start_server()
+    if production:
+        try:
+            workers = parse_workers(args.workers or os.getenv("BRIDGE_WORKERS"))
+        except ValueError as e:
+            logger.error(f"✗ {e}")
+            sys.exit(1)
+        start_production_server(workers)
+    else:
+        start_server()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+"""Tests for the upstream admission scheduler."""
+import asyncio
+import os
+import pytest
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from admission import (
+    AdmissionRejected, AdmissionScheduler, admission, estimate_tokens, parse_limits, used_tokens
+)
+from rate_limit import limiter
+
+client = TestClient(app)
+
+
+def test_parse_limits_and_estimates():
+    assert parse_limits("perplexity=32, github-copilot=8,bad,x=y") == {"perplexity": 32, "github-copilot": 8}
+    messages = [{"role": "user", "content": "a" * 400}, {"role": "assistant", "content": "ok"}]
+    assert estimate_tokens(messages, 100) == 2 * 4 + 100 + 100
+    assert estimate_tokens("not a list", None) == 0
+    assert used_tokens({"usage": {"total_tokens": 42}}) == 42
+    assert used_tokens({"choices": []}) is None
+
+
+async def _admit_in_order(scheduler, requests):
+    """Queue ``(flow, model)`` requests and return the order they were admitted in."""
+    order = []
+
+    async def run(name, flow, model):
+        ticket = await scheduler.admit(model, "perplexity", 10, flow)
+        order.append(name)
+        await asyncio.sleep(0)
+        ticket.release()
+
+    tasks = []
+    for name, flow, model in requests:
+        tasks.append(asyncio.ensure_future(run(name, flow, model)))
+        await asyncio.sleep(0)
+    return tasks, order
+
+
+@pytest.mark.asyncio
+async def test_provider_cap_queues_until_release():
+    scheduler = AdmissionScheduler(provider_limits={"perplexity": 1})
+    first = await scheduler.admit("sonar", "perplexity", 10)
+    waiting = asyncio.ensure_future(scheduler.admit("sonar", "perplexity", 10))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    assert scheduler.stats()["waiting"] == 1
+
+    first.release()
+    first.release()  # idempotent
+    second = await asyncio.wait_for(waiting, 1)
+    assert second.waited > 0
+    assert scheduler.stats()["in_flight"] == {"perplexity": 1}
+    second.release()
+    assert scheduler.stats()["in_flight"] == {}
+
+
+@pytest.mark.asyncio
+async def test_weighted_fair_order_across_flows():
+    scheduler = AdmissionScheduler(provider_limits={"perplexity": 1})
+    held = await scheduler.admit("sonar", "perplexity", 10)
+    tasks, order = await _admit_in_order(scheduler, [
+        ("a1", "a", "sonar"), ("a2", "a", "sonar"), ("a3", "a", "sonar"), ("b1", "b", "sonar")
+    ])
+    held.release()
+    await asyncio.wait_for(asyncio.gather(*tasks), 1)
+    # The late flow "b" is not stuck behind flow "a"'s whole burst
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+@pytest.mark.asyncio
+async def test_model_cap_does_not_block_other_models():
+    scheduler = AdmissionScheduler(model_limits={"slow": 1})
+    held = await scheduler.admit("slow", "perplexity", 10)
+    blocked = asyncio.ensure_future(scheduler.admit("slow", "perplexity", 10))
+    await asyncio.sleep(0)
+    other = await asyncio.wait_for(scheduler.admit("fast", "perplexity", 10), 1)
+    assert not blocked.done()
+    other.release()
+    held.release()
+    (await asyncio.wait_for(blocked, 1)).release()
+
+
+@pytest.mark.asyncio
+async def test_tpm_budget_waits_for_refill_and_refunds_unused_tokens():
+    scheduler = AdmissionScheduler(tpm={"perplexity": 60000})
+    big = await scheduler.admit("sonar", "perplexity", 60000)
+    big.release(used_tokens=59900)
+    # The refund covers this request without waiting
+    small = await asyncio.wait_for(scheduler.admit("sonar", "perplexity", 100), 0.05)
+    small.release()
+
+    started = asyncio.get_running_loop().time()
+    later = await asyncio.wait_for(scheduler.admit("sonar", "perplexity", 100), 1)
+    # 100 tokens at 1000 tokens/second
+    assert asyncio.get_running_loop().time() - started >= 0.05
+    later.release()
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_and_full_queue_reject_with_503():
+    scheduler = AdmissionScheduler(provider_limits={"perplexity": 1}, queue_timeout=0.05, max_queue=1)
+    held = await scheduler.admit("sonar", "perplexity", 10)
+    waiting = asyncio.ensure_future(scheduler.admit("sonar", "perplexity", 10))
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected) as exc:
+        await scheduler.admit("sonar", "perplexity", 10)
+    assert exc.value.reason == "queue_full"
+
+    with pytest.raises(AdmissionRejected) as exc:
+        await waiting
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "1"
+    assert scheduler.stats()["rejected"] == {"queue_full": 1, "queue_timeout": 1}
+    held.release()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    scheduler = AdmissionScheduler(provider_limits={"perplexity": 1})
+    held = await scheduler.admit("sonar", "perplexity", 10)
+    waiting = asyncio.ensure_future(scheduler.admit("sonar", "perplexity", 10))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert scheduler.stats()["waiting"] == 0
+    held.release()
+    assert scheduler.stats()["in_flight"] == {}
+
+
+def test_chat_returns_503_when_no_capacity(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(admission, "queue_timeout", 0.01)
+    monkeypatch.setitem(admission.provider_limits, "perplexity", 0)
+    response = client.post(
+        "/v1/chat/completions",
+        headers={"X-API-KEY": "test-secret-key"},
+        json={"model": "sonar-pro", "messages": [{"role": "user", "content": "Hi"}]}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    with client.websocket_connect("/ws/chat?api_key=test-secret-key") as websocket:
+        websocket.send_json({"id": "r1", "model": "sonar-pro", "messages": [{"role": "user", "content": "Hi"}]})
+        frame = websocket.receive_json()
+        assert frame["type"] == "error" and frame["id"] == "r1"
+        assert frame["retry_after"] == 1
+
+
+def test_admin_admission():
+    assert client.get("/admin/admission").status_code == 401
+    stats = client.get("/admin/admission", headers={"X-API-KEY": "test-secret-key"}).json()
+    assert stats["provider_limits"]["perplexity"] == 32
+    assert stats["waiting"] == 0
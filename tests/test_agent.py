@@ -0,0 +1,150 @@
+"""Tests for agent plan parsing and parallel plan execution."""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from adapters.roo_adapter import AsyncRooAdapter
+from agent.executor import Executor
+from agent.plan import parse_plan
+
+PLAN = """Here is the plan:
+```json
+{"steps": [
+  {"id": "research", "task": "Research OAuth device flow sources"},
+  {"id": "code", "task": "Implement the token refresh function"},
+  {"id": "review", "task": "Write the integration notes", "depends_on": ["research", "code"]},
+  {"id": "ship", "description": "Deploy the pipeline", "deps": "review", "model": "sonar"}
+]}
+```"""
+
+
+def test_parse_plan_shapes_and_errors():
+    plan = parse_plan(PLAN)
+    assert [step.id for step in plan.roots()] == ["research", "code"]
+    assert plan.steps["review"].depends_on == ("research", "code")
+    assert plan.steps["ship"].depends_on == ("review",) and plan.steps["ship"].model == "sonar"
+    assert plan.order == ["research", "code", "review", "ship"]
+    assert plan.dependents["review"] == ["ship"]
+
+    listed = parse_plan('["Find sources", {"task": "Summarize", "depends_on": [1]}]')
+    assert [(step.id, step.depends_on) for step in listed] == [("1", ()), ("2", ("1",))]
+
+    for text, message in [
+        ("no json here", "valid JSON"),
+        ('{"steps": []}', "non-empty"),
+        ('[{"id": "a", "task": "x"}, {"id": "a", "task": "y"}]', "Duplicate"),
+        ('[{"id": "a", "task": "x", "depends_on": ["b"]}]', "unknown step"),
+        ('[{"id": "a", "task": "x", "depends_on": ["b"]}, {"id": "b", "task": "y", "depends_on": ["a"]}]', "cycle"),
+        ('[{"id": "a"}]', "no task"),
+    ]:
+        with pytest.raises(ValueError, match=message):
+            parse_plan(text)
+
+
+def _executor(handler, concurrency=4):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    adapter = AsyncRooAdapter(url="http://bridge.test", api_key="k", client=client)
+    return Executor("http://bridge.test", "k", concurrency=concurrency, adapter=adapter), client
+
+
+def _answering(requests, in_flight, fail=()):
+    async def handler(request):
+        body = json.loads(request.content)
+        prompt = body["messages"][0]["content"]
+        requests.append((body["model"], prompt))
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0.02)
+        in_flight[0] -= 1
+        if any(prompt.startswith(task) for task in fail):
+            return httpx.Response(502, json={"error": {"message": "Upstream failed"}})
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"done: {prompt.splitlines()[0]}"}}]})
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_independent_steps_run_concurrently_and_results_stream():
+    requests, in_flight = [], [0, 0]
+    executor, client = _executor(_answering(requests, in_flight))
+    async with client:
+        results = [result async for result in executor.stream(PLAN)]
+    assert [result.step.id for result in results[2:]] == ["review", "ship"]
+    assert {result.step.id for result in results[:2]} == {"research", "code"}
+    assert all(result.ok for result in results)
+    assert in_flight[1] == 2
+
+    models = {prompt.splitlines()[0]: model for model, prompt in requests}
+    assert models["Research OAuth device flow sources"] == "sonar-pro"
+    assert models["Implement the token refresh function"] == "copilot-gpt-4"
+    assert models["Deploy the pipeline"] == "sonar"
+    review_prompt = next(prompt for _, prompt in requests if prompt.startswith("Write the integration notes"))
+    assert "[research] Research OAuth device flow sources\ndone: Research OAuth" in review_prompt
+    assert "[code] Implement the token refresh function\ndone: Implement" in review_prompt
+
+
+@pytest.mark.asyncio
+async def test_concurrency_cap_is_global_and_failures_skip_dependents():
+    requests, in_flight = [], [0, 0]
+    executor, client = _executor(_answering(requests, in_flight, fail=["Implement"]), concurrency=2)
+    wide = json.dumps([f"Find fact {i}" for i in range(5)])
+    async with client:
+        first, second = await asyncio.gather(executor.execute(wide), executor.execute(PLAN))
+    assert in_flight[1] == 2
+    assert all(result.ok for result in first.values())
+
+    assert list(second) == ["research", "code", "review", "ship"]
+    assert second["research"].ok
+    assert second["code"].status == "error" and "Upstream failed" in second["code"].error
+    assert second["review"].status == "skipped" and second["ship"].status == "skipped"
+    assert not any(prompt.startswith("Deploy") for _, prompt in requests)
+
+
+@pytest.mark.asyncio
+async def test_closing_the_stream_cancels_running_steps():
+    started, cancelled = [], []
+
+    async def handler(request):
+        started.append(request)
+        try:
+            await asyncio.sleep(10 if len(started) > 1 else 0)
+        except asyncio.CancelledError:
+            cancelled.append(request)
+            raise
+        return httpx.Response(200, json={"choices": [{"message": {"content": "quick"}}]})
+
+    executor, client = _executor(handler)
+    async with client:
+        stream = executor.stream('["Find a", "Find b"]')
+        first = await stream.__anext__()
+        await stream.aclose()
+    assert first.output == "quick"
+    assert len(cancelled) == 1
+
+
+@pytest.mark.asyncio
+async def test_steps_follow_the_bridge_stats_and_feed_them_back():
+    large = "llama-3.1-sonar-large-128k-online"
+    figures = {"samples": 10, "age": 0, "calls": 10, "errors": 0, "ttft": 1.0, "tokens_per_second": 50,
+               "error_rate": 0.0, "cost": None}
+    bridge_stats = {"models": {"sonar-pro": dict(figures, latency=8.0), large: dict(figures, latency=2.0)}}
+    requests, in_flight = [], [0, 0]
+    answer = _answering(requests, in_flight, fail=["Find b"])
+
+    async def handler(request):
+        if request.url.path == "/models/stats":
+            assert request.headers["X-API-KEY"] == "k"
+            return httpx.Response(200, json=bridge_stats)
+        return await answer(request)
+
+    executor, client = _executor(handler)
+    async with client:
+        assert executor.router.stats is None
+        assert await executor.refresh_model_stats() == 2
+        results = await executor.execute('["Find a", "Find b", "Implement c"]')
+    assert [result.model for result in results.values()] == [large, large, "copilot-gpt-4"]
+    estimate = executor.router.stats.estimate(large)
+    assert (estimate["calls"], estimate["errors"]) == (12, 1) and estimate["latency"] < 2.0
+    # Only classes whose model the stats know are affected
+    assert executor.router.stats.estimate("copilot-gpt-4")["calls"] == 1
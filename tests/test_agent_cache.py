@@ -0,0 +1,137 @@
+"""Tests for the on-disk agent plan and step cache."""
+import json
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+
+from adapters.roo_adapter import AsyncRooAdapter
+from agent.cache import AgentCache, cache_key, context_hash
+from agent.executor import Executor
+import agent.planner as planner_module
+from agent.planner import Planner
+
+PLAN = json.dumps({"steps": [
+    {"id": "a", "task": "Research library A"},
+    {"id": "b", "task": "Research library B"},
+    {"id": "c", "task": "Write the comparison", "depends_on": ["a", "b"]},
+]})
+
+
+def test_keys_are_content_addressed():
+    assert cache_key("step", "m", "task") == cache_key("step", "m", "task", "")
+    assert len({
+        cache_key("step", "m", "task"), cache_key("plan", "m", "task"),
+        cache_key("step", "n", "task"), cache_key("step", "m", "task", context_hash(["x"]))
+    }) == 4
+    assert context_hash(["ab", "c"]) != context_hash(["a", "bc"])
+
+
+def test_lru_eviction_invalidation_and_persistence(tmp_path):
+    path = str(tmp_path / "agent.sqlite3")
+    cache = AgentCache(path, max_bytes=10)
+    assert len(cache) == 0
+    cache.set("k1", "step", "m1", "one", "aaaa")
+    cache.set("k2", "step", "m2", "two", "bbbb")
+    assert cache.get("k1") == "aaaa"
+    cache.set("k3", "plan", "m1", "three", "cccc")
+    # k2 was least recently used
+    assert cache.get("k2") is None and cache.get("k1") == "aaaa"
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] == 8
+    assert not cache.set("big", "step", "m1", "big", "x" * 11)
+    cache.close()
+
+    cache = AgentCache(path, max_bytes=10)
+    assert cache.get("k3") == "cccc"
+    assert cache.invalidate() == 0
+    assert cache.invalidate(kind="plan", model="m2") == 0
+    assert cache.invalidate(prompt="three") == 1
+    assert cache.invalidate(older_than=3600) == 0
+    assert cache.invalidate(older_than=0) == 1
+    assert len(cache) == 0
+
+
+def _executor(cache, answers):
+    calls = []
+
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        calls.append(prompt.splitlines()[0])
+        return httpx.Response(200, json={"choices": [{"message": {"content": answers(prompt)}}]})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    adapter = AsyncRooAdapter(url="http://bridge.test", api_key="k", client=client)
+    return Executor("http://bridge.test", "k", adapter=adapter, cache=cache), client, calls
+
+
+@pytest.mark.asyncio
+async def test_replays_unchanged_steps_and_reruns_downstream_of_changes(tmp_path):
+    cache = AgentCache(str(tmp_path / "agent.sqlite3"))
+    versions = {"Research library A": "A v1"}
+
+    def answers(prompt):
+        return versions.get(prompt, f"answer to {prompt.splitlines()[0]}")
+
+    executor, client, calls = _executor(cache, answers)
+    async with client:
+        first = await executor.execute(PLAN)
+        assert len(calls) == 3 and not any(result.cached for result in first.values())
+
+        calls.clear()
+        second = await executor.execute(PLAN)
+        assert calls == []
+        assert all(result.cached and result.ok for result in second.values())
+        assert {step_id: result.output for step_id, result in second.items()} == \
+            {step_id: result.output for step_id, result in first.items()}
+
+        # Re-running step "a" with the same answer keeps "c" cached
+        assert cache.invalidate(prompt="Research library A") == 1
+        await executor.execute(PLAN)
+        assert calls == ["Research library A"]
+
+        # A changed answer only re-runs what depends on it
+        calls.clear()
+        cache.invalidate(prompt="Research library A")
+        versions["Research library A"] = "A v2"
+        third = await executor.execute(PLAN)
+        assert calls == ["Research library A", "Write the comparison"]
+        assert third["b"].cached and not third["c"].cached
+
+
+def test_planner_and_single_task_runs_are_memoized(tmp_path):
+    cache = AgentCache(str(tmp_path / "agent.sqlite3"))
+    response = MagicMock()
+    response.json.return_value = {"choices": [{"message": {"content": PLAN}}]}
+    planner = Planner("http://bridge.test", "k", "claude-4.5-sonnet", cache=cache)
+    executor = Executor("http://bridge.test", "k", cache=cache)
+    with patch("requests.post", return_value=response) as post:
+        assert len(planner.steps("Compare A and B")) == 3
+        assert len(planner.steps("Compare A and B")) == 3
+        assert executor.run("Summarize", "gpt-5.2") == executor.run("Summarize", "gpt-5.2") == PLAN
+        planner.plan("Compare A and C")
+    # Two distinct goals and one distinct task
+    assert post.call_count == 3
+    # Plans are stored under the goal, so it is what invalidate() matches
+    assert cache.get(planner_module.plan_key("claude-4.5-sonnet", "Compare A and B")) == PLAN
+    assert cache.invalidate(kind="plan", prompt="Compare A and B") == 1
+
+
+def test_unusable_plans_are_not_replayed(tmp_path):
+    cache = AgentCache(str(tmp_path / "agent.sqlite3"))
+    answers = [MagicMock(), MagicMock()]
+    answers[0].json.return_value = {"choices": [{"message": {"content": "Sorry, I cannot plan that."}}]}
+    answers[1].json.return_value = {"choices": [{"message": {"content": PLAN}}]}
+    planner = Planner("http://bridge.test", "k", "claude-4.5-sonnet", cache=cache)
+    with patch("requests.post", side_effect=answers) as post:
+        with pytest.raises(ValueError):
+            planner.steps("Compare A and B")
+        assert len(cache) == 0
+        assert len(planner.steps("Compare A and B")) == 3
+        assert len(planner.steps("Compare A and B")) == 3
+    assert post.call_count == 2
+
+    # An unusable answer already on disk is dropped and the goal planned again
+    cache.set(planner_module.plan_key("claude-4.5-sonnet", "Goal C"), "plan", "claude-4.5-sonnet", "Goal C", "not a plan")
+    with patch("requests.post", return_value=answers[1]) as post:
+        assert len(planner.steps("Goal C")) == 3
+    assert post.call_count == 1
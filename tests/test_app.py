@@ -1,4 +1,5 @@
 """Tests for the FastAPI application endpoints."""
+import json
 import os
 import pytest
 from unittest.mock import patch, AsyncMock, MagicMock
@@ -81,6 +82,7 @@ def test_auth_middleware_allows_authorized():
         "model": "test-model", 
         "choices": [{"message": {"role": "assistant", "content": "test response"}}]
     }
+    mock_response.content = json.dumps(mock_response.json.return_value).encode("utf-8")
     mock_response.raise_for_status = MagicMock()
     
     # Create mock client
@@ -0,0 +1,117 @@
+"""Tests for the ASGI API-key middleware."""
+import asyncio
+import os
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from auth import APIKeyMiddleware, compile_path_matcher
+from keystore import KeyStore
+
+client = TestClient(app)
+
+
+def test_public_path_matcher():
+    is_public = compile_path_matcher(["/", "/health", "/docs"], ["/ui", "/assets/"])
+    for path in ["/", "/health", "/docs", "/ui", "/ui/", "/ui/index.html", "/assets/app.js"]:
+        assert is_public(path), path
+    for path in ["/healthz", "/docs/", "/uix", "/v1/chat/completions", "", "/health\n"]:
+        assert not is_public(path), path
+    assert not compile_path_matcher([])("/")
+
+
+def test_app_rejects_missing_or_wrong_key():
+    for headers in ({}, {"X-API-KEY": "wrong"}, {"X-API-KEY": ""}):
+        response = client.get("/admin/providers", headers=headers)
+        assert response.status_code == 401
+        assert response.json() == {"error": "Unauthorized. Invalid X-API-KEY header."}
+    assert client.get("/admin/providers", headers={"x-api-key": "test-secret-key"}).status_code == 200
+    assert client.get("/health").status_code == 200
+
+
+def _streaming_app(chunks, public_paths=()):
+    async def stream(request):
+        async def body():
+            for chunk in chunks:
+                yield chunk
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    async def ping(request):
+        return PlainTextResponse("pong")
+
+    inner = Starlette(routes=[Route("/stream", stream), Route("/ping", ping)])
+    return inner, APIKeyMiddleware(inner, keys=KeyStore(secret="s3cret"), public_paths=public_paths)
+
+
+def test_authorized_streams_reach_the_app_untouched():
+    chunks = [b"data: one\n\n", b"data: two\n\n", b"data: [DONE]\n\n"]
+    inner, wrapped = _streaming_app(chunks, public_paths=["/ping"])
+    sent = []
+
+    async def run(headers):
+        sent.clear()
+        requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        await wrapped({
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/stream", "raw_path": b"/stream", "root_path": "",
+            "query_string": b"", "headers": headers, "client": ("10.0.0.1", 1234), "server": ("test", 80)
+        }, receive, send)
+
+    asyncio.run(run([(b"x-api-key", b"s3cret")]))
+    assert sent[0]["status"] == 200
+    assert [m["body"] for m in sent[1:] if m.get("body")] == chunks
+
+    asyncio.run(run([(b"x-api-key", b"nope")]))
+    assert sent[0]["status"] == 401
+    assert len(sent) == 2
+
+    test_client = TestClient(wrapped)
+    assert test_client.get("/ping").text == "pong"
+    assert test_client.get("/stream").status_code == 401
+
+
+def test_receive_and_send_are_not_wrapped():
+    seen = []
+
+    async def inner(scope, receive, send):
+        seen.append((scope["type"], receive, send))
+
+    wrapped = APIKeyMiddleware(inner, keys=KeyStore(secret="s3cret"))
+
+    async def receive():
+        pass
+
+    async def send(message):
+        pass
+
+    asyncio.run(wrapped({"type": "http", "path": "/x", "headers": [(b"x-api-key", b"s3cret")]}, receive, send))
+    asyncio.run(wrapped({"type": "websocket", "path": "/ws", "headers": []}, receive, send))
+    assert seen == [("http", receive, send), ("websocket", receive, send)]
+
+
+def test_lifespan_scope_passes_through():
+    inner, wrapped = _streaming_app([])
+    assert wrapped.app is inner
+    with TestClient(wrapped) as test_client:
+        assert test_client.get("/ping", headers={"X-API-KEY": "s3cret"}).text == "pong"
+
+
+@pytest.mark.parametrize("path", ["/", "/models", "/openapi.json"])
+def test_app_public_paths(path):
+    assert client.get(path).status_code == 200
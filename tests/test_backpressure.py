@@ -0,0 +1,151 @@
+"""Tests for backpressure-aware WebSocket send queues."""
+import asyncio
+import json
+import os
+import pytest
+
+# Set test environment before importing modules that read config
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from backpressure import BackpressureStats, SendQueue, SlowConsumerError
+from sse import format_sse
+
+
+def delta(text):
+    return format_sse(json.dumps({"choices": [{"delta": {"content": text}}]}))
+
+
+def content(frame):
+    return json.loads(frame[6:])["choices"][0]["delta"]["content"]
+
+
+class SlowSocket:
+    """Records frames, blocking every send until released."""
+
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+
+    async def send(self, frame):
+        await self.gate.wait()
+        self.sent.append(frame)
+
+
+@pytest.mark.asyncio
+async def test_frames_are_delivered_in_order():
+    stats = BackpressureStats()
+    sent = []
+
+    async def send(frame):
+        sent.append(frame)
+
+    queue = SendQueue(send, maxsize=4, policy="coalesce", stats=stats)
+    for i in range(10):
+        await queue.put(delta(str(i)))
+    await queue.close()
+    assert "".join(content(f) for f in sent) == "0123456789"
+    assert stats.frames_sent == len(sent)
+
+
+@pytest.mark.asyncio
+async def test_coalesce_policy_merges_deltas_without_blocking():
+    """Test a slow consumer gets merged deltas instead of stalling the reader."""
+    stats = BackpressureStats()
+    socket = SlowSocket()
+    queue = SendQueue(socket.send, maxsize=2, policy="coalesce", stats=stats)
+
+    for i in range(10):
+        await asyncio.wait_for(queue.put(delta(str(i))), timeout=1)
+    assert queue.depth <= 2
+    assert stats.coalesced > 0
+
+    socket.gate.set()
+    await queue.put("data: [DONE]\n\n")
+    await queue.close()
+    assert "".join(content(f) for f in socket.sent[:-1]) == "0123456789"
+    assert socket.sent[-1] == "data: [DONE]\n\n"
+
+
+@pytest.mark.asyncio
+async def test_summary_policy_sends_held_back_content_before_done():
+    stats = BackpressureStats()
+    socket = SlowSocket()
+    queue = SendQueue(socket.send, maxsize=2, policy="summary", stats=stats)
+
+    for i in range(6):
+        await asyncio.wait_for(queue.put(delta(str(i))), timeout=1)
+    assert stats.summarized > 0
+
+    socket.gate.set()
+    await queue.put("data: [DONE]\n\n")
+    await queue.close()
+    assert "".join(content(f) for f in socket.sent[:-1]) == "012345"
+    assert socket.sent[-1] == "data: [DONE]\n\n"
+
+
+@pytest.mark.asyncio
+async def test_end_stream_flushes_pending_summary():
+    socket = SlowSocket()
+    queue = SendQueue(socket.send, maxsize=1, policy="summary", stats=BackpressureStats())
+    for i in range(4):
+        await queue.put(delta(str(i)))
+    socket.gate.set()
+    await queue.end_stream()
+    await queue.close()
+    assert "".join(content(f) for f in socket.sent) == "0123"
+
+
+@pytest.mark.asyncio
+async def test_abort_policy_gives_up_on_slow_consumer():
+    """Test the abort policy raises and records blocked time."""
+    stats = BackpressureStats()
+    socket = SlowSocket()
+    queue = SendQueue(socket.send, maxsize=1, policy="abort", block_timeout=0.05, stats=stats)
+
+    with pytest.raises(SlowConsumerError):
+        for i in range(5):
+            await queue.put(delta(str(i)))
+    assert stats.aborted == 1
+    assert stats.blocked_seconds >= 0.05
+
+    assert queue.discard() >= 1
+    socket.gate.set()
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_writer_errors_surface_to_reader():
+    async def broken(frame):
+        raise ConnectionError("client went away")
+
+    queue = SendQueue(broken, maxsize=1, policy="coalesce", stats=BackpressureStats())
+    await queue.put("data: one\n\n")
+    await asyncio.sleep(0)
+    with pytest.raises(ConnectionError):
+        await queue.put("data: two\n\n")
+    await queue.close()
+
+
+def test_invalid_policy_is_rejected():
+    async def send(frame):
+        pass
+
+    with pytest.raises(ValueError):
+        SendQueue(send, policy="drop", stats=BackpressureStats())
+
+
+@pytest.mark.asyncio
+async def test_snapshot_reports_live_depth():
+    stats = BackpressureStats()
+    socket = SlowSocket()
+    queue = SendQueue(socket.send, maxsize=8, policy="coalesce", stats=stats)
+    for i in range(3):
+        await queue.put(delta(str(i)))
+    await asyncio.sleep(0)
+    snapshot = stats.snapshot()
+    assert snapshot["active_queues"] == 1
+    assert snapshot["queue_depth"] >= 2
+    assert snapshot["max_queue_depth"] >= 2
+    socket.gate.set()
+    await queue.close()
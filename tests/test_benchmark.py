@@ -0,0 +1,53 @@
+"""Tests for the benchmark harness and its mock upstream."""
+import json
+import httpx
+import pytest
+
+from benchmarks.mock_upstream import MockSettings, create_app
+from benchmarks.run import compare, main, percentiles
+
+
+def test_percentiles_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentiles(values) == {"p50": 50.0, "p95": 95.0, "p99": 99.0, "mean": 50.5, "max": 100.0}
+    assert percentiles([])["p50"] is None
+
+
+def test_compare_flags_regressions_in_both_directions():
+    baseline = {"scenarios": {"sse": {"ttft_ms": {"p50": 10.0, "p95": 20.0}, "throughput_rps": 100.0}}}
+    current = {"scenarios": {"sse": {"ttft_ms": {"p50": 10.5, "p95": 30.0}, "throughput_rps": 70.0}}}
+    regressions = compare(current, baseline, max_regression=0.2)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("sse ttft_ms.p95")
+    assert regressions[1].startswith("sse throughput_rps")
+
+
+@pytest.mark.asyncio
+async def test_mock_upstream_streams_configured_chunks():
+    app = create_app(MockSettings(latency=0, token_rate=0, tokens=5, chunk_tokens=2))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mock") as client:
+        response = await client.post("/chat/completions", json={"model": "m", "stream": True})
+        events = [e for e in response.text.split("\n\n") if e]
+        assert events[-1] == "data: [DONE]"
+        contents = [json.loads(e[6:])["choices"][0]["delta"].get("content") for e in events[:-1]]
+        assert contents == ["tok tok ", "tok tok ", "tok ", None]
+
+        response = await client.post("/copilot/chat/completions", json={"model": "m", "max_tokens": 3})
+        assert response.json()["usage"]["completion_tokens"] == 3
+
+
+def test_benchmark_smoke_run(tmp_path, capsys):
+    """Test a tiny end-to-end run against real uvicorn processes produces comparable JSON."""
+    output = tmp_path / "results.json"
+    args = [
+        "--scenarios", "direct-sse,sse,ws", "--requests", "3", "--concurrency", "2", "--warmup", "0",
+        "--latency", "0", "--token-rate", "0", "--tokens", "4", "--output", str(output)
+    ]
+    assert main(args) == 0
+    results = json.loads(output.read_text())
+    for name in ("direct-sse", "sse", "ws"):
+        assert results["scenarios"][name]["errors"] == 0
+        assert results["scenarios"][name]["ttft_ms"]["p99"] is not None
+    assert "sse" in results["overhead_ms"]
+    assert main(args[:-2] + ["--output", str(tmp_path / "again.json"), "--compare", str(output),
+                             "--max-regression", "1000"]) == 0
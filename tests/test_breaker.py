@@ -0,0 +1,149 @@
+"""Tests for upstream circuit breakers and failover."""
+import os
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app, get_model_provider
+from breaker import CircuitBreaker, CircuitBreakers, CircuitOpenError, parse_fallbacks
+from breaker import circuit_breakers
+from providers import providers
+from rate_limit import limiter
+
+client = TestClient(app)
+HEADERS = {"X-API-KEY": "test-secret-key"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock, **kwargs):
+    settings = dict(window=10, min_requests=4, failure_rate=0.5, slow_call=5, open_seconds=30, clock=clock)
+    settings.update(kwargs)
+    return CircuitBreaker("perplexity", **settings)
+
+
+def test_breaker_opens_on_failure_rate_and_recovers_through_half_open():
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for success in (True, True, False):
+        breaker.record(success, 0.1)
+    assert breaker.current_state() == "closed"
+    breaker.record(False, 0.1)
+    assert breaker.current_state() == "open"
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+    clock.now += 30
+    assert breaker.current_state() == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # one probe at a time
+    breaker.record(True, 0.1)
+    assert breaker.current_state() == "closed"
+    assert breaker.stats()["trips"] == 1
+
+
+def test_failed_probe_reopens_and_slow_calls_count_as_failures():
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record(True, 6.0)
+    assert breaker.current_state() == "open"
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.current_state() == "open"
+    assert breaker.stats()["trips"] == 2
+
+
+def test_old_outcomes_leave_the_window():
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record(False, 0.1)
+    clock.now += 11
+    breaker.record(True, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.current_state() == "closed"
+    assert breaker.stats()["calls"] == 2
+
+
+def test_route_follows_fallbacks_and_fails_fast():
+    clock = Clock()
+    breakers = CircuitBreakers(
+        fallbacks=parse_fallbacks("perplexity=copilot-gpt-4, sonar-pro=sonar,bad"),
+        window=10, min_requests=1, open_seconds=30, clock=clock
+    )
+    assert breakers.route("sonar-pro", "perplexity", get_model_provider) == ("sonar-pro", "perplexity")
+    breakers.record("perplexity", False, 0.1)
+    assert breakers.is_open("perplexity")
+
+    # Model-specific fallbacks come first; sonar is on the same open circuit, so the provider fallback is used
+    assert breakers.route("sonar-pro", "perplexity", get_model_provider) == ("copilot-gpt-4", "github-copilot")
+    with pytest.raises(CircuitOpenError) as exc:
+        breakers.route("sonar-pro", "perplexity", get_model_provider, ("perplexity",))
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "30"
+    assert breakers.stats()["failovers"] == 1
+
+
+def _open_perplexity(monkeypatch, fallbacks):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(circuit_breakers, "_breakers", {})
+    monkeypatch.setattr(circuit_breakers, "fallbacks", fallbacks)
+    breaker = circuit_breakers.get("perplexity")
+    breaker._open(breaker.clock())
+
+
+def test_open_circuit_fails_fast_and_shows_on_health(monkeypatch):
+    _open_perplexity(monkeypatch, {})
+    health = client.get("/health").json()
+    assert health["status"] == "degraded"
+    assert health["circuits"] == {"perplexity": "open"}
+
+    response = client.post("/v1/chat/completions", headers=HEADERS, json={
+        "model": "sonar-pro", "messages": [{"role": "user", "content": "Hi"}]
+    })
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) > 0
+
+    with client.websocket_connect("/ws/chat?api_key=test-secret-key") as websocket:
+        websocket.send_json({"model": "sonar-pro", "messages": [{"role": "user", "content": "Hi"}]})
+        frame = websocket.receive_json()
+        assert "circuit open" in frame["error"]
+        assert frame["retry_after"] > 0
+
+    stats = client.get("/admin/circuits", headers=HEADERS).json()
+    assert stats["upstreams"]["perplexity"]["state"] == "open"
+
+
+def test_open_circuit_fails_over_to_copilot(monkeypatch):
+    _open_perplexity(monkeypatch, {"perplexity": "copilot-gpt-4"})
+    monkeypatch.setattr(providers.get("github-copilot"), "api_key", "gh-test-key")
+    urls = []
+
+    def handler(request):
+        urls.append(str(request.url))
+        return httpx.Response(200, json={
+            "model": "copilot-gpt-4", "choices": [{"message": {"role": "assistant", "content": "from copilot"}}]
+        })
+
+    real_client = httpx.AsyncClient
+    with patch("upstream.httpx.AsyncClient", side_effect=lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw)):
+        response = client.post("/v1/chat/completions", headers=HEADERS, json={
+            "model": "sonar-pro", "messages": [{"role": "user", "content": "failover please"}]
+        })
+    assert response.status_code == 200
+    assert response.json()["choices"][0]["message"]["content"] == "from copilot"
+    assert urls and urls[0].endswith("/copilot/chat/completions")
@@ -0,0 +1,134 @@
+"""Tests for the chat completion response cache."""
+import json
+import os
+from unittest.mock import patch, AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from cache import ResponseCache, canonical_request_key, parse_model_ttls, wants_no_cache
+
+client = TestClient(app)
+
+
+class TestCanonicalKey:
+    """Tests for canonical request hashing."""
+
+    def test_key_ignores_field_order_and_stream(self):
+        a = {"model": "gpt-5.2", "messages": [{"role": "user", "content": "hi"}], "temperature": 0.0, "stream": False}
+        b = {"temperature": 0.0, "stream": True, "messages": [{"content": "hi", "role": "user"}], "model": "gpt-5.2"}
+        assert canonical_request_key(a) == canonical_request_key(b)
+
+    def test_key_changes_with_sampling_params(self):
+        base = {"model": "gpt-5.2", "messages": [{"role": "user", "content": "hi"}], "temperature": 0.0}
+        other = dict(base, temperature=0.5)
+        assert canonical_request_key(base) != canonical_request_key(other)
+
+
+class TestResponseCache:
+    """Tests for LRU, TTL and budget behaviour."""
+
+    def test_hit_and_miss(self):
+        cache = ResponseCache(enabled=True, max_bytes=1024, default_ttl=60)
+        assert cache.get("k") is None
+        assert cache.set("k", "gpt-5.2", b"body")
+        assert cache.get("k") == b"body"
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_lru_eviction_respects_budget(self):
+        cache = ResponseCache(enabled=True, max_bytes=10, default_ttl=60)
+        cache.set("a", "m", b"aaaa")
+        cache.set("b", "m", b"bbbb")
+        cache.get("a")  # a is now most recently used
+        cache.set("c", "m", b"cccc")
+        assert cache.get("b") is None
+        assert cache.get("a") == b"aaaa"
+        assert cache.get("c") == b"cccc"
+        assert cache.stats()["bytes"] <= 10
+        assert cache.evictions == 1
+
+    def test_oversized_body_is_not_cached(self):
+        cache = ResponseCache(enabled=True, max_bytes=4, default_ttl=60)
+        assert not cache.set("k", "m", b"too large")
+        assert cache.stats()["entries"] == 0
+
+    def test_expired_entries_are_dropped(self):
+        cache = ResponseCache(enabled=True, max_bytes=1024, default_ttl=60)
+        with patch("cache.time.monotonic", return_value=1000.0):
+            cache.set("k", "m", b"body")
+        with patch("cache.time.monotonic", return_value=1061.0):
+            assert cache.get("k") is None
+        assert cache.expirations == 1
+        assert cache.stats()["bytes"] == 0
+
+    def test_per_model_ttl_and_exclusions(self):
+        cache = ResponseCache(
+            enabled=True,
+            max_bytes=1024,
+            default_ttl=60,
+            model_ttls={"gpt-5.2": 600, "grok-4.1": 0},
+            exclude=["sonar"]
+        )
+        assert cache.ttl_for("gpt-5.2") == 600
+        assert cache.ttl_for("claude-4.5-sonnet") == 60
+        assert not cache.should_cache("grok-4.1")
+        assert not cache.should_cache("sonar-pro")
+        assert not cache.should_cache("llama-3.1-sonar-large-128k-online")
+
+    def test_disabled_cache_never_caches(self):
+        cache = ResponseCache(enabled=False)
+        assert not cache.should_cache("gpt-5.2")
+        assert not cache.set("k", "gpt-5.2", b"body")
+
+
+def test_parse_model_ttls():
+    assert parse_model_ttls("gpt-5.2=600, grok-4.1=0,bad,x=y") == {"gpt-5.2": 600.0, "grok-4.1": 0.0}
+
+
+def test_wants_no_cache():
+    assert wants_no_cache(None) == (False, False)
+    assert wants_no_cache("no-cache") == (True, False)
+    assert wants_no_cache("max-age=0, no-store") == (True, True)
+
+
+def _mock_upstream():
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {
+        "id": "test-id",
+        "model": "gpt-5.2",
+        "choices": [{"message": {"role": "assistant", "content": "cached answer"}}]
+    }
+    mock_response.content = json.dumps(mock_response.json.return_value).encode("utf-8")
+    mock_response.raise_for_status = MagicMock()
+    mock_client = AsyncMock()
+    mock_client.post.return_value = mock_response
+    mock_client.__aenter__.return_value = mock_client
+    mock_client.__aexit__.return_value = None
+    return mock_client
+
+
+def test_chat_endpoint_serves_hits_and_honours_no_cache():
+    """Test X-Cache headers and Cache-Control bypass on the chat endpoint."""
+    cache = ResponseCache(enabled=True, max_bytes=1024 * 1024, default_ttl=60, exclude=["sonar"])
+    mock_client = _mock_upstream()
+    body = {"model": "gpt-5.2", "messages": [{"role": "user", "content": "deterministic"}]}
+    headers = {"X-API-KEY": "test-secret-key"}
+
+    with patch("app.response_cache", cache), patch("httpx.AsyncClient", return_value=mock_client):
+        first = client.post("/v1/chat/completions", json=body, headers=headers)
+        second = client.post("/v1/chat/completions", json=body, headers=headers)
+        bypass = client.post(
+            "/v1/chat/completions", json=body, headers=dict(headers, **{"Cache-Control": "no-cache"})
+        )
+
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.json() == first.json()
+    assert bypass.headers["X-Cache"] == "BYPASS"
+    assert mock_client.post.await_count == 2
@@ -0,0 +1,141 @@
+"""Tests for client-driven cancellation of upstream streams."""
+import asyncio
+import json
+import os
+import threading
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from cancellation import CancellationStats, StreamTracker, cancel_on_disconnect, cancellation_stats
+
+
+async def _ticks(closed=None):
+    try:
+        while True:
+            yield 'data: {"choices": [{"delta": {"content": "x"}}]}\n\n'
+            await asyncio.sleep(0.01)
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+@pytest.mark.asyncio
+async def test_tracker_records_abandoned_stream():
+    stats = CancellationStats()
+    tracker = StreamTracker(max_tokens=10, stats=stats)
+    stream = tracker.wrap(_ticks())
+    for _ in range(4):
+        await stream.__anext__()
+    await stream.aclose()
+
+    snapshot = stats.snapshot()
+    assert snapshot["by_reason"] == {"client_disconnect": 1}
+    assert snapshot["tokens_streamed_before_cancel"] == 4
+    assert snapshot["estimated_tokens_saved"] == 6
+    assert snapshot["estimated_bytes_saved"] == 6 * tracker.bytes // 4
+
+
+@pytest.mark.asyncio
+async def test_tracker_ignores_completed_and_failed_streams():
+    stats = CancellationStats()
+
+    async def finite():
+        yield "data: a\n\n"
+        yield "data: [DONE]\n\n"
+
+    async def failing():
+        yield "data: a\n\n"
+        raise RuntimeError("upstream down")
+
+    assert [c async for c in StreamTracker(stats=stats).wrap(finite())] == ["data: a\n\n", "data: [DONE]\n\n"]
+    with pytest.raises(RuntimeError):
+        [c async for c in StreamTracker(stats=stats).wrap(failing())]
+    assert stats.snapshot()["cancelled_streams"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancel_on_disconnect_for_servers_without_disconnect_listener():
+    """Test ASGI 2.4 servers get the upstream torn down on http.disconnect, not on the next write."""
+    disconnect = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    request = Request({"type": "http", "asgi": {"spec_version": "2.4"}}, receive)
+    closed = asyncio.Event()
+
+    async def consume():
+        async for _ in cancel_on_disconnect(request, _ticks(closed)):
+            pass
+
+    task = asyncio.ensure_future(consume())
+    await asyncio.sleep(0.03)
+    disconnect.set()
+    await asyncio.wait_for(closed.wait(), timeout=1)
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def _endless_upstream(closed):
+    """An httpx client whose upstream never finishes and signals when it is closed."""
+
+    class Body(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            try:
+                while True:
+                    yield b'data: {"choices": [{"delta": {"content": "x"}}]}\n\n'
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.set()
+
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, stream=Body())
+
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_websocket_cancel_closes_upstream_stream():
+    """Test an untagged {"type": "cancel"} stops the stream and closes the upstream request."""
+    client = TestClient(app)
+    closed = threading.Event()
+    before = cancellation_stats.snapshot()["by_reason"].get("client_cancel", 0)
+    with patch("upstream.httpx.AsyncClient", side_effect=_endless_upstream(closed)):
+        with client.websocket_connect("/ws/chat?api_key=test-secret-key") as ws:
+            ws.send_json({"model": "cancel-test", "max_tokens": 50, "messages": [{"role": "user", "content": "hi"}]})
+            assert ws.receive_text().startswith("data: ")
+            ws.send_json({"type": "cancel"})
+            while True:
+                frame = ws.receive_text()
+                if frame.startswith("{"):
+                    break
+            assert json.loads(frame) == {"type": "cancelled"}
+            assert closed.wait(timeout=1)
+    assert cancellation_stats.snapshot()["by_reason"]["client_cancel"] == before + 1
+
+
+def test_websocket_disconnect_closes_upstream_stream():
+    client = TestClient(app)
+    closed = threading.Event()
+    with patch("upstream.httpx.AsyncClient", side_effect=_endless_upstream(closed)):
+        with client.websocket_connect("/ws/chat?api_key=test-secret-key") as ws:
+            ws.send_json({"model": "disconnect-test", "messages": [{"role": "user", "content": "hi"}]})
+            ws.receive_text()
+        assert closed.wait(timeout=1)
+
+
+def test_cancellation_stats_require_auth():
+    client = TestClient(app)
+    assert client.get("/admin/cancellations").status_code == 401
+    response = client.get("/admin/cancellations", headers={"X-API-KEY": "test-secret-key"})
+    assert response.status_code == 200
+    assert "estimated_tokens_saved" in response.json()
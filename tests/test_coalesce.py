@@ -0,0 +1,153 @@
+"""Tests for single-flight request coalescing."""
+import asyncio
+import os
+import pytest
+
+# Set test environment before importing modules that read config
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from coalesce import SingleFlight, StreamFanout
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_call():
+    """Test concurrent duplicates await a single upstream call."""
+    flight = SingleFlight(enabled=True)
+    calls = 0
+    release = asyncio.Event()
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return {"answer": 42}
+
+    waiters = [asyncio.ensure_future(flight.do("key", upstream)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters)
+
+    assert calls == 1
+    assert all(result == {"answer": 42} for result, _ in results)
+    assert sum(1 for _, shared in results if shared) == 4
+    assert flight.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_errors_and_forgets_key():
+    """Test a failed call fails every waiter and is not reused."""
+    flight = SingleFlight(enabled=True)
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(
+        flight.do("key", failing), flight.do("key", failing), return_exceptions=True
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    async def ok():
+        return "fresh"
+
+    assert await flight.do("key", ok) == ("fresh", False)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_leader_cancellation():
+    """Test followers still get a result if the first caller goes away."""
+    flight = SingleFlight(enabled=True)
+    release = asyncio.Event()
+
+    async def upstream():
+        await release.wait()
+        return "done"
+
+    leader = asyncio.ensure_future(flight.do("key", upstream))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flight.do("key", upstream))
+    await asyncio.sleep(0)
+    leader.cancel()
+    release.set()
+    assert await follower == ("done", True)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_disabled_calls_every_time():
+    flight = SingleFlight(enabled=False)
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    await asyncio.gather(flight.do("key", upstream), flight.do("key", upstream))
+    assert calls == 2
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+@pytest.mark.asyncio
+async def test_stream_fanout_shares_upstream_and_replays_for_late_joiners():
+    """Test streaming duplicates fan out from one upstream stream."""
+    fanout = StreamFanout(enabled=True)
+    opened = 0
+    gate = asyncio.Event()
+
+    async def upstream():
+        nonlocal opened
+        opened += 1
+        yield "data: 1\n\n"
+        await gate.wait()
+        yield "data: 2\n\n"
+        yield "data: [DONE]\n\n"
+
+    first = asyncio.ensure_future(_collect(fanout.subscribe("key", upstream)))
+    await asyncio.sleep(0.01)
+    late = asyncio.ensure_future(_collect(fanout.subscribe("key", upstream)))
+    await asyncio.sleep(0.01)
+    gate.set()
+
+    expected = ["data: 1\n\n", "data: 2\n\n", "data: [DONE]\n\n"]
+    assert await first == expected
+    assert await late == expected
+    assert opened == 1
+    assert fanout.stats()["shared"] == 1
+    assert fanout.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_fanout_propagates_errors():
+    fanout = StreamFanout(enabled=True)
+
+    async def upstream():
+        yield "data: 1\n\n"
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await _collect(fanout.subscribe("key", upstream))
+
+
+@pytest.mark.asyncio
+async def test_stream_fanout_cancels_upstream_when_everyone_leaves():
+    """Test the shared upstream is torn down once its last subscriber leaves."""
+    fanout = StreamFanout(enabled=True)
+    closed = asyncio.Event()
+
+    async def upstream():
+        try:
+            while True:
+                yield "data: tick\n\n"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    stream = fanout.subscribe("key", upstream)
+    assert await stream.__anext__() == "data: tick\n\n"
+    await stream.aclose()
+    await asyncio.wait_for(closed.wait(), timeout=1)
+    assert fanout.stats()["in_flight"] == 0
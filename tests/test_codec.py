@@ -0,0 +1,91 @@
+"""Tests for the JSON codec layer and raw-bytes passthrough."""
+import json
+import os
+import httpx
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+import codec
+from app import app
+from admission import used_tokens
+from rate_limit import limiter
+
+client = TestClient(app)
+HEADERS = {"X-API-KEY": "test-secret-key"}
+
+
+def test_select_backend():
+    name, dumps, loads = codec.select_backend("auto")
+    assert name in ("orjson", "msgspec", "json")
+    assert loads(dumps({"a": ["é", 1]})) == {"a": ["é", 1]}
+    assert codec.select_backend("json")[0] == "json"
+    assert codec.select_backend("no-such-codec")[0] == "json"
+    # Compact, unescaped output like FastAPI's JSONResponse
+    assert codec.select_backend("json")[1]({"a": "é"}) == '{"a":"é"}'.encode("utf-8")
+
+
+def test_looks_like_completion():
+    good = b' {"id": "x", "choices": [{"message": {"content": "say \\"error\\": no"}}]}\n'
+    assert codec.looks_like_completion(good)
+    assert not codec.looks_like_completion(b'{"error": {"message": "bad"}, "choices": [{"message": {}}]}')
+    assert not codec.looks_like_completion(b'{"choices": []}')
+    assert not codec.looks_like_completion(b'[{"choices": "message"}]')
+    assert not codec.looks_like_completion({"choices": []})
+
+
+def test_used_tokens_from_raw_bytes():
+    assert used_tokens(b'{"choices": [], "usage": {"prompt_tokens": 3, "total_tokens": 42}}') == 42
+    assert used_tokens(b'{"choices": []}') is None
+
+
+def _upstream(body, seen):
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, content=body, headers={"Content-Type": "application/json"})
+
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_completion_bytes_are_forwarded_untouched(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(codec, "passthrough", True)
+    body = b'{"id": "raw",  "choices": [{"message": {"role": "assistant", "content": "\\u00e9"}}], "usage": {"total_tokens": 7}}'
+    seen = []
+    with patch("upstream.httpx.AsyncClient", side_effect=_upstream(body, seen)):
+        response = client.post("/v1/chat/completions", headers=HEADERS, json={
+            "model": "passthrough-test", "messages": [{"role": "user", "content": "raw please"}]
+        })
+    assert response.status_code == 200
+    assert response.content == body
+    assert response.headers["content-type"] == "application/json"
+    # The request was encoded by the codec, not re-encoded by httpx
+    assert json.loads(seen[0].content)["messages"] == [{"role": "user", "content": "raw please"}]
+    assert seen[0].headers["content-type"] == "application/json"
+
+
+def test_upstream_error_body_falls_back_to_validation(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(codec, "passthrough", True)
+    with patch("upstream.httpx.AsyncClient", side_effect=_upstream(b'{"error": {"message": "quota exceeded"}}', [])):
+        response = client.post("/v1/chat/completions", headers=HEADERS, json={
+            "model": "passthrough-test", "messages": [{"role": "user", "content": "error please"}]
+        })
+    assert response.status_code == 502
+    assert "quota exceeded" in response.json()["detail"]
+
+
+def test_passthrough_disabled_validates_and_reencodes(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(codec, "passthrough", False)
+    body = b'{"id": "parsed",  "choices": [{"message": {"role": "assistant", "content": "hi"}}]}'
+    with patch("upstream.httpx.AsyncClient", side_effect=_upstream(body, [])):
+        response = client.post("/v1/chat/completions", headers=HEADERS, json={
+            "model": "passthrough-test", "messages": [{"role": "user", "content": "parse please"}]
+        })
+    assert response.status_code == 200
+    assert response.content == codec.dumps(json.loads(body))
@@ -0,0 +1,165 @@
+"""Tests for GitHub Copilot streaming over SSE and /ws/chat."""
+import asyncio
+import json
+import os
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+import metrics
+from app import app
+from adapters.copilot_adapter import CopilotAdapter
+from providers import providers
+from rate_limit import limiter
+
+client = TestClient(app)
+HEADERS = {"X-API-KEY": "test-secret-key"}
+
+CHUNKS = [
+    {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"role": "assistant", "content": "de"}}]},
+    {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": "f f():"}}]},
+]
+UPSTREAM_BODY = (
+    "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in CHUNKS) + ": keep-alive\n\ndata: [DONE]\n\n"
+).encode("utf-8")
+
+
+def _copilot_upstream(status_code=200, body=UPSTREAM_BODY, requests=None, delay=0.0):
+    """An httpx client whose upstream streams ``body`` in awkward 7-byte pieces, ``delay`` seconds after its headers."""
+    class Body(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            await asyncio.sleep(delay)
+            for i in range(0, len(body), 7):
+                yield body[i:i + 7]
+
+    def handler(request):
+        if requests is not None:
+            requests.append(request)
+        return httpx.Response(status_code, headers={"Content-Type": "text/event-stream"}, stream=Body())
+
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+@pytest.fixture
+def copilot(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(providers.get("github-copilot"), "api_key", "gh-test-key")
+
+
+@pytest.mark.asyncio
+async def test_adapter_yields_parsed_deltas():
+    requests = []
+    async with _copilot_upstream(requests=requests)() as http:
+        adapter = CopilotAdapter(api_key="gh-test-key", base_url="https://copilot.test", client=http)
+        chunks = [chunk async for chunk in adapter.stream_chat_completion([{"role": "user", "content": "hi"}])]
+    assert chunks == CHUNKS
+    assert requests[0].headers["Accept"] == "text/event-stream"
+    assert json.loads(requests[0].content)["stream"] is True
+
+
+@pytest.mark.asyncio
+async def test_adapter_raises_with_error_body():
+    async with _copilot_upstream(401, b'{"message": "Bad credentials"}')() as http:
+        adapter = CopilotAdapter(api_key="gh-test-key", base_url="https://copilot.test", client=http)
+        with pytest.raises(httpx.HTTPStatusError) as exc:
+            async for _ in adapter.stream_chat_completion([{"role": "user", "content": "hi"}]):
+                pass
+    assert "Bad credentials" in exc.value.response.text
+
+
+def test_http_stream_from_copilot(copilot):
+    requests = []
+    with patch("upstream.httpx.AsyncClient", side_effect=_copilot_upstream(requests=requests)):
+        response = client.post("/v1/chat/completions", headers=HEADERS, json={
+            "model": "copilot-gpt-4", "stream": True, "messages": [{"role": "user", "content": "stream code"}]
+        })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    frames = response.text.split("\n\n")[:3]
+    assert [json.loads(frame[len("data: "):]) for frame in frames[:2]] == CHUNKS
+    assert frames[2] == "data: [DONE]"
+    assert str(requests[0].url).endswith("/chat/completions")
+
+
+def test_http_stream_error_is_framed(copilot):
+    with patch("upstream.httpx.AsyncClient", side_effect=_copilot_upstream(403, b"forbidden")):
+        response = client.post("/v1/chat/completions", headers=HEADERS, json={
+            "model": "copilot-gpt-4", "stream": True, "messages": [{"role": "user", "content": "denied stream"}]
+        })
+    assert response.status_code == 200
+    error = json.loads(response.text.split("\n\n")[0][len("data: "):])
+    assert error == {"error": "GitHub Copilot API error: forbidden", "type": "error"}
+
+
+def test_websocket_streams_copilot(copilot):
+    with patch("upstream.httpx.AsyncClient", side_effect=_copilot_upstream()):
+        with client.websocket_connect("/ws/chat?api_key=test-secret-key") as websocket:
+            websocket.send_json({"model": "copilot-gpt-4", "messages": [{"role": "user", "content": "ws code"}]})
+            frames = [websocket.receive_text() for _ in range(3)]
+    assert [json.loads(frame[len("data: "):]) for frame in frames[:2]] == CHUNKS
+    assert frames[2] == "data: [DONE]\n\n"
+
+
+def test_websocket_copilot_error_frame(copilot):
+    with patch("upstream.httpx.AsyncClient", side_effect=_copilot_upstream(500, b"boom")):
+        with client.websocket_connect("/ws/chat?api_key=test-secret-key") as websocket:
+            websocket.send_json({"model": "copilot-gpt-4", "messages": [{"role": "user", "content": "ws error"}]})
+            frame = websocket.receive_json()
+    assert frame == {"error": "GitHub Copilot API error: 500", "type": "error"}
+
+
+def test_websocket_copilot_not_configured(monkeypatch):
+    monkeypatch.setattr(providers.get("github-copilot"), "api_key", None)
+    with client.websocket_connect("/ws/chat?api_key=test-secret-key") as websocket:
+        websocket.send_json({"model": "copilot-gpt-4", "messages": [{"role": "user", "content": "no key"}]})
+        frame = websocket.receive_json()
+    assert "not configured" in frame["error"]
+
+
+def test_provider_timeouts_reach_copilot_requests(copilot, monkeypatch):
+    copilot_provider = providers.get("github-copilot")
+    monkeypatch.setattr(copilot_provider, "timeout", 7.0)
+    monkeypatch.setattr(copilot_provider, "stream_timeout", 11.0)
+    timeouts = []
+
+    def handler(request):
+        timeouts.append(request.extensions["timeout"]["read"])
+        if json.loads(request.content)["stream"]:
+            return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=UPSTREAM_BODY)
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": "ok"}}]})
+
+    real_client = httpx.AsyncClient
+    upstream = lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+    with patch("upstream.httpx.AsyncClient", side_effect=upstream):
+        for stream in (False, True):
+            response = client.post("/v1/chat/completions", headers=HEADERS, json={
+                "model": "copilot-gpt-4", "stream": stream, "messages": [{"role": "user", "content": f"timeout {stream}"}]
+            })
+            assert response.status_code == 200
+    assert timeouts == [7.0, 11.0]
+
+
+@pytest.mark.asyncio
+async def test_copilot_stream_is_timed_when_it_opens(copilot):
+    copilot_provider = providers.get("github-copilot")
+    statuses = metrics.upstream_requests_total
+    payload = {"model": "copilot-timing", "messages": [{"role": "user", "content": "hi"}]}
+    with patch("upstream.httpx.AsyncClient", side_effect=_copilot_upstream(delay=0.2)):
+        frames = [frame async for frame in copilot_provider.stream(payload)]
+    assert frames[-1] == "data: [DONE]\n\n"
+    # Recorded once, when the headers arrived rather than with the slow first chunk
+    assert statuses.labels("github-copilot", "copilot-timing", "200").value == 1
+    assert metrics.upstream_latency.labels("github-copilot", "copilot-timing").sum < 0.2
+    assert metrics.model_stats.estimate("copilot-timing")["ttft"] >= 0.2
+
+    with patch("upstream.httpx.AsyncClient", side_effect=_copilot_upstream(401, b"{}")):
+        with pytest.raises(httpx.HTTPStatusError):
+            async for _ in copilot_provider.stream(payload):
+                pass
+    assert statuses.labels("github-copilot", "copilot-timing", "401").value == 1
@@ -0,0 +1,169 @@
+"""Tests for multi-key authentication, allowlists and per-key quotas."""
+import hashlib
+import json
+import os
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from keystore import KeyStore, api_keys, parse_keys_spec
+from rate_limit import MemoryStore, RateLimitExceeded, limiter
+
+client = TestClient(app)
+HEADERS = {"X-API-KEY": "test-secret-key"}
+
+
+def test_parse_keys_spec_and_invalid_entries_are_skipped():
+    digest = hashlib.sha256(b"team-b-key").hexdigest()
+    spec = f"team-a=key-a;models=sonar*|gpt-5.2;rpm=60;tpm=1000, team-b=sha256:{digest};admin=yes, broken, bad=x;rpm=-1"
+    entries = parse_keys_spec(spec)
+    assert entries[0] == {"name": "team-a", "key": "key-a", "models": "sonar*|gpt-5.2", "rpm": "60", "tpm": "1000"}
+    store = KeyStore(secret="root", spec=spec)
+    assert len(store) == 3
+    team_a = store.lookup("key-a")
+    assert team_a.name == "team-a" and not team_a.admin
+    assert team_a.allows("sonar-pro") and team_a.allows("gpt-5.2") and not team_a.allows("gpt-5.2-mini")
+    assert (team_a.rpm.count, team_a.tpm.count) == (60, 1000)
+    assert store.lookup(b"team-b-key").admin
+    assert store.lookup("root").name == "default"
+    assert store.lookup("sha256:" + digest) is None
+    assert store.lookup("") is None and store.lookup(None) is None
+    assert "key-a" not in json.dumps(store.stats())
+
+
+def test_key_file_is_reloaded_without_losing_usage(tmp_path):
+    path = tmp_path / "keys.json"
+    path.write_text(json.dumps({"keys": [{"name": "ops", "key": "one", "admin": True}]}))
+    store = KeyStore(path=str(path), reload_interval=0)
+    ops = store.lookup("one")
+    store.record_usage(ops, 5)
+
+    path.write_text(json.dumps([{"name": "ops", "key": "two"}, {"name": "new", "key": "three"}]))
+    os.utime(path, ns=(0, 10 ** 9))
+    assert store.lookup("one") is None
+    assert store.lookup("two").name == "ops" and not store.lookup("two").admin
+    assert store.stats()["keys"]["ops"]["tokens_used"] == 5
+
+    # A broken file keeps the previous table
+    path.write_text("{not json")
+    assert store.lookup("three").name == "new"
+    assert store.reload_errors == 1
+    with pytest.raises(ValueError):
+        store.reload()
+    assert len(store) == 2
+
+
+def test_missing_key_file_still_serves_the_other_keys(tmp_path):
+    store = KeyStore(secret="root", path=str(tmp_path / "missing.json"))
+    assert store.lookup("root").name == "default"
+    assert store.reload_errors == 1
+
+
+@pytest.mark.asyncio
+async def test_rpm_and_tpm_quotas():
+    store = KeyStore(spec="a=ka;rpm=2,b=kb;tpm=100", store=MemoryStore())
+    a, b = store.lookup("ka"), store.lookup("kb")
+    await store.check_quota(a, 10)
+    await store.check_quota(a, 10)
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        await store.check_quota(a, 10)
+    assert excinfo.value.scope == "key:a:rpm"
+    await store.check_quota(b, 60)
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        await store.check_quota(b, 60)
+    assert excinfo.value.scope == "key:b:tpm"
+    assert store.stats()["keys"]["a"]["requests"] == 2
+    assert store.stats()["keys"]["b"]["rejected"] == {"tpm": 1}
+
+
+@pytest.fixture
+def team_keys(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(api_keys, "spec", "team=team-key;models=sonar*;rpm=2")
+    monkeypatch.setattr(api_keys, "store", MemoryStore())
+    api_keys.reload()
+    yield {"X-API-KEY": "team-key"}
+    monkeypatch.undo()
+    api_keys.reload()
+
+
+def _upstream():
+    def handler(request):
+        return httpx.Response(200, json={
+            "choices": [{"message": {"role": "assistant", "content": "ok"}}], "usage": {"total_tokens": 9}
+        })
+
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_team_key_allowlist_quota_and_admin_paths(team_keys):
+    with patch("upstream.httpx.AsyncClient", side_effect=_upstream()):
+        for i in range(2):
+            response = client.post("/v1/chat/completions", headers=team_keys, json={
+                "model": "sonar-pro", "messages": [{"role": "user", "content": f"team question {i}"}]
+            })
+            assert response.status_code == 200
+        response = client.post("/v1/chat/completions", headers=team_keys, json={
+            "model": "sonar-pro", "messages": [{"role": "user", "content": "one too many"}]
+        })
+        assert response.status_code == 429
+        assert response.headers["X-RateLimit-Scope"] == "key:team:rpm"
+
+    response = client.post("/v1/chat/completions", headers=team_keys, json={
+        "model": "gpt-5.2", "messages": [{"role": "user", "content": "not allowed"}]
+    })
+    assert response.status_code == 403
+
+    assert client.get("/admin/keys", headers=team_keys).status_code == 403
+    stats = client.get("/admin/keys", headers=HEADERS).json()
+    assert stats["keys"]["team"]["requests"] == 2
+    assert stats["keys"]["team"]["tokens_used"] == 18
+    assert stats["keys"]["team"]["rejected"] == {"rpm": 1, "model": 1}
+    assert client.post("/admin/keys/reload", headers=HEADERS).json() == {"status": "reloaded", "keys": 2}
+
+
+def test_streamed_requests_count_towards_key_usage(team_keys):
+    def handler(request):
+        body = b"".join(b'data: {"choices": [{"delta": {"content": "x"}}]}\n\n' for _ in range(4)) + b"data: [DONE]\n\n"
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body)
+
+    real_client = httpx.AsyncClient
+    upstream = lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+    with patch("upstream.httpx.AsyncClient", side_effect=upstream):
+        response = client.post("/v1/chat/completions", headers=team_keys, json={
+            "model": "sonar-pro", "stream": True, "messages": [{"role": "user", "content": "team stream"}]
+        })
+        assert response.text.endswith("data: [DONE]\n\n")
+    usage = client.get("/admin/keys", headers=HEADERS).json()["keys"]["team"]
+    assert usage["requests"] == 1 and usage["tokens_used"] == 4
+
+
+def test_websocket_streams_count_towards_key_usage(team_keys):
+    def handler(request):
+        body = b"".join(b'data: {"choices": [{"delta": {"content": "x"}}]}\n\n' for _ in range(3)) + b"data: [DONE]\n\n"
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body)
+
+    real_client = httpx.AsyncClient
+    upstream = lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+    with patch("upstream.httpx.AsyncClient", side_effect=upstream):
+        with client.websocket_connect("/ws/chat?api_key=team-key") as websocket:
+            websocket.send_text(json.dumps({"model": "sonar-pro", "messages": [{"role": "user", "content": "ws usage"}]}))
+            while websocket.receive_text() != "data: [DONE]\n\n":
+                pass
+    usage = client.get("/admin/keys", headers=HEADERS).json()["keys"]["team"]
+    assert usage["requests"] == 1 and usage["tokens_used"] == 3
+
+
+def test_websocket_applies_the_key_allowlist(team_keys):
+    with client.websocket_connect("/ws/chat?api_key=team-key") as websocket:
+        websocket.send_text(json.dumps({"model": "gpt-5.2", "messages": [{"role": "user", "content": "hi"}]}))
+        frame = json.loads(websocket.receive_text())
+    assert frame["type"] == "error"
+    assert "not allowed to use model" in frame["error"]
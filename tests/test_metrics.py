@@ -0,0 +1,163 @@
+"""Tests for the in-process metrics and the /metrics endpoint."""
+import json
+import os
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+import metrics
+from app import app
+from metrics import MetricsRegistry, SharedMetrics, UpstreamTimer, instrument_stream, snapshot_samples
+
+
+def test_counter_and_histogram_render_prometheus_text():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_requests_total", "Requests.", ("model",))
+    histogram = registry.histogram("test_latency_seconds", "Latency.", ("model",), buckets=(0.1, 1.0))
+    counter.labels("a").inc()
+    counter.labels("a").inc(2)
+    for value in (0.05, 0.5, 5.0):
+        histogram.labels("a").observe(value)
+
+    text = registry.render()
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{model="a"} 3' in text
+    assert 'test_latency_seconds_bucket{model="a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{model="a",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{model="a",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{model="a"} 3' in text
+    assert 'test_latency_seconds_sum{model="a"} 5.55' in text
+
+
+def test_label_values_are_escaped_and_series_are_capped(monkeypatch):
+    monkeypatch.setattr(metrics, "MAX_SERIES", 2)
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test.", ("model",))
+    counter.labels('we"ird').inc()
+    counter.labels("b").inc()
+    counter.labels("c").inc()
+    counter.labels("d").inc()
+
+    text = registry.render()
+    assert 'test_total{model="we\\"ird"} 1' in text
+    assert 'test_total{model="overflow"} 2' in text
+
+
+def _worker_registry(requests, connections, cache_entries):
+    registry = MetricsRegistry()
+    registry.counter("test_requests_total", "Requests.", ("model",)).labels("a").inc(requests)
+    registry.gauge("test_connections", "Connections.").labels().set(connections)
+    registry.histogram("test_latency_seconds", "Latency.", buckets=(1.0,)).labels().observe(0.5)
+    registry.register_collector(lambda: [("test_cache_entries", {}, cache_entries)])
+    return registry
+
+
+def test_shared_metrics_aggregate_workers(tmp_path, monkeypatch):
+    exited_pid = 2 ** 22 + 12345
+    monkeypatch.setattr(metrics, "_process_alive", lambda pid: pid != exited_pid)
+    other = SharedMetrics(_worker_registry(5, 3, 7), str(tmp_path))
+    for pid in (1001, exited_pid):
+        with patch.object(metrics.os, "getpid", return_value=pid):
+            other.flush()
+
+    shared = SharedMetrics(_worker_registry(1, 1, 2), str(tmp_path))
+    text = shared.render()
+    # Counters and histograms include the exited worker; gauges only count live ones
+    assert 'test_requests_total{model="a"} 11' in text
+    assert "test_latency_seconds_count 3" in text
+    assert "test_connections 4" in text
+    assert 'test_cache_entries{worker="1001"} 7' in text
+    assert f'test_cache_entries{{worker="{os.getpid()}"}} 2' in text
+    assert str(exited_pid) not in text
+
+    # The exited worker's snapshot was folded into the archive and keeps counting
+    assert sorted(os.listdir(tmp_path)) == [".lock", "1001.json", f"{os.getpid()}.json", "exited.json"]
+    assert 'test_requests_total{model="a"} 11' in shared.render()
+
+
+def test_snapshot_samples_flattens_and_labels():
+    samples = snapshot_samples(
+        "bridge_pool",
+        {"started": True, "mode": "h2", "providers": {"perplexity": {"in_flight": 2}}},
+        {"providers": "provider"}
+    )
+    assert ("bridge_pool_started", {}, 1.0) in samples
+    assert ("bridge_pool_providers_in_flight", {"provider": "perplexity"}, 2.0) in samples
+    assert all(name != "bridge_pool_mode" for name, _, _ in samples)
+
+
+def test_upstream_timer_records_status_once():
+    with UpstreamTimer("test-provider", "timer-model") as call:
+        call.done(429)
+    with pytest.raises(httpx.ConnectError):
+        with UpstreamTimer("test-provider", "timer-model"):
+            raise httpx.ConnectError("refused")
+
+    statuses = metrics.upstream_requests_total._children
+    assert statuses[("test-provider", "timer-model", "429")].value == 1
+    assert statuses[("test-provider", "timer-model", "error")].value == 1
+
+
+@pytest.mark.asyncio
+async def test_instrument_stream_records_ttft_duration_and_bytes():
+    async def source():
+        yield "data: a\n\n"
+        yield "data: é\n\n"
+
+    chunks = [c async for c in instrument_stream(source(), "test", "stream-model", "p")]
+    assert len(chunks) == 2
+    assert metrics.bytes_proxied.labels("test", "stream-model", "p").value == len("data: a\n\ndata: é\n\n".encode())
+    assert sum(metrics.time_to_first_token.labels("test", "stream-model", "p").counts) == 1
+    assert sum(metrics.stream_duration.labels("test", "stream-model", "p").counts) == 1
+    assert metrics.streams_in_flight.labels("test").value == 0
+
+
+def _one_chunk_upstream():
+    def handler(request):
+        body = b'data: {"choices": [{"delta": {"content": "hi"}}]}\n\ndata: [DONE]\n\n'
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body)
+
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_metrics_endpoint_reports_websocket_streams():
+    client = TestClient(app)
+    assert client.get("/metrics").status_code == 401
+
+    with patch("upstream.httpx.AsyncClient", side_effect=_one_chunk_upstream()):
+        with client.websocket_connect("/ws/chat?api_key=test-secret-key") as ws:
+            ws.send_text(json.dumps({"model": "metrics-test", "messages": [{"role": "user", "content": "hi"}]}))
+            while ws.receive_text() != "data: [DONE]\n\n":
+                pass
+
+    response = client.get("/metrics", headers={"X-API-KEY": "test-secret-key"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'bridge_requests_total{endpoint="ws_chat",model="metrics-test",provider="perplexity",status="200"}' in text
+    assert 'bridge_upstream_requests_total{provider="perplexity",model="metrics-test",status="200"}' in text
+    assert 'bridge_time_to_first_token_seconds_count{endpoint="ws_chat",model="metrics-test",provider="perplexity"}' in text
+    assert "bridge_websocket_frames_sent" in text
+    assert "bridge_cancellations_cancelled_streams" in text
+
+
+def test_collector_samples_are_grouped_by_family():
+    registry = MetricsRegistry()
+    registry.register_collector(lambda: snapshot_samples(
+        "pool", {"providers": {"a": {"requests": 1, "idle": 0}, "b": {"requests": 2, "idle": 1}}}, {"providers": "provider"}
+    ))
+    lines = registry.render().splitlines()
+    assert lines == [
+        "# TYPE pool_providers_requests untyped",
+        'pool_providers_requests{provider="a"} 1',
+        'pool_providers_requests{provider="b"} 2',
+        "# TYPE pool_providers_idle untyped",
+        'pool_providers_idle{provider="a"} 0',
+        'pool_providers_idle{provider="b"} 1',
+    ]
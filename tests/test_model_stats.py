@@ -0,0 +1,120 @@
+"""Tests for the rolling per-model estimates and /models/stats."""
+import asyncio
+import os
+
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+import metrics
+from app import app
+from metrics import UpstreamTimer
+from model_stats import ModelStats, parse_prices, usage_tokens
+
+HEADERS = {"X-API-KEY": "test-secret-key"}
+
+
+def test_estimates_decay_with_half_life():
+    stats = ModelStats(half_life=10, prices={"m": 2.0})
+    stats.record("m", 2.0, ttft=0.5, completion_tokens=30, total_tokens=100, now=0)
+    estimate = stats.estimate("m", now=0)
+    assert estimate["ttft"] == 0.5 and estimate["latency"] == 2.0
+    # 30 tokens over the 1.5s after the first one, 100 tokens at $2 per 1K
+    assert estimate["tokens_per_second"] == 20.0 and estimate["cost"] == 0.2
+    assert estimate["error_rate"] == 0.0 and estimate["samples"] == 1.0
+
+    # One half-life later the first sample weighs half as much as the new one
+    stats.record("m", 5.0, now=10)
+    estimate = stats.estimate("m", now=10)
+    assert estimate["latency"] == pytest.approx(4.0) and estimate["ttft"] == pytest.approx(3.5)
+    assert estimate["samples"] == 1.5 and estimate["cost"] == 0.2
+    stats.record("m", 9.0, error=True, now=10)
+    estimate = stats.estimate("m", now=30)
+    assert estimate["error_rate"] == pytest.approx(0.4) and estimate["latency"] == pytest.approx(4.0)
+    assert estimate["samples"] == pytest.approx(2.5 / 4) and estimate["age"] == 20
+    assert (estimate["calls"], estimate["errors"]) == (3, 1)
+    assert stats.estimate("unknown") is None
+
+
+def test_snapshot_loads_into_another_estimator():
+    bridge = ModelStats(half_life=60)
+    for latency in (1.0, 2.0, 3.0):
+        bridge.record("m", latency, now=100)
+    local = ModelStats(half_life=60)
+    assert local.load({"m": bridge.estimate("m", now=160), "bad": {"samples": "x"}, "none": None}, now=0) == 1
+    loaded, original = local.estimate("m", now=0), bridge.estimate("m", now=160)
+    assert loaded.pop("age") == 0 and original.pop("age") == 60
+    assert loaded == original and loaded["samples"] == 1.5
+    # Local samples blend in with the loaded weight
+    local.record("m", 8.0, now=0)
+    assert local.estimate("m", now=0)["latency"] == pytest.approx((2.0 * 1.5 + 8.0) / 2.5)
+
+
+def test_usage_and_price_parsing():
+    assert usage_tokens(b'{"usage": {"prompt_tokens": 5, "completion_tokens": 7, "total_tokens": 12}}') == (7, 12)
+    assert usage_tokens({"usage": {"total_tokens": 3}}) == (None, 3)
+    assert usage_tokens(b"{}") == usage_tokens({"usage": "n/a"}) == usage_tokens(None) == (None, None)
+    assert parse_prices("a=0.5, b = 1,bad=x,=3,c") == {"a": 0.5, "b": 1.0}
+
+
+def test_upstream_timer_records_model_failures_only():
+    with UpstreamTimer("p", "stats-errors") as call:
+        call.done(503)
+    with pytest.raises(httpx.ConnectError):
+        with UpstreamTimer("p", "stats-errors"):
+            raise httpx.ConnectError("refused")
+    # Client errors and abandoned calls say nothing about the model
+    with UpstreamTimer("p", "stats-errors") as call:
+        call.done(404)
+    with pytest.raises(asyncio.CancelledError):
+        with UpstreamTimer("p", "stats-errors") as call:
+            call.done(200)
+            raise asyncio.CancelledError()
+    estimate = metrics.model_stats.estimate("stats-errors")
+    assert (estimate["calls"], estimate["errors"], estimate["latency"]) == (2, 2, None)
+
+
+def _upstream():
+    def handler(request):
+        if b'"stream": true' in request.content or b'"stream":true' in request.content:
+            body = b"".join(
+                b'data: {"choices": [{"delta": {"content": "x"}}]}\n\n' for _ in range(3)
+            ) + b"data: [DONE]\n\n"
+            return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body)
+        return httpx.Response(200, json={
+            "choices": [{"message": {"role": "assistant", "content": "hi"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 40, "total_tokens": 50}
+        })
+
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_bridge_records_calls_and_serves_stats(monkeypatch):
+    monkeypatch.setitem(metrics.model_stats.prices, "stats-model", 4.0)
+    client = TestClient(app)
+    messages = [{"role": "user", "content": "hi"}]
+    with patch("upstream.httpx.AsyncClient", side_effect=_upstream()):
+        response = client.post("/v1/chat/completions", headers=HEADERS, json={"model": "stats-model", "messages": messages})
+        assert response.status_code == 200
+        response = client.post("/v1/chat/completions", headers=HEADERS,
+                               json={"model": "stats-stream", "messages": messages, "stream": True})
+        assert response.text.endswith("data: [DONE]\n\n")
+
+    assert client.get("/models/stats").status_code == 401
+    data = client.get("/models/stats", headers=HEADERS).json()
+    assert data["half_life"] == metrics.model_stats.half_life
+    plain, streamed = data["models"]["stats-model"], data["models"]["stats-stream"]
+    assert plain["calls"] == 1 and plain["errors"] == 0 and plain["error_rate"] == 0
+    assert plain["ttft"] == plain["latency"] > 0 and plain["tokens_per_second"] > 0
+    assert plain["cost"] == pytest.approx(0.2)
+    assert streamed["calls"] == 1 and 0 < streamed["ttft"] <= streamed["latency"]
+    assert streamed["tokens_per_second"] > 0 and streamed["cost"] is None
+
+    text = client.get("/metrics", headers=HEADERS).text
+    assert 'bridge_model_stats_models_calls{model="stats-model"} 1' in text
@@ -168,3 +168,43 @@ def test_specific_expected_models():
     
     for expected_id in expected_models:
         assert expected_id in model_ids, f"Expected model not found: {expected_id}"
+
+
+def test_models_etag_and_not_modified():
+    """Test /models is served with a strong ETag and answers 304 when unchanged."""
+    response = client.get("/models")
+    etag = response.headers["ETag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+    assert "max-age=" in response.headers["Cache-Control"]
+
+    cached = client.get("/models", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["ETag"] == etag
+
+    # Weak comparison and lists of tags are accepted
+    assert client.get("/models", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/models", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_models_filtering():
+    """Test filtering /models by provider and category."""
+    search = client.get("/models", params={"category": "search"}).json()
+    assert search["models"] and all(m["category"] == "search" for m in search["models"])
+    assert [m["id"] for m in search["data"]] == [m["id"] for m in search["models"]]
+
+    both = client.get("/models", params={"provider": "perplexity", "category": "general"})
+    assert {m["id"] for m in both.json()["models"]} == {"llama-3.1-70b-instruct", "mistral-7b-instruct"}
+    assert both.headers["ETag"] != client.get("/models").headers["ETag"]
+
+    assert client.get("/models", params={"provider": "nope"}).json() == {"models": [], "data": []}
+
+
+def test_models_rebuilt_when_configuration_changes(monkeypatch):
+    """Test the cached catalogue is rebuilt when a provider becomes configured."""
+    from providers import providers
+    before = client.get("/models", params={"provider": "github-copilot"})
+    monkeypatch.setattr(providers.get("github-copilot"), "api_key", "gh-test-key")
+    after = client.get("/models", params={"provider": "github-copilot"})
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert {m["id"] for m in after.json()["models"]} == {"copilot-gpt-4", "copilot-agent"}
@@ -0,0 +1,131 @@
+"""Tests for the provider registry and configured OpenAI-compatible backends."""
+import json
+import os
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from catalog import model_catalog
+from providers import Provider, ProviderRegistry, local_providers, parse_models, providers
+from rate_limit import limiter
+from upstream import UpstreamPool
+
+client = TestClient(app)
+HEADERS = {"X-API-KEY": "test-secret-key"}
+
+
+def make_registry():
+    registry = ProviderRegistry(default="perplexity")
+    registry.register(Provider("perplexity", "https://pplx.test", models=[{"id": "sonar-pro"}]))
+    registry.register(Provider("github-copilot", "https://copilot.test", prefixes=("copilot-",)))
+    registry.register(Provider("llamacpp", "http://llama.test", models=parse_models("qwen-coder, copilot-local", "llamacpp"), prefixes=("local/",)))
+    return registry
+
+
+def test_resolve_uses_exact_ids_then_prefixes_then_default():
+    registry = make_registry()
+    assert registry.provider_name("sonar-pro") == "perplexity"
+    assert registry.provider_name("qwen-coder") == "llamacpp"
+    # An exact id beats another provider's prefix
+    assert registry.provider_name("copilot-local") == "llamacpp"
+    assert registry.provider_name("copilot-gpt-4") == "github-copilot"
+    assert registry.provider_name("local/anything") == "llamacpp"
+    assert registry.provider_name("unknown-model") == "perplexity"
+
+
+def test_resolve_memo_is_bounded(monkeypatch):
+    monkeypatch.setattr("providers.MAX_RESOLVED", 4)
+    registry = make_registry()
+    for i in range(20):
+        assert registry.provider_name(f"model-{i}") == "perplexity"
+    assert len(registry._resolved) <= 4 + len(registry._index)
+    assert registry.provider_name("qwen-coder") == "llamacpp"
+
+
+def test_local_providers_from_environment(monkeypatch):
+    monkeypatch.setenv("PROVIDER_LLAMA_CPP_URL", "http://127.0.0.1:8080/v1/chat/completions")
+    monkeypatch.setenv("PROVIDER_LLAMA_CPP_MODELS", "qwen2.5-coder-7b,,llama-3.1-8b")
+    monkeypatch.setenv("PROVIDER_LLAMA_CPP_TIMEOUT", "300")
+    monkeypatch.setenv("PROVIDER_LLAMA_CPP_MAX_CONNECTIONS", "4")
+    monkeypatch.setenv("PROVIDER_LLAMA_CPP_STREAM_TIMEOUT", "soon")
+    built = local_providers(["llama-cpp", "missing-url"])
+    assert len(built) == 1
+    backend = built[0]
+    assert backend.configured
+    assert [m["id"] for m in backend.models] == ["qwen2.5-coder-7b", "llama-3.1-8b"]
+    assert backend.models[0]["provider"] == "llama-cpp"
+    assert (backend.timeout, backend.stream_timeout, backend.max_connections) == (300.0, 120.0, 4)
+    assert "Authorization" not in backend.headers()
+
+
+def test_pool_limits_per_provider():
+    pool = UpstreamPool(http2=False, max_connections=100, max_keepalive=20)
+    pool.configure("llamacpp", max_connections=4)
+    pool._counter("llamacpp")
+    entry = pool.stats()["providers"]["llamacpp"]
+    assert (entry["max_connections"], entry["max_keepalive_connections"]) == (4, 20)
+
+
+@pytest.fixture
+def local_backend(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    backend = Provider("llamacpp", "http://llama.test/v1/chat/completions", models=parse_models("qwen-coder", "llamacpp"))
+    registry = ProviderRegistry(default="perplexity")
+    for provider in providers:
+        registry.register(provider)
+    registry.register(backend)
+    monkeypatch.setattr("app.providers", registry)
+    monkeypatch.setattr(model_catalog, "registry", registry)
+    return backend
+
+
+def _upstream(handler):
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_chat_and_stream_through_local_backend(local_backend):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        body = json.loads(request.content)
+        if body["stream"]:
+            return httpx.Response(200, content=b'data: {"choices": [{"delta": {"content": "hi"}}]}\n\ndata: [DONE]\n\n')
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": "local answer"}}]})
+
+    with patch("upstream.httpx.AsyncClient", side_effect=_upstream(handler)):
+        response = client.post("/v1/chat/completions", headers=HEADERS, json={
+            "model": "qwen-coder", "messages": [{"role": "user", "content": "local please"}]
+        })
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"] == "local answer"
+
+        streamed = client.post("/v1/chat/completions", headers=HEADERS, json={
+            "model": "qwen-coder", "stream": True, "messages": [{"role": "user", "content": "local stream"}]
+        })
+        assert streamed.text.split("\n\n")[:2] == ['data: {"choices": [{"delta": {"content": "hi"}}]}', "data: [DONE]"]
+
+    assert [str(request.url) for request in seen] == ["http://llama.test/v1/chat/completions"] * 2
+    assert "authorization" not in seen[0].headers
+
+    models = client.get("/models").json()["models"]
+    assert {"id": "qwen-coder", "provider": "llamacpp"}.items() <= next(m for m in models if m["id"] == "qwen-coder").items()
+    stats = client.get("/admin/providers", headers=HEADERS).json()
+    assert stats["providers"]["llamacpp"]["url"] == "http://llama.test/v1/chat/completions"
+
+
+def test_unconfigured_provider_is_rejected(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(providers.get("github-copilot"), "api_key", None)
+    response = client.post("/v1/chat/completions", headers=HEADERS, json={
+        "model": "copilot-gpt-4", "messages": [{"role": "user", "content": "no copilot"}]
+    })
+    assert response.status_code == 400
+    assert "GITHUB_COPILOT_API_KEY" in response.json()["detail"]
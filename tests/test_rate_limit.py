@@ -0,0 +1,282 @@
+"""Tests for the token-bucket rate limiter and its stores."""
+import asyncio
+import os
+
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from app import app
+from rate_limit import (
+    FileStore, MemoryStore, RateLimitExceeded, RateLimiter, RateLimitStore, RedisError, RedisStore,
+    create_store, gcra, limiter, parse_rate, parse_rate_map
+)
+
+client = TestClient(app)
+
+
+def make_request(api_key=None, host="10.0.0.1"):
+    headers = [(b"x-api-key", api_key.encode())] if api_key else []
+    return Request({"type": "http", "method": "POST", "path": "/v1/chat/completions", "headers": headers,
+                    "client": (host, 1234), "query_string": b""})
+
+
+def test_parse_rate_variants():
+    assert parse_rate("10/minute")[:3] == (10, 60.0, 10)
+    assert parse_rate("5 per second")[:3] == (5, 1.0, 5)
+    assert parse_rate("100/h;burst=20")[:3] == (100, 3600.0, 20)
+    assert parse_rate("10/minute").interval == 6.0
+    for spec in ("", "10", "0/minute", "ten/minute", "10/fortnight"):
+        with pytest.raises(ValueError):
+            parse_rate(spec)
+
+
+def test_parse_rate_map():
+    rates = parse_rate_map("/terminal=5/minute, sonar-pro=2/second")
+    assert rates["/terminal"].count == 5
+    assert rates["sonar-pro"].period == 1.0
+    assert parse_rate_map("") == {}
+    with pytest.raises(ValueError):
+        parse_rate_map("/terminal")
+
+
+def test_gcra_allows_burst_then_rejects():
+    rate = parse_rate("2/second;burst=3")
+    tat, now = None, 100.0
+    remaining = []
+    for _ in range(3):
+        tat, decision = gcra(tat, now, rate)
+        assert decision.allowed
+        remaining.append(decision.remaining)
+    assert remaining == [2, 1, 0]
+
+    rejected_tat, decision = gcra(tat, now, rate)
+    assert rejected_tat is None and not decision.allowed
+    assert decision.retry_after == pytest.approx(0.5)
+
+    # One token refills after one interval
+    _, decision = gcra(tat, now + 0.5, rate)
+    assert decision.allowed
+
+
+@pytest.mark.asyncio
+async def test_memory_store_keys_are_independent():
+    store = MemoryStore()
+    rate = parse_rate("1/minute")
+    assert (await store.acquire("a", rate)).allowed
+    assert not (await store.acquire("a", rate)).allowed
+    assert (await store.acquire("b", rate)).allowed
+    await store.clear()
+    assert (await store.acquire("a", rate)).allowed
+
+
+@pytest.mark.asyncio
+async def test_file_store_is_shared_between_instances(tmp_path):
+    """Two stores on one file behave like two workers sharing buckets."""
+    path = str(tmp_path / "buckets.bin")
+    first, second = FileStore(path, slots=64), FileStore(path, slots=64)
+    rate = parse_rate("2/minute")
+    try:
+        assert (await first.acquire("client", rate)).allowed
+        assert (await second.acquire("client", rate)).allowed
+        decision = await first.acquire("client", rate)
+        assert not decision.allowed and decision.retry_after > 0
+        await second.clear()
+        assert (await first.acquire("client", rate)).allowed
+    finally:
+        await first.close()
+        await second.close()
+
+
+@pytest.mark.asyncio
+async def test_file_store_reuses_slots_when_full(tmp_path):
+    store = FileStore(str(tmp_path / "small.bin"), slots=4)
+    rate = parse_rate("1/minute")
+    try:
+        for n in range(20):
+            assert (await store.acquire(f"key-{n}", rate)).allowed
+    finally:
+        await store.close()
+
+
+class FakeRedis:
+    """Tiny RESP server that runs the limiter's Lua script semantics in Python."""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.data = {}
+        self.commands = []
+        self.now_us = 1_000_000_000
+
+    async def handle(self, reader, writer):
+        authed = self.password is None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                command = args[0].decode().upper()
+                self.commands.append(command)
+                if command == "AUTH":
+                    authed = args[-1].decode() == self.password
+                    writer.write(b"+OK\r\n" if authed else b"-WRONGPASS invalid password\r\n")
+                elif not authed:
+                    writer.write(b"-NOAUTH Authentication required.\r\n")
+                elif command == "SELECT":
+                    writer.write(b"+OK\r\n")
+                elif command == "EVALSHA":
+                    writer.write(b"-NOSCRIPT No matching script.\r\n")
+                elif command == "EVAL":
+                    writer.write(self._gcra(args[3].decode(), *(int(a) for a in args[4:7])))
+                elif command == "SCAN":
+                    keys = b"".join(b"$%d\r\n%s\r\n" % (len(k), k.encode()) for k in self.data)
+                    writer.write(b"*2\r\n$1\r\n0\r\n*%d\r\n%s" % (len(self.data), keys))
+                elif command == "DEL":
+                    for key in args[1:]:
+                        self.data.pop(key.decode(), None)
+                    writer.write(b":%d\r\n" % (len(args) - 1))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _gcra(self, key, interval, burst, cost):
+        now = self.now_us
+        tat = max(self.data.get(key, now), now)
+        new_tat = tat + interval * cost
+        allow_at = new_tat - burst
+        if now < allow_at:
+            return b"*3\r\n:0\r\n:0\r\n:%d\r\n" % (allow_at - now)
+        self.data[key] = new_tat
+        return b"*3\r\n:1\r\n:%d\r\n:0\r\n" % ((burst - (new_tat - now)) // interval)
+
+
+@pytest.mark.asyncio
+async def test_redis_store_against_resp_server():
+    fake = FakeRedis(password="s3cret")
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    store = RedisStore(f"redis://:s3cret@127.0.0.1:{port}/2")
+    rate = parse_rate("2/second")
+    try:
+        first = await store.acquire("client", rate)
+        assert first.allowed and first.remaining == 1
+        assert (await store.acquire("client", rate)).allowed
+        decision = await store.acquire("client", rate)
+        assert not decision.allowed
+        assert decision.retry_after == pytest.approx(0.5)
+        assert fake.commands[:4] == ["AUTH", "SELECT", "EVALSHA", "EVAL"]
+        assert "bridge:ratelimit:client" in fake.data
+
+        await store.clear()
+        assert fake.data == {}
+        # One pooled connection is reused for every call
+        assert fake.commands.count("AUTH") == 1
+    finally:
+        await store.close()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_redis_store_closes_rejected_connections():
+    fake = FakeRedis(password="s3cret")
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    store = RedisStore(f"redis://:wrong@127.0.0.1:{port}/2")
+    try:
+        for _ in range(2):
+            with pytest.raises(RedisError, match="WRONGPASS"):
+                await store.acquire("client", parse_rate("2/second"))
+        assert store._idle == []
+        assert fake.commands == ["AUTH", "AUTH"]
+    finally:
+        await store.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_create_store_specs(tmp_path):
+    assert isinstance(create_store("memory"), MemoryStore)
+    assert isinstance(create_store(f"file:{tmp_path / 'x.bin'}"), FileStore)
+    redis = create_store("redis://user:pw@cache:6380/3")
+    assert (redis.host, redis.port, redis.username, redis.password, redis.db) == ("cache", 6380, "user", "pw", 3)
+    with pytest.raises(ValueError):
+        create_store("memcached://localhost")
+
+
+@pytest.mark.asyncio
+async def test_limiter_scopes():
+    checker = RateLimiter(
+        MemoryStore(),
+        default=parse_rate("5/minute"),
+        routes={"/terminal": parse_rate("1/minute")},
+        per_key=parse_rate("3/minute"),
+        models={"sonar-pro": parse_rate("1/minute")}
+    )
+    await checker.check(make_request(), "/terminal")
+    with pytest.raises(RateLimitExceeded) as exc:
+        await checker.check(make_request(), "/terminal")
+    assert exc.value.scope == "route"
+    assert exc.value.headers["Retry-After"] == "60"
+
+    # Model limits are per client and per model
+    await checker.check(make_request(), "/chat", model="sonar-pro")
+    await checker.check(make_request(host="10.0.0.2"), "/chat", model="sonar-pro")
+    await checker.check(make_request(), "/chat", model="gpt-5.2")
+    with pytest.raises(RateLimitExceeded) as exc:
+        await checker.check(make_request(), "/chat", model="sonar-pro")
+    assert exc.value.scope == "model"
+
+    # The API-key limit follows the key across client addresses
+    for host in ("10.1.0.1", "10.1.0.2", "10.1.0.3"):
+        await checker.check(make_request("key-a", host), "/chat")
+    with pytest.raises(RateLimitExceeded) as exc:
+        await checker.check(make_request("key-a", "10.1.0.4"), "/chat")
+    assert exc.value.scope == "key"
+    assert checker.stats()["rejected"] == 3
+
+
+class BrokenStore(RateLimitStore):
+    name = "broken"
+
+    async def acquire(self, key, rate, cost=1):
+        raise ConnectionError("store down")
+
+
+@pytest.mark.asyncio
+async def test_limiter_fail_open_and_closed():
+    await RateLimiter(BrokenStore(), parse_rate("1/minute"), fail_open=True).check(make_request(), "/x")
+    closed = RateLimiter(BrokenStore(), parse_rate("1/minute"), fail_open=False)
+    with pytest.raises(HTTPException) as exc:
+        await closed.check(make_request(), "/x")
+    assert exc.value.status_code == 503
+    assert closed.stats()["store_errors"] == 1
+
+
+def test_endpoint_returns_429_with_retry_after(monkeypatch):
+    monkeypatch.setitem(limiter.routes, "/project/file", parse_rate("1/minute"))
+    asyncio.run(limiter.store.clear())
+    headers = {"X-API-KEY": "test-secret-key"}
+    first = client.get("/project/file", params={"path": "README.md"}, headers=headers)
+    assert first.status_code != 429
+    second = client.get("/project/file", params={"path": "README.md"}, headers=headers)
+    assert second.status_code == 429
+    assert second.headers["Retry-After"] == "60"
+    assert second.headers["X-RateLimit-Scope"] == "route"
+    assert "Rate limit exceeded" in second.json()["error"]
+    asyncio.run(limiter.store.clear())
+
+
+def test_admin_rate_limit():
+    assert client.get("/admin/rate-limit").status_code == 401
+    stats = client.get("/admin/rate-limit", headers={"X-API-KEY": "test-secret-key"}).json()
+    assert stats["store"] == "memory"
+    assert stats["default"] == "10/minute"
@@ -0,0 +1,182 @@
+"""Tests for upstream retries, the retry budget and hedged requests."""
+import asyncio
+import functools
+import os
+import time
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from rate_limit import limiter
+from breaker import CircuitBreakers
+from retry import RetryBudget, RetryPolicy, parse_retry_after, upstream_retry
+
+client = TestClient(app)
+URL = "https://upstream.test/chat/completions"
+
+
+def fast_policy(**kwargs):
+    kwargs.setdefault("base_delay", 0.001)
+    kwargs.setdefault("max_delay", 0.002)
+    kwargs.setdefault("breakers", CircuitBreakers(enabled=False))
+    return RetryPolicy(**kwargs)
+
+
+def scripted(responses):
+    """MockTransport handler answering with ``responses`` in order (exceptions are raised)."""
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        item = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(item, Exception):
+            raise item
+        if callable(item):
+            return await item()
+        return item
+
+    return handler, calls
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:10 GMT", now=1445412480.0) == 10.0
+
+
+def test_decorrelated_jitter_stays_within_bounds():
+    policy = RetryPolicy(base_delay=0.1, max_delay=2.0)
+    sleep = 0.1
+    for _ in range(50):
+        sleep = policy.backoff(sleep)
+        assert 0.1 <= sleep <= 2.0
+
+
+@pytest.mark.asyncio
+async def test_retries_transient_status_and_connect_errors():
+    handler, calls = scripted([
+        httpx.Response(429), httpx.ConnectError("refused"), httpx.Response(200, json={"ok": True})
+    ])
+    policy = fast_policy()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+        response = await policy.call("perplexity", functools.partial(http.post, URL, json={}))
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert policy.stats()["retries"] == {"429": 1, "ConnectError": 1}
+
+
+async def run(policy, responses):
+    handler, calls = scripted(responses)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+        response = await policy.call("perplexity", functools.partial(http.post, URL))
+    return response, len(calls)
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_attempts_and_on_long_retry_after():
+    response, calls = await run(fast_policy(attempts=2), [httpx.Response(503)])
+    assert (response.status_code, calls) == (503, 2)
+
+    response, calls = await run(fast_policy(max_retry_after=10), [httpx.Response(429, headers={"Retry-After": "60"})])
+    assert (response.status_code, calls) == (429, 1)
+
+    response, calls = await run(fast_policy(), [httpx.Response(400)])
+    assert (response.status_code, calls) == (400, 1)
+
+    with pytest.raises(httpx.ConnectError):
+        await run(fast_policy(attempts=2), [httpx.ConnectError("refused")])
+
+
+@pytest.mark.asyncio
+async def test_honours_retry_after():
+    handler, calls = scripted([httpx.Response(503, headers={"Retry-After": "0.05"}), httpx.Response(200)])
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+        response = await fast_policy().call("perplexity", functools.partial(http.post, URL))
+    assert response.status_code == 200
+    assert time.perf_counter() - started >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_retry_budget_stops_retry_storms():
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0, capacity=1.0)
+    handler, calls = scripted([httpx.Response(502)])
+    policy = fast_policy(attempts=5, budget=budget)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+        assert (await policy.call("perplexity", functools.partial(http.post, URL))).status_code == 502
+        # One retry from the budget, then the original answer is returned
+        assert len(calls) == 2
+        assert (await policy.call("perplexity", functools.partial(http.post, URL))).status_code == 502
+        assert len(calls) == 3
+    assert budget.exhausted == 2
+
+
+@pytest.mark.asyncio
+async def test_hedge_fires_after_p95_and_first_answer_wins():
+    async def slow():
+        await asyncio.sleep(1)
+        return httpx.Response(200, json={"attempt": "slow"})
+
+    handler, calls = scripted([slow, httpx.Response(200, json={"attempt": "hedge"})])
+    policy = fast_policy(hedge=True, hedge_min_delay=0.01)
+    for _ in range(20):
+        policy._window("perplexity").add(0.02)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+        response = await policy.call("perplexity", functools.partial(http.post, URL))
+    assert response.json() == {"attempt": "hedge"}
+    assert time.perf_counter() - started < 0.5
+    assert len(calls) == 2
+    assert policy.stats()["hedges"] == {"fired": 1, "won": 1}
+
+
+@pytest.mark.asyncio
+async def test_stream_retries_before_first_byte():
+    body = b'data: {"choices": [{"delta": {"content": "hi"}}]}\n\ndata: [DONE]\n\n'
+    handler, calls = scripted([httpx.Response(502), httpx.Response(200, content=body)])
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+        async with fast_policy().stream(http, "perplexity", "POST", URL, json={"stream": True}) as response:
+            assert response.status_code == 200
+            assert await response.aread() == body
+    assert len(calls) == 2
+
+
+def _upstream(handler):
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_chat_retries_and_forwards_retry_after(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", False)
+    monkeypatch.setattr(upstream_retry, "base_delay", 0.001)
+    monkeypatch.setattr(upstream_retry, "max_delay", 0.002)
+    headers = {"X-API-KEY": "test-secret-key"}
+    completion = {"choices": [{"message": {"role": "assistant", "content": "hi"}}]}
+
+    handler, calls = scripted([httpx.Response(502), httpx.Response(200, json=completion)])
+    with patch("upstream.httpx.AsyncClient", side_effect=_upstream(handler)):
+        response = client.post("/v1/chat/completions", headers=headers, json={
+            "model": "retry-test", "messages": [{"role": "user", "content": "retry once"}]
+        })
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+    handler, calls = scripted([httpx.Response(429, headers={"Retry-After": "30"}, json={"error": "slow down"})])
+    with patch("upstream.httpx.AsyncClient", side_effect=_upstream(handler)):
+        response = client.post("/v1/chat/completions", headers=headers, json={
+            "model": "retry-test", "messages": [{"role": "user", "content": "too many"}]
+        })
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    assert len(calls) == 1
+
+    stats = client.get("/admin/retry", headers=headers).json()
+    assert stats["retries"]["502"] >= 1
@@ -0,0 +1,167 @@
+"""Tests for the sync and async Roo adapters."""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import websockets
+
+from adapters.roo_adapter import AsyncRooAdapter, RooAdapter
+
+
+def _completion(content):
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+def _sse(*chunks):
+    return "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+
+
+def _delta(content):
+    return {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": content}}]}
+
+
+@pytest.fixture
+def bridge_server():
+    """A keep-alive HTTP server that answers with the prompt and records client ports."""
+    ports = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            ports.append(self.client_address[1])
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            data = json.dumps(_completion(body["messages"][0]["content"])).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", ports
+    server.shutdown()
+    server.server_close()
+
+
+def test_sync_adapter_reuses_its_connection(bridge_server):
+    url, ports = bridge_server
+    with RooAdapter(url=url, api_key="k") as adapter:
+        assert adapter.query("one") == "one"
+        assert adapter.query("two") == "two"
+        assert adapter.query_many(["a", "b", "c"], concurrency=2) == ["a", "b", "c"]
+        with pytest.raises(ValueError):
+            adapter.query("   ")
+    assert ports[0] == ports[1]
+
+
+def _adapter(handler, **kwargs):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return AsyncRooAdapter(url="http://bridge.test/", api_key="k", client=client, **kwargs), client
+
+
+@pytest.mark.asyncio
+async def test_query_many_bounds_concurrency_and_keeps_order():
+    in_flight = [0, 0]
+
+    async def handler(request):
+        assert request.headers["X-API-KEY"] == "k"
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0.01)
+        in_flight[0] -= 1
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        if prompt == "bad":
+            return httpx.Response(403, json={"detail": "API key 'k' is not allowed to use model 'x'"})
+        return httpx.Response(200, json=_completion(prompt.upper()))
+
+    adapter, client = _adapter(handler)
+    async with client:
+        prompts = [f"p{i}" for i in range(10)]
+        assert await adapter.query_many(prompts, concurrency=3) == [p.upper() for p in prompts]
+        assert in_flight[1] == 3
+
+        results = await adapter.query_many(["a", "bad"], return_exceptions=True)
+        assert results[0] == "A"
+        assert isinstance(results[1], RuntimeError) and "not allowed" in str(results[1])
+        with pytest.raises(RuntimeError):
+            await adapter.query_many(["a", "bad", "c"])
+        # A shared client is left open for its owner
+        await adapter.aclose()
+        assert not client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_sse_stream_yields_deltas_and_raises_on_error_frames():
+    bodies = [
+        _sse(_delta("Hel"), _delta(None), _delta("lo")),
+        f"data: {json.dumps(_delta('partial'))}\n\ndata: {json.dumps({'error': 'Upstream failed', 'type': 'error'})}\n\n",
+    ]
+    seen = []
+
+    def handler(request):
+        seen.append(json.loads(request.content))
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=bodies.pop(0))
+
+    adapter, client = _adapter(handler)
+    async with client:
+        assert [delta async for delta in adapter.stream("hi", model="sonar")] == ["Hel", "lo"]
+        assert seen[0]["stream"] is True and seen[0]["model"] == "sonar"
+        deltas = []
+        with pytest.raises(RuntimeError, match="Upstream failed"):
+            async for delta in adapter.stream("hi"):
+                deltas.append(delta)
+        assert deltas == ["partial"]
+        with pytest.raises(ValueError):
+            [delta async for delta in adapter.stream("hi", transport="grpc")]
+
+
+@pytest.mark.asyncio
+async def test_async_errors_map_to_builtin_exceptions():
+    def refuse(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    adapter, client = _adapter(refuse)
+    async with client:
+        with pytest.raises(ConnectionError):
+            await adapter.query("hi")
+
+    def slow(request):
+        raise httpx.ReadTimeout("slow", request=request)
+
+    adapter, client = _adapter(slow)
+    async with client:
+        with pytest.raises(TimeoutError):
+            await adapter.query("hi")
+
+
+@pytest.mark.asyncio
+async def test_websocket_stream():
+    received = []
+
+    async def bridge(websocket):
+        payload = json.loads(await websocket.recv())
+        received.append((websocket.request.path, payload))
+        if payload["model"] == "unknown":
+            await websocket.send(json.dumps({"error": "Invalid model", "type": "error"}))
+            return
+        for chunk in (_delta("a"), _delta("b")):
+            await websocket.send(f"data: {json.dumps(chunk)}\n\n")
+        await websocket.send("data: [DONE]\n\n")
+
+    async with websockets.serve(bridge, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        async with AsyncRooAdapter(url=f"http://127.0.0.1:{port}", api_key="k y") as adapter:
+            assert [delta async for delta in adapter.stream("hi", transport="ws")] == ["a", "b"]
+            with pytest.raises(RuntimeError, match="Invalid model"):
+                [delta async for delta in adapter.stream("hi", model="unknown", transport="ws")]
+    assert received[0][0] == "/ws/chat?api_key=k+y"
+    assert received[0][1]["stream"] is True
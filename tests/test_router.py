@@ -0,0 +1,173 @@
+"""Tests for the data-driven agent model router."""
+import json
+
+import pytest
+
+import agent.router as router_module
+from agent.router import SLO, Router, parse_rule, parse_slo
+from benchmarks.router_bench import legacy_pick, main as bench_main, workload
+from model_stats import ModelStats
+
+
+@pytest.mark.parametrize("task, model", [
+    ("Implement the login function", "copilot-gpt-4"),
+    ("Review this code and explain it", "claude-4.5-sonnet"),
+    ("Think through this complex technical problem", "claude-4.5-sonnet"),
+    ("Analyze the trade-offs", "gpt-5.2"),
+    ("Research primary sources", "sonar-pro"),
+    ("What   is a monad?", "sonar-pro"),
+    ("Summarize a large dataset", "gemini-3-pro"),
+    ("Design the architecture", "claude-4.5-sonnet"),
+    ("Write unit tests", "copilot-gpt-4"),
+    ("Generate a short story", "gpt-5.2"),
+    ("Deploy via the CI/CD pipeline", "copilot-agent"),
+    ("Say hello", "gpt-5.2"),
+])
+def test_default_rules(task, model):
+    assert Router().pick(task) == model
+
+
+def test_matches_are_scored_and_anchored_at_word_starts():
+    router = Router()
+    # First-hit routing sent these to the coding and testing rules
+    task = "Find and research sources on the function"
+    assert legacy_pick(task) == "copilot-gpt-4"
+    assert router.pick(task) == "sonar-pro"
+    assert router.scores(task) == {"sonar-pro": 21.0, "copilot-gpt-4": 9.0}
+    assert legacy_pick("Summarize the latest news") == "copilot-gpt-4"
+    assert router.pick("Summarize the latest news") == "gpt-5.2"
+    assert router.scores("Debugging a subclass") == {"copilot-gpt-4": 9.0}
+    assert router.pick_with_reasoning("Research it")[0] == "sonar-pro"
+
+
+def test_pick_batch_matches_pick():
+    router = Router()
+    tasks = workload(500, 50) + ["", "İSTANBUL code", "what\n\tis it", "unit\ntest", "(refactor) this", "ci/cd"]
+    assert router.pick_batch(tasks) == [Router().pick(task) for task in tasks]
+    assert router.pick_batch([]) == []
+
+
+def test_memo_tables_stay_bounded(monkeypatch):
+    monkeypatch.setattr(router_module, "MEMO_SIZE", 3)
+    router = Router()
+    tasks = workload(50, 50)
+    assert router.pick_batch(tasks) == [Router().pick(task) for task in tasks]
+    assert len(router._tokens) <= 3 and len(router._routes) <= 3
+
+
+def test_rules_file(tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"default": "sonar", "rules": [
+        {"name": "k8s", "model": "copilot-agent", "keywords": ["kubectl", "helm chart"], "weight": 2},
+        {"model": "claude-4.5-sonnet", "keywords": "rust"},
+    ]}))
+    monkeypatch.setattr(router_module, "ROUTER_RULES_FILE", str(path))
+    router = Router()
+    assert [rule.name for rule in router.rules] == ["k8s", "claude-4.5-sonnet"]
+    assert router.pick("Write a Helm  chart and a Rust CLI") == "copilot-agent"
+    assert router.pick("Port it to Rust") == "claude-4.5-sonnet"
+    assert router.pick("anything else") == "sonar"
+    assert Router(rules=[{"model": "x", "keywords": ["y"]}]).pick("y") == "x"
+
+    for bad in [{"keywords": ["a"]}, {"model": "m"}, {"model": "m", "keywords": [""]},
+                {"model": "m", "keywords": ["a"], "weight": 0}, {"model": "m", "keywords": [1]}]:
+        with pytest.raises(ValueError):
+            parse_rule(bad)
+    path.write_text("{not json")
+    with pytest.raises(ValueError):
+        Router()
+
+
+def test_microbenchmark_reports_json(tmp_path):
+    output = tmp_path / "router.json"
+    assert bench_main(["--tasks", "200", "--distinct", "20", "--extra-rules", "5", "--repeat", "1",
+                       "--output", str(output)]) == 0
+    results = json.loads(output.read_text())
+    assert results["tasks"] == 200 and results["rules"] == 15
+    assert set(results["ns_per_task"]) == {"legacy", "pick", "pick_batch"}
+    assert 0 < results["agreement_with_legacy"] <= 1
+
+
+def _stats(figures, calls=5):
+    """ModelStats with ``calls`` identical calls per model of (latency, ttft, completion tokens, errors)."""
+    stats = ModelStats(half_life=600, prices={"sonar-pro": 0.01, "llama-3.1-sonar-large-128k-online": 0.002})
+    for model, (latency, ttft, tokens, errors) in figures.items():
+        for i in range(calls):
+            stats.record(model, latency, ttft, tokens, error=i < errors)
+    return stats
+
+
+def test_learned_routing_picks_the_best_candidate_meeting_the_slo():
+    task = "Research the latest sources"
+    large = "llama-3.1-sonar-large-128k-online"
+    assert Router().task_class(task) == "research" and Router().task_class("hello") is None
+    stats = _stats({"sonar-pro": (6.0, 1.0, 500, 0), large: (2.0, 0.5, 500, 0)})
+    router = Router(stats=stats)
+    assert router.pick(task) == large
+    model, reason = router.pick_with_reasoning(task)
+    assert model == large and reason.startswith("Large context window")
+    assert "research: 2.00s latency, 0.50s to first token" in reason and "best latency of 2 meeting" in reason
+    # Classes without stats for their own model, and unmatched tasks, stay static
+    assert router.pick("Implement the login function") == "copilot-gpt-4"
+    assert router.pick("Say hello") == "gpt-5.2"
+    assert router.pick_batch([task, "Say hello", task]) == [large, "gpt-5.2", large]
+
+    # Too many errors breaks the default SLO; failed calls also count against latency
+    stats = _stats({"sonar-pro": (6.0, 1.0, 500, 0), large: (2.0, 0.5, 500, 2)})
+    assert Router(stats=stats).pick(task) == "sonar-pro"
+    assert Router(stats=stats, slo={"max_error_rate": 0.5}).pick(task) == large
+    # Nobody meets the SLO: best effort, 2s at 60% success still beats 6s
+    model, reason = Router(stats=stats, slo=SLO(max_latency=1.0)).pick_with_reasoning(task)
+    assert model == large and "no candidate meets the SLO, best latency of 2" in reason
+    # Too few recent calls have no say
+    assert Router(stats=_stats({"sonar-pro": (6.0, 1.0, 500, 0), large: (2.0, 0.5, 500, 0)}, calls=2)).pick(task) == \
+        "sonar-pro"
+
+
+def test_rule_slos_and_cost_objective():
+    large = "llama-3.1-sonar-large-128k-online"
+    stats = _stats({"sonar-pro": (1.0, 0.2, 100, 0), large: (3.0, 0.4, 100, 0), "gpt-5.2": (0.5, 0.1, 100, 0)})
+    rules = [
+        {"name": "research", "model": "sonar-pro", "candidates": [large, "sonar-pro"], "keywords": ["research"],
+         "slo": {"objective": "cost"}},
+        {"name": "quick", "model": "sonar-pro", "candidates": large, "keywords": ["quick"],
+         "slo": {"max_ttft": 0.3, "objective": "ttft"}},
+    ]
+    router = Router(rules=rules, stats=stats)
+    assert router.rules[0].candidates == (large,)
+    # The cheaper model wins on cost; unknown cost never wins
+    assert router.pick("research it") == large
+    assert router.task_class("quick research") == "research"
+    assert router.pick("quick") == "sonar-pro"
+
+    # Feedback from the agent moves the choice
+    for _ in range(20):
+        router.observe("sonar-pro", 30.0, error=True)
+    assert router.pick("quick") == large
+    Router().observe("sonar-pro", 1.0)
+
+    for bad in [{"max_ttft": -1}, {"max_ttft": "1"}, {"objective": "speed"}, {"max_tokens": 3}, [1]]:
+        with pytest.raises(ValueError):
+            parse_slo(bad)
+    with pytest.raises(ValueError):
+        parse_rule({"model": "m", "keywords": ["a"], "candidates": [""]})
+    assert SLO(min_tokens_per_second=50, max_cost=0.1).violations(
+        {"tokens_per_second": 20.0, "cost": None}) == ["tokens_per_second"]
+
+
+def test_learned_routing_survives_estimates_without_timings():
+    stats = ModelStats()
+    for model in ("copilot-gpt-4", "claude-4.5-sonnet", "gpt-5.2"):
+        for _ in range(5):
+            stats.record(model, 1.0, error=True)
+    router = Router(stats=stats)
+    assert router.pick("implement this function") == "copilot-gpt-4"
+    assert router.pick_batch(["implement this function"]) == ["copilot-gpt-4"]
+    model, reason = router.pick_with_reasoning("implement this function")
+    assert model == "copilot-gpt-4" and "coding: 100% errors (no candidate meets the SLO" in reason
+
+    # A bridge snapshot of a model that has only failed carries no timings either
+    loaded = ModelStats()
+    assert loaded.load({"sonar-pro": {"samples": 5, "error_rate": 1.0, "latency": None, "ttft": None}}) == 1
+    model, reason = Router(stats=loaded).pick_with_reasoning("Research the sources")
+    assert model == "sonar-pro" and "research: 100% errors" in reason
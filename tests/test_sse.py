@@ -0,0 +1,138 @@
+"""Tests for incremental SSE parsing and re-framing."""
+import os
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from sse import SSEParser, SSEBufferOverflow, format_sse, iter_sse_events
+
+UPSTREAM_BODY = (
+    b'data: {"choices": [{"delta": {"content": "Hel"}}]}\r\n\r\n'
+    b': keep-alive\n\n'
+    b'data: {"choices": [{"delta": {"content": "lo \xc3\xa9"}}]}\n\n'
+    b'data: [DONE]\n\n'
+)
+
+
+def _feed_in_pieces(body, size):
+    parser = SSEParser()
+    events = []
+    for i in range(0, len(body), size):
+        events.extend(parser.feed(body[i:i + size]))
+    events.extend(parser.flush())
+    return events
+
+
+class TestSSEParser:
+    """Tests for the incremental parser."""
+
+    @pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 4096])
+    def test_events_are_independent_of_chunk_boundaries(self, size):
+        events = _feed_in_pieces(UPSTREAM_BODY, size)
+        assert [e.data for e in events] == [
+            '{"choices": [{"delta": {"content": "Hel"}}]}',
+            '{"choices": [{"delta": {"content": "lo é"}}]}',
+            "[DONE]",
+        ]
+        assert events[-1].is_done
+
+    def test_multiline_data_and_event_fields(self):
+        parser = SSEParser()
+        events = parser.feed(b"event: update\nid: 7\ndata: line one\ndata:line two\n\n")
+        assert len(events) == 1
+        assert events[0].data == "line one\nline two"
+        assert events[0].event == "update"
+        assert events[0].id == "7"
+
+    def test_flush_emits_unterminated_event(self):
+        parser = SSEParser()
+        assert parser.feed(b"data: [DONE]") == []
+        assert [e.data for e in parser.flush()] == ["[DONE]"]
+
+    def test_long_line_in_small_pieces_is_scanned_once(self):
+        parser = SSEParser()
+        payload = b"data: " + b"x" * 5000
+        for i in range(0, len(payload), 10):
+            assert parser.feed(payload[i:i + 10]) == []
+            # The next search resumes after everything already buffered
+            assert parser._scanned == len(parser._buffer) == min(i + 10, len(payload))
+        events = parser.feed(b"\r\n\r\ndata: y")
+        assert [e.data for e in events] == ["x" * 5000]
+        assert parser._scanned == len(parser._buffer) == 7
+        assert [e.data for e in parser.flush()] == ["y"]
+        assert parser._scanned == 0
+
+    def test_oversized_event_is_rejected(self):
+        parser = SSEParser(max_event_bytes=16)
+        with pytest.raises(SSEBufferOverflow):
+            parser.feed(b"data: " + b"x" * 32 + b"\n")
+
+    def test_unterminated_line_is_bounded(self):
+        parser = SSEParser(max_event_bytes=16)
+        with pytest.raises(SSEBufferOverflow):
+            parser.feed(b"data: " + b"x" * 32)
+
+
+@pytest.mark.asyncio
+async def test_iter_sse_events():
+    async def chunks():
+        yield b"data: a\n"
+        yield b"\ndata: b\n\n"
+
+    assert [e.data async for e in iter_sse_events(chunks())] == ["a", "b"]
+
+
+def test_format_sse():
+    assert format_sse("[DONE]") == "data: [DONE]\n\n"
+    assert format_sse("a\nb", event="x") == "event: x\ndata: a\ndata: b\n\n"
+
+
+def _split_upstream():
+    """An httpx client whose upstream streams the body in awkward 5-byte pieces."""
+    class Body(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            for i in range(0, len(UPSTREAM_BODY), 5):
+                yield UPSTREAM_BODY[i:i + 5]
+
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, stream=Body())
+
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_websocket_sends_one_event_per_frame():
+    """Test /ws/chat re-frames upstream bytes into whole events."""
+    client = TestClient(app)
+    with patch("upstream.httpx.AsyncClient", side_effect=_split_upstream()):
+        with client.websocket_connect("/ws/chat?api_key=test-secret-key") as ws:
+            ws.send_json({"model": "sse-frame-test", "messages": [{"role": "user", "content": "hi"}]})
+            frames = [ws.receive_text() for _ in range(3)]
+    assert frames == [
+        'data: {"choices": [{"delta": {"content": "Hel"}}]}\n\n',
+        'data: {"choices": [{"delta": {"content": "lo é"}}]}\n\n',
+        "data: [DONE]\n\n",
+    ]
+
+
+def test_http_stream_is_reframed():
+    """Test the SSE branch of /v1/chat/completions re-frames upstream bytes."""
+    client = TestClient(app)
+    with patch("upstream.httpx.AsyncClient", side_effect=_split_upstream()):
+        response = client.post(
+            "/v1/chat/completions",
+            json={"model": "sse-frame-test", "stream": True, "messages": [{"role": "user", "content": "hi"}]},
+            headers={"X-API-KEY": "test-secret-key"}
+        )
+    assert response.status_code == 200
+    assert response.text.split("\n\n")[:3] == [
+        'data: {"choices": [{"delta": {"content": "Hel"}}]}',
+        'data: {"choices": [{"delta": {"content": "lo é"}}]}',
+        "data: [DONE]",
+    ]
@@ -0,0 +1,66 @@
+"""Tests for the production serving helpers in start.py."""
+import os
+import socket
+import pytest
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+import start
+from admission import per_worker
+
+
+def test_parse_workers():
+    assert start.parse_workers(None) == (os.cpu_count() or 1)
+    assert start.parse_workers(" AUTO ") == (os.cpu_count() or 1)
+    assert start.parse_workers("3") == 3
+    for value in ("0", "-2", "many"):
+        with pytest.raises(ValueError):
+            start.parse_workers(value)
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="SO_REUSEPORT is not available")
+def test_workers_can_bind_the_same_port():
+    first = start.bind_reuse_port("127.0.0.1", 0)
+    try:
+        port = first.getsockname()[1]
+        second = start.bind_reuse_port("127.0.0.1", port)
+        second.close()
+    finally:
+        first.close()
+
+
+def test_prepare_worker_environment(monkeypatch, tmp_path):
+    for name in ("RATE_LIMIT_STORE", "METRICS_MULTIPROC_DIR", "BRIDGE_WORKER_COUNT"):
+        monkeypatch.delenv(name, raising=False)
+    # Only fcntl's presence matters, so both branches run on every OS
+    monkeypatch.setattr(start, "fcntl", object())
+    start.prepare_worker_environment(4)
+    assert os.environ["BRIDGE_WORKER_COUNT"] == "4"
+    assert os.environ["RATE_LIMIT_STORE"] == "file"
+    assert os.path.isdir(os.environ["METRICS_MULTIPROC_DIR"])
+    os.rmdir(os.environ["METRICS_MULTIPROC_DIR"])
+
+    # Without fcntl (Windows) the file store cannot work; fall back to memory
+    monkeypatch.setattr(start, "fcntl", None)
+    for name in ("RATE_LIMIT_STORE", "METRICS_MULTIPROC_DIR"):
+        monkeypatch.delenv(name, raising=False)
+    start.prepare_worker_environment(4)
+    assert os.environ["RATE_LIMIT_STORE"] == "memory"
+    os.rmdir(os.environ["METRICS_MULTIPROC_DIR"])
+
+    # An explicit store is kept and stale snapshots are cleared
+    (tmp_path / "123.json").write_text("{}")
+    monkeypatch.setenv("RATE_LIMIT_STORE", "redis://localhost:6379/0")
+    monkeypatch.setenv("METRICS_MULTIPROC_DIR", str(tmp_path))
+    start.prepare_worker_environment(2)
+    assert os.environ["RATE_LIMIT_STORE"] == "redis://localhost:6379/0"
+    assert os.listdir(tmp_path) == []
+
+
+def test_admission_limits_are_split_between_workers():
+    assert per_worker({"perplexity": 32, "copilot": 3, "tiny": 1, "off": 0}, 4) == {
+        "perplexity": 8, "copilot": 1, "tiny": 1, "off": 0
+    }
+    assert per_worker({"perplexity": 32}, 1) == {"perplexity": 32}
@@ -0,0 +1,71 @@
+"""Tests for the shared upstream connection pool."""
+import os
+import pytest
+from fastapi.testclient import TestClient
+
+# Set test environment before importing app
+os.environ["BRIDGE_SECRET"] = "test-secret-key"
+os.environ["PERPLEXITY_API_KEY"] = "test-api-key"
+
+from app import app
+from upstream import UpstreamPool, upstream_pool
+
+
+@pytest.mark.asyncio
+async def test_client_falls_back_to_ephemeral_when_not_started():
+    """Test an unstarted pool hands out short-lived clients."""
+    pool = UpstreamPool(http2=False)
+    async with pool.client("perplexity") as client:
+        assert not client.is_closed
+    assert client.is_closed
+    stats = pool.stats()
+    assert stats["started"] is False
+    assert stats["providers"]["perplexity"]["ephemeral"] == 1
+    assert stats["providers"]["perplexity"]["pooled"] is False
+
+
+@pytest.mark.asyncio
+async def test_started_pool_reuses_shared_client():
+    """Test a started pool returns the same long-lived client."""
+    pool = UpstreamPool(http2=False, max_connections=5, max_keepalive=2)
+    await pool.start(["perplexity"])
+    try:
+        async with pool.client("perplexity") as first:
+            assert pool.stats()["providers"]["perplexity"]["in_flight"] == 1
+        async with pool.client("perplexity") as second:
+            pass
+        assert first is second
+        assert not first.is_closed
+
+        stats = pool.stats()
+        assert stats["started"] is True
+        assert stats["limits"]["max_connections"] == 5
+        assert stats["limits"]["max_keepalive_connections"] == 2
+        provider = stats["providers"]["perplexity"]
+        assert provider["requests"] == 2
+        assert provider["in_flight"] == 0
+        assert provider["ephemeral"] == 0
+        assert provider["connections"] == 0
+    finally:
+        await pool.close()
+    assert first.is_closed
+    assert pool.started is False
+
+
+def test_lifespan_starts_and_closes_pool():
+    """Test the app lifespan owns the shared pool."""
+    with TestClient(app) as client:
+        assert upstream_pool.started
+        response = client.get("/admin/pool", headers={"X-API-KEY": "test-secret-key"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["started"] is True
+        assert "perplexity" in data["providers"]
+    assert not upstream_pool.started
+
+
+def test_pool_stats_requires_auth():
+    """Test pool statistics are not public."""
+    client = TestClient(app)
+    response = client.get("/admin/pool")
+    assert response.status_code == 401
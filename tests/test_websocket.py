@@ -1,5 +1,7 @@
 """Tests for WebSocket functionality."""
+import asyncio
 import os
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock, MagicMock
@@ -243,3 +245,75 @@ def test_websocket_model_routing():
         "messages": [{"role": "user", "content": "test"}]
     }
     assert copilot_req["model"].startswith("copilot-")
+
+
+def _echo_upstream(delay=0.0, repeat=3):
+    """An httpx client whose upstream streams the prompt back as `repeat` deltas."""
+
+    class Body(httpx.AsyncByteStream):
+        def __init__(self, text):
+            self.text = text
+
+        async def __aiter__(self):
+            for _ in range(repeat):
+                await asyncio.sleep(delay)
+                chunk = {"choices": [{"delta": {"content": self.text}}]}
+                yield f"data: {json.dumps(chunk)}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][-1]["content"]
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, stream=Body(prompt))
+
+    real_client = httpx.AsyncClient
+    return lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def _parse_tagged(frame):
+    """Split an `id:`-tagged SSE frame into (id, data)."""
+    lines = frame.strip().split("\n")
+    assert lines[0].startswith("id: ")
+    return lines[0][4:], lines[1][6:]
+
+
+def test_websocket_multiplexes_requests_by_id():
+    """Test concurrent requests on one socket are tagged with their id."""
+    with patch("upstream.httpx.AsyncClient", side_effect=_echo_upstream(delay=0.01)):
+        with client.websocket_connect("/ws/chat?api_key=test-secret-key") as ws:
+            ws.send_json({"id": "a", "model": "mux-test", "messages": [{"role": "user", "content": "A"}]})
+            ws.send_json({"id": "b", "model": "mux-test", "messages": [{"role": "user", "content": "B"}]})
+            content = {"a": "", "b": ""}
+            done = set()
+            while done != {"a", "b"}:
+                request_id, data = _parse_tagged(ws.receive_text())
+                if data == "[DONE]":
+                    done.add(request_id)
+                else:
+                    content[request_id] += json.loads(data)["choices"][0]["delta"]["content"]
+    assert content == {"a": "AAA", "b": "BBB"}
+
+
+def test_websocket_cancels_single_request_by_id():
+    """Test cancelling one multiplexed request leaves the others running."""
+    with patch("upstream.httpx.AsyncClient", side_effect=_echo_upstream(delay=0.05, repeat=100)):
+        with client.websocket_connect("/ws/chat?api_key=test-secret-key") as ws:
+            ws.send_json({"id": "slow", "model": "mux-test", "messages": [{"role": "user", "content": "S"}]})
+            assert _parse_tagged(ws.receive_text())[0] == "slow"
+            ws.send_json({"type": "cancel", "id": "slow"})
+            while True:
+                frame = ws.receive_text()
+                if frame.startswith("{"):
+                    break
+            assert json.loads(frame) == {"type": "cancelled", "id": "slow"}
+
+            ws.send_json({"type": "cancel", "id": "slow"})
+            error = json.loads(ws.receive_text())
+            assert error["type"] == "error"
+            assert error["id"] == "slow"
+
+
+def test_websocket_rejects_invalid_request_id():
+    with client.websocket_connect("/ws/chat?api_key=test-secret-key") as ws:
+        ws.send_json({"id": "bad id\n", "model": "mux-test", "messages": [{"role": "user", "content": "x"}]})
+        error = json.loads(ws.receive_text())
+        assert error == {"error": "Invalid request id", "type": "error"}
@@ -0,0 +1,180 @@
+"""
+Shared upstream HTTP connection pool.
+
+The bridge keeps one long-lived ``httpx.AsyncClient`` per provider so that
+completions reuse keep-alive (and, when ``h2`` is installed, HTTP/2)
+connections instead of paying a fresh TCP+TLS handshake on every request.
+
+Each provider can override the connection limits of its own pool with
+``configure`` (see ``providers.py``). Clients are created by the FastAPI
+lifespan handler in ``app.py`` and closed on shutdown. Code running outside the lifespan (scripts, a ``TestClient``
+used without a context manager) transparently falls back to a short-lived
+client so behaviour stays the same, just without connection reuse.
+"""
+
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import httpx
+
+from config import (
+    UPSTREAM_HTTP2, UPSTREAM_MAX_CONNECTIONS, UPSTREAM_MAX_KEEPALIVE, UPSTREAM_KEEPALIVE_EXPIRY
+)
+
+logger = logging.getLogger(__name__)
+
+# Fallback timeout for clients; individual calls pass their own timeout.
+DEFAULT_TIMEOUT = 120.0
+
+
+def http2_available() -> bool:
+    """Return True if the optional ``h2`` package needed for HTTP/2 is installed."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class UpstreamPool:
+    """Owns one pooled ``httpx.AsyncClient`` per upstream provider."""
+
+    def __init__(
+        self,
+        http2: bool = UPSTREAM_HTTP2,
+        max_connections: int = UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive: int = UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry: float = UPSTREAM_KEEPALIVE_EXPIRY
+    ):
+        if http2 and not http2_available():
+            logger.warning("UPSTREAM_HTTP2 is enabled but 'h2' is not installed; falling back to HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._limits: Dict[str, httpx.Limits] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def started(self) -> bool:
+        return bool(self._clients)
+
+    def _counter(self, provider: str) -> Dict[str, int]:
+        counter = self._counters.get(provider)
+        if counter is None:
+            counter = self._counters[provider] = {"requests": 0, "in_flight": 0, "ephemeral": 0}
+        return counter
+
+    def configure(
+        self,
+        provider: str,
+        max_connections: Optional[int] = None,
+        max_keepalive: Optional[int] = None
+    ) -> None:
+        """Override the connection limits of one provider's pool (before ``start``)."""
+        self._limits[provider] = httpx.Limits(
+            max_connections=self.limits.max_connections if max_connections is None else max_connections,
+            max_keepalive_connections=self.limits.max_keepalive_connections if max_keepalive is None else max_keepalive,
+            keepalive_expiry=self.limits.keepalive_expiry
+        )
+
+    async def start(self, providers: Iterable[str]) -> None:
+        """Create a pooled client for each provider."""
+        for provider in providers:
+            if provider in self._clients:
+                continue
+            self._clients[provider] = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self._limits.get(provider, self.limits),
+                timeout=DEFAULT_TIMEOUT
+            )
+            logger.info(f"Upstream pool started for {provider} (http2={self.http2})")
+
+    async def close(self) -> None:
+        """Close every pooled client, releasing their connections."""
+        clients, self._clients = self._clients, {}
+        for provider, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing upstream client for {provider}: {e}")
+        if clients:
+            logger.info("Upstream pool closed")
+
+    @asynccontextmanager
+    async def client(self, provider: str) -> AsyncIterator[httpx.AsyncClient]:
+        """
+        Yield the shared client for ``provider``.
+
+        Falls back to a one-off client when the pool has not been started.
+        The shared client is never closed here; ephemeral ones are.
+        """
+        counter = self._counter(provider)
+        counter["requests"] += 1
+        shared = self._clients.get(provider)
+        if shared is not None and not shared.is_closed:
+            counter["in_flight"] += 1
+            try:
+                yield shared
+            finally:
+                counter["in_flight"] -= 1
+            return
+
+        counter["ephemeral"] += 1
+        async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT) as client:
+            yield client
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool configuration and per-provider connection statistics."""
+        providers: Dict[str, Any] = {}
+        for provider in sorted(set(self._clients) | set(self._counters)):
+            entry: Dict[str, Any] = dict(self._counter(provider))
+            entry["pooled"] = provider in self._clients
+            if provider in self._limits:
+                entry["max_connections"] = self._limits[provider].max_connections
+                entry["max_keepalive_connections"] = self._limits[provider].max_keepalive_connections
+            entry.update(_connection_stats(self._clients.get(provider)))
+            providers[provider] = entry
+        return {
+            "started": self.started,
+            "http2": self.http2,
+            "limits": {
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry
+            },
+            "providers": providers
+        }
+
+
+def _connection_stats(client: Optional[httpx.AsyncClient]) -> Dict[str, Any]:
+    """Summarise the connections currently held by a client's transport pool."""
+    connections: List[Any] = []
+    if client is not None:
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+    idle = 0
+    http2 = 0
+    for connection in connections:
+        try:
+            if connection.is_idle():
+                idle += 1
+            if "HTTP/2" in connection.info():
+                http2 += 1
+        except Exception:
+            continue
+    return {
+        "connections": len(connections),
+        "idle_connections": idle,
+        "active_connections": len(connections) - idle,
+        "http2_connections": http2
+    }
+
+
+# Module-level pool shared by the application
+upstream_pool = UpstreamPool()